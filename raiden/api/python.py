@@ -11,8 +11,10 @@ from raiden.blockchain.events import (
     get_token_network_events,
     get_token_network_registry_events,
 )
+from raiden.storage.introspection import node_state_size
 from raiden.transfer import views
 from raiden.transfer.events import (
+    EventChannelPruned,
     EventTransferSentSuccess,
     EventTransferSentFailed,
     EventTransferReceivedSuccess,
@@ -49,6 +51,18 @@ EVENTS_EXTERNALLY_VISIBLE = (
     EventTransferSentFailed,
     EventTransferReceivedSuccess,
 )
+EVENTS_EXTERNALLY_VISIBLE_NAMES = tuple(
+    event_type.__name__
+    for event_type in EVENTS_EXTERNALLY_VISIBLE
+)
+
+
+def event_to_dict(event):
+    """ Return the attributes of one of the EVENTS_EXTERNALLY_VISIBLE. """
+    return {
+        name: getattr(event, name)
+        for name in type(event).__slots__
+    }
 
 
 class RaidenAPI:
@@ -520,6 +534,50 @@ class RaidenAPI:
 
         return result
 
+    def get_pruned_channel_list(
+            self,
+            registry_address,
+            token_address=None,
+            partner_address=None,
+            from_block=0,
+            to_block='latest',
+    ):
+        """ Returns the final state of the channels removed from the node
+        state once settled, the latest one for each channel identifier.
+
+        The channels are read from the events stored in the block range, the
+        cost of a call grows with the history it covers. The events not yet
+        written by a write-behind storage are waited for.
+        """
+        self.raiden.wal.durability_barrier().get()
+
+        token_network_identifier = None
+        if token_address:
+            token_network_identifier = views.get_token_network_identifier_by_token_address(
+                views.state_from_raiden(self.raiden),
+                registry_address,
+                token_address,
+            )
+
+            if token_network_identifier is None:
+                return list()
+
+        pruned_events = self.raiden.wal.storage.get_events_by_block(
+            from_block=from_block,
+            to_block=to_block,
+            event_types=[EventChannelPruned.__name__],
+            token_network_identifier=token_network_identifier,
+        )
+
+        identifiers_to_channels = dict()
+        for _, event in pruned_events:
+            channel_state = event.channel_state
+
+            if partner_address is None or channel_state.partner_state.address == partner_address:
+                identifiers_to_channels[channel_state.identifier] = channel_state
+
+        return list(identifiers_to_channels.values())
+
     def get_node_network_state(self, node_address):
         """ Returns the currently network status of `node_address`. """
         return views.get_node_network_status(
@@ -527,6 +585,12 @@ class RaidenAPI:
             node_address,
         )
 
+    def get_state_size(self):
+        """ Returns the memory and serialized size of the current node state,
+        see `raiden.storage.introspection`.
+        """
+        return node_state_size(views.state_from_raiden(self.raiden))
+
     def start_health_check_for(self, node_address):
         """ Returns the currently network status of `node_address`. """
         self.raiden.start_health_check_for(node_address)
@@ -637,6 +701,7 @@ class RaidenAPI:
         raiden_events = self.raiden.wal.storage.get_events_by_block(
             from_block=from_block,
             to_block=to_block,
+            event_types=EVENTS_EXTERNALLY_VISIBLE_NAMES,
         )
         # Here choose which raiden internal events we want to expose to the end user
         for block_number, event in raiden_events:
@@ -645,7 +710,7 @@ class RaidenAPI:
                     'block_number': block_number,
                     'event': type(event).__name__,
                 }
-                new_event.update(event.__dict__)
+                new_event.update(event_to_dict(event))
                 returned_events.append(new_event)
 
         return returned_events
@@ -682,6 +747,7 @@ class RaidenAPI:
         raiden_events = self.raiden.wal.storage.get_events_by_block(
             from_block=from_block,
             to_block=to_block,
+            event_types=EVENTS_EXTERNALLY_VISIBLE_NAMES,
         )
 
         # Here choose which raiden internal events we want to expose to the end user
@@ -691,7 +757,7 @@ class RaidenAPI:
                     'block_number': block_number,
                     'event': type(event).__name__,
                 }
-                new_event.update(event.__dict__)
+                new_event.update(event_to_dict(event))
                 returned_events.append(new_event)
 
         return returned_events
@@ -50,6 +50,7 @@ from raiden.api.v1.resources import (
     create_blueprint,
     AddressResource,
     ChannelsResource,
+    PrunedChannelsResource,
     ChannelsResourceByTokenAndPartnerAddress,
     TokensResource,
     PartnersResourceByTokenAddress,
@@ -60,6 +61,7 @@ from raiden.api.v1.resources import (
     TransferToTargetResource,
     ConnectionsResource,
     ConnectionsInfoResource,
+    DebugStateSizeResource,
 )
 from raiden.transfer import channel, views
 from raiden.transfer.state import (
@@ -88,6 +90,7 @@ ERROR_STATUS_CODES = [
 URLS_V1 = [
     ('/address', AddressResource),
     ('/channels', ChannelsResource),
+    ('/channels/pruned', PrunedChannelsResource),
     (
         '/channels/<hexaddress:token_address>/<hexaddress:partner_address>',
         ChannelsResourceByTokenAndPartnerAddress),
@@ -106,6 +109,7 @@ URLS_V1 = [
     ),
     ('/connections/<hexaddress:token_address>', ConnectionsResource),
     ('/connections', ConnectionsInfoResource),
+    ('/debug/state_size', DebugStateSizeResource),
 ]
 
 
@@ -542,6 +546,18 @@ class RestAPI:
         result = self.channel_list_schema.dump(channel_list)
         return api_response(result=checksummed_response_list(result.data))
 
+    def get_pruned_channel_list(self, registry_address, from_block, to_block):
+        raiden_service_result = self.raiden_api.get_pruned_channel_list(
+            registry_address,
+            from_block=from_block,
+            to_block=to_block,
+        )
+        assert isinstance(raiden_service_result, list)
+
+        channel_list = ChannelList(raiden_service_result)
+        result = self.channel_list_schema.dump(channel_list)
+        return api_response(result=checksummed_response_list(result.data))
+
     def get_tokens_list(self, registry_address):
         raiden_service_result = self.raiden_api.get_tokens_list(registry_address)
         assert isinstance(raiden_service_result, list)
@@ -549,6 +565,9 @@ class RestAPI:
         result = self.address_list_schema.dump(tokens_list)
         return api_response(result=checksummed_response_list(result.data))
 
+    def get_state_size(self):
+        return api_response(result=self.raiden_api.get_state_size())
+
     def get_network_events(self, registry_address, from_block, to_block):
         raiden_service_result = self.raiden_api.get_network_events(
             registry_address,
@@ -56,6 +56,24 @@ class ChannelsResource(BaseResource):
         )
 
 
+class PrunedChannelsResource(BaseResource):
+
+    get_schema = EventRequestSchema()
+
+    @use_kwargs(get_schema, locations=('query',))
+    def get(self, from_block, to_block):
+        """
+        the final state of the settled channels removed from the node state
+        """
+        from_block = from_block or 0
+        to_block = to_block or 'latest'
+        return self.rest_api.get_pruned_channel_list(
+            registry_address=self.rest_api.raiden_api.raiden.default_registry.address,
+            from_block=from_block,
+            to_block=to_block,
+        )
+
+
 class ChannelsResourceByTokenAndPartnerAddress(BaseResource):
 
     patch_schema = ChannelPatchSchema
@@ -203,3 +221,9 @@ class ConnectionsInfoResource(BaseResource):
         return self.rest_api.get_connection_managers_info(
             self.rest_api.raiden_api.raiden.default_registry.address,
         )
+
+
+class DebugStateSizeResource(BaseResource):
+
+    def get(self):
+        return self.rest_api.get_state_size()
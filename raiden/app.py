@@ -20,6 +20,9 @@ from raiden.settings import (
     DEFAULT_REVEAL_TIMEOUT,
     DEFAULT_SETTLE_TIMEOUT,
     DEFAULT_SHUTDOWN_TIMEOUT,
+    DEFAULT_SNAPSHOT_INTERVAL,
+    DEFAULT_DISPATCH_MODE,
+    DEFAULT_SNAPSHOT_STATECHANGE_COUNT,
     INITIAL_PORT,
 )
 from raiden.utils import (
@@ -62,6 +65,23 @@ class App:  # pylint: disable=too-few-public-methods
         'rpc': True,
         'console': False,
         'shutdown_timeout': DEFAULT_SHUTDOWN_TIMEOUT,
+        'storage': {
+            'snapshot_statechange_count': DEFAULT_SNAPSHOT_STATECHANGE_COUNT,
+            'snapshot_interval': DEFAULT_SNAPSHOT_INTERVAL,
+            'compact_on_snapshot': True,
+            'incremental_snapshots': True,
+            'archive_segment_size': None,
+            'group_commit_window': None,
+            'write_behind': False,
+        },
+        'state_machine': {
+            'dispatch_mode': DEFAULT_DISPATCH_MODE,
+            # a state per token network, see raiden.transfer.sharding
+            'sharded': False,
+            # number of worker processes that replay the log of the shards
+            # at startup, None to replay it in the node process
+            'shard_workers': None,
+        },
         'transport_type': 'udp',
         'matrix': {
             'server': 'auto',
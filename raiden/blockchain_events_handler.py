@@ -35,6 +35,11 @@ from raiden.transfer.state_change import (
 
 log = structlog.get_logger(__name__)  # pylint: disable=invalid-name
 
+# The handlers queue the state changes that do not create a channel or change
+# its deposits, these are dispatched in a batch once the poll is done. The
+# other ones are dispatched right away, the handlers read the state they
+# produce.
+
 
 def handle_tokennetwork_new(raiden, event, current_block_number):
     """ Handles a `TokenNetworkCreated` event. """
@@ -62,7 +67,7 @@ def handle_tokennetwork_new(raiden, event, current_block_number):
         event.originating_contract,
         token_network_state,
     )
-    raiden.handle_state_change(new_token_network, current_block_number)
+    raiden.queue_state_change(new_token_network, current_block_number)
 
 
 def handle_channel_new(raiden, event, current_block_number):
@@ -116,7 +121,7 @@ def handle_channel_new(raiden, event, current_block_number):
             participant1,
             participant2,
         )
-        raiden.handle_state_change(new_route, current_block_number)
+        raiden.queue_state_change(new_route, current_block_number)
 
 
 def handle_channel_new_balance(raiden, event, current_block_number):
@@ -218,7 +223,7 @@ def handle_channel_batch_unlock(raiden, event, current_block_number):
         data['returned_tokens'],
     )
 
-    raiden.handle_state_change(unlock_state_change, current_block_number)
+    raiden.queue_state_change(unlock_state_change, current_block_number)
 
 
 def handle_secret_revealed(raiden, event, current_block_number):
@@ -231,7 +236,7 @@ def handle_secret_revealed(raiden, event, current_block_number):
         data['secret'],
     )
 
-    raiden.handle_state_change(registeredsecret_state_change, current_block_number)
+    raiden.queue_state_change(registeredsecret_state_change, current_block_number)
 
 
 def on_blockchain_event(raiden, event, current_block_number):
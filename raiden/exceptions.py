@@ -18,6 +18,12 @@ class InvalidFunctionName(RaidenError):
     """ Raised by the rpc proxy when a call to an unknown function is made. """
 
 
+class SerializationError(RaidenError):
+    """ Raised if an object cannot be serialized or stored data cannot be
+    decoded, e.g. the type is missing from the serializer's tag table.
+    """
+
+
 # Exceptions raised due to user interaction (the user may be another software)
 
 class ChannelNotFound(RaidenError):
@@ -504,6 +504,7 @@ class MatrixTransport:
                 #       which means that message order is important which isn't guaranteed between
                 #       federated servers.
                 #       See: https://matrix.org/docs/spec/client_server/r0.3.0.html#id57
+                self._raiden_service.wal.durability_barrier().get()
                 delivered_message = Delivered(message.message_identifier)
                 self._raiden_service.sign(delivered_message)
                 self._send_immediate(message.sender, json.dumps(delivered_message.to_dict()))
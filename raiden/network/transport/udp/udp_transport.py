@@ -490,6 +490,11 @@ class UDPTransport:
             #   state change
             # - Decode it, save to the WAL, and process it (the current
             #   implementation)
+            #
+            # With the write-behind storage the WAL writes are asynchronous,
+            # the state change must be durable before it is acknowledged.
+            self.raiden.wal.durability_barrier().get()
+
             delivered_message = Delivered(message.message_identifier)
             self.raiden.sign(delivered_message)
 
@@ -9,6 +9,8 @@ from raiden.transfer.events import (
     ContractSendChannelSettle,
     ContractSendChannelUpdateTransfer,
     ContractSendChannelBatchUnlock,
+    EventChannelPruned,
+    EventPaymentTaskPruned,
     EventTransferReceivedSuccess,
     EventTransferSentFailed,
     EventTransferSentSuccess,
@@ -27,6 +29,7 @@ from raiden.transfer.mediated_transfer.events import (
     SendSecretRequest,
 )
 from raiden.transfer.balance_proof import signing_update_data
+from raiden.transfer.state import HashTimeLockState, UnlockProofState
 from raiden.utils import pex
 # type alias to avoid both circular dependencies and flake8 errors
 RaidenService = 'RaidenService'
@@ -37,6 +40,8 @@ UNEVENTFUL_EVENTS = (
     EventUnlockSuccess,
     EventUnlockClaimFailed,
     EventUnlockClaimSuccess,
+    EventChannelPruned,
+    EventPaymentTaskPruned,
 )
 
 
@@ -227,6 +232,17 @@ def handle_contract_send_channelupdate(
         )
 
 
+def lock_from_unlock_proof(unlock_proof: UnlockProofState) -> HashTimeLockState:
+    """ Decode the lock of `unlock_proof`, see `HashTimeLockState.encoded`. """
+    lock_encoded = unlock_proof.lock_encoded
+
+    return HashTimeLockState(
+        int.from_bytes(lock_encoded[32:64], byteorder='big'),
+        int.from_bytes(lock_encoded[:32], byteorder='big'),
+        lock_encoded[64:],
+    )
+
+
 def handle_contract_send_channelunlock(
         raiden: RaidenService,
         channel_unlock_event: ContractSendChannelBatchUnlock,
@@ -235,7 +251,14 @@ def handle_contract_send_channelunlock(
         channel_unlock_event.token_network_identifier,
         channel_unlock_event.channel_identifier,
     )
-    channel.unlock(channel_unlock_event.merkle_treee_leaves)
+
+    # the mediators unlock a batch of locks with the proofs computed by
+    # `channel.compute_proofs_for_locks`, the contract is given the locks
+    merkle_tree_leaves = [
+        lock_from_unlock_proof(leaf) if isinstance(leaf, UnlockProofState) else leaf
+        for leaf in channel_unlock_event.merkle_treee_leaves
+    ]
+    channel.unlock(merkle_tree_leaves)
 
 
 def handle_contract_send_channelsettle(
@@ -3,6 +3,7 @@ import os
 import random
 import sys
 from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
 
 import filelock
 import gevent
@@ -53,7 +54,7 @@ from raiden.utils import (
     random_secret,
     create_default_identifier,
 )
-from raiden.storage import wal, serialize, sqlite
+from raiden.storage import wal, serialize, sqlite, writebehind
 
 log = structlog.get_logger(__name__)  # pylint: disable=invalid-name
 
@@ -223,6 +224,11 @@ class RaidenService:
 
         self.event_poll_lock = gevent.lock.Semaphore()
 
+        # State changes of the current blockchain events poll, dispatched
+        # together by `flush_state_changes`
+        self.queued_state_changes = list()
+        self.queued_block_numbers = list()
+
         self.start()
 
     def start(self):
@@ -235,11 +241,43 @@ class RaidenService:
             assert self.db_lock.is_locked
 
         # The database may be :memory:
-        storage = sqlite.SQLiteStorage(self.database_path, serialize.PickleSerializer())
-        self.wal, unapplied_events = wal.restore_from_latest_snapshot(
-            node.state_transition,
-            storage,
+        storage = sqlite.SQLiteStorage(self.database_path, serialize.BinarySerializer())
+
+        # Databases created by older versions store pickled objects
+        migrated = storage.migrate_pickled_data()
+        if migrated:
+            log.info('migrated pickled database rows', node=pex(self.address), rows=migrated)
+
+        storage_config = self.config['storage']
+        if storage_config['write_behind']:
+            storage = writebehind.WriteBehindStorage(storage)
+
+        snapshot_policy = wal.SnapshotPolicy(
+            storage_config['snapshot_statechange_count'],
+            storage_config['snapshot_interval'],
+            storage_config['compact_on_snapshot'],
+            storage_config['incremental_snapshots'],
+            storage_config['archive_segment_size'],
         )
+        state_machine_config = self.config['state_machine']
+        shard_executor = None
+        if state_machine_config['sharded'] and state_machine_config['shard_workers']:
+            # only used to replay the log, before the node has started
+            shard_executor = ProcessPoolExecutor(state_machine_config['shard_workers'])
+
+        try:
+            self.wal, unapplied_events = wal.restore_from_latest_snapshot(
+                node.state_transition,
+                storage,
+                snapshot_policy,
+                storage_config['group_commit_window'],
+                state_machine_config['dispatch_mode'],
+                state_machine_config['sharded'],
+                shard_executor,
+            )
+        finally:
+            if shard_executor is not None:
+                shard_executor.shutdown()
 
         if self.wal.state_manager.current_state is None:
             block_number = self.chain.block_number()
@@ -326,6 +364,14 @@ class RaidenService:
 
         self.blockchain_events.reset()
 
+        # Snapshot on shutdown so the next start doesn't have to replay the
+        # state changes applied since the last periodic snapshot
+        self.wal.snapshot()
+
+        # With the write-behind storage the writes may still be queued
+        if isinstance(self.wal.storage, writebehind.WriteBehindStorage):
+            self.wal.storage.stop()
+
         if self.db_lock is not None:
             self.db_lock.release()
 
@@ -341,8 +387,14 @@ class RaidenService:
         if block_number is None:
             block_number = self.get_block_number()
 
+        # the queued state changes happened first
+        self.flush_state_changes()
+
         event_list = self.wal.log_and_dispatch(state_change, block_number)
 
+        if event_list:
+            self.wait_durability()
+
         for event in event_list:
             log.debug('RAIDEN EVENT', node=pex(self.address), raiden_event=event)
 
@@ -350,6 +402,59 @@ class RaidenService:
 
         return event_list
 
+    def handle_state_changes(self, state_changes, block_numbers):
+        """ Dispatch the `state_changes` as a batch, see
+        `WriteAheadLog.log_and_dispatch_batch`, and handle their events in
+        order.
+        """
+        events_by_state_change = self.wal.log_and_dispatch_batch(state_changes, block_numbers)
+
+        if any(events_by_state_change):
+            self.wait_durability()
+
+        for state_change, event_list in zip(state_changes, events_by_state_change):
+            log.debug('STATE CHANGE', node=pex(self.address), state_change=state_change)
+
+            for event in event_list:
+                log.debug('RAIDEN EVENT', node=pex(self.address), raiden_event=event)
+
+                on_raiden_event(self, event)
+
+        return events_by_state_change
+
+    def wait_durability(self):
+        """ Wait until the state changes and the events logged so far are
+        durable.
+
+        With the write-behind storage the writes are asynchronous. The
+        events send messages and transactions, a crash after handling them
+        but before the write would lose state changes the partners or the
+        blockchain already saw the effects of.
+        """
+        self.wal.durability_barrier().get()
+
+    def queue_state_change(self, state_change, block_number):
+        """ Queue the `state_change` to be dispatched in a batch with the
+        other state changes of the same poll.
+
+        Until the queue is flushed the state does not reflect the queued
+        state changes. Only state changes that the code reading the state
+        meanwhile does not depend on may be queued, i.e. state changes that
+        never create a channel or change its deposits.
+        """
+        self.queued_state_changes.append(state_change)
+        self.queued_block_numbers.append(block_number)
+
+    def flush_state_changes(self):
+        """ Dispatch the queued state changes. """
+        state_changes = self.queued_state_changes
+        block_numbers = self.queued_block_numbers
+
+        if state_changes:
+            self.queued_state_changes = list()
+            self.queued_block_numbers = list()
+            self.handle_state_changes(state_changes, block_numbers)
+
     def set_node_network_state(self, node_address, network_state):
         state_change = ActionChangeNodeNetworkState(node_address, network_state)
         self.wal.log_and_dispatch(state_change, self.get_block_number())
@@ -398,7 +503,9 @@ class RaidenService:
             # been processed but the Block state change has not been
             # dispatched.
             state_change = Block(current_block_number)
-            self.handle_state_change(state_change, current_block_number)
+            self.queue_state_change(state_change, current_block_number)
+
+            self.flush_state_changes()
 
     def sign(self, message):
         """ Sign message inplace. """
@@ -424,6 +531,8 @@ class RaidenService:
             for event in self.blockchain_events.poll_blockchain_events():
                 on_blockchain_event(self, event, event.event_data['block_number'])
 
+            self.flush_state_changes()
+
     def connection_manager_for_token_network(self, token_network_identifier):
         if not is_binary_address(token_network_identifier):
             raise InvalidAddress('token address is not valid.')
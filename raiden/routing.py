@@ -1,8 +1,10 @@
+import weakref
 from typing import List, Tuple
-from heapq import heappush, heappop
+from heapq import heappush
 
 import networkx
 import structlog
+from cachetools import LRUCache
 from eth_utils import is_binary_address
 
 from raiden.transfer import channel, views
@@ -11,12 +13,22 @@ from raiden.transfer.state import (
     CHANNEL_STATE_OPENED,
     NODE_NETWORK_REACHABLE,
     NODE_NETWORK_UNKNOWN,
+    TokenNetworkGraphState,
 )
 from raiden.utils import pex, typing
 from raiden.transfer.state import RouteState
 
 log = structlog.get_logger(__name__)  # pylint: disable=invalid-name
 
+# The distances of the neighbors are computed with a single search from the
+# target if the number of neighbors squared is at least this factor times the
+# number of nodes in the graph
+SINGLE_SEARCH_FACTOR = 4
+
+# (token network, from address, to address) -> (reference to the networkx
+# graph, graph version, ordered partners)
+_partners_cache = LRUCache(maxsize=128)
+
 
 def make_graph(
         edge_list: List[Tuple[typing.Address, typing.Address]],
@@ -47,6 +59,48 @@ def make_graph(
     return graph
 
 
+def get_distances_to(
+        network_graph: networkx.Graph,
+        to_address: typing.Address,
+        addresses: typing.Iterable[typing.Address],
+) -> typing.Dict[typing.Address, int]:
+    """ Returns the length of the shortest path from each of `addresses` to
+    `to_address`.
+
+    A single breadth first search is done from `to_address`, it stops once
+    all the `addresses` are reached. The addresses without a path are not in
+    the result.
+    """
+    distances = dict()
+    pending = set(addresses)
+
+    if to_address not in network_graph:
+        return distances
+
+    adjacency = network_graph.adj
+    visited = {to_address}
+    layer = [to_address]
+    length = 0
+
+    while layer and pending:
+        next_layer = list()
+
+        for node in layer:
+            if node in pending:
+                distances[node] = length
+                pending.remove(node)
+
+            for neighbor in adjacency[node]:
+                if neighbor not in visited:
+                    visited.add(neighbor)
+                    next_layer.append(neighbor)
+
+        layer = next_layer
+        length += 1
+
+    return distances
+
+
 def get_ordered_partners(
         network_graph: networkx.Graph,
         from_address: typing.Address,
@@ -55,26 +109,69 @@ def get_ordered_partners(
     paths = list()
 
     try:
-        all_neighbors = networkx.all_neighbors(network_graph, from_address)
+        all_neighbors = list(networkx.all_neighbors(network_graph, from_address))
     except networkx.NetworkXError:
         # If `our_address` is not in the graph, no channels opened with the
         # address
         return []
 
+    # A breadth first search from the target may visit the whole graph, while
+    # the bidirectional search done by `shortest_path_length` for each
+    # neighbor only visits a small part of it. The single search is cheaper
+    # for nodes with many channels, which would otherwise do one search for
+    # each of them.
+    if len(all_neighbors) ** 2 >= SINGLE_SEARCH_FACTOR * network_graph.number_of_nodes():
+        distances = get_distances_to(network_graph, to_address, all_neighbors)
+    else:
+        distances = dict()
+        for neighbor in all_neighbors:
+            try:
+                distances[neighbor] = networkx.shortest_path_length(
+                    network_graph,
+                    neighbor,
+                    to_address,
+                )
+            except (networkx.NetworkXNoPath, networkx.NodeNotFound):
+                pass
+
     for neighbor in all_neighbors:
-        try:
-            length = networkx.shortest_path_length(
-                network_graph,
-                neighbor,
-                to_address,
-            )
+        length = distances.get(neighbor)
+
+        if length is not None:
             heappush(paths, (length, neighbor))
-        except (networkx.NetworkXNoPath, networkx.NodeNotFound):
-            pass
 
     return paths
 
 
+def get_cached_ordered_partners(
+        network_graph_state: TokenNetworkGraphState,
+        token_network_id: typing.Address,
+        from_address: typing.Address,
+        to_address: typing.Address,
+) -> Tuple[Tuple[int, typing.Address], ...]:
+    """ Returns the result of `get_ordered_partners` sorted by distance.
+
+    The result is cached until the graph is replaced or its version changes,
+    the graph must only be modified through the state writers, which
+    increment the version.
+    """
+    network = network_graph_state.network
+    version = getattr(network_graph_state, 'version', 0)
+    key = (token_network_id, from_address, to_address)
+
+    cached = _partners_cache.get(key)
+    if cached is not None:
+        network_reference, cached_version, ordered_partners = cached
+
+        if network_reference() is network and cached_version == version:
+            return ordered_partners
+
+    ordered_partners = tuple(sorted(get_ordered_partners(network, from_address, to_address)))
+    _partners_cache[key] = (weakref.ref(network), version, ordered_partners)
+
+    return ordered_partners
+
+
 def get_best_routes(
         node_state: NodeState,
         token_network_id: typing.Address,
@@ -101,20 +198,19 @@ def get_best_routes(
 
     network_statuses = views.get_networkstatuses(node_state)
 
-    neighbors_heap = get_ordered_partners(
-        token_network.network_graph.network,
+    ordered_partners = get_cached_ordered_partners(
+        token_network.network_graph,
+        token_network_id,
         from_address,
         to_address,
     )
 
-    if not neighbors_heap:
+    if not ordered_partners:
         log.warning(
             'No routes available from %s to %s' % (pex(from_address), pex(to_address)),
         )
 
-    while neighbors_heap:
-        _, partner_address = heappop(neighbors_heap)
-
+    for _, partner_address in ordered_partners:
         channel_state = views.get_channelstate_by_token_network_and_partner(
             node_state,
             token_network_id,
@@ -30,6 +30,12 @@ DEFAULT_NAT_INVITATION_TIMEOUT = 15
 
 DEFAULT_SHUTDOWN_TIMEOUT = 2
 
+DEFAULT_SNAPSHOT_STATECHANGE_COUNT = 500
+DEFAULT_SNAPSHOT_INTERVAL = 600
+
+# One of the dispatch modes of raiden.transfer.architecture.StateManager
+DEFAULT_DISPATCH_MODE = 'copy_on_write'
+
 ORACLE_BLOCKNUMBER_DRIFT_TOLERANCE = 3
 ETHERSCAN_API = 'https://{network}.etherscan.io/api?module=proxy&action={action}'
 
@@ -0,0 +1,84 @@
+""" Cold storage for the rows moved out of the node database.
+
+Each archival run writes the archived rows of a table to a new segment file,
+segments are never modified afterwards. A segment is the header followed by
+the zlib compressed rows, encoded with the BinarySerializer. The rows are
+kept as they were stored, the state changes and events are not decoded.
+"""
+import os
+import threading
+import zlib
+from collections import OrderedDict
+
+from raiden.exceptions import SerializationError
+from raiden.storage.serialize import BinarySerializer
+
+SEGMENT_MAGIC = b'RDNSEG'
+SEGMENT_FORMAT_VERSION = 1
+SEGMENT_HEADER = SEGMENT_MAGIC + bytes([SEGMENT_FORMAT_VERSION])
+
+# Number of decoded segments kept in memory by a SegmentArchive
+DEFAULT_SEGMENT_CACHE_SIZE = 4
+
+
+class SegmentArchive:
+    """ A directory of compressed, write-once segment files.
+
+    The segments may be read concurrently by multiple threads.
+    """
+
+    def __init__(self, directory, cache_size=DEFAULT_SEGMENT_CACHE_SIZE):
+        self.directory = directory
+        self.cache_size = cache_size
+        self.cache = OrderedDict()
+        self.cache_lock = threading.Lock()
+
+    def write_segment(self, table_name, first_identifier, last_identifier, rows):
+        """ Write `rows` to a new segment and return its file name.
+
+        The file is only visible under its final name once its content is on
+        disk.
+        """
+        os.makedirs(self.directory, exist_ok=True)
+
+        filename = '{}-{:012d}-{:012d}.seg'.format(table_name, first_identifier, last_identifier)
+        path = os.path.join(self.directory, filename)
+        temporary_path = path + '.tmp'
+
+        data = SEGMENT_HEADER + zlib.compress(BinarySerializer.serialize(tuple(rows)), 9)
+
+        with open(temporary_path, 'wb') as segment_file:
+            segment_file.write(data)
+            segment_file.flush()
+            os.fsync(segment_file.fileno())
+
+        os.replace(temporary_path, path)
+
+        return filename
+
+    def read_segment(self, filename):
+        """ Return the tuple of rows stored in the segment `filename`. """
+        with self.cache_lock:
+            rows = self.cache.get(filename)
+
+            if rows is not None:
+                self.cache.move_to_end(filename)
+                return rows
+
+        with open(os.path.join(self.directory, filename), 'rb') as segment_file:
+            data = segment_file.read()
+
+        if not data.startswith(SEGMENT_HEADER):
+            raise SerializationError('{} is not a valid archive segment'.format(filename))
+
+        try:
+            rows = BinarySerializer.deserialize(zlib.decompress(data[len(SEGMENT_HEADER):]))
+        except zlib.error as e:
+            raise SerializationError('{} is corrupted: {}'.format(filename, e))
+
+        with self.cache_lock:
+            self.cache[filename] = rows
+            while len(self.cache) > self.cache_size:
+                self.cache.popitem(last=False)
+
+        return rows
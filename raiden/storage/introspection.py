@@ -0,0 +1,166 @@
+""" Memory and serialized size of the parts of a NodeState.
+
+`node_state_size` reports, for the whole state and for each payment network,
+token network, network graph, channel, merkle tree, payment task and the
+message queues:
+
+- `memory`: the deep size in bytes of the objects of the subtree, as given
+  by `sys.getsizeof`. Each subtree is measured on its own, so objects shared
+  by two subtrees, e.g. a channel and the payment task that references its
+  locks, are counted in both.
+- `serialized`: the size in bytes of the subtree written by the
+  `BinarySerializer`, which is what a snapshot of it costs.
+
+The report only contains plain types and hex strings, it can be encoded as
+JSON as is. Walking a large state takes time, this is meant for diagnostics
+and must not be used on a hot path.
+"""
+import random
+import sys
+
+from eth_utils import encode_hex, to_checksum_address
+
+from raiden.storage.serialize import BinarySerializer
+from raiden.transfer import views
+from raiden.transfer.undo_log import get_attribute_names
+
+# Objects without references to other objects
+ATOMIC_TYPES = (
+    type(None),
+    bool,
+    int,
+    float,
+    complex,
+    str,
+    bytes,
+    bytearray,
+    random.Random,
+)
+
+
+def deep_size(obj, seen=None):
+    """ The memory in bytes used by `obj` and the objects reachable from it.
+
+    The objects with their id in `seen` are not counted, the visited ids are
+    added to it.
+    """
+    if seen is None:
+        seen = set()
+
+    size = 0
+    pending = [obj]
+
+    while pending:
+        obj = pending.pop()
+
+        if id(obj) in seen or isinstance(obj, type):
+            continue
+
+        seen.add(id(obj))
+        size += sys.getsizeof(obj)
+
+        if isinstance(obj, ATOMIC_TYPES):
+            continue
+
+        if isinstance(obj, dict):
+            pending.extend(obj.keys())
+            pending.extend(obj.values())
+
+        elif isinstance(obj, (list, tuple, set, frozenset)):
+            pending.extend(obj)
+
+        else:
+            if hasattr(obj, '__dict__'):
+                pending.append(obj.__dict__)
+
+            for name in get_attribute_names(type(obj)):
+                value = getattr(obj, name, None)
+                if value is not None:
+                    pending.append(value)
+
+    return size
+
+
+def object_size(obj):
+    return {
+        'memory': deep_size(obj),
+        'serialized': len(BinarySerializer.serialize(obj)),
+    }
+
+
+def merkletree_size(end_state):
+    result = object_size(end_state.merkletree)
+    result['leaves'] = len(end_state.merkletree.layers[0])
+    return result
+
+
+def channel_size(channel_state):
+    result = object_size(channel_state)
+    result.update(
+        identifier=encode_hex(channel_state.identifier),
+        partner_address=to_checksum_address(channel_state.partner_state.address),
+        our_merkletree=merkletree_size(channel_state.our_state),
+        partner_merkletree=merkletree_size(channel_state.partner_state),
+    )
+    return result
+
+
+def token_network_size(token_network_state):
+    result = object_size(token_network_state)
+    result.update(
+        address=to_checksum_address(token_network_state.address),
+        token_address=to_checksum_address(token_network_state.token_address),
+        network_graph=object_size(token_network_state.network_graph),
+        channels=[
+            channel_size(channel_state)
+            for channel_state in token_network_state.channelidentifiers_to_channels.values()
+        ],
+    )
+    return result
+
+
+def payment_network_size(payment_network_state):
+    result = object_size(payment_network_state)
+    result.update(
+        address=to_checksum_address(payment_network_state.address),
+        token_networks=[
+            token_network_size(token_network_state)
+            for token_network_state
+            in payment_network_state.tokenidentifiers_to_tokennetworks.values()
+        ],
+    )
+    return result
+
+
+def payment_task_size(node_state, secrethash, task):
+    result = object_size(task)
+    result.update(
+        secrethash=encode_hex(secrethash),
+        role=views.get_transfer_role(node_state, secrethash),
+        token_network_identifier=to_checksum_address(task.token_network_identifier),
+    )
+    return result
+
+
+def node_state_size(node_state):
+    """ Return the size report of `node_state`, see the module docstring. """
+    result = object_size(node_state)
+
+    tasks = node_state.payment_mapping.secrethashes_to_task
+    queues = node_state.queueids_to_queues
+
+    result.update(
+        block_number=node_state.block_number,
+        payment_networks=[
+            payment_network_size(payment_network_state)
+            for payment_network_state in node_state.identifiers_to_paymentnetworks.values()
+        ],
+        payment_tasks=[
+            payment_task_size(node_state, secrethash, task)
+            for secrethash, task in tasks.items()
+        ],
+        queues=object_size(queues),
+    )
+    result['queues']['messages'] = sum(len(queue) for queue in queues.values())
+
+    return result
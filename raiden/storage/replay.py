@@ -0,0 +1,96 @@
+""" Offline replay of a node database, used to measure the performance of the
+state machine on real histories.
+"""
+import time
+from collections import defaultdict
+
+from raiden.transfer.architecture import StateManager
+
+
+class ReplayStatistics:
+    """ Counters collected while replaying the state changes of a database. """
+
+    __slots__ = (
+        'from_statechange_id',
+        'statechanges',
+        'events',
+        'elapsed',
+        'dispatch_elapsed',
+        'statechanges_by_type',
+    )
+
+    def __init__(self, from_statechange_id):
+        self.from_statechange_id = from_statechange_id
+        self.statechanges = 0
+        self.events = 0
+        # wall time, including reading and deserializing the state changes
+        self.elapsed = 0.0
+        self.dispatch_elapsed = 0.0
+        # state change class name -> [count, dispatch time]
+        self.statechanges_by_type = defaultdict(lambda: [0, 0.0])
+
+    def statechanges_per_second(self):
+        if not self.elapsed:
+            return 0.0
+
+        return self.statechanges / self.elapsed
+
+
+def replay_database(
+        storage,
+        transition_function,
+        from_snapshot=False,
+        profiler=None,
+        dispatch_mode=None,
+):
+    """ Apply the state changes stored in `storage` to a new StateManager.
+
+    If `from_snapshot` is set the latest snapshot is restored first and only
+    the state changes applied after it are replayed, otherwise the whole log
+    is. `profiler` is a `cProfile.Profile` enabled during the replay.
+    `dispatch_mode` is given to the StateManager.
+
+    Returns the tuple (state_manager, ReplayStatistics).
+    """
+    state = None
+    from_statechange_id = 0
+
+    if from_snapshot:
+        snapshot = storage.get_state_snapshot()
+        if snapshot:
+            last_applied_state_change_id, state = snapshot
+            from_statechange_id = last_applied_state_change_id + 1
+
+    state_manager = StateManager(transition_function, state, dispatch_mode)
+    statistics = ReplayStatistics(from_statechange_id)
+    statechanges_by_type = statistics.statechanges_by_type
+
+    state_changes = storage.iter_statechanges_by_identifier(
+        from_identifier=from_statechange_id,
+        to_identifier='latest',
+    )
+
+    if profiler is not None:
+        profiler.enable()
+
+    start = time.perf_counter()
+    try:
+        for state_change in state_changes:
+            dispatch_start = time.perf_counter()
+            events = state_manager.dispatch(state_change)
+            dispatch_elapsed = time.perf_counter() - dispatch_start
+
+            type_statistics = statechanges_by_type[type(state_change).__name__]
+            type_statistics[0] += 1
+            type_statistics[1] += dispatch_elapsed
+
+            statistics.statechanges += 1
+            statistics.events += len(events)
+            statistics.dispatch_elapsed += dispatch_elapsed
+    finally:
+        statistics.elapsed = time.perf_counter() - start
+
+        if profiler is not None:
+            profiler.disable()
+
+    return state_manager, statistics
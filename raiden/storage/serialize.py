@@ -1,4 +1,624 @@
 import pickle
+import random
+import struct
+
+import networkx
+
+from raiden.exceptions import SerializationError
+from raiden.transfer import (
+    channel,
+    events,
+    state,
+    state_change,
+)
+from raiden.transfer.block_deadlines import BlockDeadlines
+from raiden.transfer.mediated_transfer import (
+    events as mediated_events,
+    state as mediated_state,
+    state_change as mediated_state_change,
+)
+
+# Pickle protocol 2+ blobs start with the PROTO opcode, this is used to detect
+# the data written by the PickleSerializer.
+PICKLE_PROTO = 0x80
+
+BINARY_MAGIC = 0x52
+BINARY_FORMAT_VERSION = 1
+
+# Value tags
+TAG_NONE = 0
+TAG_TRUE = 1
+TAG_FALSE = 2
+TAG_INT = 3
+TAG_BYTES = 4
+TAG_STR = 5
+TAG_FLOAT = 6
+TAG_LIST = 7
+TAG_TUPLE = 8
+TAG_DICT = 9
+TAG_SET = 10
+TAG_FROZENSET = 11
+TAG_BYTEARRAY = 12
+TAG_OBJECT = 13
+TAG_REF = 14
+TAG_UNSET = 15
+TAG_RANDOM = 16
+TAG_GRAPH = 17
+
+# Strings and bytes at least this long are written once per blob and
+# referenced afterwards, addresses and hashes are repeated all over the state.
+MEMO_MIN_LENGTH = 8
+
+FLOAT_STRUCT = struct.Struct('>d')
+
+# The type tags are part of the storage format, a tag must never be reused or
+# renumbered. New classes are added with a new tag, renaming or moving a class
+# only requires updating the table.
+TYPE_TAGS = (
+    # raiden.transfer.state
+    (1, state.NodeState),
+    (2, state.PaymentNetworkState),
+    (3, state.TokenNetworkState),
+    (4, state.TokenNetworkGraphState),
+    (5, state.PaymentMappingState),
+    (6, state.PaymentMappingState.InitiatorTask),
+    (7, state.PaymentMappingState.MediatorTask),
+    (8, state.PaymentMappingState.TargetTask),
+    (9, state.RouteState),
+    (10, state.BalanceProofUnsignedState),
+    (11, state.BalanceProofSignedState),
+    (12, state.HashTimeLockState),
+    (13, state.UnlockPartialProofState),
+    (14, state.UnlockProofState),
+    (15, state.TransactionExecutionStatus),
+    (16, state.MerkleTreeState),
+    (17, state.NettingChannelEndState),
+    (18, state.NettingChannelState),
+    (19, state.TransactionChannelNewBalance),
+    (20, channel.TransactionOrder),
+
+    # raiden.transfer.mediated_transfer.state
+    (40, mediated_state.InitiatorPaymentState),
+    (41, mediated_state.InitiatorTransferState),
+    (42, mediated_state.MediatorTransferState),
+    (43, mediated_state.TargetTransferState),
+    (44, mediated_state.LockedTransferUnsignedState),
+    (45, mediated_state.LockedTransferSignedState),
+    (46, mediated_state.TransferDescriptionWithSecretState),
+    (47, mediated_state.MediationPairState),
+
+    # raiden.transfer.state_change
+    (60, state_change.Block),
+    (61, state_change.ActionCancelPayment),
+    (62, state_change.ActionChannelClose),
+    (63, state_change.ActionCancelTransfer),
+    (64, state_change.ActionTransferDirect),
+    (65, state_change.ContractReceiveChannelNew),
+    (66, state_change.ContractReceiveChannelClosed),
+    (67, state_change.ActionInitNode),
+    (68, state_change.ActionNewTokenNetwork),
+    (69, state_change.ContractReceiveChannelNewBalance),
+    (70, state_change.ContractReceiveChannelSettled),
+    (71, state_change.ActionLeaveAllNetworks),
+    (72, state_change.ActionChangeNodeNetworkState),
+    (73, state_change.ContractReceiveNewPaymentNetwork),
+    (74, state_change.ContractReceiveNewTokenNetwork),
+    (75, state_change.ContractReceiveSecretReveal),
+    (76, state_change.ContractReceiveChannelBatchUnlock),
+    (77, state_change.ContractReceiveNewRoute),
+    (78, state_change.ContractReceiveRouteNew),
+    (79, state_change.ReceiveTransferDirect),
+    (80, state_change.ReceiveUnlock),
+    (81, state_change.ReceiveDelivered),
+    (82, state_change.ReceiveProcessed),
+
+    # raiden.transfer.mediated_transfer.state_change
+    (100, mediated_state_change.ActionInitInitiator),
+    (101, mediated_state_change.ActionInitMediator),
+    (102, mediated_state_change.ActionInitTarget),
+    (103, mediated_state_change.ActionCancelRoute),
+    (104, mediated_state_change.ReceiveSecretRequest),
+    (105, mediated_state_change.ReceiveSecretReveal),
+    (106, mediated_state_change.ReceiveTransferRefundCancelRoute),
+    (107, mediated_state_change.ReceiveTransferRefund),
+
+    # raiden.transfer.events
+    (120, events.ContractSendChannelClose),
+    (121, events.ContractSendChannelSettle),
+    (122, events.ContractSendChannelUpdateTransfer),
+    (123, events.ContractSendChannelBatchUnlock),
+    (124, events.ContractSendSecretReveal),
+    (125, events.EventTransferSentSuccess),
+    (126, events.EventTransferSentFailed),
+    (127, events.EventTransferReceivedSuccess),
+    (128, events.EventTransferReceivedInvalidDirectTransfer),
+    (129, events.SendDirectTransfer),
+    (130, events.SendProcessed),
+    (131, events.EventChannelPruned),
+    (132, events.EventPaymentTaskPruned),
+
+    # raiden.transfer.mediated_transfer.events
+    (140, mediated_events.SendLockedTransfer),
+    (141, mediated_events.SendRevealSecret),
+    (142, mediated_events.SendBalanceProof),
+    (143, mediated_events.SendSecretRequest),
+    (144, mediated_events.SendRefundTransfer),
+    (145, mediated_events.EventUnlockSuccess),
+    (146, mediated_events.EventUnlockFailed),
+    (147, mediated_events.EventUnlockClaimSuccess),
+    (148, mediated_events.EventUnlockClaimFailed),
+)
+
+_UNSET = object()
+
+
+class TypeLayout:
+    """ The fields of a registered class, in serialization order.
+
+    The `__slots__` of the class hierarchy are stored positionally, the
+    instance `__dict__`, if the class has one, is stored as a mapping.
+    """
+
+    __slots__ = (
+        'cls',
+        'tag',
+        'slots',
+        'has_dict',
+        'is_namedtuple',
+    )
+
+    def __init__(self, cls, tag):
+        slots = list()
+        has_dict = False
+
+        for klass in reversed(cls.__mro__[:-1]):
+            klass_slots = klass.__dict__.get('__slots__')
+
+            if klass_slots is None:
+                has_dict = True
+                continue
+
+            if isinstance(klass_slots, str):
+                klass_slots = (klass_slots,)
+
+            slots.extend(
+                name
+                for name in klass_slots
+                if name not in ('__dict__', '__weakref__')
+            )
+
+        is_namedtuple = issubclass(cls, tuple) and hasattr(cls, '_fields')
+
+        self.cls = cls
+        self.tag = tag
+        self.slots = tuple(slots) if not is_namedtuple else cls._fields
+        self.has_dict = has_dict and not is_namedtuple
+        self.is_namedtuple = is_namedtuple
+
+
+TYPE_LAYOUTS = {cls: TypeLayout(cls, tag) for tag, cls in TYPE_TAGS}
+TAG_LAYOUTS = {layout.tag: layout for layout in TYPE_LAYOUTS.values()}
+
+
+def _write_uint(buffer, value):
+    while value > 0x7f:
+        buffer.append((value & 0x7f) | 0x80)
+        value >>= 7
+    buffer.append(value)
+
+
+class _Encoder:
+    __slots__ = (
+        'buffer',
+        'memo',
+    )
+
+    def __init__(self):
+        self.buffer = bytearray((BINARY_MAGIC, BINARY_FORMAT_VERSION))
+        self.memo = dict()
+
+    def encode(self, value):
+        encoder = ENCODERS.get(type(value))
+
+        if encoder is None:
+            raise SerializationError(
+                'Type {} has no serialization tag'.format(type(value).__name__),
+            )
+
+        encoder(self, value)
+
+    def memoize(self, key):
+        """ Return True if `key` was already written, otherwise assign the
+        next reference index to it.
+        """
+        memo = self.memo
+        index = memo.get(key)
+
+        if index is not None:
+            self.buffer.append(TAG_REF)
+            _write_uint(self.buffer, index)
+            return True
+
+        memo[key] = len(memo)
+        return False
+
+    def encode_none(self, value):  # pylint: disable=unused-argument
+        self.buffer.append(TAG_NONE)
+
+    def encode_bool(self, value):
+        self.buffer.append(TAG_TRUE if value else TAG_FALSE)
+
+    def encode_int(self, value):
+        # zigzag encoding, small negative numbers stay small
+        zigzag = value << 1 if value >= 0 else ((-value) << 1) - 1
+        buffer = self.buffer
+        buffer.append(TAG_INT)
+
+        if zigzag < 0x80:
+            buffer.append(zigzag)
+        else:
+            _write_uint(buffer, zigzag)
+
+    def encode_bytes(self, value):
+        if len(value) >= MEMO_MIN_LENGTH and self.memoize(value):
+            return
+
+        buffer = self.buffer
+        buffer.append(TAG_BYTES)
+        _write_uint(buffer, len(value))
+        buffer.extend(value)
+
+    def encode_str(self, value):
+        if len(value) >= MEMO_MIN_LENGTH and self.memoize(value):
+            return
+
+        data = value.encode('utf8')
+        buffer = self.buffer
+        buffer.append(TAG_STR)
+        _write_uint(buffer, len(data))
+        buffer.extend(data)
+
+    def encode_bytearray(self, value):
+        buffer = self.buffer
+        buffer.append(TAG_BYTEARRAY)
+        _write_uint(buffer, len(value))
+        buffer.extend(value)
+
+    def encode_float(self, value):
+        self.buffer.append(TAG_FLOAT)
+        self.buffer.extend(FLOAT_STRUCT.pack(value))
+
+    def encode_items(self, tag, values):
+        self.buffer.append(tag)
+        _write_uint(self.buffer, len(values))
+
+        encode = self.encode
+        for item in values:
+            encode(item)
+
+    def encode_list(self, value):
+        if not self.memoize(id(value)):
+            self.encode_items(TAG_LIST, value)
+
+    def encode_tuple(self, value):
+        self.encode_items(TAG_TUPLE, value)
+
+    def encode_set(self, value):
+        if not self.memoize(id(value)):
+            self.encode_items(TAG_SET, value)
+
+    def encode_frozenset(self, value):
+        if not self.memoize(id(value)):
+            self.encode_items(TAG_FROZENSET, value)
+
+    def encode_dict(self, value):
+        if self.memoize(id(value)):
+            return
+
+        self.buffer.append(TAG_DICT)
+        _write_uint(self.buffer, len(value))
+
+        encode = self.encode
+        for key, item in value.items():
+            encode(key)
+            encode(item)
+
+    def encode_random(self, value):
+        if self.memoize(id(value)):
+            return
+
+        # The Mersenne Twister state is a tuple of 32bit words, packed it
+        # is a fraction of the size of the varint encoding.
+        version, internal_state, gauss_next = value.getstate()
+        self.buffer.append(TAG_RANDOM)
+        self.encode(version)
+        self.encode(struct.pack('>{}I'.format(len(internal_state)), *internal_state))
+        self.encode(gauss_next)
+
+    def encode_graph(self, value):
+        if not self.memoize(id(value)):
+            self.buffer.append(TAG_GRAPH)
+            # tuples are not memoized, these are temporary objects
+            self.encode_tuple(tuple(value.nodes(data=True)))
+            self.encode_tuple(tuple(value.edges(data=True)))
+
+    def encode_object(self, value):
+        # State objects are shared inside the tree, e.g. a channel is
+        # reachable both by its identifier and by the partner address, the
+        # references must be kept to not break the aliasing on decode.
+        if self.memoize(id(value)):
+            return
+
+        layout = TYPE_LAYOUTS[type(value)]
+        buffer = self.buffer
+        buffer.append(TAG_OBJECT)
+        _write_uint(buffer, layout.tag)
+        _write_uint(buffer, len(layout.slots))
+
+        encode = self.encode
+        for name in layout.slots:
+            field = getattr(value, name, _UNSET)
+
+            if field is _UNSET:
+                buffer.append(TAG_UNSET)
+            else:
+                encode(field)
+
+        if layout.has_dict:
+            self.encode_dict(value.__dict__)
+
+
+ENCODERS = {
+    type(None): _Encoder.encode_none,
+    bool: _Encoder.encode_bool,
+    int: _Encoder.encode_int,
+    bytes: _Encoder.encode_bytes,
+    str: _Encoder.encode_str,
+    float: _Encoder.encode_float,
+    list: _Encoder.encode_list,
+    tuple: _Encoder.encode_tuple,
+    dict: _Encoder.encode_dict,
+    set: _Encoder.encode_set,
+    frozenset: _Encoder.encode_frozenset,
+    bytearray: _Encoder.encode_bytearray,
+    random.Random: _Encoder.encode_random,
+    networkx.Graph: _Encoder.encode_graph,
+    # derived from the state, rebuilt after a restore
+    BlockDeadlines: _Encoder.encode_none,
+}
+ENCODERS.update((cls, _Encoder.encode_object) for cls in TYPE_LAYOUTS)
+
+
+class _Decoder:
+    __slots__ = (
+        'data',
+        'position',
+        'memo',
+    )
+
+    def __init__(self, data):
+        self.data = data
+        self.position = 2
+        self.memo = list()
+
+    def read_uint(self):
+        data = self.data
+        position = self.position
+        byte = data[position]
+        position += 1
+
+        if byte < 0x80:
+            self.position = position
+            return byte
+
+        result = byte & 0x7f
+        shift = 7
+        while True:
+            byte = data[position]
+            position += 1
+            result |= (byte & 0x7f) << shift
+
+            if byte < 0x80:
+                self.position = position
+                return result
+
+            shift += 7
+
+    def read_bytes(self):
+        length = self.read_uint()
+        start = self.position
+        end = start + length
+
+        if end > len(self.data):
+            raise SerializationError('Truncated data')
+
+        self.position = end
+        return self.data[start:end]
+
+    def decode(self):
+        tag = self.data[self.position]
+        self.position += 1
+        return DECODERS[tag](self)
+
+    def decode_unknown(self):
+        tag = self.data[self.position - 1]
+        raise SerializationError('Unknown value tag {}'.format(tag))
+
+    def decode_none(self):  # pylint: disable=no-self-use
+        return None
+
+    def decode_true(self):  # pylint: disable=no-self-use
+        return True
+
+    def decode_false(self):  # pylint: disable=no-self-use
+        return False
+
+    def decode_unset(self):  # pylint: disable=no-self-use
+        return _UNSET
+
+    def decode_int(self):
+        zigzag = self.read_uint()
+        return zigzag >> 1 if not zigzag & 1 else -((zigzag + 1) >> 1)
+
+    def decode_bytes(self):
+        value = self.read_bytes()
+        if len(value) >= MEMO_MIN_LENGTH:
+            self.memo.append(value)
+        return value
+
+    def decode_str(self):
+        value = self.read_bytes().decode('utf8')
+        if len(value) >= MEMO_MIN_LENGTH:
+            self.memo.append(value)
+        return value
+
+    def decode_bytearray(self):
+        return bytearray(self.read_bytes())
+
+    def decode_float(self):
+        start = self.position
+        self.position = start + FLOAT_STRUCT.size
+        return FLOAT_STRUCT.unpack_from(self.data, start)[0]
+
+    def decode_list(self):
+        result = list()
+        self.memo.append(result)
+
+        decode = self.decode
+        for _ in range(self.read_uint()):
+            result.append(decode())
+
+        return result
+
+    def decode_tuple(self):
+        decode = self.decode
+        return tuple([decode() for _ in range(self.read_uint())])
+
+    def decode_dict(self):
+        result = dict()
+        self.memo.append(result)
+
+        decode = self.decode
+        for _ in range(self.read_uint()):
+            key = decode()
+            result[key] = decode()
+
+        return result
+
+    def decode_set(self):
+        result = set()
+        self.memo.append(result)
+
+        decode = self.decode
+        for _ in range(self.read_uint()):
+            result.add(decode())
+
+        return result
+
+    def decode_frozenset(self):
+        index = len(self.memo)
+        self.memo.append(None)
+
+        decode = self.decode
+        result = frozenset([decode() for _ in range(self.read_uint())])
+        self.memo[index] = result
+        return result
+
+    def decode_ref(self):
+        return self.memo[self.read_uint()]
+
+    def decode_random(self):
+        result = random.Random()
+        self.memo.append(result)
+
+        version = self.decode()
+        packed_state = self.decode()
+        gauss_next = self.decode()
+        internal_state = struct.unpack('>{}I'.format(len(packed_state) // 4), packed_state)
+
+        result.setstate((version, internal_state, gauss_next))
+        return result
+
+    def decode_graph(self):
+        result = networkx.Graph()
+        self.memo.append(result)
+        result.add_nodes_from(self.decode())
+        result.add_edges_from(self.decode())
+        return result
+
+    def decode_object(self):
+        tag = self.read_uint()
+        layout = TAG_LAYOUTS.get(tag)
+
+        if layout is None:
+            raise SerializationError('Unknown type tag {}'.format(tag))
+
+        slots = layout.slots
+        count = self.read_uint()
+        if count > len(slots):
+            raise SerializationError(
+                'Data for {} has {} fields, expected at most {}'.format(
+                    layout.cls.__name__,
+                    count,
+                    len(slots),
+                ),
+            )
+
+        memo = self.memo
+        decode = self.decode
+
+        if layout.is_namedtuple:
+            index = len(memo)
+            memo.append(None)
+
+            fields = [decode() for _ in range(count)]
+            result = layout.cls(*fields)
+            memo[index] = result
+            return result
+
+        result = layout.cls.__new__(layout.cls)
+        memo.append(result)
+
+        # Fields appended to the class after the data was written are left
+        # unset, same as with pickle
+        has_unset_fields = count < len(slots)
+        for index in range(count):
+            value = decode()
+
+            if value is not _UNSET:
+                setattr(result, slots[index], value)
+            else:
+                has_unset_fields = True
+
+        if layout.has_dict:
+            result.__dict__.update(decode())
+
+        # as with pickle, the class may fill the fields it is missing
+        if has_unset_fields and hasattr(result, '__setstate__'):
+            result.__setstate__((None, None))
+
+        return result
+
+
+DECODERS = [_Decoder.decode_unknown] * 256
+DECODERS[TAG_NONE] = _Decoder.decode_none
+DECODERS[TAG_TRUE] = _Decoder.decode_true
+DECODERS[TAG_FALSE] = _Decoder.decode_false
+DECODERS[TAG_INT] = _Decoder.decode_int
+DECODERS[TAG_BYTES] = _Decoder.decode_bytes
+DECODERS[TAG_STR] = _Decoder.decode_str
+DECODERS[TAG_FLOAT] = _Decoder.decode_float
+DECODERS[TAG_LIST] = _Decoder.decode_list
+DECODERS[TAG_TUPLE] = _Decoder.decode_tuple
+DECODERS[TAG_DICT] = _Decoder.decode_dict
+DECODERS[TAG_SET] = _Decoder.decode_set
+DECODERS[TAG_FROZENSET] = _Decoder.decode_frozenset
+DECODERS[TAG_BYTEARRAY] = _Decoder.decode_bytearray
+DECODERS[TAG_OBJECT] = _Decoder.decode_object
+DECODERS[TAG_REF] = _Decoder.decode_ref
+DECODERS[TAG_UNSET] = _Decoder.decode_unset
+DECODERS[TAG_RANDOM] = _Decoder.decode_random
+DECODERS[TAG_GRAPH] = _Decoder.decode_graph
 
 
 class PickleSerializer:
@@ -9,3 +629,56 @@ class PickleSerializer:
     @staticmethod
     def deserialize(data):
         return pickle.loads(data)
+
+
+class BinarySerializer:
+    """ Compact serializer for the State, StateChange and Event classes.
+
+    Every blob starts with a magic byte and the format version. Objects are
+    written as their type tag from `TYPE_TAGS` followed by their `__slots__`
+    values, so the data does not depend on the module path of the classes.
+    Shared objects and repeated addresses are written once and referenced
+    afterwards.
+
+    Data written by the `PickleSerializer` is still readable, see
+    `SQLiteStorage.migrate_pickled_data` to rewrite it in the binary format.
+    """
+
+    @staticmethod
+    def serialize(transaction):
+        encoder = _Encoder()
+        encoder.encode(transaction)
+        return bytes(encoder.buffer)
+
+    @staticmethod
+    def deserialize(data):
+        if not data:
+            raise SerializationError('Empty data')
+
+        if data[0] == PICKLE_PROTO:
+            return pickle.loads(data)
+
+        if data[0] != BINARY_MAGIC:
+            raise SerializationError('Unknown serialization format')
+
+        if data[1] != BINARY_FORMAT_VERSION:
+            raise SerializationError(
+                'Unsupported serialization format version {}'.format(data[1]),
+            )
+
+        decoder = _Decoder(data)
+
+        try:
+            result = decoder.decode()
+        except IndexError:
+            raise SerializationError('Truncated data')
+
+        if decoder.position != len(data):
+            raise SerializationError('Trailing data after the serialized object')
+
+        return result
+
+    @staticmethod
+    def is_legacy(data):
+        """ True if `data` was written by the PickleSerializer. """
+        return bool(data) and data[0] == PICKLE_PROTO
@@ -0,0 +1,197 @@
+""" Incremental snapshots of the NodeState.
+
+The node state is split in a skeleton and its subtrees: the token networks
+(without their channels), their network graphs, the channels and the payment
+tasks. The skeleton keeps the keys of the maps that hold the subtrees, in
+order, with None as value, and the aliases to token networks and channels are
+replaced by their identifiers.
+
+An incremental snapshot writes the skeleton and only the subtrees that
+changed since the previous snapshot, restoring joins the skeleton with the
+latest version of each subtree.
+"""
+import copy
+import hashlib
+
+from raiden.transfer.state import NodeState
+
+SUBTREE_TOKEN_NETWORK = 'token_network'
+SUBTREE_NETWORK_GRAPH = 'network_graph'
+SUBTREE_CHANNEL = 'channel'
+SUBTREE_PAYMENT_TASK = 'payment_task'
+
+
+def subtree_key(kind, *identifiers):
+    return ':'.join([kind] + [identifier.hex() for identifier in identifiers])
+
+
+def split_node_state(node_state):
+    """ Return the tuple (skeleton, subtrees) for `node_state`.
+
+    `subtrees` maps the key of each subtree to the tuple (source, subtree),
+    where source is the object of `node_state` the subtree was taken from.
+    The objects of `node_state` are not modified.
+    """
+    subtrees = dict()
+
+    skeleton = copy.copy(node_state)
+    skeleton.identifiers_to_paymentnetworks = dict()
+
+    for payment_network_id, payment_network in node_state.identifiers_to_paymentnetworks.items():
+        payment_network_skeleton = copy.copy(payment_network)
+        payment_network_skeleton.tokenidentifiers_to_tokennetworks = dict.fromkeys(
+            payment_network.tokenidentifiers_to_tokennetworks,
+        )
+        payment_network_skeleton.tokenaddresses_to_tokennetworks = {
+            token_address: token_network.address
+            for token_address, token_network
+            in payment_network.tokenaddresses_to_tokennetworks.items()
+        }
+        skeleton.identifiers_to_paymentnetworks[payment_network_id] = payment_network_skeleton
+
+        token_networks = payment_network.tokenidentifiers_to_tokennetworks
+        for token_network_id, token_network in token_networks.items():
+            token_network_skeleton = copy.copy(token_network)
+            token_network_skeleton.network_graph = None
+            token_network_skeleton.channelidentifiers_to_channels = dict.fromkeys(
+                token_network.channelidentifiers_to_channels,
+            )
+            token_network_skeleton.partneraddresses_to_channels = {
+                partner_address: channel_state.identifier
+                for partner_address, channel_state
+                in token_network.partneraddresses_to_channels.items()
+            }
+
+            key = subtree_key(SUBTREE_TOKEN_NETWORK, payment_network_id, token_network_id)
+            subtrees[key] = (token_network, token_network_skeleton)
+
+            key = subtree_key(SUBTREE_NETWORK_GRAPH, payment_network_id, token_network_id)
+            subtrees[key] = (token_network.network_graph, token_network.network_graph)
+
+            channels = token_network.channelidentifiers_to_channels
+            for channel_id, channel_state in channels.items():
+                key = subtree_key(
+                    SUBTREE_CHANNEL,
+                    payment_network_id,
+                    token_network_id,
+                    channel_id,
+                )
+                subtrees[key] = (channel_state, channel_state)
+
+    payment_mapping = copy.copy(node_state.payment_mapping)
+    payment_mapping.secrethashes_to_task = dict.fromkeys(
+        node_state.payment_mapping.secrethashes_to_task,
+    )
+    skeleton.payment_mapping = payment_mapping
+
+    for secrethash, task in node_state.payment_mapping.secrethashes_to_task.items():
+        subtrees[subtree_key(SUBTREE_PAYMENT_TASK, secrethash)] = (task, task)
+
+    return skeleton, subtrees
+
+
+def join_node_state(skeleton, subtrees):
+    """ Inverse of `split_node_state`, `subtrees` maps the keys to the
+    subtree objects. `skeleton` is modified in place and returned.
+    """
+    for payment_network_id, payment_network in skeleton.identifiers_to_paymentnetworks.items():
+        token_networks = payment_network.tokenidentifiers_to_tokennetworks
+
+        for token_network_id in token_networks:
+            key = subtree_key(SUBTREE_TOKEN_NETWORK, payment_network_id, token_network_id)
+            token_network = subtrees[key]
+
+            key = subtree_key(SUBTREE_NETWORK_GRAPH, payment_network_id, token_network_id)
+            token_network.network_graph = subtrees[key]
+
+            channels = token_network.channelidentifiers_to_channels
+            for channel_id in channels:
+                key = subtree_key(
+                    SUBTREE_CHANNEL,
+                    payment_network_id,
+                    token_network_id,
+                    channel_id,
+                )
+                channels[channel_id] = subtrees[key]
+
+            token_network.partneraddresses_to_channels = {
+                partner_address: channels[channel_id]
+                for partner_address, channel_id
+                in token_network.partneraddresses_to_channels.items()
+            }
+
+            token_networks[token_network_id] = token_network
+
+        payment_network.tokenaddresses_to_tokennetworks = {
+            token_address: token_networks[token_network_id]
+            for token_address, token_network_id
+            in payment_network.tokenaddresses_to_tokennetworks.items()
+        }
+
+    tasks = skeleton.payment_mapping.secrethashes_to_task
+    for secrethash in tasks:
+        tasks[secrethash] = subtrees[subtree_key(SUBTREE_PAYMENT_TASK, secrethash)]
+
+    return skeleton
+
+
+class IncrementalSnapshots:
+    """ Writes snapshots of the NodeState that only contain the subtrees
+    changed since the previous snapshot.
+
+    A subtree taken from the same object as in the previous snapshot is not
+    serialized again, the old states are never modified. The other subtrees
+    are serialized and only written if their data changed. The first
+    snapshot written by an instance replaces all the stored subtrees.
+    """
+
+    def __init__(self):
+        # key -> (source, digest of the subtree data) for the previous snapshot
+        self.previous_subtrees = None
+
+    def write_snapshot(self, storage, statechange_id, state):
+        """ Write the snapshot of `state` to `storage`, returns the number of
+        written subtrees.
+
+        Only NodeStates can be split, other states are written in full.
+        """
+        if not isinstance(state, NodeState):
+            storage.write_state_snapshot(statechange_id, state)
+            self.previous_subtrees = None
+            return 0
+
+        skeleton, subtrees = split_node_state(state)
+        previous_subtrees = self.previous_subtrees or dict()
+
+        current_subtrees = dict()
+        changed_subtrees = dict()
+        for key, (source, subtree) in subtrees.items():
+            previous = previous_subtrees.get(key)
+
+            if previous is not None and previous[0] is source:
+                current_subtrees[key] = previous
+                continue
+
+            data = storage.serializer.serialize(subtree)
+            digest = hashlib.sha256(data).digest()
+            current_subtrees[key] = (source, digest)
+
+            if previous is None or previous[1] != digest:
+                changed_subtrees[key] = data
+
+        removed_keys = [
+            key
+            for key in previous_subtrees
+            if key not in current_subtrees
+        ]
+
+        storage.write_state_snapshot_subtrees(
+            statechange_id,
+            skeleton,
+            changed_subtrees,
+            removed_keys,
+            replace_all=self.previous_subtrees is None,
+        )
+        self.previous_subtrees = current_subtrees
+
+        return len(changed_subtrees)
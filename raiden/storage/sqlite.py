@@ -1,17 +1,171 @@
+import contextlib
+import os
+import pickle
 import sqlite3
 import threading
+from urllib.request import pathname2url
+
+import gevent
+from gevent.event import AsyncResult
+
+from raiden.storage.archive import SegmentArchive
+from raiden.storage.snapshot import join_node_state
 from typing import (
     Any,
     Optional,
     Tuple,
 )
 
+# Number of idle read-only connections kept open
+DEFAULT_READ_POOL_SIZE = 4
+
+# Number of rows read at once by the iterators over the database
+DEFAULT_FETCH_CHUNK_SIZE = 1000
+
+# `PRAGMA user_version` of the databases without pickled rows, see
+# `SQLiteStorage.migrate_pickled_data`
+MIGRATED_USER_VERSION = 1
+
+# Columns of state_events with data extracted from the event, used to filter
+# the events without deserializing them.
+EVENT_INDEX_COLUMNS = (
+    'event_type',
+    'token_network_identifier',
+    'channel_identifier',
+    'payment_identifier',
+)
+
+# Layout of the rows stored in the archive segments
+ARCHIVED_STATE_CHANGE_COLUMNS = ('identifier', 'data')
+ARCHIVED_EVENT_COLUMNS = (
+    'identifier',
+    'source_statechange_id',
+    'block_number',
+    'data',
+) + EVENT_INDEX_COLUMNS
+
+
+def event_index_columns(event):
+    """ Return the values for the EVENT_INDEX_COLUMNS of `event`.
+
+    The identifiers are looked up in the event itself and in the transfer or
+    balance proof it carries, None is used for the missing ones. Payment
+    identifiers are uint64 and stored as text, sqlite integers are signed.
+    """
+    transfer = getattr(event, 'transfer', None)
+    balance_proof = getattr(event, 'balance_proof', None)
+    if balance_proof is None:
+        balance_proof = getattr(transfer, 'balance_proof', None)
+
+    token_network_identifier = getattr(event, 'token_network_identifier', None)
+    if token_network_identifier is None:
+        token_network_identifier = getattr(balance_proof, 'token_network_identifier', None)
+
+    channel_identifier = getattr(event, 'channel_identifier', None)
+    if channel_identifier is None:
+        channel_identifier = getattr(balance_proof, 'channel_address', None)
+
+    # The EventTransfer* and EventUnlock* events name the payment identifier
+    # just `identifier`
+    payment_identifier = getattr(event, 'payment_identifier', None)
+    if payment_identifier is None:
+        payment_identifier = getattr(transfer, 'payment_identifier', None)
+    if payment_identifier is None:
+        payment_identifier = getattr(event, 'identifier', None)
+
+    return (
+        type(event).__name__,
+        token_network_identifier,
+        channel_identifier,
+        str(payment_identifier) if payment_identifier is not None else None,
+    )
+
 
 class SQLiteStorage:
-    def __init__(self, database_path, serializer):
-        conn = sqlite3.connect(database_path)
+    """ Storage for the state changes, snapshots and events of the node.
+
+    A single connection is used for the writes, the queries use a pool of
+    read-only connections. With the database in WAL journal mode the readers
+    see the last committed data and don't block, nor are blocked by, the
+    writer. The queries of the pooled connections run in the gevent
+    threadpool, a long query does not stall the other greenlets. In-memory
+    databases can not be shared by multiple connections, for these all the
+    queries use the writer connection and run in the calling greenlet.
+
+    With `read_only` the database is opened read-only and its schema is used
+    as is, e.g. to inspect the database of another node.
+
+    Old state changes and events can be moved to the segment files of an
+    archive directory next to the database, see `archive_state_changes`.
+    The queries read the archived rows transparently.
+    """
+
+    def __init__(
+            self,
+            database_path,
+            serializer,
+            read_pool_size=DEFAULT_READ_POOL_SIZE,
+            read_only=False,
+    ):
+        if database_path == ':memory:':
+            read_uri = None
+            archive = None
+        else:
+            read_uri = 'file:{}?mode=ro'.format(
+                pathname2url(os.path.abspath(database_path)),
+            )
+            archive = SegmentArchive('{}-archive'.format(os.path.abspath(database_path)))
+
+        if read_only:
+            if read_uri is None:
+                raise ValueError('An in-memory database can not be opened read-only')
+
+            # The schema is used as is, all the writes fail
+            conn = sqlite3.connect(read_uri, uri=True, check_same_thread=False)
+        else:
+            # The writes may be done by the WriteBehindStorage thread
+            conn = sqlite3.connect(database_path, check_same_thread=False)
+            conn.execute('PRAGMA foreign_keys=ON')
+            conn.execute('PRAGMA journal_mode=WAL')
+
         conn.text_factory = str
-        conn.execute('PRAGMA foreign_keys=ON')
+
+        # When writting to a table where the primary key is the identifier and we want
+        # to return said identifier we use cursor.lastrowid, which uses sqlite's last_insert_rowid
+        # https://github.com/python/cpython/blob/2.7/Modules/_sqlite/cursor.c#L727-L732
+        #
+        # According to the documentation (http://www.sqlite.org/c3ref/last_insert_rowid.html)
+        # if a different thread tries to use the same connection to write into the table
+        # while we query the last_insert_rowid, the result is unpredictable. For that reason
+        # we have this write lock here.
+        #
+        # TODO (If possible):
+        # Improve on this and find a better way to protect against this potential race
+        # condition.
+        self.write_lock = threading.Lock()
+        self.conn = conn
+        self.serializer = serializer
+
+        self.read_uri = read_uri
+        self.read_pool_size = read_pool_size
+        self.read_pool = list()
+        self.archive = archive
+
+        if not read_only:
+            self._create_schema()
+        elif not self._has_table('archive_segments'):
+            # database created by an older version
+            self.archive = None
+
+    def _has_table(self, table_name):
+        cursor = self.conn.execute(
+            "SELECT count(*) FROM sqlite_master WHERE type = 'table' AND name = ?",
+            (table_name, ),
+        )
+        return cursor.fetchone()[0] == 1
+
+    def _create_schema(self):
+        conn = self.conn
 
         with conn:
             cursor = conn.cursor()
@@ -29,53 +183,189 @@ class SQLiteStorage:
                 '    FOREIGN KEY(statechange_id) REFERENCES state_changes(identifier)'
                 ')',
             )
+            cursor.execute(
+                'CREATE TABLE IF NOT EXISTS state_snapshot_subtrees ('
+                '    key TEXT PRIMARY KEY, '
+                '    data BINARY'
+                ')',
+            )
             cursor.execute(
                 'CREATE TABLE IF NOT EXISTS state_events ('
                 '    identifier INTEGER PRIMARY KEY, '
                 '    source_statechange_id INTEGER NOT NULL, '
                 '    block_number INTEGER NOT NULL, '
                 '    data BINARY, '
+                '    event_type TEXT, '
+                '    token_network_identifier BINARY, '
+                '    channel_identifier BINARY, '
+                '    payment_identifier TEXT, '
                 '    FOREIGN KEY(source_statechange_id) REFERENCES state_changes(identifier)'
                 ')',
             )
+            cursor.execute(
+                'CREATE TABLE IF NOT EXISTS archive_segments ('
+                '    identifier INTEGER PRIMARY KEY, '
+                '    table_name TEXT NOT NULL, '
+                '    filename TEXT NOT NULL, '
+                '    first_identifier INTEGER NOT NULL, '
+                '    last_identifier INTEGER NOT NULL, '
+                '    first_block INTEGER, '
+                '    last_block INTEGER, '
+                '    rows_without_data INTEGER NOT NULL'
+                ')',
+            )
 
-        # When writting to a table where the primary key is the identifier and we want
-        # to return said identifier we use cursor.lastrowid, which uses sqlite's last_insert_rowid
-        # https://github.com/python/cpython/blob/2.7/Modules/_sqlite/cursor.c#L727-L732
-        #
-        # According to the documentation (http://www.sqlite.org/c3ref/last_insert_rowid.html)
-        # if a different thread tries to use the same connection to write into the table
-        # while we query the last_insert_rowid, the result is unpredictable. For that reason
-        # we have this write lock here.
-        #
-        # TODO (If possible):
-        # Improve on this and find a better way to protect against this potential race
-        # condition.
-        self.write_lock = threading.Lock()
-        self.conn = conn
-        self.serializer = serializer
+        self._migrate_event_columns()
 
-    def write_state_change(self, state_change):
-        serialized_data = self.serializer.serialize(state_change)
+        with conn:
+            conn.execute(
+                'CREATE INDEX IF NOT EXISTS state_events_block_number '
+                'ON state_events(block_number)',
+            )
+            conn.execute(
+                'CREATE INDEX IF NOT EXISTS state_events_event_type '
+                'ON state_events(event_type, block_number)',
+            )
+            conn.execute(
+                'CREATE INDEX IF NOT EXISTS state_events_token_network_identifier '
+                'ON state_events(token_network_identifier, block_number)',
+            )
+            conn.execute(
+                'CREATE INDEX IF NOT EXISTS state_events_channel_identifier '
+                'ON state_events(channel_identifier, block_number)',
+            )
+            conn.execute(
+                'CREATE INDEX IF NOT EXISTS state_events_payment_identifier '
+                'ON state_events(payment_identifier)',
+            )
+
+    def _migrate_event_columns(self):
+        """ Add the EVENT_INDEX_COLUMNS to a state_events table created by an
+        older version and fill them from the stored events.
+        """
+        cursor = self.conn.execute('PRAGMA table_info(state_events)')
+        existing_columns = {row[1] for row in cursor}
+
+        if set(EVENT_INDEX_COLUMNS) <= existing_columns:
+            return
 
         with self.write_lock, self.conn:
+            self.conn.execute('ALTER TABLE state_events ADD COLUMN event_type TEXT')
+            self.conn.execute(
+                'ALTER TABLE state_events ADD COLUMN token_network_identifier BINARY',
+            )
+            self.conn.execute('ALTER TABLE state_events ADD COLUMN channel_identifier BINARY')
+            self.conn.execute('ALTER TABLE state_events ADD COLUMN payment_identifier TEXT')
+
+            cursor = self.conn.execute('SELECT identifier, data FROM state_events')
+            rows = [
+                event_index_columns(self.serializer.deserialize(data)) + (identifier, )
+                for identifier, data in cursor
+            ]
+            self.conn.executemany(
+                'UPDATE state_events SET '
+                '    event_type = ?, token_network_identifier = ?, '
+                '    channel_identifier = ?, payment_identifier = ? '
+                'WHERE identifier = ?',
+                rows,
+            )
+
+    @contextlib.contextmanager
+    def _read_connection(self):
+        """ Borrow a read-only connection from the pool. """
+        if self.read_uri is None:
+            yield self.conn
+            return
+
+        try:
+            conn = self.read_pool.pop()
+        except IndexError:
+            conn = sqlite3.connect(self.read_uri, uri=True, check_same_thread=False)
+            conn.text_factory = str
+
+        try:
+            yield conn
+        finally:
+            if len(self.read_pool) < self.read_pool_size:
+                self.read_pool.append(conn)
+            else:
+                conn.close()
+
+    def _run_read(self, conn, function, *args):
+        """ Call `function(*args)`, which queries the read connection `conn`.
+
+        A pooled connection is used by a single greenlet at a time, so its
+        queries run in the gevent threadpool and the hub keeps running the
+        other greenlets meanwhile, sqlite releases the GIL while it executes a
+        query. The writer connection is shared, its queries run in the
+        calling greenlet.
+        """
+        if conn is self.conn:
+            return function(*args)
+
+        return gevent.get_hub().threadpool.apply(function, args)
+
+    def _read(self, query):
+        """ Return the result of `query(conn)` with a borrowed read-only
+        connection, see `_run_read`.
+        """
+        with self._read_connection() as conn:
+            return self._run_read(conn, query, conn)
+
+    def _transaction(self, commit):
+        """ Return the context manager to use for a write.
+
+        With `commit` set the changes are committed on success and rolled back
+        on failure, otherwise they are left in the open transaction and must
+        be persisted with a later call to `commit`.
+        """
+        if commit:
+            return self.conn
+
+        return contextlib.suppress()
+
+    def commit(self):
+        """ Commit the writes done with `commit=False`. """
+        with self.write_lock:
+            self.conn.commit()
+
+    def durability_barrier(self):
+        """ Return an AsyncResult that is set once the writes done so far are
+        durable.
+
+        The writes of this storage are synchronous, so the result is already
+        set. Writes done with `commit=False` are only durable after `commit`.
+        """
+        result = AsyncResult()
+        result.set(None)
+        return result
+
+    def write_state_change(self, state_change, commit=True, identifier=None):
+        """ Save a state change and return its identifier.
+
+        If `identifier` is None the next one from the sequence is used.
+        """
+        serialized_data = self.serializer.serialize(state_change)
+
+        with self.write_lock, self._transaction(commit):
             cursor = self.conn.execute(
-                'INSERT INTO state_changes(identifier, data) VALUES(null, ?)',
-                (serialized_data,),
+                'INSERT INTO state_changes(identifier, data) VALUES(?, ?)',
+                (identifier, serialized_data),
             )
             last_id = cursor.lastrowid
 
         return last_id
 
     def write_state_snapshot(self, statechange_id, snapshot):
-        # TODO: Snapshotting is not yet implemented. This is just skeleton code
-        # (Issue #682)
-        #
-        # This skeleton code assumes we only keep a single snapshot and
-        # overwrite it each time.
+        """ Save a snapshot of the state after `statechange_id` was applied.
+
+        Only the latest snapshot is kept, it is overwritten on each call.
+        """
         serialized_data = self.serializer.serialize(snapshot)
 
         with self.write_lock, self.conn:
+            # the subtrees of a previous incremental snapshot are stale
+            self.conn.execute('DELETE FROM state_snapshot_subtrees')
             cursor = self.conn.execute(
                 'INSERT OR REPLACE INTO state_snapshot('
                 '    identifier, statechange_id, data'
@@ -86,74 +376,431 @@ class SQLiteStorage:
 
         return last_id
 
-    def write_events(self, state_change_id, block_number, events):
+    def write_state_snapshot_subtrees(
+            self,
+            statechange_id,
+            skeleton,
+            subtrees,
+            removed_keys=(),
+            replace_all=False,
+    ):
+        """ Save an incremental snapshot of the state after `statechange_id`
+        was applied.
+
+        `skeleton` is the state without its subtrees, `subtrees` maps the key
+        of each new or changed subtree to its data, already serialized with
+        the serializer of this storage. The subtrees of `removed_keys` are
+        deleted, if `replace_all` is set all the stored subtrees are.
+        """
+        serialized_skeleton = self.serializer.serialize(skeleton)
+
+        with self.write_lock, self.conn:
+            if replace_all:
+                self.conn.execute('DELETE FROM state_snapshot_subtrees')
+            else:
+                self.conn.executemany(
+                    'DELETE FROM state_snapshot_subtrees WHERE key = ?',
+                    ((key, ) for key in removed_keys),
+                )
+
+            self.conn.executemany(
+                'INSERT OR REPLACE INTO state_snapshot_subtrees(key, data) VALUES(?, ?)',
+                subtrees.items(),
+            )
+            self.conn.execute(
+                'INSERT OR REPLACE INTO state_snapshot('
+                '    identifier, statechange_id, data'
+                ') VALUES(?, ?, ?)',
+                (1, statechange_id, serialized_skeleton),
+            )
+
+    def compact_state_changes(self, statechange_id):
+        """ Remove the state changes already covered by the snapshot taken at
+        `statechange_id`.
+
+        State changes that are the source of a stored event can not be
+        deleted without breaking the foreign key of `state_events`, for these
+        only the serialized data is dropped.
+        """
+        with self.write_lock, self.conn:
+            self.conn.execute(
+                'DELETE FROM state_changes WHERE identifier < ? AND identifier NOT IN ('
+                '    SELECT source_statechange_id FROM state_events'
+                ')',
+                (statechange_id,),
+            )
+            self.conn.execute(
+                'UPDATE state_changes SET data = NULL '
+                'WHERE identifier < ? AND data IS NOT NULL',
+                (statechange_id,),
+            )
+
+    def archive_state_changes(self, statechange_id, min_state_changes=1) -> int:
+        """ Move the state changes older than `statechange_id`, and their
+        events, to new segments of the archive.
+
+        `statechange_id` must be covered by a snapshot, the archived state
+        changes are not needed to restore the node. Nothing is done if there
+        are less than `min_state_changes` state changes to archive. Returns
+        the number of archived state changes.
+        """
+        if self.archive is None:
+            raise ValueError('In-memory databases can not be archived')
+
+        with self.write_lock, self.conn:
+            cursor = self.conn.execute(
+                'SELECT count(*) FROM state_changes WHERE identifier < ?',
+                (statechange_id, ),
+            )
+            if cursor.fetchone()[0] < min_state_changes:
+                return 0
+
+            cursor = self.conn.execute(
+                'SELECT {} FROM state_changes WHERE identifier < ? '
+                'ORDER BY identifier'.format(', '.join(ARCHIVED_STATE_CHANGE_COLUMNS)),
+                (statechange_id, ),
+            )
+            state_changes = cursor.fetchall()
+
+            cursor = self.conn.execute(
+                'SELECT {} FROM state_events WHERE source_statechange_id < ? '
+                'ORDER BY identifier'.format(', '.join(ARCHIVED_EVENT_COLUMNS)),
+                (statechange_id, ),
+            )
+            events = cursor.fetchall()
+
+            segments = list()
+            if state_changes:
+                first_identifier = state_changes[0][0]
+                last_identifier = state_changes[-1][0]
+                filename = self.archive.write_segment(
+                    'state_changes',
+                    first_identifier,
+                    last_identifier,
+                    state_changes,
+                )
+                rows_without_data = sum(1 for _, data in state_changes if data is None)
+                segments.append((
+                    'state_changes',
+                    filename,
+                    first_identifier,
+                    last_identifier,
+                    None,
+                    None,
+                    rows_without_data,
+                ))
+
+            if events:
+                first_identifier = events[0][0]
+                last_identifier = events[-1][0]
+                filename = self.archive.write_segment(
+                    'state_events',
+                    first_identifier,
+                    last_identifier,
+                    events,
+                )
+                block_numbers = [event[2] for event in events]
+                segments.append((
+                    'state_events',
+                    filename,
+                    first_identifier,
+                    last_identifier,
+                    min(block_numbers),
+                    max(block_numbers),
+                    0,
+                ))
+
+            self.conn.executemany(
+                'INSERT INTO archive_segments('
+                '    table_name, filename, first_identifier, last_identifier, '
+                '    first_block, last_block, rows_without_data'
+                ') VALUES(?, ?, ?, ?, ?, ?, ?)',
+                segments,
+            )
+            self.conn.execute(
+                'DELETE FROM state_events WHERE source_statechange_id < ?',
+                (statechange_id, ),
+            )
+            self.conn.execute(
+                'DELETE FROM state_changes WHERE identifier < ?',
+                (statechange_id, ),
+            )
+
+        return len(state_changes)
+
+    def _archived_segments(self, conn, table_name, conditions, parameters):
+        """ Return the file names of the archived segments of `table_name`
+        selected by `conditions`, in identifier order.
+        """
+        if self.archive is None:
+            return []
+
+        cursor = conn.execute(
+            'SELECT filename FROM archive_segments WHERE table_name = ? {} '
+            'ORDER BY first_identifier'.format(
+                ''.join(' AND ' + condition for condition in conditions),
+            ),
+            [table_name] + list(parameters),
+        )
+
+        return [filename for (filename, ) in cursor.fetchall()]
+
+    def _iter_archived_rows(self, conn, table_name, conditions, parameters):
+        """ Iterate over the rows of the archived segments of `table_name`
+        selected by `conditions`, in identifier order.
+        """
+        for filename in self._archived_segments(conn, table_name, conditions, parameters):
+            yield from self.archive.read_segment(filename)
+
+    def migrate_pickled_data(self, chunk_size=DEFAULT_FETCH_CHUNK_SIZE) -> int:
+        """ Rewrite the rows written by the PickleSerializer with the
+        serializer of this storage.
+
+        Pickled rows are recognized by the pickle protocol header. The rows
+        are rewritten `chunk_size` at a time, each chunk in its own
+        transaction, so the migration can be interrupted and restarted. Once
+        it is done the database is marked with `MIGRATED_USER_VERSION` and
+        later calls return immediately. Returns the number of rewritten rows.
+        """
+        cursor = self.conn.execute('PRAGMA user_version')
+        if cursor.fetchone()[0] >= MIGRATED_USER_VERSION:
+            return 0
+
+        migrated = 0
+        for table in ('state_changes', 'state_snapshot', 'state_events'):
+            last_identifier = 0
+
+            while True:
+                with self.write_lock, self.conn:
+                    cursor = self.conn.execute(
+                        'SELECT identifier, data FROM {} '
+                        "WHERE identifier > ? AND substr(data, 1, 1) = X'80' "
+                        'ORDER BY identifier'.format(table),
+                        (last_identifier, ),
+                    )
+                    rows = cursor.fetchmany(chunk_size)
+                    cursor.close()
+
+                    if not rows:
+                        break
+
+                    self.conn.executemany(
+                        'UPDATE {} SET data = ? WHERE identifier = ?'.format(table),
+                        [
+                            (self.serializer.serialize(pickle.loads(data)), identifier)
+                            for identifier, data in rows
+                        ],
+                    )
+
+                last_identifier = rows[-1][0]
+                migrated += len(rows)
+
+        with self.write_lock, self.conn:
+            self.conn.execute('PRAGMA user_version = {}'.format(MIGRATED_USER_VERSION))
+
+        return migrated
+
+    def get_next_state_change_id(self) -> int:
+        """ Return the identifier the next state change will be assigned. """
+        with self.write_lock:
+            cursor = self.conn.execute(
+                "SELECT seq FROM sqlite_sequence WHERE name = 'state_changes'",
+            )
+            result = cursor.fetchone()
+
+        if result:
+            return result[0] + 1
+
+        return 1
+
+    def is_log_complete(self) -> bool:
+        """ True if none of the state changes was removed by
+        `compact_state_changes`, i.e. the whole log can be replayed.
+
+        Archived state changes are still part of the log.
+        """
+        def query(conn):
+            cursor = conn.execute(
+                'SELECT min(identifier), sum(data IS NULL) FROM state_changes',
+            )
+            first_identifier, compacted = cursor.fetchone()
+
+            cursor = conn.execute(
+                'SELECT min(first_identifier), sum(rows_without_data) '
+                "FROM archive_segments WHERE table_name = 'state_changes'",
+            )
+            return (first_identifier, compacted) + cursor.fetchone()
+
+        result = self._read(query)
+        first_identifier, compacted, first_archived_identifier, archived_compacted = result
+
+        if first_archived_identifier is not None:
+            first_identifier = first_archived_identifier
+
+        # identifiers start at 1
+        return first_identifier in (None, 1) and not compacted and not archived_compacted
+
+    def get_latest_state_change_id(self) -> Optional[int]:
+        def query(conn):
+            cursor = conn.execute(
+                'SELECT identifier FROM state_changes ORDER BY identifier DESC LIMIT 1',
+            )
+            return cursor.fetchone()
+
+        result = self._read(query)
+
+        if result:
+            return result[0]
+
+        return None
+
+    def write_events(self, state_change_id, block_number, events, commit=True):
         """ Save events.
 
         Args:
             state_change_id: Id of the state change that generate these events.
             block_number: Block number at which the state change was applied.
             events: List of Event objects.
+            commit: If False the events are written in the open transaction
+                and are not durable until `commit` is called.
         """
         events_data = [
-            (None, state_change_id, block_number, self.serializer.serialize(event))
+            (
+                (None, state_change_id, block_number, self.serializer.serialize(event)) +
+                event_index_columns(event)
+            )
             for event in events
         ]
 
-        with self.write_lock, self.conn:
+        with self.write_lock, self._transaction(commit):
             self.conn.executemany(
                 'INSERT INTO state_events('
-                '   identifier, source_statechange_id, block_number, data'
-                ') VALUES(?, ?, ?, ?)',
+                '   identifier, source_statechange_id, block_number, data, event_type, '
+                '   token_network_identifier, channel_identifier, payment_identifier'
+                ') VALUES(?, ?, ?, ?, ?, ?, ?, ?)',
                 events_data,
             )
 
     def get_state_snapshot(self) -> Optional[Tuple[int, Any]]:
-        """ Return the tuple of (last_applied_state_change_id, snapshot) or None"""
-        cursor = self.conn.execute('SELECT statechange_id, data from state_snapshot')
-        serialized = cursor.fetchall()
+        """ Return the tuple of (last_applied_state_change_id, snapshot) or None
+
+        For incremental snapshots the skeleton is joined with the subtrees.
+        """
+        def query(conn):
+            cursor = conn.execute('SELECT statechange_id, data from state_snapshot')
+            serialized = cursor.fetchall()
+
+            cursor = conn.execute('SELECT key, data FROM state_snapshot_subtrees')
+            return serialized, cursor.fetchall()
+
+        serialized, serialized_subtrees = self._read(query)
 
         result = None
         if serialized:
             assert len(serialized) == 1
             last_applied_state_change_id = serialized[0][0]
             snapshot_state = self.serializer.deserialize(serialized[0][1])
+
+            if serialized_subtrees:
+                subtrees = {
+                    key: self.serializer.deserialize(data)
+                    for key, data in serialized_subtrees
+                }
+                snapshot_state = join_node_state(snapshot_state, subtrees)
+
             return (last_applied_state_change_id, snapshot_state)
 
         return result
 
     def get_statechanges_by_identifier(self, from_identifier, to_identifier):
+        return list(self.iter_statechanges_by_identifier(from_identifier, to_identifier))
+
+    def iter_statechanges_by_identifier(
+            self,
+            from_identifier,
+            to_identifier,
+            chunk_size=DEFAULT_FETCH_CHUNK_SIZE,
+    ):
+        """ Return an iterator over the state changes in the identifier range.
+
+        Rows are fetched and deserialized `chunk_size` at a time, so the memory
+        used does not depend on the number of state changes in the range.
+        """
         if not (from_identifier == 'latest' or isinstance(from_identifier, int)):
             raise ValueError("from_identifier must be an integer or 'latest'")
 
         if not (to_identifier == 'latest' or isinstance(to_identifier, int)):
             raise ValueError("to_identifier must be an integer or 'latest'")
 
-        cursor = self.conn.cursor()
-
-        if from_identifier == 'latest':
-            assert to_identifier is None
+        return self._iter_statechanges(from_identifier, to_identifier, chunk_size)
 
-            cursor.execute(
-                'SELECT identifier FROM state_changes ORDER BY identifier DESC LIMIT 1',
-            )
-            from_identifier = cursor.fetchone()
-
-        if to_identifier == 'latest':
-            cursor.execute(
-                'SELECT data FROM state_changes WHERE identifier >= ?',
-                (from_identifier,),
-            )
-        else:
-            cursor.execute(
-                'SELECT data FROM state_changes WHERE identifier '
-                'BETWEEN ? AND ?', (from_identifier, to_identifier),
-            )
+    def _iter_statechanges(self, from_identifier, to_identifier, chunk_size):
+        # The read connection is held until the iterator is exhausted or
+        # closed
+        with self._read_connection() as conn:
+            cursor = conn.cursor()
 
-        result = [
-            self.serializer.deserialize(entry[0])
-            for entry in cursor.fetchall()
-        ]
-        return result
+            if from_identifier == 'latest':
+                assert to_identifier is None
+
+                self._run_read(
+                    conn,
+                    cursor.execute,
+                    'SELECT identifier FROM state_changes ORDER BY identifier DESC LIMIT 1',
+                )
+                from_identifier = self._run_read(conn, cursor.fetchone)
+
+            # Archived state changes are older than the ones in the database
+            if isinstance(from_identifier, int):
+                conditions = ['last_identifier >= ?']
+                parameters = [from_identifier]
+                if to_identifier != 'latest':
+                    conditions.append('first_identifier <= ?')
+                    parameters.append(to_identifier)
+
+                filenames = self._run_read(
+                    conn,
+                    self._archived_segments,
+                    conn,
+                    'state_changes',
+                    conditions,
+                    parameters,
+                )
+                for filename in filenames:
+                    archived_rows = self._run_read(conn, self.archive.read_segment, filename)
+
+                    for identifier, data in archived_rows:
+                        is_in_range = identifier >= from_identifier and (
+                            to_identifier == 'latest' or identifier <= to_identifier
+                        )
+                        if is_in_range and data is not None:
+                            yield self.serializer.deserialize(data)
+
+            # Compacted state changes don't have data, these are covered by
+            # the snapshot and must not be replayed
+            if to_identifier == 'latest':
+                self._run_read(
+                    conn,
+                    cursor.execute,
+                    'SELECT data FROM state_changes WHERE identifier >= ? '
+                    'AND data IS NOT NULL ORDER BY identifier',
+                    (from_identifier,),
+                )
+            else:
+                self._run_read(
+                    conn,
+                    cursor.execute,
+                    'SELECT data FROM state_changes WHERE identifier '
+                    'BETWEEN ? AND ? AND data IS NOT NULL ORDER BY identifier',
+                    (from_identifier, to_identifier),
+                )
+
+            rows = self._run_read(conn, cursor.fetchmany, chunk_size)
+            while rows:
+                for (data, ) in rows:
+                    yield self.serializer.deserialize(data)
+
+                rows = self._run_read(conn, cursor.fetchmany, chunk_size)
 
     def get_events_by_identifier(self, from_identifier, to_identifier):
         if not (from_identifier == 'latest' or isinstance(from_identifier, int)):
@@ -162,69 +809,206 @@ class SQLiteStorage:
         if not (to_identifier == 'latest' or isinstance(to_identifier, int)):
             raise ValueError("to_identifier must be an integer or 'latest'")
 
-        cursor = self.conn.cursor()
+        def query(conn):
+            nonlocal from_identifier
 
-        if from_identifier == 'latest':
-            assert to_identifier is None
+            cursor = conn.cursor()
 
-            cursor.execute(
-                'SELECT identifier FROM state_events ORDER BY identifier DESC LIMIT 1',
-            )
-            from_identifier = cursor.fetchone()
-
-        if to_identifier == 'latest':
-            cursor.execute(
-                'SELECT block_number, data FROM state_events WHERE identifier >= ?',
-                (from_identifier,),
-            )
-        else:
-            cursor.execute(
-                'SELECT block_number, data FROM state_events WHERE identifier '
-                'BETWEEN ? AND ?', (from_identifier, to_identifier),
-            )
+            if from_identifier == 'latest':
+                assert to_identifier is None
+
+                cursor.execute(
+                    'SELECT identifier FROM state_events ORDER BY identifier DESC LIMIT 1',
+                )
+                from_identifier = cursor.fetchone()
+
+            if to_identifier == 'latest':
+                cursor.execute(
+                    'SELECT identifier, block_number, data FROM state_events '
+                    'WHERE identifier >= ?',
+                    (from_identifier,),
+                )
+            else:
+                cursor.execute(
+                    'SELECT identifier, block_number, data FROM state_events WHERE identifier '
+                    'BETWEEN ? AND ?', (from_identifier, to_identifier),
+                )
+            rows = cursor.fetchall()
+
+            if isinstance(from_identifier, int):
+                conditions = ['last_identifier >= ?']
+                parameters = [from_identifier]
+                if to_identifier != 'latest':
+                    conditions.append('first_identifier <= ?')
+                    parameters.append(to_identifier)
+
+                archived_rows = self._iter_archived_rows(
+                    conn,
+                    'state_events',
+                    conditions,
+                    parameters,
+                )
+                rows.extend(
+                    (identifier, block_number, data)
+                    for identifier, _, block_number, data, *_ in archived_rows
+                    if identifier >= from_identifier and (
+                        to_identifier == 'latest' or identifier <= to_identifier
+                    )
+                )
+                rows.sort()
+
+            return rows
+
+        rows = self._read(query)
 
         result = [
-            (entry[0], self.serializer.deserialize(entry[1]))
-            for entry in cursor.fetchall()
+            (block_number, self.serializer.deserialize(data))
+            for _, block_number, data in rows
         ]
         return result
 
-    def get_events_by_block(self, from_block, to_block):
+    def get_events_by_block(
+            self,
+            from_block,
+            to_block,
+            event_types=None,
+            token_network_identifier=None,
+            channel_identifier=None,
+            payment_identifier=None,
+    ):
+        """ Return the list of (block_number, event) in the block range.
+
+        The result can be narrowed down with the remaining arguments, these
+        filters are applied by the database and only the matching events are
+        deserialized.
+
+        Args:
+            event_types: Iterable with the names of the event classes.
+            token_network_identifier: Token network of the events.
+            channel_identifier: Channel of the events.
+            payment_identifier: Payment of the events.
+        """
         if not (from_block == 'latest' or isinstance(from_block, int)):
             raise ValueError("from_block must be an integer or 'latest'")
 
         if not (to_block == 'latest' or isinstance(to_block, int)):
             raise ValueError("to_block must be an integer or 'latest'")
 
-        cursor = self.conn.cursor()
+        def query(conn):
+            nonlocal from_block, event_types
 
-        if from_block is None:
-            from_block = 0
+            cursor = conn.cursor()
 
-        if from_block == 'latest':
-            assert to_block is None
+            if from_block is None:
+                from_block = 0
 
-            cursor.execute(
-                'SELECT block_number FROM state_events ORDER BY block_number DESC LIMIT 1',
-            )
-            from_block = cursor.fetchone()
+            if from_block == 'latest':
+                assert to_block is None
+
+                cursor.execute(
+                    'SELECT block_number FROM state_events ORDER BY block_number DESC LIMIT 1',
+                )
+                from_block = cursor.fetchone()
+
+            if to_block == 'latest':
+                conditions = ['block_number >= ?']
+                parameters = [from_block]
+            else:
+                conditions = ['block_number BETWEEN ? AND ?']
+                parameters = [from_block, to_block]
+
+            if event_types is not None:
+                event_types = list(event_types)
+                conditions.append('event_type IN ({})'.format(', '.join('?' * len(event_types))))
+                parameters.extend(event_types)
+
+            if token_network_identifier is not None:
+                conditions.append('token_network_identifier = ?')
+                parameters.append(token_network_identifier)
+
+            if channel_identifier is not None:
+                conditions.append('channel_identifier = ?')
+                parameters.append(channel_identifier)
+
+            if payment_identifier is not None:
+                conditions.append('payment_identifier = ?')
+                parameters.append(str(payment_identifier))
 
-        if to_block == 'latest':
-            cursor.execute(
-                'SELECT block_number, data FROM state_events WHERE block_number >= ?',
-                (from_block, ),
-            )
-        else:
             cursor.execute(
-                'SELECT block_number, data FROM state_events WHERE block_number '
-                'BETWEEN ? AND ?', (from_block, to_block),
+                'SELECT identifier, block_number, data FROM state_events WHERE {} '
+                'ORDER BY identifier'.format(' AND '.join(conditions)),
+                parameters,
             )
+            rows = cursor.fetchall()
+
+            if isinstance(from_block, int):
+                rows.extend(self._archived_events_by_block(
+                    conn,
+                    from_block,
+                    to_block,
+                    event_types,
+                    token_network_identifier,
+                    channel_identifier,
+                    payment_identifier,
+                ))
+                rows.sort()
+
+            return rows
+
+        rows = self._read(query)
 
         result = [
-            (entry[0], self.serializer.deserialize(entry[1]))
-            for entry in cursor.fetchall()
+            (block_number, self.serializer.deserialize(data))
+            for _, block_number, data in rows
         ]
         return result
 
+    def _archived_events_by_block(
+            self,
+            conn,
+            from_block,
+            to_block,
+            event_types,
+            token_network_identifier,
+            channel_identifier,
+            payment_identifier,
+    ):
+        """ Return the (identifier, block_number, data) of the archived events
+        matching the filters of `get_events_by_block`.
+        """
+        conditions = ['last_block >= ?']
+        parameters = [from_block]
+        if to_block != 'latest':
+            conditions.append('first_block <= ?')
+            parameters.append(to_block)
+
+        if event_types is not None:
+            event_types = set(event_types)
+
+        if payment_identifier is not None:
+            payment_identifier = str(payment_identifier)
+
+        archived_rows = self._iter_archived_rows(conn, 'state_events', conditions, parameters)
+
+        result = list()
+        for row in archived_rows:
+            identifier, _, block_number, data, event_type, token_network, channel, payment = row
+
+            is_match = (
+                block_number >= from_block and
+                (to_block == 'latest' or block_number <= to_block) and
+                (event_types is None or event_type in event_types) and
+                (token_network_identifier is None or token_network == token_network_identifier) and
+                (channel_identifier is None or channel == channel_identifier) and
+                (payment_identifier is None or payment == payment_identifier)
+            )
+            if is_match:
+                result.append((identifier, block_number, data))
+
+        return result
+
     def __del__(self):
+        for conn in self.read_pool:
+            conn.close()
+
         self.conn.close()
@@ -1,37 +1,207 @@
-from raiden.transfer.architecture import StateManager
+import itertools
+import time
 
+import gevent
+from gevent.event import AsyncResult
 
-def restore_from_latest_snapshot(transition_function, storage):
+from raiden.storage.serialize import BinarySerializer
+from raiden.storage.snapshot import IncrementalSnapshots
+from raiden.storage.writebehind import WriteBehindStorage
+from raiden.transfer.architecture import DISPATCH_UNDO_LOG, StateManager
+from raiden.transfer.sharding import ShardedStateManager
+
+# Number of state changes applied at once when the log is replayed, bounds
+# the number of state changes held in memory
+REPLAY_BATCH_SIZE = 1000
+
+
+def restore_from_latest_snapshot(
+        transition_function,
+        storage,
+        snapshot_policy=None,
+        group_commit_window=None,
+        dispatch_mode=None,
+        sharded=False,
+        shard_executor=None,
+):
+    """ Restore the state from the latest snapshot and replay the state
+    changes logged after it. Returns the tuple (wal, events) with the events
+    of the replayed state changes.
+
+    If `sharded` is set the state is kept by a
+    `raiden.transfer.sharding.ShardedStateManager`, which replays the log
+    through `shard_executor` if it is given. The executor is not kept, the
+    state changes dispatched later run in-process.
+    """
     events = list()
     snapshot = storage.get_state_snapshot()
 
     if snapshot:
         last_applied_state_change_id, state = snapshot
-        unapplied_state_changes = storage.get_statechanges_by_identifier(
-            from_identifier=last_applied_state_change_id,
-            to_identifier='latest',
-        )
+        from_identifier = last_applied_state_change_id + 1
     else:
         state = None
-        unapplied_state_changes = storage.get_statechanges_by_identifier(
-            from_identifier=0,
-            to_identifier='latest',
+        from_identifier = 0
+
+    # The state changes are streamed from the database, the log may be
+    # arbitrarily long and must not be loaded in memory at once
+    unapplied_state_changes = storage.iter_statechanges_by_identifier(
+        from_identifier=from_identifier,
+        to_identifier='latest',
+    )
+
+    if sharded:
+        state_manager = ShardedStateManager(
+            transition_function,
+            state,
+            dispatch_mode,
+            shard_executor,
+            BinarySerializer if shard_executor is not None else None,
         )
+    else:
+        state_manager = StateManager(transition_function, state, dispatch_mode)
+
+    wal = WriteAheadLog(state_manager, storage, snapshot_policy, group_commit_window)
+
+    replayed = 0
+    while True:
+        state_changes = list(itertools.islice(unapplied_state_changes, REPLAY_BATCH_SIZE))
 
-    state_manager = StateManager(transition_function, state)
-    wal = WriteAheadLog(state_manager, storage)
+        if not state_changes:
+            break
 
-    for state_change in unapplied_state_changes:
-        events.extend(state_manager.dispatch(state_change))
+        for state_change_events in state_manager.dispatch_batch(state_changes):
+            events.extend(state_change_events)
+
+        replayed += len(state_changes)
+
+    if sharded:
+        # waiting on the workers would block the gevent hub
+        state_manager.executor = None
+
+    wal.state_change_id = storage.get_latest_state_change_id()
+    wal.statechanges_since_snapshot = replayed
 
     return wal, events
 
 
+class SnapshotPolicy:
+    """ Decides when the WriteAheadLog must take a new snapshot.
+
+    A snapshot is due after `statechange_count` state changes were applied
+    since the previous snapshot, or after `interval` seconds if at least one
+    state change was applied. Either limit can be disabled by using None.
+
+    If `compact` is set the state changes covered by a new snapshot are
+    removed from the storage, so that the database does not grow unbounded.
+
+    If `incremental` is set the snapshots only write the parts of the node
+    state that changed since the previous snapshot, see
+    `raiden.storage.snapshot`.
+
+    If `archive_segment_size` is set the state changes covered by the
+    snapshot and their events are moved to the archive instead of being
+    compacted, once there are at least `archive_segment_size` of them.
+    """
+
+    __slots__ = (
+        'statechange_count',
+        'interval',
+        'compact',
+        'incremental',
+        'archive_segment_size',
+    )
+
+    def __init__(
+            self,
+            statechange_count=None,
+            interval=None,
+            compact=False,
+            incremental=False,
+            archive_segment_size=None,
+    ):
+        if statechange_count is not None and statechange_count <= 0:
+            raise ValueError('statechange_count must be a positive integer or None')
+
+        if interval is not None and interval <= 0:
+            raise ValueError('interval must be a positive number or None')
+
+        if archive_segment_size is not None and archive_segment_size <= 0:
+            raise ValueError('archive_segment_size must be a positive integer or None')
+
+        self.statechange_count = statechange_count
+        self.interval = interval
+        self.compact = compact
+        self.incremental = incremental
+        self.archive_segment_size = archive_segment_size
+
+    def is_snapshot_due(self, statechanges_since_snapshot, seconds_since_snapshot):
+        if statechanges_since_snapshot == 0:
+            return False
+
+        count_reached = (
+            self.statechange_count is not None and
+            statechanges_since_snapshot >= self.statechange_count
+        )
+        interval_reached = (
+            self.interval is not None and
+            seconds_since_snapshot >= self.interval
+        )
+
+        return count_reached or interval_reached
+
+
 class WriteAheadLog:
-    def __init__(self, state_manager, storage):
+    """ Persists the state changes before they are applied.
+
+    If `group_commit_window` is set the WAL works in group-commit mode: the
+    state change and its events are written in a single transaction, which
+    is shared by all the greenlets that dispatch a state change within
+    `group_commit_window` seconds of each other. This trades a bit of latency
+    for a single fsync per group.
+
+    The storage may also be a `WriteBehindStorage`, in which case the writes
+    are done asynchronously and `durability_barrier` must be waited on before
+    the node acknowledges anything. Group commits block the dispatching
+    greenlet on the commit, so they can not be combined with write-behind.
+
+    A state manager in the undo log dispatch mode modifies the state in
+    place, which is incompatible with the write-behind storage, that
+    serializes the snapshots later, and with the incremental snapshots,
+    that don't serialize objects seen in the previous snapshot again.
+    """
+
+    def __init__(self, state_manager, storage, snapshot_policy=None, group_commit_window=None):
+        if group_commit_window is not None and group_commit_window < 0:
+            raise ValueError('group_commit_window must be a non-negative number or None')
+
+        if group_commit_window is not None and isinstance(storage, WriteBehindStorage):
+            raise ValueError('group commits can not be used with the write-behind storage')
+
+        if state_manager.dispatch_mode == DISPATCH_UNDO_LOG:
+            if isinstance(storage, WriteBehindStorage):
+                raise ValueError('the undo log can not be used with the write-behind storage')
+
+            if snapshot_policy is not None and snapshot_policy.incremental:
+                raise ValueError('the undo log can not be used with incremental snapshots')
+
         self.state_manager = state_manager
         self.state_change_id = None
         self.storage = storage
+        self.snapshot_policy = snapshot_policy
+        self.group_commit_window = group_commit_window
+
+        self.statechanges_since_snapshot = 0
+        self.last_snapshot_time = time.monotonic()
+
+        if snapshot_policy is not None and snapshot_policy.incremental:
+            self.incremental_snapshots = IncrementalSnapshots()
+        else:
+            self.incremental_snapshots = None
+
+        # AsyncResult set once the transaction of the current group is
+        # committed, None if there is no group collecting writes.
+        self.pending_group_commit = None
 
     def log_and_dispatch(self, state_change, block_number):
         """ Log and apply a state change.
@@ -41,7 +211,15 @@ class WriteAheadLog:
         to restore the node state.
 
         Events produced by applying state change are also saved.
+
+        In group-commit mode this blocks the calling greenlet until the group
+        is committed, the events must not have side-effects before they are
+        durable (e.g. a Delivered message must be sent only after the state
+        change is persisted).
         """
+        if self.group_commit_window is not None:
+            return self._log_and_dispatch_grouped(state_change, block_number)
+
         state_change_id = self.storage.write_state_change(state_change)
 
         events = self.state_manager.dispatch(state_change)
@@ -49,8 +227,118 @@ class WriteAheadLog:
         self.state_change_id = state_change_id
         self.storage.write_events(state_change_id, block_number, events)
 
+        self.statechanges_since_snapshot += 1
+        self.maybe_snapshot()
+
         return events
 
+    def log_and_dispatch_batch(self, state_changes, block_numbers):
+        """ Log and apply the `state_changes` in order, `block_numbers` has
+        the block number of each state change.
+
+        The state changes and their events are written in a single
+        transaction and the state is copied at most once, see
+        `StateManager.dispatch_batch`. Returns the events in a list per
+        state change.
+
+        If the dispatch fails the state changes are still logged, as with
+        `log_and_dispatch`, and none of them is applied.
+        """
+        assert len(state_changes) == len(block_numbers)
+
+        if not state_changes:
+            return list()
+
+        state_change_ids = [
+            self.storage.write_state_change(state_change, commit=False)
+            for state_change in state_changes
+        ]
+
+        try:
+            events_by_state_change = self.state_manager.dispatch_batch(state_changes)
+
+            self.state_change_id = state_change_ids[-1]
+            batch = zip(state_change_ids, block_numbers, events_by_state_change)
+            for state_change_id, block_number, events in batch:
+                self.storage.write_events(state_change_id, block_number, events, commit=False)
+
+            self.statechanges_since_snapshot += len(state_changes)
+        finally:
+            if self.group_commit_window is not None:
+                self._wait_group_commit()
+            else:
+                self.storage.commit()
+
+        self.maybe_snapshot()
+
+        return events_by_state_change
+
+    def _log_and_dispatch_grouped(self, state_change, block_number):
+        state_change_id = self.storage.write_state_change(state_change, commit=False)
+
+        try:
+            events = self.state_manager.dispatch(state_change)
+
+            self.state_change_id = state_change_id
+            self.storage.write_events(state_change_id, block_number, events, commit=False)
+            self.statechanges_since_snapshot += 1
+        finally:
+            self._wait_group_commit()
+
+        self.maybe_snapshot()
+
+        return events
+
+    def _wait_group_commit(self):
+        """ Wait until the writes of the current group are durable.
+
+        The first greenlet of a group becomes the leader, it yields for the
+        commit window to let other greenlets add their writes to the open
+        transaction and then commits on behalf of everybody.
+        """
+        pending_commit = self.pending_group_commit
+
+        if pending_commit is not None:
+            pending_commit.get()
+            return
+
+        pending_commit = AsyncResult()
+        self.pending_group_commit = pending_commit
+
+        try:
+            gevent.sleep(self.group_commit_window)
+        finally:
+            # Close the group before committing, writes done from now on
+            # belong to the next group.
+            self.pending_group_commit = None
+
+            try:
+                self.storage.commit()
+            except Exception as e:  # pylint: disable=broad-except
+                pending_commit.set_exception(e)
+                raise
+            else:
+                pending_commit.set(None)
+
+    def durability_barrier(self):
+        """ Return an AsyncResult that is set once all the state changes and
+        events logged so far are durable.
+        """
+        return self.storage.durability_barrier()
+
+    def maybe_snapshot(self):
+        """ Snapshot the application state if the snapshot policy says so. """
+        if self.snapshot_policy is None:
+            return
+
+        is_snapshot_due = self.snapshot_policy.is_snapshot_due(
+            self.statechanges_since_snapshot,
+            time.monotonic() - self.last_snapshot_time,
+        )
+
+        if is_snapshot_due:
+            self.snapshot()
+
     def snapshot(self):
         """ Snapshot the application state.
 
@@ -62,4 +350,23 @@ class WriteAheadLog:
 
         # otherwise no state change was dispatched
         if state_change_id:
-            self.storage.write_state_snapshot(state_change_id, current_state)
+            if self.incremental_snapshots is not None:
+                self.incremental_snapshots.write_snapshot(
+                    self.storage,
+                    state_change_id,
+                    current_state,
+                )
+            else:
+                self.storage.write_state_snapshot(state_change_id, current_state)
+
+            snapshot_policy = self.snapshot_policy
+            if snapshot_policy is not None and snapshot_policy.archive_segment_size is not None:
+                self.storage.archive_state_changes(
+                    state_change_id,
+                    snapshot_policy.archive_segment_size,
+                )
+            elif snapshot_policy is not None and snapshot_policy.compact:
+                self.storage.compact_state_changes(state_change_id)
+
+        self.statechanges_since_snapshot = 0
+        self.last_snapshot_time = time.monotonic()
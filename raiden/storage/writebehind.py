@@ -0,0 +1,155 @@
+import gevent
+from gevent.event import AsyncResult
+from gevent.threadpool import ThreadPool
+
+
+class WriteBehindStorage:
+    """ Wraps a SQLiteStorage so that its writes are done by a dedicated OS
+    thread.
+
+    Serializing the objects and waiting on the disk then happen outside of
+    the gevent hub, the other greenlets keep running meanwhile. Writes are
+    queued and handed to the thread in batches, they are executed in the
+    order they were queued. `durability_barrier` returns an AsyncResult that
+    is set once every write queued before the call is committed. A failed
+    write fails all the writes queued after it.
+
+    The identifiers of the state changes are assigned when the write is
+    queued because the WAL needs them right away. Queries are forwarded to
+    the wrapped storage and only see the data already committed.
+    """
+
+    def __init__(self, storage):
+        if storage.read_uri is None:
+            raise ValueError(
+                'The write-behind storage needs a database file, in-memory '
+                'databases can not be shared across threads',
+            )
+
+        self.storage = storage
+        self.writer = ThreadPool(1)
+        self.next_state_change_id = storage.get_next_state_change_id()
+        self.last_write = storage.durability_barrier()
+
+        self.queued_writes = list()
+        self.writer_greenlet = None
+
+        # Set by the writer thread, fails all the following writes
+        self.write_error = None
+
+    def __getattr__(self, name):
+        return getattr(self.storage, name)
+
+    def _queue_write(self, function, *args):
+        result = AsyncResult()
+        self.queued_writes.append((function, args, result))
+        self.last_write = result
+
+        if self.writer_greenlet is None:
+            self.writer_greenlet = gevent.spawn(self._write_queued)
+
+        return result
+
+    def _write_queued(self):
+        """ Hand the queued writes to the writer thread until the queue is
+        empty.
+        """
+        try:
+            while self.queued_writes:
+                writes = self.queued_writes
+                self.queued_writes = list()
+
+                outcomes = self.writer.apply(self._run_writes, (writes, ))
+
+                for (_, _, result), (value, error) in zip(writes, outcomes):
+                    if error is None:
+                        result.set(value)
+                    else:
+                        result.set_exception(error)
+        finally:
+            self.writer_greenlet = None
+
+    def _run_writes(self, writes):
+        """ Execute the writes, this runs in the writer thread.
+
+        Exceptions are returned instead of raised, the thread pool would
+        report them to the hub.
+        """
+        outcomes = list()
+
+        for function, args, _ in writes:
+            if self.write_error is not None:
+                outcomes.append((None, self.write_error))
+                continue
+
+            try:
+                outcomes.append((function(*args), None))
+            except Exception as e:  # pylint: disable=broad-except
+                self.write_error = e
+                outcomes.append((None, e))
+
+        return outcomes
+
+    def durability_barrier(self):
+        return self.last_write
+
+    def write_state_change(self, state_change, commit=True):
+        state_change_id = self.next_state_change_id
+        self.next_state_change_id += 1
+
+        self._queue_write(
+            self.storage.write_state_change,
+            state_change,
+            commit,
+            state_change_id,
+        )
+        return state_change_id
+
+    def write_events(self, state_change_id, block_number, events, commit=True):
+        self._queue_write(
+            self.storage.write_events,
+            state_change_id,
+            block_number,
+            events,
+            commit,
+        )
+
+    def write_state_snapshot(self, statechange_id, snapshot):
+        self._queue_write(self.storage.write_state_snapshot, statechange_id, snapshot)
+
+    def write_state_snapshot_subtrees(
+            self,
+            statechange_id,
+            skeleton,
+            subtrees,
+            removed_keys=(),
+            replace_all=False,
+    ):
+        self._queue_write(
+            self.storage.write_state_snapshot_subtrees,
+            statechange_id,
+            skeleton,
+            subtrees,
+            removed_keys,
+            replace_all,
+        )
+
+    def compact_state_changes(self, statechange_id):
+        self._queue_write(self.storage.compact_state_changes, statechange_id)
+
+    def archive_state_changes(self, statechange_id, min_state_changes=1):
+        self._queue_write(
+            self.storage.archive_state_changes,
+            statechange_id,
+            min_state_changes,
+        )
+
+    def commit(self):
+        self._queue_write(self.storage.commit)
+
+    def stop(self):
+        """ Wait for the queued writes and stop the writer thread. """
+        try:
+            self.durability_barrier().get()
+        finally:
+            self.writer.kill()
@@ -0,0 +1,86 @@
+"""
+Compare the cost of a state transition in the dispatch modes of the
+StateManager, for an increasing number of channels: a deep copy of the whole
+NodeState, copying only the objects the state machine changes, and modifying
+the state in place with an undo log.
+
+Every dispatch is either a `Block` or a deposit to a single channel, so the
+work done by the state machine is the same for any number of channels.
+"""
+import time
+from copy import deepcopy
+
+from raiden.tests.utils import factories
+from raiden.transfer import node
+from raiden.transfer.architecture import DISPATCH_MODES, StateManager
+from raiden.transfer.state import TransactionChannelNewBalance
+from raiden.transfer.state_change import Block, ContractReceiveChannelNewBalance
+
+
+def make_state_changes(node_state, number_of_statechanges):
+    payment_network = list(node_state.identifiers_to_paymentnetworks.values())[0]
+    token_network = list(payment_network.tokenidentifiers_to_tokennetworks.values())[0]
+    channels = list(token_network.channelidentifiers_to_channels.values())
+
+    state_changes = list()
+    block_number = node_state.block_number
+    for number in range(number_of_statechanges):
+        if number % 2:
+            channel_state = channels[number % len(channels)]
+            deposit = TransactionChannelNewBalance(
+                channel_state.our_state.address,
+                channel_state.our_state.contract_balance + number,
+                block_number,
+            )
+            state_changes.append(ContractReceiveChannelNewBalance(
+                token_network.address,
+                channel_state.identifier,
+                deposit,
+            ))
+        else:
+            block_number += 1
+            state_changes.append(Block(block_number))
+
+    return state_changes
+
+
+def run_dispatch(dispatch_mode, node_state, state_changes):
+    # the undo log modifies the state in place
+    node_state = deepcopy(node_state)
+    state_changes = deepcopy(state_changes)
+    state_manager = StateManager(node.state_transition, node_state, dispatch_mode)
+
+    start = time.time()
+    for state_change in state_changes:
+        state_manager.dispatch(state_change)
+    elapsed = time.time() - start
+
+    return elapsed / len(state_changes)
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--channels', default=[10, 100, 1000, 5000], nargs='+', type=int)
+    parser.add_argument('--locks', default=2, type=int)
+    parser.add_argument('--statechanges', default=50, type=int)
+    args = parser.parse_args()
+
+    for number_of_channels in args.channels:
+        node_state = factories.make_node_state(number_of_channels, args.locks)
+        state_changes = make_state_changes(node_state, args.statechanges)
+
+        elapsed = [
+            '{}={:.6f}s'.format(
+                dispatch_mode,
+                run_dispatch(dispatch_mode, node_state, state_changes),
+            )
+            for dispatch_mode in DISPATCH_MODES
+        ]
+
+        print('channels={} {} per state change'.format(number_of_channels, ' '.join(elapsed)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,96 @@
+"""
+Compare the cost of full and incremental snapshots of a node with many
+channels, of which only a few change between snapshots.
+"""
+import os
+import tempfile
+import time
+from copy import deepcopy
+
+from raiden.storage.serialize import BinarySerializer
+from raiden.storage.snapshot import IncrementalSnapshots
+from raiden.storage.sqlite import SQLiteStorage
+from raiden.tests.utils import factories
+from raiden.transfer.state_change import Block
+
+
+def get_channels(node_state):
+    payment_network = list(node_state.identifiers_to_paymentnetworks.values())[0]
+    token_network = list(payment_network.tokenidentifiers_to_tokennetworks.values())[0]
+    return list(token_network.channelidentifiers_to_channels.values())
+
+
+def run_snapshots(database_path, node_state, snapshots, changed_channels, incremental):
+    storage = SQLiteStorage(database_path, BinarySerializer)
+    incremental_snapshots = IncrementalSnapshots()
+
+    written = [0]
+    write_state_snapshot_subtrees = storage.write_state_snapshot_subtrees
+
+    def count_subtrees(statechange_id, skeleton, subtrees, removed_keys, replace_all):
+        written[0] += sum(len(data) for data in subtrees.values())
+        write_state_snapshot_subtrees(
+            statechange_id,
+            skeleton,
+            subtrees,
+            removed_keys,
+            replace_all,
+        )
+
+    # the first incremental snapshot writes every subtree
+    statechange_id = storage.write_state_change(Block(0))
+    incremental_snapshots.write_snapshot(storage, statechange_id, node_state)
+
+    storage.write_state_snapshot_subtrees = count_subtrees
+
+    elapsed = 0
+    for snapshot_number in range(1, snapshots + 1):
+        # the state machine works on a copy of the state
+        node_state = deepcopy(node_state)
+        for channel_state in get_channels(node_state)[:changed_channels]:
+            channel_state.our_state.contract_balance += 1
+
+        statechange_id = storage.write_state_change(Block(snapshot_number))
+
+        start = time.time()
+        if incremental:
+            incremental_snapshots.write_snapshot(storage, statechange_id, node_state)
+        else:
+            storage.write_state_snapshot(statechange_id, node_state)
+            written[0] += len(BinarySerializer.serialize(node_state))
+        elapsed += time.time() - start
+
+    return elapsed / snapshots, written[0] / snapshots
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--channels', default=1000, type=int)
+    parser.add_argument('--locks', default=5, type=int)
+    parser.add_argument('--changed', default=10, type=int)
+    parser.add_argument('--snapshots', default=10, type=int)
+    args = parser.parse_args()
+
+    node_state = factories.make_node_state(args.channels, args.locks)
+
+    for incremental in (False, True):
+        with tempfile.TemporaryDirectory() as datadir:
+            elapsed, written = run_snapshots(
+                os.path.join(datadir, 'snapshot.db'),
+                node_state,
+                args.snapshots,
+                args.changed,
+                incremental,
+            )
+
+        print('incremental={} {:.4f}s and {:.0f} bytes per snapshot'.format(
+            incremental,
+            elapsed,
+            written,
+        ))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,66 @@
+"""
+Measure adding and removing a lock from the merkle tree of a channel with an
+increasing number of pending locks, computing the layers from scratch and
+incrementally.
+"""
+import os
+import timeit
+
+from raiden.transfer.merkle_tree import (
+    compute_layers,
+    compute_layers_with,
+    compute_layers_without,
+)
+
+
+def add_and_remove_from_scratch(leaves, element):
+    with_element = list(leaves)
+    with_element.append(element)
+    layers = compute_layers(with_element)
+
+    without_element = list(layers[0])
+    without_element.remove(element)
+    compute_layers(without_element)
+
+
+def add_and_remove_incremental(layers, element):
+    with_element = compute_layers_with(layers, element)
+    compute_layers_without(with_element, element)
+
+
+def measure(function, number):
+    return timeit.timeit(function, number=number) / number * 10 ** 3
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--locks', default=[10, 100, 1000, 10000], nargs='+', type=int)
+    parser.add_argument('--number', default=20, type=int)
+    args = parser.parse_args()
+
+    for number_of_locks in args.locks:
+        leaves = [os.urandom(32) for _ in range(number_of_locks)]
+        layers = compute_layers(leaves)
+        elements = [os.urandom(32) for _ in range(args.number)]
+
+        elements_iter = iter(elements * 2)
+        from_scratch = measure(
+            lambda: add_and_remove_from_scratch(leaves, next(elements_iter)),
+            args.number,
+        )
+        incremental = measure(
+            lambda: add_and_remove_incremental(layers, next(elements_iter)),
+            args.number,
+        )
+
+        print('locks={} from_scratch={:.3f}ms incremental={:.3f}ms'.format(
+            number_of_locks,
+            from_scratch,
+            incremental,
+        ))
+
+
+if __name__ == '__main__':
+    main()
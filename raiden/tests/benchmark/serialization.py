@@ -0,0 +1,113 @@
+"""
+Compare the PickleSerializer and the BinarySerializer, both in size and
+speed.
+
+By default a synthetic node state is used, with `--database` the snapshot,
+state changes and events of an existing node database are measured instead.
+The database is only read.
+"""
+import sqlite3
+import time
+
+from raiden.storage.serialize import BinarySerializer, PickleSerializer
+from raiden.tests.utils import factories
+from raiden.transfer.events import EventTransferSentSuccess
+from raiden.transfer.state_change import Block, ContractReceiveChannelNew
+
+
+def objects_from_database(database_path):
+    """ Return the deserialized objects of a database, grouped by table. """
+    conn = sqlite3.connect('file:{}?mode=ro'.format(database_path), uri=True)
+
+    result = dict()
+    for table in ('state_snapshot', 'state_changes', 'state_events'):
+        cursor = conn.execute('SELECT data FROM {} WHERE data IS NOT NULL'.format(table))
+        result[table] = [
+            BinarySerializer.deserialize(data)
+            for (data, ) in cursor
+        ]
+
+    conn.close()
+    return result
+
+
+def synthetic_objects(channels, locks):
+    node_state = factories.make_node_state(channels, locks)
+
+    payment_network = list(node_state.identifiers_to_paymentnetworks.values())[0]
+    token_network = list(payment_network.tokenidentifiers_to_tokennetworks.values())[0]
+    channel_states = token_network.channelidentifiers_to_channels.values()
+
+    state_changes = [Block(block_number) for block_number in range(channels)]
+    state_changes.extend(
+        ContractReceiveChannelNew(token_network.address, channel_state)
+        for channel_state in channel_states
+    )
+    events = [
+        EventTransferSentSuccess(identifier, 10, factories.make_address())
+        for identifier in range(channels)
+    ]
+
+    return {
+        'state_snapshot': [node_state],
+        'state_changes': state_changes,
+        'state_events': events,
+    }
+
+
+def measure(serializer, objects, repeat):
+    blobs = [serializer.serialize(obj) for obj in objects]
+    size = sum(len(blob) for blob in blobs)
+
+    start = time.time()
+    for _ in range(repeat):
+        for obj in objects:
+            serializer.serialize(obj)
+    serialize_elapsed = (time.time() - start) / repeat
+
+    start = time.time()
+    for _ in range(repeat):
+        for blob in blobs:
+            serializer.deserialize(blob)
+    deserialize_elapsed = (time.time() - start) / repeat
+
+    return size, serialize_elapsed, deserialize_elapsed
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--database', help='path to an existing node database')
+    parser.add_argument('--channels', default=100, type=int)
+    parser.add_argument('--locks', default=5, type=int)
+    parser.add_argument('--repeat', default=10, type=int)
+    args = parser.parse_args()
+
+    if args.database:
+        objects_by_table = objects_from_database(args.database)
+    else:
+        objects_by_table = synthetic_objects(args.channels, args.locks)
+
+    for table, objects in objects_by_table.items():
+        if not objects:
+            continue
+
+        print('{} ({} rows)'.format(table, len(objects)))
+
+        for serializer in (PickleSerializer, BinarySerializer):
+            size, serialize_elapsed, deserialize_elapsed = measure(
+                serializer,
+                objects,
+                args.repeat,
+            )
+            print('    {:<16} size={:<10} serialize={:.4f}s deserialize={:.4f}s'.format(
+                serializer.__name__,
+                size,
+                serialize_elapsed,
+                deserialize_elapsed,
+            ))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,74 @@
+"""
+Measure the overhead of picking the handler of a state change in the state
+machines, per state change type.
+
+The handlers are found in the `STATE_CHANGE_HANDLERS` table of each module,
+the cost is compared with the chain of `type(state_change) == ...`
+comparisons the table replaced, which was ordered the same way. The
+handlers themselves are not called.
+"""
+import timeit
+
+from raiden.transfer import channel, node, token_network
+from raiden.transfer.mediated_transfer import initiator_manager, mediator, target
+
+MODULES = (
+    node,
+    token_network,
+    channel,
+    initiator_manager,
+    mediator,
+    target,
+)
+
+
+def make_state_change(state_change_class):
+    # only the type is used, the attributes are irrelevant
+    return state_change_class.__new__(state_change_class)
+
+
+def select_by_table(handlers, state_change):
+    return handlers.get(type(state_change))
+
+
+def select_by_chain(chain, state_change):
+    for state_change_class, handler in chain:
+        if type(state_change) is state_change_class:  # pylint: disable=unidiomatic-typecheck
+            return handler
+
+    return None
+
+
+def measure(function, handlers, state_change, number):
+    elapsed = timeit.timeit(lambda: function(handlers, state_change), number=number)
+    return elapsed / number * 10 ** 9
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--number', default=200000, type=int)
+    args = parser.parse_args()
+
+    for module in MODULES:
+        handlers = module.STATE_CHANGE_HANDLERS
+        chain = list(handlers.items())
+
+        print(module.__name__)
+        for position, state_change_class in enumerate(handlers):
+            state_change = make_state_change(state_change_class)
+
+            table = measure(select_by_table, handlers, state_change, args.number)
+            if_chain = measure(select_by_chain, chain, state_change, args.number)
+
+            print('  {:2d} {:40s} table={:6.1f}ns chain={:6.1f}ns'.format(
+                position,
+                state_change_class.__name__,
+                table,
+                if_chain,
+            ))
+
+
+if __name__ == '__main__':
+    main()
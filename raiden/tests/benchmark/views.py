@@ -0,0 +1,94 @@
+"""
+Measure the lookups of the views by token network and channel identifier for
+an increasing number of token networks. With the indexes of the NodeState
+the cost must not depend on the number of token networks.
+"""
+import random
+import timeit
+
+from raiden.tests.utils import factories
+from raiden.transfer import views
+from raiden.transfer.indexes import rebuild_indexes
+from raiden.transfer.state import NodeState, PaymentNetworkState, TokenNetworkState
+
+
+def make_node_state(number_of_token_networks, channels_per_token_network):
+    our_address = factories.make_address()
+    token_networks = [
+        TokenNetworkState(factories.make_address(), factories.make_address())
+        for _ in range(number_of_token_networks)
+    ]
+    payment_network = PaymentNetworkState(factories.make_address(), token_networks)
+
+    for token_network in token_networks:
+        for _ in range(channels_per_token_network):
+            channel_state = factories.make_channel(
+                our_address=our_address,
+                token_address=token_network.token_address,
+                token_network_identifier=token_network.address,
+            )
+            partner_address = channel_state.partner_state.address
+            token_network.channelidentifiers_to_channels[channel_state.identifier] = channel_state
+            token_network.partneraddresses_to_channels[partner_address] = channel_state
+
+    node_state = NodeState(random.Random(), 1)
+    node_state.identifiers_to_paymentnetworks[payment_network.address] = payment_network
+    rebuild_indexes(node_state)
+
+    return node_state, payment_network
+
+
+def measure(function, number):
+    return timeit.timeit(function, number=number) / number * 10 ** 6
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--token-networks', default=[1, 10, 100, 1000], nargs='+', type=int)
+    parser.add_argument('--channels', default=5, type=int)
+    parser.add_argument('--number', default=10000, type=int)
+    args = parser.parse_args()
+
+    for number_of_token_networks in args.token_networks:
+        node_state, payment_network = make_node_state(number_of_token_networks, args.channels)
+
+        # the last token network is the worst case for a linear scan
+        token_network = list(payment_network.tokenidentifiers_to_tokennetworks.values())[-1]
+        channel_state = list(token_network.channelidentifiers_to_channels.values())[-1]
+
+        by_identifier = measure(
+            lambda: views.get_token_network_by_identifier(node_state, token_network.address),
+            args.number,
+        )
+        search = measure(
+            lambda: views.search_for_channel(
+                node_state,
+                payment_network.address,
+                channel_state.identifier,
+            ),
+            args.number,
+        )
+        for_partner = measure(
+            lambda: views.list_channelstate_for_partner(
+                node_state,
+                payment_network.address,
+                channel_state.partner_state.address,
+            ),
+            args.number,
+        )
+
+        print(
+            'token_networks={} get_token_network_by_identifier={:.2f}us '
+            'search_for_channel={:.2f}us list_channelstate_for_partner={:.2f}us'.format(
+                number_of_token_networks,
+                by_identifier,
+                search,
+                for_partner,
+            ),
+        )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,101 @@
+"""
+Benchmark the WriteAheadLog throughput with and without group commits, and
+with the write-behind storage.
+
+Several greenlets dispatch `Block` state changes concurrently against a
+database file, the same way the transport greenlets do under mediator load.
+"""
+import os
+import tempfile
+import time
+
+import gevent
+
+from raiden.storage.serialize import PickleSerializer
+from raiden.storage.sqlite import SQLiteStorage
+from raiden.storage.wal import WriteAheadLog
+from raiden.storage.writebehind import WriteBehindStorage
+from raiden.transfer.architecture import StateManager, TransitionResult
+from raiden.transfer.events import EventTransferSentFailed
+from raiden.transfer.state_change import Block
+
+
+def state_transition_event(state, state_change):  # pylint: disable=unused-argument
+    return TransitionResult(state, [EventTransferSentFailed(1, 'benchmark')])
+
+
+def run_wal(database_path, statechanges, concurrency, group_commit_window, write_behind):
+    storage = SQLiteStorage(database_path, PickleSerializer)
+    state_manager = StateManager(state_transition_event, None)
+
+    if write_behind:
+        wal = WriteAheadLog(state_manager, WriteBehindStorage(storage))
+    else:
+        wal = WriteAheadLog(state_manager, storage, group_commit_window=group_commit_window)
+
+    commits = [0]
+    storage_commit = storage.commit
+
+    def count_commit():
+        commits[0] += 1
+        storage_commit()
+
+    storage.commit = count_commit
+
+    def worker(offset):
+        for block_number in range(offset, statechanges, concurrency):
+            wal.log_and_dispatch(Block(block_number), block_number)
+            # the transport waits for durability before sending Delivered
+            wal.durability_barrier().get()
+
+    start = time.time()
+    greenlets = [gevent.spawn(worker, offset) for offset in range(concurrency)]
+    gevent.joinall(greenlets, raise_error=True)
+    elapsed = time.time() - start
+
+    if group_commit_window is None:
+        # one transaction for the state change and one for the events
+        commits[0] = 2 * statechanges
+
+    return elapsed, commits[0]
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--statechanges', default=2000, type=int)
+    parser.add_argument('--concurrency', default=20, type=int)
+    parser.add_argument('--window', default=0.002, type=float)
+    args = parser.parse_args()
+
+    modes = (
+        (None, False),
+        (args.window, False),
+        (None, True),
+    )
+    for group_commit_window, write_behind in modes:
+        with tempfile.TemporaryDirectory() as datadir:
+            database_path = os.path.join(datadir, 'log.db')
+            elapsed, commits = run_wal(
+                database_path,
+                args.statechanges,
+                args.concurrency,
+                group_commit_window,
+                write_behind,
+            )
+
+        print('group_commit_window={} write_behind={} commits={} elapsed={:.3f}s'.format(
+            group_commit_window,
+            write_behind,
+            commits,
+            elapsed,
+        ))
+        print('    {:.1f} state changes/s, {:.1f} commits/s'.format(
+            args.statechanges / elapsed,
+            commits / elapsed,
+        ))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,110 @@
+"""
+Measure the memory used to replay the state changes of a long log.
+
+A database with `--statechanges` Block state changes is created and then
+replayed by `restore_from_latest_snapshot`, once using the streaming replay
+and once loading the whole log in a list as it was done before. Each replay
+runs in its own process so the peak RSS of one does not hide the other.
+"""
+import multiprocessing
+import os
+import resource
+import tempfile
+import time
+
+from raiden.storage.serialize import BinarySerializer
+from raiden.storage.sqlite import SQLiteStorage
+from raiden.storage.wal import restore_from_latest_snapshot
+from raiden.transfer.architecture import State, TransitionResult
+from raiden.transfer.state_change import Block
+
+
+class CountState(State):
+    __slots__ = ('count', )
+
+    def __init__(self):
+        self.count = 0
+
+
+def state_transition_count(state, state_change):  # pylint: disable=unused-argument
+    state = state or CountState()
+    state.count += 1
+    return TransitionResult(state, list())
+
+
+def create_log(database_path, statechanges):
+    storage = SQLiteStorage(database_path, BinarySerializer)
+
+    with storage.conn:
+        storage.conn.executemany(
+            'INSERT INTO state_changes(identifier, data) VALUES(null, ?)',
+            (
+                (BinarySerializer.serialize(Block(block_number)), )
+                for block_number in range(statechanges)
+            ),
+        )
+
+    storage.conn.close()
+
+
+def max_rss_kb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def replay(database_path, streaming, results):
+    storage = SQLiteStorage(database_path, BinarySerializer)
+    rss_before = max_rss_kb()
+    start = time.time()
+
+    if not streaming:
+        # emulate the replay from a fully materialized list
+        statechanges = storage.get_statechanges_by_identifier(0, 'latest')
+        storage.iter_statechanges_by_identifier = lambda *args, **kwargs: iter(statechanges)
+
+    wal, _ = restore_from_latest_snapshot(state_transition_count, storage)
+    elapsed = time.time() - start
+
+    results.put((
+        wal.state_manager.current_state.count,
+        elapsed,
+        rss_before,
+        max_rss_kb(),
+    ))
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--statechanges', default=1000000, type=int)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as datadir:
+        database_path = os.path.join(datadir, 'log.db')
+        create_log(database_path, args.statechanges)
+
+        for streaming in (True, False):
+            results = multiprocessing.Queue()
+            process = multiprocessing.Process(
+                target=replay,
+                args=(database_path, streaming, results),
+            )
+            process.start()
+            process.join()
+
+            if process.exitcode != 0:
+                raise RuntimeError('replay failed')
+
+            replayed, elapsed, rss_before, rss_after = results.get()
+
+            print('streaming={} replayed={} elapsed={:.1f}s max_rss={}KB (+{}KB)'.format(
+                streaming,
+                replayed,
+                elapsed,
+                rss_after,
+                rss_after - rss_before,
+            ))
+
+
+if __name__ == '__main__':
+    main()
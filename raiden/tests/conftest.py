@@ -119,6 +119,13 @@ def dont_exit_pytest():
     gevent.get_hub().NOT_ERROR = (gevent.GreenletExit, SystemExit, RaidenShuttingDown)
 
 
+@pytest.fixture(scope='session', autouse=True)
+def check_amount_locked():
+    """ Check the memoized locked amount of the channels on every read. """
+    from raiden.transfer import channel
+    channel.CHECK_AMOUNT_LOCKED = True
+
+
 if sys.platform == 'darwin':
     # On macOS the temp directory base path is already very long.
     # To avoid failures on ipc tests (ipc path length is limited to 104/108 chars on macOS/linux)
@@ -7,7 +7,7 @@ from raiden_contracts.constants import (
 )
 
 from raiden.api.python import RaidenAPI
-from raiden.tests.utils.transfer import get_channelstate
+from raiden.tests.utils.transfer import get_channelstate, get_settled_channelstate
 from raiden.tests.utils.geth import wait_until_block
 from raiden.transfer import channel, views
 from raiden.transfer.state import (
@@ -158,7 +158,7 @@ def test_channel_lifecycle(raiden_network, token_addresses, deposit, transport_c
     )
     wait_until_block(node1.raiden.chain, settlement_block)
 
-    # Load the new state with the channel settled
-    channel12 = get_channelstate(node1, node2, token_network_identifier)
+    # Load the final state of the settled channel
+    channel12 = get_settled_channelstate(node1, node2, token_network_identifier)
 
     assert channel.get_status(channel12) == CHANNEL_STATE_SETTLED
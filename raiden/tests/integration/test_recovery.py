@@ -8,6 +8,8 @@ from raiden.network.transport import UDPTransport
 from raiden.tests.utils.network import CHAIN
 from raiden.tests.utils.transfer import (
     assert_synched_channel_state,
+    assert_synched_channels,
+    get_settled_channelstate,
     mediated_transfer,
 )
 from raiden.transfer import views
@@ -199,10 +201,15 @@ def test_recovery_unhappy_case(
     )
     del app0  # from here on the app0_restart should be used
 
-    assert_synched_channel_state(
-        token_network_identifier,
-        app0_restart, deposit - spent_amount, [],
-        app1, deposit + spent_amount, [],
+    # app1 removed the settled channel from its node state, app0_restart
+    # has not seen the close yet
+    assert_synched_channels(
+        get_settled_channelstate(app0_restart, app1, token_network_identifier),
+        deposit - spent_amount,
+        [],
+        get_settled_channelstate(app1, app0_restart, token_network_identifier),
+        deposit + spent_amount,
+        [],
     )
     assert_synched_channel_state(
         token_network_identifier,
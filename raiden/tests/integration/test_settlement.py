@@ -12,9 +12,11 @@ from raiden.tests.utils.geth import wait_until_block
 from raiden.tests.utils.network import CHAIN
 from raiden.tests.utils.transfer import (
     assert_synched_channel_state,
+    assert_synched_channels,
     claim_lock,
     direct_transfer,
     get_channelstate,
+    get_settled_channelstate,
     pending_mediated_transfer,
 )
 from raiden.transfer import channel, views
@@ -65,18 +67,21 @@ def test_settle_is_automatically_called(raiden_network, token_addresses, deposit
         app0.raiden.address,
     )
 
-    waiting.wait_for_settle(
-        app0.raiden,
-        registry_address,
-        token_address,
-        [channel_identifier],
-        app0.raiden.alarm.wait_time,
-    )
+    for app in (app0, app1):
+        waiting.wait_for_settle(
+            app.raiden,
+            registry_address,
+            token_address,
+            [channel_identifier],
+            app.raiden.alarm.wait_time,
+        )
 
-    assert_synched_channel_state(
-        token_network_identifier,
-        app0, deposit, [],
-        app1, deposit, [],
+    # the settled channels are removed from the node state, their final
+    # states are kept by the events
+    channel_state = get_settled_channelstate(app0, app1, token_network_identifier)
+    assert_synched_channels(
+        channel_state, deposit, [],
+        get_settled_channelstate(app1, app0, token_network_identifier), deposit, [],
     )
 
     state_changes = app0.raiden.wal.storage.get_statechanges_by_identifier(
@@ -84,7 +89,6 @@ def test_settle_is_automatically_called(raiden_network, token_addresses, deposit
         to_identifier='latest',
     )
 
-    channel_state = get_channelstate(app0, app1, token_network_identifier)
     assert channel_state.close_transaction.finished_block_number
     assert channel_state.settle_transaction.finished_block_number
 
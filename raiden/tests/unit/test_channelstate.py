@@ -1,4 +1,5 @@
 # pylint: disable=too-many-locals,too-many-statements,too-many-lines
+import pickle
 import random
 from collections import namedtuple
 from copy import deepcopy
@@ -14,6 +15,7 @@ from raiden.messages import (
     Secret,
 )
 from raiden.settings import DEFAULT_NUMBER_OF_CONFIRMATIONS_BLOCK
+from raiden.storage.serialize import BinarySerializer
 from raiden.transfer import channel
 from raiden.transfer.events import (
     ContractSendChannelBatchUnlock,
@@ -1250,6 +1252,42 @@ def test_channelstate_get_unlock_proof():
     assert merkleroot(end_state.merkletree) == computed_merkleroot
 
 
+def test_amount_locked():
+    end_state = NettingChannelEndState(HOP1, 300)
+    locks = [
+        HashTimeLockState(amount, 10, sha3(make_secret(amount)))
+        for amount in range(1, 6)
+    ]
+
+    for lock in locks:
+        channel._add_lock(end_state, lock)
+    assert channel.get_amount_locked(end_state) == 15
+
+    # the unlocked locks are still locked until they are claimed
+    channel.register_secret_endstate(end_state, make_secret(1), locks[0].secrethash)
+    channel.register_onchain_secret_endstate(end_state, make_secret(2), locks[1].secrethash)
+    assert channel.get_amount_locked(end_state) == 15
+
+    channel._del_lock(end_state, locks[0].secrethash)
+    channel._del_lock(end_state, locks[1].secrethash)
+    channel._del_lock(end_state, locks[2].secrethash)
+    assert channel.get_amount_locked(end_state) == 9
+    assert end_state.amount_locked == channel.compute_amount_locked(end_state)
+
+    # the states written before the amount was kept compute it on load
+    old_state = deepcopy(end_state)
+    del old_state.amount_locked
+    for data in (pickle.dumps(old_state), BinarySerializer.serialize(old_state)):
+        loaded_state = BinarySerializer.deserialize(data)
+        assert loaded_state.amount_locked == 9
+        assert channel.get_amount_locked(loaded_state) == 9
+
+    # a lock added directly is detected by the check
+    end_state.secrethashes_to_lockedlocks[locks[0].secrethash] = locks[0]
+    with pytest.raises(AssertionError):
+        channel.get_amount_locked(end_state)
+
+
 def test_channelstate_unlock():
     """The node must call unlock after the channel is settled"""
     our_model1, _ = create_model(70)
@@ -1,3 +1,5 @@
+import random
+
 import pytest
 
 from raiden.exceptions import HashLengthNot32
@@ -6,11 +8,17 @@ from raiden.transfer.state import EMPTY_MERKLE_ROOT
 from raiden.transfer.merkle_tree import (
     MERKLEROOT,
     compute_layers,
+    compute_layers_with,
+    compute_layers_without,
     compute_merkleproof_for,
+    compute_merkleproofs_for,
+    merkle_leaves_from_packed_data,
     validate_proof,
     merkleroot,
 )
-from raiden.transfer.state import MerkleTreeState
+from raiden.transfer.state import EMPTY_MERKLE_TREE, HashTimeLockState, MerkleTreeState
+from raiden.encoding import messages
+from raiden.encoding.format import buffer_for
 
 
 def sort_join(first, second):
@@ -143,3 +151,94 @@ def test_many(tree_up_to=10):
 
         reversed_tree = MerkleTreeState(compute_layers(reversed(leaves)))
         assert root == merkleroot(reversed_tree)
+
+
+def test_incremental_layers():
+    """ Adding and removing elements one by one must give the same layers as
+    computing them from scratch.
+    """
+    rng = random.Random(42)
+    elements = [sha3(str(value).encode()) for value in range(70)]
+    rng.shuffle(elements)
+
+    layers = EMPTY_MERKLE_TREE.layers
+    present = list()
+
+    for element in elements:
+        previous_layers = [list(layer) for layer in layers]
+        layers = compute_layers_with(layers, element)
+        present.append(element)
+
+        assert layers == compute_layers(present)
+        assert compute_layers_with(layers, element) is None
+        assert compute_layers_without(previous_layers, element) is None
+
+    rng.shuffle(present)
+    while present:
+        element = present.pop()
+        layers = compute_layers_without(layers, element)
+
+        if present:
+            assert layers == compute_layers(present)
+
+            tree = MerkleTreeState(layers)
+            other = rng.choice(present)
+            proof = compute_merkleproof_for(tree, other)
+            assert validate_proof(proof, merkleroot(tree), other)
+        else:
+            assert layers == []
+
+    with pytest.raises(HashLengthNot32):
+        compute_layers_with(EMPTY_MERKLE_TREE.layers, b'not32bytes')
+
+
+def test_batch_proofs():
+    for number_of_leaves in range(1, 20):
+        leaves = [
+            sha3(str(value).encode())
+            for value in range(number_of_leaves)
+        ]
+        tree = MerkleTreeState(compute_layers(leaves))
+        root = merkleroot(tree)
+
+        elements = list(reversed(leaves[::2]))
+        proofs = compute_merkleproofs_for(tree, elements)
+
+        assert proofs == [compute_merkleproof_for(tree, element) for element in elements]
+        for proof, element in zip(proofs, elements):
+            assert validate_proof(proof, root, element)
+
+    assert compute_merkleproofs_for(tree, []) == []
+
+    with pytest.raises(ValueError):
+        compute_merkleproofs_for(tree, [sha3(b'unknown')])
+
+    with pytest.raises(ValueError):
+        compute_merkleproof_for(tree, sha3(b'unknown'))
+
+
+def test_merkle_leaves_from_packed_data():
+    locks = [
+        HashTimeLockState(amount, expiration, sha3(str(amount).encode()))
+        for amount, expiration in ((1, 10), (2 ** 256 - 1, 2 ** 64), (0, 0))
+    ]
+
+    for lock in locks:
+        packed = messages.Lock(buffer_for(messages.Lock))
+        packed.amount = lock.amount
+        packed.expiration = lock.expiration
+        packed.secrethash = lock.secrethash
+        assert lock.encoded == bytes(packed.data)
+
+    packed_data = b''.join(lock.encoded for lock in locks)
+    lockhashes = [lock.lockhash for lock in locks]
+
+    assert merkle_leaves_from_packed_data(packed_data) == lockhashes
+    assert merkle_leaves_from_packed_data(bytearray(packed_data)) == lockhashes
+    assert merkle_leaves_from_packed_data(b'') == []
+
+    with pytest.raises(ValueError):
+        HashTimeLockState(2 ** 256, 1, sha3(b'secret'))
+
+    with pytest.raises(ValueError):
+        HashTimeLockState(1, -1, sha3(b'secret'))
@@ -0,0 +1,80 @@
+import random
+
+import networkx
+
+from raiden.routing import (
+    get_cached_ordered_partners,
+    get_distances_to,
+    get_ordered_partners,
+    make_graph,
+)
+from raiden.tests.utils.factories import make_address
+from raiden.transfer.state import TokenNetworkGraphState
+
+
+def test_get_ordered_partners():
+    rng = random.Random(7)
+    addresses = [make_address() for _ in range(40)]
+    outsider = make_address()
+
+    edges = {
+        tuple(rng.sample(addresses, 2))
+        for _ in range(60)
+    }
+    graph = make_graph(list(edges))
+
+    for from_address in graph.nodes():
+        to_address = rng.choice(list(graph.nodes()))
+
+        expected = list()
+        for neighbor in graph.neighbors(from_address):
+            try:
+                length = networkx.shortest_path_length(graph, neighbor, to_address)
+            except networkx.NetworkXNoPath:
+                continue
+            expected.append((length, neighbor))
+
+        assert sorted(get_ordered_partners(graph, from_address, to_address)) == sorted(expected)
+
+        distances = get_distances_to(graph, to_address, graph.neighbors(from_address))
+        assert distances == {neighbor: length for length, neighbor in expected}
+
+    assert get_ordered_partners(graph, outsider, addresses[0]) == []
+    assert get_ordered_partners(graph, from_address, outsider) == []
+    assert get_distances_to(graph, outsider, addresses) == {}
+
+
+def test_get_cached_ordered_partners():
+    token_network_id = make_address()
+    our_address, partner1, partner2, target = [make_address() for _ in range(4)]
+
+    graph_state = TokenNetworkGraphState(make_graph([
+        (our_address, partner1),
+        (our_address, partner2),
+        (partner1, target),
+    ]))
+    partners = get_cached_ordered_partners(graph_state, token_network_id, our_address, target)
+    assert partners == ((1, partner1), (3, partner2))
+
+    # changes done without incrementing the version are not seen
+    graph_state.network.add_edge(partner2, target)
+    assert get_cached_ordered_partners(
+        graph_state,
+        token_network_id,
+        our_address,
+        target,
+    ) is partners
+
+    graph_state.version += 1
+    partners = get_cached_ordered_partners(graph_state, token_network_id, our_address, target)
+    assert sorted(partners) == sorted(((1, partner1), (1, partner2)))
+
+    # another graph with the same version is not confused with the cached one
+    other_graph_state = TokenNetworkGraphState(make_graph([(our_address, partner1)]))
+    other_graph_state.version = graph_state.version
+    assert get_cached_ordered_partners(
+        other_graph_state,
+        token_network_id,
+        our_address,
+        target,
+    ) == ()
@@ -0,0 +1,221 @@
+import inspect
+import random
+
+import pytest
+
+from raiden.exceptions import SerializationError
+from raiden.storage.serialize import (
+    BinarySerializer,
+    PickleSerializer,
+    TYPE_TAGS,
+)
+from raiden.storage.introspection import deep_size, node_state_size
+from raiden.storage.sqlite import MIGRATED_USER_VERSION, SQLiteStorage
+from raiden.tests.utils import factories
+from raiden.transfer import events, state, state_change
+from raiden.transfer.architecture import Event, State, StateChange
+from raiden.transfer.mediated_transfer import (
+    events as mediated_events,
+    state as mediated_state,
+    state_change as mediated_state_change,
+)
+from raiden.transfer.events import EventTransferSentFailed, SendProcessed
+from raiden.transfer.state_change import (
+    ActionInitNode,
+    Block,
+    ContractReceiveChannelSettled,
+)
+from raiden.utils import sha3
+
+
+def test_all_types_have_a_tag():
+    tags = [tag for tag, _ in TYPE_TAGS]
+    assert len(tags) == len(set(tags))
+
+    tagged = {cls for _, cls in TYPE_TAGS}
+    modules = (
+        state,
+        state_change,
+        events,
+        mediated_state,
+        mediated_state_change,
+        mediated_events,
+    )
+    for module in modules:
+        for _, cls in inspect.getmembers(module, inspect.isclass):
+            is_defined_here = cls.__module__ == module.__name__
+            is_serializable = issubclass(cls, (State, StateChange, Event))
+
+            if is_defined_here and is_serializable:
+                assert cls in tagged, cls
+
+
+def test_roundtrip_state_changes_and_events():
+    values = [
+        None,
+        True,
+        0,
+        -1,
+        2 ** 256 - 1,
+        -2 ** 200,
+        1.5,
+        b'',
+        'text',
+        (1, b'bytes', [None, {'key': {1, 2}}]),
+        Block(10),
+        ContractReceiveChannelSettled(
+            factories.make_address(),
+            factories.make_channel_identifier(),
+            10,
+        ),
+        EventTransferSentFailed(1, 'whatever'),
+        SendProcessed(factories.ADDR, 'queue', 5),
+        factories.UNIT_TRANSFER_DESCRIPTION,
+        factories.make_transfer(
+            10,
+            factories.UNIT_TRANSFER_INITIATOR,
+            factories.UNIT_TRANSFER_TARGET,
+            20,
+            factories.UNIT_SECRET,
+        ),
+    ]
+
+    for value in values:
+        data = BinarySerializer.serialize(value)
+        assert BinarySerializer.deserialize(data) == value
+
+
+def test_roundtrip_node_state():
+    node_state = factories.make_node_state(number_of_channels=3, number_of_locks=2)
+    node_state.pseudo_random_generator.random()
+
+    data = BinarySerializer.serialize(node_state)
+    result = BinarySerializer.deserialize(data)
+
+    # Random and Graph don't compare by value
+    generator = result.pseudo_random_generator
+    assert generator.getstate() == node_state.pseudo_random_generator.getstate()
+    result.pseudo_random_generator = node_state.pseudo_random_generator
+
+    payment_network = list(node_state.identifiers_to_paymentnetworks.values())[0]
+    token_network = list(payment_network.tokenidentifiers_to_tokennetworks.values())[0]
+    result_payment_network = result.identifiers_to_paymentnetworks[payment_network.address]
+    result_token_network = result_payment_network.tokenaddresses_to_tokennetworks[
+        token_network.token_address
+    ]
+
+    graph = token_network.network_graph.network
+    result_graph = result_token_network.network_graph.network
+    assert sorted(graph.edges()) == sorted(result_graph.edges())
+    result_token_network.network_graph = token_network.network_graph
+
+    assert result == node_state
+
+    # aliased objects must still be shared after decoding
+    token_networks = result_payment_network.tokenidentifiers_to_tokennetworks
+    assert token_networks[token_network.address] is result_token_network
+    for channel_state in result_token_network.channelidentifiers_to_channels.values():
+        partner_address = channel_state.partner_state.address
+        assert result_token_network.partneraddresses_to_channels[partner_address] is channel_state
+
+    assert len(data) < len(PickleSerializer.serialize(node_state))
+
+
+def test_node_state_size():
+    node_state = factories.make_node_state(number_of_channels=3, number_of_locks=2)
+    payment_network = list(node_state.identifiers_to_paymentnetworks.values())[0]
+    token_network = list(payment_network.tokenidentifiers_to_tokennetworks.values())[0]
+
+    secrethash = sha3(factories.make_secret(0))
+    mediator_state = mediated_state.MediatorTransferState(secrethash)
+    node_state.payment_mapping.secrethashes_to_task[secrethash] = (
+        state.PaymentMappingState.MediatorTask(token_network.address, mediator_state)
+    )
+
+    result = node_state_size(node_state)
+
+    assert result['memory'] > 0
+    assert result['serialized'] == len(BinarySerializer.serialize(node_state))
+    assert result['block_number'] == node_state.block_number
+
+    payment_network_result, = result['payment_networks']
+    token_network_result, = payment_network_result['token_networks']
+    assert len(token_network_result['channels']) == 3
+    assert token_network_result['memory'] < payment_network_result['memory'] < result['memory']
+
+    for channel_result in token_network_result['channels']:
+        assert channel_result['our_merkletree']['leaves'] == 0
+        assert channel_result['partner_merkletree']['leaves'] == 2
+        assert channel_result['memory'] < token_network_result['memory']
+        assert channel_result['serialized'] < token_network_result['serialized']
+
+    task_result, = result['payment_tasks']
+    assert task_result['role'] == 'mediator'
+    assert task_result['serialized'] > 0
+
+    assert result['queues']['messages'] == 0
+
+
+def test_deep_size_counts_shared_objects_once():
+    items = list(range(1000, 1100))
+    assert deep_size([items, items]) < deep_size([items, list(items)])
+
+
+def test_pickle_compatibility():
+    state_change = ActionInitNode(random.Random(), 1)
+    pickled = PickleSerializer.serialize(state_change)
+
+    assert BinarySerializer.is_legacy(pickled)
+    assert not BinarySerializer.is_legacy(BinarySerializer.serialize(state_change))
+    assert BinarySerializer.deserialize(pickled).block_number == 1
+
+    # state changes and events were pickled with a __dict__ before they had
+    # __slots__
+    block = Block.__new__(Block)
+    block.__setstate__({'block_number': 5})
+    assert block == Block(5)
+
+
+def test_invalid_data():
+    class NotRegistered(State):
+        pass
+
+    with pytest.raises(SerializationError):
+        BinarySerializer.serialize(NotRegistered())
+
+    data = BinarySerializer.serialize(Block(10))
+
+    with pytest.raises(SerializationError):
+        BinarySerializer.deserialize(data[:-1])
+
+    with pytest.raises(SerializationError):
+        BinarySerializer.deserialize(data + b'\x00')
+
+    with pytest.raises(SerializationError):
+        BinarySerializer.deserialize(data[:1] + b'\xff' + data[2:])
+
+
+def test_migrate_pickled_data():
+    pickle_storage = SQLiteStorage(':memory:', PickleSerializer)
+    state_change_id = pickle_storage.write_state_change(Block(1))
+    pickle_storage.write_events(state_change_id, 1, [EventTransferSentFailed(1, 'whatever')])
+    pickle_storage.write_state_snapshot(state_change_id, Block(1))
+    pickle_storage.write_state_change(Block(2))
+
+    storage = SQLiteStorage(':memory:', BinarySerializer)
+    storage.conn = pickle_storage.conn
+
+    assert storage.migrate_pickled_data(chunk_size=1) == 4
+    assert storage.conn.execute('PRAGMA user_version').fetchone()[0] == MIGRATED_USER_VERSION
+
+    for (data, ) in storage.conn.execute('SELECT data FROM state_changes'):
+        assert not BinarySerializer.is_legacy(data)
+
+    assert storage.get_statechanges_by_identifier(0, 'latest') == [Block(1), Block(2)]
+    assert storage.get_state_snapshot() == (state_change_id, Block(1))
+    events = storage.get_events_by_identifier(0, 'latest')
+    assert events[0][1] == EventTransferSentFailed(1, 'whatever')
+
+    # the migrated database is not scanned again
+    pickle_storage.write_state_change(Block(3))
+    assert storage.migrate_pickled_data() == 0
@@ -0,0 +1,81 @@
+from copy import deepcopy
+
+from raiden.storage.serialize import BinarySerializer
+from raiden.storage.snapshot import IncrementalSnapshots, split_node_state
+from raiden.storage.sqlite import SQLiteStorage
+from raiden.tests.utils import factories
+from raiden.transfer.state import PaymentMappingState
+from raiden.transfer.state_change import Block
+
+
+def get_token_network(node_state):
+    payment_network = list(node_state.identifiers_to_paymentnetworks.values())[0]
+    return list(payment_network.tokenidentifiers_to_tokennetworks.values())[0]
+
+
+def count_subtree_rows(storage):
+    cursor = storage.conn.execute('SELECT count(*) FROM state_snapshot_subtrees')
+    return cursor.fetchone()[0]
+
+
+def test_incremental_snapshots():
+    storage = SQLiteStorage(':memory:', BinarySerializer)
+    snapshots = IncrementalSnapshots()
+
+    node_state = factories.make_node_state(number_of_channels=3, number_of_locks=2)
+    token_network = get_token_network(node_state)
+    secrethash = factories.UNIT_SECRETHASH
+    node_state.payment_mapping.secrethashes_to_task[secrethash] = PaymentMappingState.TargetTask(
+        token_network.address,
+        factories.make_channel_identifier(),
+        None,
+    )
+
+    # token network, network graph, three channels and the payment task
+    _, subtrees = split_node_state(node_state)
+    assert len(subtrees) == 6
+
+    first_id = storage.write_state_change(Block(1))
+    assert snapshots.write_snapshot(storage, first_id, node_state) == 6
+
+    # unchanged subtrees are not written again, even when copied
+    node_state = deepcopy(node_state)
+    token_network = get_token_network(node_state)
+    channel_state = list(token_network.channelidentifiers_to_channels.values())[0]
+    channel_state.our_state.contract_balance += 1
+    del node_state.payment_mapping.secrethashes_to_task[secrethash]
+
+    second_id = storage.write_state_change(Block(2))
+    assert snapshots.write_snapshot(storage, second_id, node_state) == 1
+    assert count_subtree_rows(storage) == 5
+
+    # the same objects are not even serialized
+    assert snapshots.write_snapshot(storage, second_id, node_state) == 0
+
+    statechange_id, restored = storage.get_state_snapshot()
+    assert statechange_id == second_id
+    assert restored.block_number == node_state.block_number
+    assert not restored.payment_mapping.secrethashes_to_task
+
+    restored_token_network = get_token_network(restored)
+    restored_channels = restored_token_network.channelidentifiers_to_channels
+    assert list(restored_channels) == list(token_network.channelidentifiers_to_channels)
+    assert restored_channels[channel_state.identifier] == channel_state
+
+    for partner_address, channel in restored_token_network.partneraddresses_to_channels.items():
+        assert channel is restored_channels[channel.identifier]
+        assert channel.partner_state.address == partner_address
+
+    payment_network = list(restored.identifiers_to_paymentnetworks.values())[0]
+    token_address = restored_token_network.token_address
+    assert payment_network.tokenaddresses_to_tokennetworks[token_address] is restored_token_network
+
+    graph = restored_token_network.network_graph.network
+    assert sorted(graph.edges()) == sorted(token_network.network_graph.network.edges())
+
+    # a full snapshot replaces the incremental one
+    storage.write_state_snapshot(second_id, node_state)
+    assert count_subtree_rows(storage) == 0
+
+    # and the next incremental snapshot writes all the subtrees
+    assert IncrementalSnapshots().write_snapshot(storage, second_id, node_state) == 5
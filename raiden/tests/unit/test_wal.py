@@ -1,18 +1,34 @@
+import random
 import sqlite3
+import threading
 
+import gevent
 import pytest
 
-from raiden.transfer.architecture import State, StateManager
-from raiden.storage.serialize import PickleSerializer
+from raiden import raiden_service
+from raiden.raiden_service import RaidenService
+from raiden.transfer.architecture import DISPATCH_UNDO_LOG, State, StateManager
+from raiden.storage.replay import replay_database
+from raiden.storage.serialize import BinarySerializer, PickleSerializer
 from raiden.storage.sqlite import SQLiteStorage
+from raiden.storage import wal as wal_module
 from raiden.storage.wal import (
     restore_from_latest_snapshot,
+    SnapshotPolicy,
     WriteAheadLog,
 )
+from raiden.storage.writebehind import WriteBehindStorage
 from raiden.tests.utils import factories
+from raiden.transfer import node, views
 from raiden.transfer.architecture import TransitionResult
-from raiden.transfer.events import EventTransferSentFailed
+from raiden.transfer.sharding import ShardedStateManager
+from raiden.transfer.events import (
+    ContractSendChannelClose,
+    EventChannelPruned,
+    EventTransferSentFailed,
+)
 from raiden.transfer.state_change import (
+    ActionInitNode,
     Block,
     ContractReceiveChannelBatchUnlock,
 )
@@ -33,13 +49,18 @@ def state_transtion_acc(state, state_change):
     return TransitionResult(state, list())
 
 
-def new_wal():
+def state_transition_failed(state, state_change):
+    events = [EventTransferSentFailed(state_change.block_number, 'whatever')]
+    return TransitionResult(state, events)
+
+
+def new_wal(state_transition=state_transition_noop, snapshot_policy=None):
     state = None
     serializer = PickleSerializer
 
-    state_manager = StateManager(state_transition_noop, state)
+    state_manager = StateManager(state_transition, state)
     storage = SQLiteStorage(':memory:', serializer)
-    wal = WriteAheadLog(state_manager, storage)
+    wal = WriteAheadLog(state_manager, storage, snapshot_policy)
     return wal
 
 
@@ -157,3 +178,597 @@ def test_restore_without_snapshot():
 
     aggregate = newwal.state_manager.current_state
     assert aggregate.state_changes == [Block(5), Block(7), Block(8)]
+
+
+def test_restore_with_snapshot():
+    wal = new_wal(state_transtion_acc)
+
+    wal.log_and_dispatch(Block(5), 5)
+    wal.log_and_dispatch(Block(7), 7)
+    wal.snapshot()
+    wal.log_and_dispatch(Block(8), 8)
+
+    newwal, events = restore_from_latest_snapshot(
+        state_transtion_acc,
+        wal.storage,
+    )
+
+    assert not events
+
+    # the state changes covered by the snapshot must not be reapplied
+    aggregate = newwal.state_manager.current_state
+    assert aggregate.state_changes == [Block(5), Block(7), Block(8)]
+    assert newwal.state_change_id == wal.state_change_id
+    assert newwal.statechanges_since_snapshot == 1
+
+
+def test_restore_sharded():
+    node_state = factories.make_node_state(number_of_channels=3, number_of_locks=1)
+    storage = SQLiteStorage(':memory:', BinarySerializer)
+    state_change_id = storage.write_state_change(Block(1))
+    storage.write_state_snapshot(state_change_id, node_state)
+    storage.write_state_change(Block(2))
+
+    newwal, _ = restore_from_latest_snapshot(node.state_transition, storage, sharded=True)
+    state_manager = newwal.state_manager
+    assert isinstance(state_manager, ShardedStateManager)
+
+    token_network_index = node_state.tokennetworkidentifiers_to_paymentnetworkidentifiers
+    assert list(state_manager.shards) == list(token_network_index)
+
+    restored_state = state_manager.current_state
+    assert restored_state.block_number == 2
+    for token_network_identifier in token_network_index:
+        token_network = views.get_token_network_by_identifier(
+            node_state,
+            token_network_identifier,
+        )
+        restored_token_network = views.get_token_network_by_identifier(
+            restored_state,
+            token_network_identifier,
+        )
+        assert restored_token_network.channelidentifiers_to_channels == (
+            token_network.channelidentifiers_to_channels
+        )
+
+    # the generators of the shards are part of the snapshots
+    newwal.log_and_dispatch(Block(3), 3)
+    newwal.snapshot()
+    current_state = newwal.state_manager.current_state
+    generators = current_state.tokennetworkidentifiers_to_pseudorandomgenerators
+
+    _, snapshot = storage.get_state_snapshot()
+    snapshot_generators = snapshot.tokennetworkidentifiers_to_pseudorandomgenerators
+    assert {
+        key: generator.getstate()
+        for key, generator in snapshot_generators.items()
+    } == {
+        key: generator.getstate()
+        for key, generator in generators.items()
+    }
+
+
+def test_snapshot_policy():
+    policy = SnapshotPolicy(statechange_count=2)
+    wal = new_wal(state_transtion_acc, policy)
+
+    wal.log_and_dispatch(Block(5), 5)
+    assert wal.storage.get_state_snapshot() is None
+
+    wal.log_and_dispatch(Block(7), 7)
+    statechange_id, snapshot = wal.storage.get_state_snapshot()
+    assert statechange_id == wal.state_change_id
+    assert snapshot.state_changes == [Block(5), Block(7)]
+
+    assert not policy.is_snapshot_due(0, 10 ** 6)
+    assert not SnapshotPolicy(interval=10).is_snapshot_due(100, 5)
+    assert SnapshotPolicy(interval=10).is_snapshot_due(1, 10)
+
+    with pytest.raises(ValueError):
+        SnapshotPolicy(statechange_count=0)
+
+
+def test_snapshot_compaction():
+    policy = SnapshotPolicy(statechange_count=3, compact=True)
+    wal = new_wal(state_transtion_acc, policy)
+
+    event = EventTransferSentFailed(1, 'whatever')
+    state_change_id = wal.storage.write_state_change(Block(1))
+    wal.storage.write_events(state_change_id, 1, [event])
+
+    wal.log_and_dispatch(Block(5), 5)
+    wal.log_and_dispatch(Block(7), 7)
+    wal.log_and_dispatch(Block(8), 8)
+
+    # only the state change of the snapshot is kept
+    state_changes = wal.storage.get_statechanges_by_identifier(
+        from_identifier=0,
+        to_identifier='latest',
+    )
+    assert state_changes == [Block(8)]
+
+    # the events are kept, even if the source state change data was removed
+    events = wal.storage.get_events_by_identifier(
+        from_identifier=0,
+        to_identifier='latest',
+    )
+    assert len(events) == 1
+
+    wal.log_and_dispatch(Block(9), 9)
+    newwal, _ = restore_from_latest_snapshot(state_transtion_acc, wal.storage)
+    aggregate = newwal.state_manager.current_state
+    assert aggregate.state_changes == [Block(5), Block(7), Block(8), Block(9)]
+
+
+def test_group_commit(tmpdir):
+    database_path = str(tmpdir.join('log.db'))
+    state_manager = StateManager(state_transtion_acc, None)
+    storage = SQLiteStorage(database_path, PickleSerializer)
+    wal = WriteAheadLog(state_manager, storage, group_commit_window=0.01)
+
+    commits = list()
+    storage_commit = storage.commit
+
+    def count_commit():
+        commits.append(True)
+        storage_commit()
+
+    storage.commit = count_commit
+
+    block_numbers = list(range(1, 6))
+    greenlets = [
+        gevent.spawn(wal.log_and_dispatch, Block(block_number), block_number)
+        for block_number in block_numbers
+    ]
+    gevent.joinall(greenlets, raise_error=True)
+
+    # all the concurrent state changes are persisted by the same transaction
+    assert len(commits) == 1
+
+    other_connection = SQLiteStorage(database_path, PickleSerializer)
+    state_changes = other_connection.get_statechanges_by_identifier(
+        from_identifier=0,
+        to_identifier='latest',
+    )
+    assert state_changes == [Block(block_number) for block_number in block_numbers]
+
+    wal.log_and_dispatch(Block(6), 6)
+    assert len(commits) == 2
+
+
+def test_write_behind(tmpdir):
+    database_path = str(tmpdir.join('log.db'))
+    storage = SQLiteStorage(database_path, PickleSerializer)
+    storage.write_state_change(Block(1))
+
+    with pytest.raises(ValueError):
+        WriteBehindStorage(SQLiteStorage(':memory:', PickleSerializer))
+
+    write_behind = WriteBehindStorage(storage)
+    with pytest.raises(ValueError):
+        WriteAheadLog(StateManager(state_transtion_acc, None), write_behind, None, 0.01)
+
+    # the snapshots are serialized later, the state must not change meanwhile
+    undo_log_state_manager = StateManager(node.state_transition, None, DISPATCH_UNDO_LOG)
+    with pytest.raises(ValueError):
+        WriteAheadLog(undo_log_state_manager, write_behind)
+
+    with pytest.raises(ValueError):
+        WriteAheadLog(undo_log_state_manager, storage, SnapshotPolicy(incremental=True))
+
+    writer_threads = set()
+    storage_write_state_change = storage.write_state_change
+
+    def write_state_change(*args):
+        writer_threads.add(threading.get_ident())
+        return storage_write_state_change(*args)
+
+    storage.write_state_change = write_state_change
+
+    state_manager = StateManager(state_transtion_acc, None)
+    wal = WriteAheadLog(state_manager, write_behind)
+
+    for block_number in range(2, 6):
+        wal.log_and_dispatch(Block(block_number), block_number)
+
+    # the identifiers are assigned before the rows are inserted
+    assert wal.state_change_id == 5
+
+    wal.durability_barrier().get()
+    assert writer_threads and threading.get_ident() not in writer_threads
+
+    state_changes = write_behind.get_statechanges_by_identifier(0, 'latest')
+    assert state_changes == [Block(block_number) for block_number in range(1, 6)]
+
+    # a failed write fails the writes queued after it
+    write_behind.write_events(1000, 1, [EventTransferSentFailed(1, 'whatever')])
+    wal.log_and_dispatch(Block(6), 6)
+
+    with pytest.raises(sqlite3.IntegrityError):
+        wal.durability_barrier().get()
+
+    assert len(write_behind.get_statechanges_by_identifier(0, 'latest')) == 5
+
+
+def test_write_behind_events_handled_once_durable(tmpdir, monkeypatch):
+    """ The node must not act on the events before their state change is
+    written.
+    """
+    database_path = str(tmpdir.join('log.db'))
+    storage = SQLiteStorage(database_path, PickleSerializer)
+    state_manager = StateManager(state_transition_failed, None)
+    wal = WriteAheadLog(state_manager, WriteBehindStorage(storage))
+
+    raiden = object.__new__(RaidenService)
+    raiden.address = factories.make_address()
+    raiden.wal = wal
+    raiden.queued_state_changes = list()
+    raiden.queued_block_numbers = list()
+
+    is_durable = list()
+
+    def on_raiden_event(raiden, event):  # pylint: disable=unused-argument
+        is_durable.append(wal.durability_barrier().ready())
+
+    monkeypatch.setattr(raiden_service, 'on_raiden_event', on_raiden_event)
+
+    raiden.handle_state_change(Block(1), 1)
+    raiden.queue_state_change(Block(2), 2)
+    raiden.queue_state_change(Block(3), 3)
+    raiden.flush_state_changes()
+    assert is_durable == [True, True, True]
+
+    state_changes = storage.get_statechanges_by_identifier(0, 'latest')
+    assert state_changes == [Block(1), Block(2), Block(3)]
+
+    wal.storage.stop()
+
+
+def test_get_events_by_block_filters():
+    wal = new_wal()
+
+    token_network_identifier = factories.make_address()
+    channel_identifier = factories.make_channel_identifier()
+    close = ContractSendChannelClose(
+        channel_identifier,
+        factories.make_address(),
+        token_network_identifier,
+        None,
+    )
+    failed = EventTransferSentFailed(2 ** 64 - 1, 'whatever')
+
+    state_change_id = wal.storage.write_state_change(Block(1))
+    wal.storage.write_events(state_change_id, 1, [close, failed])
+    state_change_id = wal.storage.write_state_change(Block(2))
+    wal.storage.write_events(state_change_id, 2, [EventTransferSentFailed(3, 'whatever')])
+
+    storage = wal.storage
+    assert len(storage.get_events_by_block(0, 'latest')) == 3
+    assert storage.get_events_by_block(0, 1, event_types=['EventTransferSentFailed']) == [
+        (1, failed),
+    ]
+    assert storage.get_events_by_block(
+        0,
+        'latest',
+        token_network_identifier=token_network_identifier,
+    ) == [(1, close)]
+    assert storage.get_events_by_block(
+        0,
+        'latest',
+        channel_identifier=channel_identifier,
+        event_types=['ContractSendChannelClose'],
+    ) == [(1, close)]
+    assert storage.get_events_by_block(0, 'latest', payment_identifier=2 ** 64 - 1) == [
+        (1, failed),
+    ]
+    assert storage.get_events_by_block(0, 'latest', event_types=[]) == []
+
+
+def test_pruned_channel_history():
+    wal = new_wal()
+
+    channel_state = factories.make_channel()
+    pruned = EventChannelPruned(
+        channel_state.token_network_identifier,
+        channel_state.identifier,
+        channel_state,
+    )
+
+    state_change_id = wal.storage.write_state_change(Block(1))
+    wal.storage.write_events(state_change_id, 1, [pruned])
+
+    events = wal.storage.get_events_by_block(
+        0,
+        'latest',
+        event_types=['EventChannelPruned'],
+        channel_identifier=channel_state.identifier,
+    )
+    assert events == [(1, pruned)]
+    assert events[0][1].channel_state == channel_state
+
+
+def test_event_columns_migration(tmpdir):
+    database_path = str(tmpdir.join('log.db'))
+    event = EventTransferSentFailed(5, 'whatever')
+
+    # schema without the event columns
+    conn = sqlite3.connect(database_path)
+    with conn:
+        conn.execute(
+            'CREATE TABLE state_changes ('
+            '    identifier INTEGER PRIMARY KEY AUTOINCREMENT, data BINARY'
+            ')',
+        )
+        conn.execute(
+            'CREATE TABLE state_events ('
+            '    identifier INTEGER PRIMARY KEY, '
+            '    source_statechange_id INTEGER NOT NULL, '
+            '    block_number INTEGER NOT NULL, '
+            '    data BINARY, '
+            '    FOREIGN KEY(source_statechange_id) REFERENCES state_changes(identifier)'
+            ')',
+        )
+        conn.execute(
+            'INSERT INTO state_changes(identifier, data) VALUES(1, ?)',
+            (PickleSerializer.serialize(Block(1)), ),
+        )
+        conn.execute(
+            'INSERT INTO state_events(source_statechange_id, block_number, data) '
+            'VALUES(1, 1, ?)',
+            (PickleSerializer.serialize(event), ),
+        )
+    conn.close()
+
+    storage = SQLiteStorage(database_path, PickleSerializer)
+    assert storage.get_events_by_block(0, 'latest', payment_identifier=5) == [(1, event)]
+    assert storage.get_events_by_block(0, 'latest', event_types=['EventTransferSentFailed'])
+
+
+def test_iter_statechanges_by_identifier():
+    wal = new_wal()
+
+    block_numbers = list(range(1, 8))
+    for block_number in block_numbers:
+        wal.log_and_dispatch(Block(block_number), block_number)
+
+    state_changes = wal.storage.iter_statechanges_by_identifier(
+        from_identifier=2,
+        to_identifier='latest',
+        chunk_size=3,
+    )
+    assert not isinstance(state_changes, list)
+    assert list(state_changes) == [Block(block_number) for block_number in block_numbers[1:]]
+
+    with pytest.raises(ValueError):
+        wal.storage.iter_statechanges_by_identifier('first', 'latest')
+
+
+def test_read_connections(tmpdir):
+    database_path = str(tmpdir.join('log.db'))
+    storage = SQLiteStorage(database_path, PickleSerializer)
+
+    journal_mode = storage.conn.execute('PRAGMA journal_mode').fetchone()[0]
+    assert journal_mode == 'wal'
+
+    storage.write_state_change(Block(1))
+
+    # the readers don't wait for the open write transaction and only see
+    # the committed data
+    storage.write_state_change(Block(2), commit=False)
+    assert storage.get_statechanges_by_identifier(0, 'latest') == [Block(1)]
+
+    storage.commit()
+    assert storage.get_statechanges_by_identifier(0, 'latest') == [Block(1), Block(2)]
+    assert len(storage.read_pool) == 1
+
+    with storage._read_connection() as conn:  # pylint: disable=protected-access
+        assert conn is not storage.conn
+
+        with pytest.raises(sqlite3.OperationalError):
+            conn.execute('DELETE FROM state_changes')
+
+
+def test_read_connections_threadpool(tmpdir):
+    """ The queries of the pooled connections run outside of the hub thread. """
+    get_ident = gevent.monkey.get_original('_thread', 'get_ident')
+    database_path = str(tmpdir.join('log.db'))
+    storage = SQLiteStorage(database_path, BinarySerializer)
+    storage.write_state_change(Block(1))
+    storage.write_events(1, 1, [])
+
+    query_threads = list()
+    with storage._read_connection() as conn:  # pylint: disable=protected-access
+        conn.set_trace_callback(lambda statement: query_threads.append(get_ident()))
+
+    assert storage.get_latest_state_change_id() == 1
+    assert storage.get_statechanges_by_identifier(0, 'latest') == [Block(1)]
+    assert storage.get_events_by_block(0, 'latest') == []
+    assert storage.is_log_complete()
+
+    assert query_threads
+    assert get_ident() not in query_threads
+
+
+def test_replay_database(tmpdir):
+    database_path = str(tmpdir.join('log.db'))
+    state_manager = StateManager(node.state_transition, None)
+    storage = SQLiteStorage(database_path, PickleSerializer)
+    wal = WriteAheadLog(state_manager, storage)
+
+    wal.log_and_dispatch(ActionInitNode(random.Random(), 1), 1)
+    for block_number in range(2, 6):
+        wal.log_and_dispatch(Block(block_number), block_number)
+
+    read_only = SQLiteStorage(database_path, PickleSerializer, read_only=True)
+    assert read_only.is_log_complete()
+
+    with pytest.raises(sqlite3.OperationalError):
+        read_only.write_state_change(Block(6))
+
+    replayed, statistics = replay_database(read_only, node.state_transition)
+    assert replayed.current_state.block_number == 5
+    assert statistics.statechanges == 5
+    assert statistics.statechanges_by_type['Block'][0] == 4
+    assert statistics.statechanges_by_type['ActionInitNode'][0] == 1
+    assert statistics.statechanges_per_second() > 0
+
+    wal.snapshot()
+    storage.compact_state_changes(wal.state_change_id)
+    wal.log_and_dispatch(Block(6), 6)
+    assert not read_only.is_log_complete()
+
+    replayed, statistics = replay_database(read_only, node.state_transition, from_snapshot=True)
+    assert replayed.current_state.block_number == 6
+    assert statistics.statechanges == 1
+    assert statistics.from_statechange_id == wal.state_change_id
+
+
+def test_archive_state_changes(tmpdir):
+    database_path = str(tmpdir.join('log.db'))
+    state_manager = StateManager(state_transtion_acc, None)
+    storage = SQLiteStorage(database_path, PickleSerializer)
+    wal = WriteAheadLog(state_manager, storage, SnapshotPolicy(archive_segment_size=3))
+
+    token_network_identifier = factories.make_address()
+    channel_identifier = factories.make_channel_identifier()
+    close = ContractSendChannelClose(
+        channel_identifier,
+        factories.make_address(),
+        token_network_identifier,
+        None,
+    )
+
+    for block_number in range(1, 6):
+        state_change_id = storage.write_state_change(Block(block_number))
+        events = [EventTransferSentFailed(block_number, 'whatever')]
+        if block_number == 2:
+            events.append(close)
+        storage.write_events(state_change_id, block_number, events)
+
+    all_events = storage.get_events_by_identifier(0, 'latest')
+    assert len(all_events) == 6
+
+    # not enough state changes for a segment
+    assert storage.archive_state_changes(3, min_state_changes=3) == 0
+
+    # the state changes 1 to 3 and their events are moved to the archive
+    wal.state_change_id = 4
+    wal.snapshot()
+
+    hot_rows = storage.conn.execute('SELECT count(*) FROM state_changes').fetchone()[0]
+    assert hot_rows == 2
+    hot_rows = storage.conn.execute('SELECT count(*) FROM state_events').fetchone()[0]
+    assert hot_rows == 2
+    assert len(tmpdir.join('log.db-archive').listdir()) == 2
+
+    assert storage.is_log_complete()
+    assert storage.get_statechanges_by_identifier(0, 'latest') == [
+        Block(block_number) for block_number in range(1, 6)
+    ]
+    assert storage.get_statechanges_by_identifier(2, 4) == [Block(2), Block(3), Block(4)]
+
+    assert storage.get_events_by_identifier(0, 'latest') == all_events
+    assert storage.get_events_by_identifier(2, 4) == all_events[1:4]
+    assert storage.get_events_by_block(2, 4) == all_events[1:5]
+    assert storage.get_events_by_block(
+        0,
+        'latest',
+        channel_identifier=channel_identifier,
+        event_types=['ContractSendChannelClose'],
+    ) == [(2, close)]
+    assert storage.get_events_by_block(0, 'latest', payment_identifier=4) == [
+        (4, EventTransferSentFailed(4, 'whatever')),
+    ]
+
+    # the archive is also read by other connections
+    read_only = SQLiteStorage(database_path, PickleSerializer, read_only=True)
+    assert read_only.get_events_by_identifier(0, 'latest') == all_events
+
+
+def state_transition_event(state, state_change):
+    if state_change.block_number < 0:
+        raise ValueError('invalid block number')
+
+    state = state_transtion_acc(state, state_change).new_state
+    event = EventTransferSentFailed(state_change.block_number, 'block')
+    return TransitionResult(state, [event])
+
+
+def test_log_and_dispatch_batch(tmpdir):
+    database_path = str(tmpdir.join('log.db'))
+    state_manager = StateManager(state_transition_event, None)
+    storage = SQLiteStorage(database_path, PickleSerializer)
+    wal = WriteAheadLog(state_manager, storage)
+
+    commits = list()
+    storage_commit = storage.commit
+
+    def count_commit():
+        commits.append(True)
+        storage_commit()
+
+    storage.commit = count_commit
+
+    block_numbers = list(range(1, 6))
+    events = wal.log_and_dispatch_batch(
+        [Block(block_number) for block_number in block_numbers],
+        block_numbers,
+    )
+
+    # the events are grouped by state change and persisted in one transaction
+    assert events == [
+        [EventTransferSentFailed(block_number, 'block')]
+        for block_number in block_numbers
+    ]
+    assert len(commits) == 1
+    assert wal.state_change_id == 5
+    assert wal.statechanges_since_snapshot == 5
+
+    other_connection = SQLiteStorage(database_path, PickleSerializer)
+    assert other_connection.get_statechanges_by_identifier(0, 'latest') == [
+        Block(block_number) for block_number in block_numbers
+    ]
+    assert other_connection.get_events_by_identifier(0, 'latest') == [
+        (block_number, EventTransferSentFailed(block_number, 'block'))
+        for block_number in block_numbers
+    ]
+
+    # the state changes of a failed batch are logged but none is applied
+    previous_state = state_manager.current_state
+    with pytest.raises(ValueError):
+        wal.log_and_dispatch_batch([Block(6), Block(-1)], [6, 6])
+
+    assert len(commits) == 2
+    assert state_manager.current_state is previous_state
+    assert previous_state.state_changes == [Block(block_number) for block_number in block_numbers]
+    assert len(other_connection.get_statechanges_by_identifier(0, 'latest')) == 7
+
+
+def test_restore_in_batches(monkeypatch):
+    wal = new_wal(state_transition_event)
+    block_numbers = list(range(1, 8))
+    for block_number in block_numbers:
+        wal.log_and_dispatch(Block(block_number), block_number)
+
+    batches = list()
+    dispatch_batch = StateManager.dispatch_batch
+
+    def record_batch(state_manager, state_changes):
+        batches.append(len(state_changes))
+        return dispatch_batch(state_manager, state_changes)
+
+    monkeypatch.setattr(wal_module, 'REPLAY_BATCH_SIZE', 3)
+    monkeypatch.setattr(StateManager, 'dispatch_batch', record_batch)
+
+    newwal, events = restore_from_latest_snapshot(state_transition_event, wal.storage)
+
+    assert batches == [3, 3, 1]
+    assert events == [
+        EventTransferSentFailed(block_number, 'block')
+        for block_number in block_numbers
+    ]
+    assert newwal.state_manager.current_state.state_changes == [
+        Block(block_number) for block_number in block_numbers
+    ]
+    assert newwal.state_change_id == 7
+    assert newwal.statechanges_since_snapshot == 7
@@ -5,8 +5,9 @@ import pytest
 
 from raiden.utils import publickey_to_address
 from raiden.transfer import channel
-from raiden.transfer.events import ContractSendChannelClose
+from raiden.transfer.events import ContractSendChannelBatchUnlock, ContractSendChannelClose
 from raiden.transfer.mediated_transfer import mediator
+from raiden.transfer.merkle_tree import merkleroot, validate_proof
 from raiden.transfer.mediated_transfer.state import (
     MediationPairState,
     MediatorTransferState,
@@ -1065,6 +1066,47 @@ def test_events_for_onchain_secretreveal():
     })
 
 
+def test_events_for_unlock_if_closed():
+    """ The locks of the closed payer channels are unlocked on-chain. """
+    amount = 10
+    block_number = 5
+    channelmap, transfers_pair = make_transfers_pair(
+        [HOP2_KEY, HOP3_KEY, HOP4_KEY, HOP5_KEY],
+        amount,
+    )
+
+    closed_pairs = [transfers_pair[0], transfers_pair[2]]
+    for pair in closed_pairs:
+        channel_identifier = pair.payer_transfer.balance_proof.channel_address
+        channel.set_closed(channelmap[channel_identifier], block_number)
+
+    events = mediator.events_for_unlock_if_closed(
+        channelmap,
+        transfers_pair,
+        UNIT_SECRET,
+        UNIT_SECRETHASH,
+    )
+
+    assert len(events) == len(closed_pairs)
+    for event, pair in zip(events, closed_pairs):
+        payer_channel = channelmap[pair.payer_transfer.balance_proof.channel_address]
+        partner_state = payer_channel.partner_state
+        lock = channel.get_lock(partner_state, UNIT_SECRETHASH)
+        [unlock_proof] = event.merkle_treee_leaves
+
+        assert isinstance(event, ContractSendChannelBatchUnlock)
+        assert event.channel_identifier == payer_channel.identifier
+        assert unlock_proof == channel.compute_proof_for_lock(partner_state, UNIT_SECRET, lock)
+        assert validate_proof(
+            unlock_proof.merkle_proof,
+            merkleroot(partner_state.merkletree),
+            lock.lockhash,
+        )
+        assert pair.payer_state == 'payer_waiting_unlock'
+
+    assert transfers_pair[1].payer_state == 'payer_pending'
+
+
 @pytest.mark.skip(reason='issue #1736')
 def test_onchain_secretreveal_must_be_emitted_only_once():
     amount = 10
@@ -0,0 +1,1000 @@
+import random
+from concurrent.futures import ThreadPoolExecutor
+from copy import deepcopy
+
+import pytest
+
+from raiden.raiden_event_handler import lock_from_unlock_proof
+from raiden.storage.serialize import BinarySerializer
+from raiden.tests.utils import factories
+from raiden.transfer import channel, node, views
+from raiden.transfer.architecture import (
+    DISPATCH_COPY_ON_WRITE,
+    DISPATCH_DEEPCOPY,
+    DISPATCH_UNDO_LOG,
+    StateManager,
+)
+from raiden.transfer.events import (
+    ContractSendChannelBatchUnlock,
+    EventChannelPruned,
+    EventPaymentTaskPruned,
+)
+from raiden.transfer.indexes import INDEXES, rebuild_indexes
+from raiden.transfer.mediated_transfer.events import SendSecretRequest
+from raiden.transfer.mediated_transfer.state import MediationPairState, MediatorTransferState
+from raiden.transfer.mediated_transfer.state_change import ActionInitMediator, ActionInitTarget
+from raiden.transfer.merkle_tree import compute_layers, merkleroot, validate_proof
+from raiden.transfer.sharding import ShardedStateManager, merge_shards
+from raiden.transfer.state import (
+    NODE_NETWORK_REACHABLE,
+    MerkleTreeState,
+    PaymentMappingState,
+    PaymentNetworkState,
+    TokenNetworkState,
+)
+from raiden.transfer.state_change import (
+    ActionChangeNodeNetworkState,
+    ActionChannelClose,
+    ActionInitNode,
+    ActionLeaveAllNetworks,
+    Block,
+    ContractReceiveChannelBatchUnlock,
+    ContractReceiveChannelClosed,
+    ContractReceiveChannelNew,
+    ContractReceiveChannelSettled,
+    ContractReceiveNewPaymentNetwork,
+    ContractReceiveNewTokenNetwork,
+    ContractReceiveRouteNew,
+    ReceiveProcessed,
+)
+
+
+def get_token_network(node_state):
+    payment_network = list(node_state.identifiers_to_paymentnetworks.values())[0]
+    return list(payment_network.tokenidentifiers_to_tokennetworks.values())[0]
+
+
+def assert_node_states_equal(node_state, other_state):
+    # the prng and the network graph compare by identity
+    assert node_state.pseudo_random_generator.getstate() == (
+        other_state.pseudo_random_generator.getstate()
+    )
+    assert node_state.block_number == other_state.block_number
+    assert node_state.queueids_to_queues == other_state.queueids_to_queues
+    assert node_state.payment_mapping == other_state.payment_mapping
+    assert node_state.nodeaddresses_to_networkstates == other_state.nodeaddresses_to_networkstates
+
+    token_network = get_token_network(node_state)
+    other_token_network = get_token_network(other_state)
+    assert token_network.channelidentifiers_to_channels == (
+        other_token_network.channelidentifiers_to_channels
+    )
+    assert token_network.partneraddresses_to_channels == (
+        other_token_network.partneraddresses_to_channels
+    )
+    assert sorted(token_network.network_graph.network.edges()) == sorted(
+        other_token_network.network_graph.network.edges(),
+    )
+
+    for index_name in INDEXES:
+        assert getattr(node_state, index_name) == getattr(other_state, index_name)
+
+
+def make_target_state_changes():
+    """ Open two channels, receive a mediated transfer as the target in one
+    and close the other.
+    """
+    token_network_identifier = factories.UNIT_REGISTRY_IDENTIFIER
+    token_network = TokenNetworkState(token_network_identifier, factories.UNIT_TOKEN_ADDRESS)
+    payment_network = PaymentNetworkState(factories.make_address(), [token_network])
+
+    our_address = factories.UNIT_TRANSFER_TARGET
+    payer_channel = factories.make_channel(
+        our_balance=factories.UNIT_TRANSFER_AMOUNT,
+        partner_balance=factories.UNIT_TRANSFER_AMOUNT,
+        our_address=our_address,
+        partner_address=factories.UNIT_TRANSFER_SENDER,
+        token_address=factories.UNIT_TOKEN_ADDRESS,
+        token_network_identifier=token_network_identifier,
+    )
+    other_channel = factories.make_channel(
+        our_balance=factories.UNIT_TRANSFER_AMOUNT,
+        our_address=our_address,
+        token_address=factories.UNIT_TOKEN_ADDRESS,
+        token_network_identifier=token_network_identifier,
+    )
+    transfer = factories.make_signed_transfer_for(
+        payer_channel,
+        factories.UNIT_TRANSFER_AMOUNT,
+        factories.UNIT_TRANSFER_INITIATOR,
+        our_address,
+        expiration=30,
+        secret=factories.UNIT_SECRET,
+    )
+
+    return [
+        ActionInitNode(random.Random(), 1),
+        ContractReceiveNewPaymentNetwork(payment_network),
+        ContractReceiveChannelNew(token_network_identifier, payer_channel),
+        ContractReceiveChannelNew(token_network_identifier, other_channel),
+        ActionInitTarget(factories.route_from_channel(payer_channel), transfer),
+        Block(2),
+        ContractReceiveRouteNew(
+            token_network_identifier,
+            factories.make_address(),
+            factories.make_address(),
+        ),
+        ContractReceiveChannelClosed(
+            token_network_identifier,
+            other_channel.identifier,
+            other_channel.partner_state.address,
+            3,
+        ),
+        Block(3 + other_channel.settle_timeout + 1),
+        ActionLeaveAllNetworks(),
+    ]
+
+
+def test_state_transition_copy_on_write():
+    """ The node state machine must not modify the previous state and share
+    the objects it does not change with the new one.
+    """
+    state_manager = StateManager(node.state_transition, None)
+
+    def dispatch(state_change):
+        previous_state = state_manager.current_state
+        previous_data = BinarySerializer.serialize(previous_state)
+
+        events = state_manager.dispatch(state_change)
+
+        if previous_state is not None:
+            assert state_manager.current_state is not previous_state
+            assert BinarySerializer.serialize(previous_state) == previous_data
+
+        return previous_state, events
+
+    # the transfers of the factories use the registry as the token network
+    token_network_identifier = factories.UNIT_REGISTRY_IDENTIFIER
+    token_network = TokenNetworkState(token_network_identifier, factories.UNIT_TOKEN_ADDRESS)
+    payment_network = PaymentNetworkState(factories.make_address(), [token_network])
+
+    our_address = factories.UNIT_TRANSFER_TARGET
+    payer_channel = factories.make_channel(
+        our_balance=factories.UNIT_TRANSFER_AMOUNT,
+        partner_balance=factories.UNIT_TRANSFER_AMOUNT,
+        our_address=our_address,
+        partner_address=factories.UNIT_TRANSFER_SENDER,
+        token_address=factories.UNIT_TOKEN_ADDRESS,
+        token_network_identifier=token_network_identifier,
+    )
+    other_channel = factories.make_channel(
+        our_balance=factories.UNIT_TRANSFER_AMOUNT,
+        our_address=our_address,
+        token_address=factories.UNIT_TOKEN_ADDRESS,
+        token_network_identifier=token_network_identifier,
+    )
+
+    dispatch(ActionInitNode(random.Random(), 1))
+    dispatch(ContractReceiveNewPaymentNetwork(payment_network))
+    dispatch(ContractReceiveChannelNew(token_network_identifier, payer_channel))
+    channel_new = ContractReceiveChannelNew(token_network_identifier, other_channel)
+    previous_state, _ = dispatch(channel_new)
+
+    previous_channels = get_token_network(previous_state).channelidentifiers_to_channels
+    assert other_channel.identifier not in previous_channels
+
+    transfer = factories.make_signed_transfer_for(
+        payer_channel,
+        factories.UNIT_TRANSFER_AMOUNT,
+        factories.UNIT_TRANSFER_INITIATOR,
+        our_address,
+        expiration=30,
+        secret=factories.UNIT_SECRET,
+    )
+    init_target = ActionInitTarget(factories.route_from_channel(payer_channel), transfer)
+    previous_state, events = dispatch(init_target)
+
+    secret_request = next(event for event in events if isinstance(event, SendSecretRequest))
+    assert not previous_state.payment_mapping.secrethashes_to_task
+    assert not previous_state.queueids_to_queues
+
+    # only the channel of the transfer was copied
+    node_state = state_manager.current_state
+    channels = get_token_network(node_state).channelidentifiers_to_channels
+    previous_channels = get_token_network(previous_state).channelidentifiers_to_channels
+    assert channels[payer_channel.identifier] is not previous_channels[payer_channel.identifier]
+    assert channels[other_channel.identifier] is previous_channels[other_channel.identifier]
+    assert node_state.payment_mapping.secrethashes_to_task
+    assert secret_request in node_state.queueids_to_queues[
+        (secret_request.recipient, secret_request.queue_name)
+    ]
+
+    # a block without work doesn't copy the channels
+    previous_state, _ = dispatch(Block(2))
+    previous_channels = get_token_network(previous_state).channelidentifiers_to_channels
+    channels = get_token_network(state_manager.current_state).channelidentifiers_to_channels
+    assert channels[other_channel.identifier] is previous_channels[other_channel.identifier]
+
+    previous_state, _ = dispatch(ReceiveProcessed(secret_request.message_identifier))
+    assert not any(state_manager.current_state.queueids_to_queues.values())
+    assert any(previous_state.queueids_to_queues.values())
+
+    previous_state, _ = dispatch(ActionChangeNodeNetworkState(
+        factories.UNIT_TRANSFER_SENDER,
+        NODE_NETWORK_REACHABLE,
+    ))
+    assert not previous_state.nodeaddresses_to_networkstates
+
+    new_route = ContractReceiveRouteNew(
+        token_network_identifier,
+        factories.make_address(),
+        factories.make_address(),
+    )
+    previous_state, _ = dispatch(new_route)
+    graph = get_token_network(state_manager.current_state).network_graph.network
+    previous_graph = get_token_network(previous_state).network_graph.network
+    assert graph.has_edge(new_route.participant1, new_route.participant2)
+    assert not previous_graph.has_edge(new_route.participant1, new_route.participant2)
+
+    dispatch(ContractReceiveChannelClosed(
+        token_network_identifier,
+        other_channel.identifier,
+        other_channel.partner_state.address,
+        3,
+    ))
+
+    # the settlement of the closed channel copies it
+    settle_block = 3 + other_channel.settle_timeout + 1
+    previous_state, _ = dispatch(Block(settle_block))
+    previous_channels = get_token_network(previous_state).channelidentifiers_to_channels
+    channels = get_token_network(state_manager.current_state).channelidentifiers_to_channels
+    assert channels[other_channel.identifier] is not previous_channels[other_channel.identifier]
+    assert channels[other_channel.identifier].settle_transaction is not None
+    assert previous_channels[other_channel.identifier].settle_transaction is None
+
+    dispatch(ActionLeaveAllNetworks())
+
+    # the state changes are not modified either
+    assert other_channel.close_transaction is None
+
+
+def test_dispatch_modes():
+    state_changes = make_target_state_changes()
+
+    results = dict()
+    for dispatch_mode in (DISPATCH_DEEPCOPY, DISPATCH_COPY_ON_WRITE, DISPATCH_UNDO_LOG):
+        # the undo log modifies the objects of the state changes in place
+        state_manager = StateManager(node.state_transition, None, dispatch_mode)
+        events = [
+            state_manager.dispatch(state_change)
+            for state_change in deepcopy(state_changes)
+        ]
+        results[dispatch_mode] = (state_manager.current_state, events)
+
+    deepcopy_state, deepcopy_events = results[DISPATCH_DEEPCOPY]
+    graph_version = get_token_network(deepcopy_state).network_graph.version
+    assert graph_version > 0
+    for node_state, events in results.values():
+        assert events == deepcopy_events
+        assert_node_states_equal(node_state, deepcopy_state)
+        assert get_token_network(node_state).network_graph.version == graph_version
+
+    with pytest.raises(ValueError):
+        StateManager(lambda state, state_change: None, None, DISPATCH_UNDO_LOG)
+
+
+def test_undo_log_rollback(monkeypatch):
+    state_changes = make_target_state_changes()
+    init_target = state_changes[4]
+
+    state_manager = StateManager(node.state_transition, None, DISPATCH_UNDO_LOG)
+    for state_change in state_changes[:4]:
+        state_manager.dispatch(state_change)
+
+    node_state = state_manager.current_state
+    previous_state = deepcopy(node_state)
+
+    target_state_transition = node.target.state_transition
+
+    def failing_state_transition(*args, **kwargs):
+        # fails after the channel and the prng were modified
+        target_state_transition(*args, **kwargs)
+        raise RuntimeError('failed transition')
+
+    monkeypatch.setattr(node.target, 'state_transition', failing_state_transition)
+
+    with pytest.raises(RuntimeError):
+        state_manager.dispatch(init_target)
+
+    assert state_manager.current_state is node_state
+    assert_node_states_equal(node_state, previous_state)
+    assert not node_state.payment_mapping.secrethashes_to_task
+
+    monkeypatch.undo()
+    events = state_manager.dispatch(init_target)
+    assert events
+    assert node_state.payment_mapping.secrethashes_to_task
+
+    # the block number is set before the task fails
+    task = list(node_state.payment_mapping.secrethashes_to_task.values())[0]
+    deadline = node.get_payment_task_block_deadline(node_state, task)
+    previous_state = deepcopy(node_state)
+    monkeypatch.setattr(node.target, 'state_transition', failing_state_transition)
+
+    with pytest.raises(RuntimeError):
+        state_manager.dispatch(Block(deadline))
+
+    assert_node_states_equal(node_state, previous_state)
+    assert node_state.block_deadlines.node_state is None
+
+
+def test_dispatch_batch(monkeypatch):
+    state_changes = make_target_state_changes()
+
+    state_manager = StateManager(node.state_transition, None)
+    expected_events = [state_manager.dispatch(state_change) for state_change in state_changes]
+    expected_state = state_manager.current_state
+
+    for dispatch_mode in (DISPATCH_DEEPCOPY, DISPATCH_COPY_ON_WRITE, DISPATCH_UNDO_LOG):
+        state_manager = StateManager(node.state_transition, None, dispatch_mode)
+        state_manager.dispatch_batch(deepcopy(state_changes[:2]))
+
+        initial_state = state_manager.current_state
+        initial_data = BinarySerializer.serialize(initial_state)
+
+        events = state_manager.dispatch_batch(deepcopy(state_changes[2:]))
+
+        assert events == expected_events[2:]
+        assert_node_states_equal(state_manager.current_state, expected_state)
+        if dispatch_mode != DISPATCH_UNDO_LOG:
+            assert BinarySerializer.serialize(initial_state) == initial_data
+
+    # the transitions of a batch share the copies
+    writers = list()
+
+    class RecordedNodeStateCopy(node.NodeStateCopy):
+        __slots__ = ()
+
+        def __init__(self, node_state):
+            super().__init__(node_state)
+            writers.append(self)
+
+    monkeypatch.setattr(node, 'NodeStateCopy', RecordedNodeStateCopy)
+    StateManager(node.state_transition, None).dispatch_batch(deepcopy(state_changes))
+    monkeypatch.undo()
+    assert len(writers) == 1
+
+    # a failed batch leaves the state as it was before the batch
+    target_state_transition = node.target.state_transition
+
+    def failing_state_transition(*args, **kwargs):
+        target_state_transition(*args, **kwargs)
+        raise RuntimeError('failed transition')
+
+    for dispatch_mode in (DISPATCH_DEEPCOPY, DISPATCH_COPY_ON_WRITE, DISPATCH_UNDO_LOG):
+        state_manager = StateManager(node.state_transition, None, dispatch_mode)
+        batch = deepcopy(state_changes)
+        state_manager.dispatch_batch(batch[:3])
+
+        node_state = state_manager.current_state
+        previous_state = deepcopy(node_state)
+
+        monkeypatch.setattr(node.target, 'state_transition', failing_state_transition)
+        with pytest.raises(RuntimeError):
+            state_manager.dispatch_batch(batch[3:])
+        monkeypatch.undo()
+
+        assert state_manager.current_state is node_state
+        assert_node_states_equal(node_state, previous_state)
+        # the channel opened by the batch was removed as well
+        assert len(get_token_network(node_state).channelidentifiers_to_channels) == 1
+
+
+def visit_all(node_state, block_deadlines, block_number):  # pylint: disable=unused-argument
+    channel_keys = [
+        (token_network_identifier, channel_identifier)
+        for payment_network in node_state.identifiers_to_paymentnetworks.values()
+        for token_network_identifier, token_network_state in (
+            payment_network.tokenidentifiers_to_tokennetworks.items()
+        )
+        for channel_identifier in token_network_state.channelidentifiers_to_channels
+    ]
+    return channel_keys, list(node_state.payment_mapping.secrethashes_to_task)
+
+
+def test_block_deadlines(monkeypatch):
+    """ A Block must only visit the channels and payment tasks with something
+    due, with the same result as visiting all of them.
+    """
+    state_changes = make_target_state_changes()
+    channel_closed = state_changes[7]
+    last_block = state_changes[8].block_number + 2
+
+    block_state_changes = state_changes[:5]
+    for block_number in range(2, last_block):
+        block_state_changes.append(Block(block_number))
+        if block_number == channel_closed.closed_block_number:
+            block_state_changes.append(channel_closed)
+
+    monkeypatch.setattr(node, 'pop_due', visit_all)
+    state_manager = StateManager(node.state_transition, None)
+    expected_events = [
+        state_manager.dispatch(state_change)
+        for state_change in deepcopy(block_state_changes)
+    ]
+    expected_state = state_manager.current_state
+    monkeypatch.undo()
+
+    assert any(expected_events[5:])
+
+    for dispatch_mode in (DISPATCH_DEEPCOPY, DISPATCH_COPY_ON_WRITE, DISPATCH_UNDO_LOG):
+        state_manager = StateManager(node.state_transition, None, dispatch_mode)
+        events = [
+            state_manager.dispatch(state_change)
+            for state_change in deepcopy(block_state_changes)
+        ]
+
+        assert events == expected_events
+        assert_node_states_equal(state_manager.current_state, expected_state)
+
+        node_state = state_manager.current_state
+        assert node_state.block_deadlines.node_state is node_state
+
+    # the index is not serialized, it is rebuilt by the next Block
+    node_state = BinarySerializer.deserialize(BinarySerializer.serialize(node_state))
+    assert node_state.block_deadlines is None
+
+    state_manager = StateManager(node.state_transition, node_state)
+    state_manager.dispatch(Block(last_block))
+    node_state = state_manager.current_state
+    assert node_state.block_deadlines.node_state is node_state
+
+
+def test_channel_block_deadline():
+    channel_state = factories.make_channel(our_balance=factories.UNIT_TRANSFER_AMOUNT)
+    assert node.channel.get_block_deadline(channel_state) is None
+
+    node.channel.set_closed(channel_state, 3)
+    deadline = node.channel.get_block_deadline(channel_state)
+
+    assert not node.channel.is_changed_by_block(channel_state, deadline - 1)
+    assert node.channel.is_changed_by_block(channel_state, deadline)
+
+
+def test_indexes():
+    """ The indexes must be updated by every transition, the views must
+    return the objects of the current state.
+    """
+    state_changes = make_target_state_changes()
+    channel_new = state_changes[3]
+    channel_state = channel_new.channel_state
+    token_network_identifier = channel_new.token_network_identifier
+    payment_network_identifier = state_changes[1].payment_network.address
+
+    for dispatch_mode in (DISPATCH_DEEPCOPY, DISPATCH_COPY_ON_WRITE, DISPATCH_UNDO_LOG):
+        state_manager = StateManager(node.state_transition, None, dispatch_mode)
+
+        for state_change in deepcopy(state_changes):
+            state_manager.dispatch(state_change)
+
+            node_state = state_manager.current_state
+            expected_state = deepcopy(node_state)
+            rebuild_indexes(expected_state)
+            for index_name in INDEXES:
+                assert getattr(node_state, index_name) == getattr(expected_state, index_name)
+
+        token_network = get_token_network(node_state)
+        current_channel = token_network.channelidentifiers_to_channels[channel_state.identifier]
+
+        assert views.get_token_network_by_identifier(
+            node_state,
+            token_network_identifier,
+        ) is token_network
+        assert views.get_token_network_registry_by_token_network_identifier(
+            node_state,
+            token_network_identifier,
+        ).address == payment_network_identifier
+        assert views.search_for_channel(
+            node_state,
+            payment_network_identifier,
+            channel_state.identifier,
+        ) is current_channel
+        assert views.list_channelstate_for_partner(
+            node_state,
+            payment_network_identifier,
+            channel_state.partner_state.address,
+        ) == [current_channel]
+        assert channel_state.partner_state.address in views.all_neighbour_nodes(node_state)
+
+        assert views.get_token_network_by_identifier(node_state, factories.make_address()) is None
+        assert views.search_for_channel(
+            node_state,
+            payment_network_identifier,
+            factories.make_channel_identifier(),
+        ) is None
+
+
+def test_pruning():
+    """ The settled channels and the finished payment tasks must be removed
+    from the node state, their final states are kept by the events.
+    """
+    state_changes = make_target_state_changes()
+    init_target = state_changes[4]
+    channel_closed = state_changes[7]
+    settle_block = state_changes[8]
+    other_channel = state_changes[3].channel_state
+    token_network_identifier = channel_closed.token_network_identifier
+    payment_network_identifier = state_changes[1].payment_network.address
+
+    assert settle_block.block_number > init_target.transfer.lock.expiration
+
+    channel_settled = ContractReceiveChannelSettled(
+        token_network_identifier,
+        other_channel.identifier,
+        settle_block.block_number,
+    )
+
+    results = list()
+    for dispatch_mode in (DISPATCH_DEEPCOPY, DISPATCH_COPY_ON_WRITE, DISPATCH_UNDO_LOG):
+        state_manager = StateManager(node.state_transition, None, dispatch_mode)
+        for state_change in deepcopy(state_changes[:8]):
+            state_manager.dispatch(state_change)
+
+        # the lock of the target expired
+        block_events = state_manager.dispatch(deepcopy(settle_block))
+        pruned_task = next(
+            event
+            for event in block_events
+            if isinstance(event, EventPaymentTaskPruned)
+        )
+        assert pruned_task.secrethash == init_target.transfer.lock.secrethash
+        assert pruned_task.payment_identifier == init_target.transfer.payment_identifier
+        assert pruned_task.task.target_state.state == 'expired'
+        assert not state_manager.current_state.payment_mapping.secrethashes_to_task
+
+        settled_events = state_manager.dispatch(deepcopy(channel_settled))
+        pruned_channel = next(
+            event
+            for event in settled_events
+            if isinstance(event, EventChannelPruned)
+        )
+        assert pruned_channel.channel_identifier == other_channel.identifier
+
+        node_state = state_manager.current_state
+        token_network = get_token_network(node_state)
+        assert other_channel.identifier not in token_network.channelidentifiers_to_channels
+        partner_channels = token_network.partneraddresses_to_channels
+        assert other_channel.partner_state.address not in partner_channels
+        assert not token_network.network_graph.network.has_edge(
+            other_channel.our_state.address,
+            other_channel.partner_state.address,
+        )
+        assert views.search_for_channel(
+            node_state,
+            payment_network_identifier,
+            other_channel.identifier,
+        ) is None
+
+        expected_state = deepcopy(node_state)
+        rebuild_indexes(expected_state)
+        for index_name in INDEXES:
+            assert getattr(node_state, index_name) == getattr(expected_state, index_name)
+
+        results.append((node_state, block_events, settled_events))
+
+    node_state, block_events, settled_events = results[0]
+    for other_state, other_block_events, other_settled_events in results[1:]:
+        assert other_block_events == block_events
+        assert other_settled_events == settled_events
+        assert_node_states_equal(other_state, node_state)
+
+
+def test_pruning_keeps_the_channels_of_the_mediator():
+    """ A settled channel must not be removed while a transfer pair of a
+    mediator uses it, it is removed with the finished mediator task.
+    """
+    token_network_identifier = factories.UNIT_REGISTRY_IDENTIFIER
+    token_network = TokenNetworkState(token_network_identifier, factories.UNIT_TOKEN_ADDRESS)
+    payment_network = PaymentNetworkState(factories.make_address(), [token_network])
+
+    our_address = factories.HOP1
+    payer_channel = factories.make_channel(
+        partner_balance=factories.UNIT_TRANSFER_AMOUNT,
+        our_address=our_address,
+        partner_address=factories.UNIT_TRANSFER_SENDER,
+        token_address=factories.UNIT_TOKEN_ADDRESS,
+        token_network_identifier=token_network_identifier,
+    )
+    payee_channel = factories.make_channel(
+        our_balance=factories.UNIT_TRANSFER_AMOUNT,
+        our_address=our_address,
+        partner_address=factories.UNIT_TRANSFER_TARGET,
+        token_address=factories.UNIT_TOKEN_ADDRESS,
+        token_network_identifier=token_network_identifier,
+    )
+    transfer = factories.make_signed_transfer_for(
+        payer_channel,
+        factories.UNIT_TRANSFER_AMOUNT,
+        factories.UNIT_TRANSFER_INITIATOR,
+        factories.UNIT_TRANSFER_TARGET,
+        expiration=30,
+        secret=factories.UNIT_SECRET,
+    )
+    expiration = transfer.lock.expiration
+
+    state_changes = [
+        ActionInitNode(random.Random(), 1),
+        ContractReceiveNewPaymentNetwork(payment_network),
+        ContractReceiveChannelNew(token_network_identifier, payer_channel),
+        ContractReceiveChannelNew(token_network_identifier, payee_channel),
+        ActionInitMediator(
+            [factories.route_from_channel(payee_channel)],
+            factories.route_from_channel(payer_channel),
+            transfer,
+        ),
+        Block(2),
+        ContractReceiveChannelClosed(
+            token_network_identifier,
+            payer_channel.identifier,
+            payer_channel.partner_state.address,
+            3,
+        ),
+        ContractReceiveChannelSettled(
+            token_network_identifier,
+            payer_channel.identifier,
+            3 + payer_channel.settle_timeout + 1,
+        ),
+        ContractReceiveChannelBatchUnlock(
+            token_network_identifier,
+            payer_channel.identifier,
+            our_address,
+            0,
+            factories.UNIT_TRANSFER_AMOUNT,
+        ),
+    ]
+
+    results = list()
+    for dispatch_mode in (DISPATCH_DEEPCOPY, DISPATCH_COPY_ON_WRITE, DISPATCH_UNDO_LOG):
+        state_manager = StateManager(node.state_transition, None, dispatch_mode)
+
+        events = list()
+        for state_change in deepcopy(state_changes):
+            events.extend(state_manager.dispatch(state_change))
+
+        assert not any(isinstance(event, EventChannelPruned) for event in events)
+        channels = get_token_network(state_manager.current_state).channelidentifiers_to_channels
+        assert payer_channel.identifier in channels
+
+        # the mediator looks up the payer channel for the on-chain reveal,
+        # the payee lock expires first
+        state_manager.dispatch(Block(expiration - payer_channel.reveal_timeout))
+        channels = get_token_network(state_manager.current_state).channelidentifiers_to_channels
+        assert payer_channel.identifier in channels
+
+        expired_events = state_manager.dispatch(Block(expiration + 1))
+
+        pruned_task = next(
+            event
+            for event in expired_events
+            if isinstance(event, EventPaymentTaskPruned)
+        )
+        assert pruned_task.secrethash == transfer.lock.secrethash
+        pruned_channel = next(
+            event
+            for event in expired_events
+            if isinstance(event, EventChannelPruned)
+        )
+        assert pruned_channel.channel_identifier == payer_channel.identifier
+
+        node_state = state_manager.current_state
+        assert not node_state.payment_mapping.secrethashes_to_task
+        channels = get_token_network(node_state).channelidentifiers_to_channels
+        assert payer_channel.identifier not in channels
+        assert payee_channel.identifier in channels
+
+        results.append((node_state, expired_events))
+
+    node_state, expired_events = results[0]
+    for other_state, other_expired_events in results[1:]:
+        assert other_expired_events == expired_events
+        assert_node_states_equal(other_state, node_state)
+
+
+def test_unlock_on_close():
+    """ The locks of a closed channel for which the mediators learned the
+    secret are unlocked on-chain together, with their proofs.
+    """
+    amount = factories.UNIT_TRANSFER_AMOUNT
+    expiration = 50
+    node_state = factories.make_node_state(2, our_address=factories.HOP1)
+    token_network = get_token_network(node_state)
+    payer_channel, payee_channel = token_network.channelidentifiers_to_channels.values()
+    partner_state = payer_channel.partner_state
+
+    locks = list()
+    for lock_number in range(5):
+        secret = factories.make_secret(lock_number)
+        payer_transfer = factories.make_signed_transfer(
+            amount,
+            factories.UNIT_TRANSFER_INITIATOR,
+            factories.UNIT_TRANSFER_TARGET,
+            expiration,
+            secret,
+            payment_identifier=lock_number,
+            channel_identifier=payer_channel.identifier,
+        )
+        payee_transfer = factories.make_transfer(
+            amount,
+            factories.UNIT_TRANSFER_INITIATOR,
+            factories.UNIT_TRANSFER_TARGET,
+            expiration - payee_channel.reveal_timeout,
+            secret,
+            identifier=lock_number,
+            token_network_identifier=token_network.address,
+            channel_identifier=payee_channel.identifier,
+        )
+        lock = payer_transfer.lock
+        partner_state.secrethashes_to_lockedlocks[lock.secrethash] = lock
+
+        pair = MediationPairState(
+            payer_transfer,
+            payee_channel.partner_state.address,
+            payee_transfer,
+        )
+        mediator_state = MediatorTransferState(lock.secrethash)
+        mediator_state.transfers_pair.append(pair)
+
+        # the last mediator does not know the secret
+        if lock_number < 4:
+            locks.append(lock)
+            mediator_state.secret = secret
+            pair.payer_state = 'payer_secret_revealed'
+            pair.payee_state = 'payee_balance_proof'
+
+        node_state.payment_mapping.secrethashes_to_task[lock.secrethash] = (
+            PaymentMappingState.MediatorTask(token_network.address, mediator_state)
+        )
+
+    partner_state.amount_locked = channel.compute_amount_locked(partner_state)
+    partner_state.merkletree = MerkleTreeState(compute_layers([
+        lock.lockhash
+        for lock in partner_state.secrethashes_to_lockedlocks.values()
+    ]))
+
+    channel_closed = ContractReceiveChannelClosed(
+        token_network.address,
+        payer_channel.identifier,
+        partner_state.address,
+        5,
+    )
+
+    results = list()
+    for dispatch_mode in (DISPATCH_DEEPCOPY, DISPATCH_COPY_ON_WRITE, DISPATCH_UNDO_LOG):
+        state_manager = StateManager(node.state_transition, deepcopy(node_state), dispatch_mode)
+
+        events = state_manager.dispatch(deepcopy(channel_closed))
+        [unlock] = [
+            event
+            for event in events
+            if isinstance(event, ContractSendChannelBatchUnlock)
+        ]
+        assert unlock.channel_identifier == payer_channel.identifier
+
+        unlocked_locks = [
+            lock_from_unlock_proof(unlock_proof)
+            for unlock_proof in unlock.merkle_treee_leaves
+        ]
+        assert sorted(unlocked_locks, key=lambda lock: lock.secrethash) == (
+            sorted(locks, key=lambda lock: lock.secrethash)
+        )
+
+        root = merkleroot(partner_state.merkletree)
+        for unlock_proof, lock in zip(unlock.merkle_treee_leaves, unlocked_locks):
+            assert validate_proof(unlock_proof.merkle_proof, root, lock.lockhash)
+
+        tasks = state_manager.current_state.payment_mapping.secrethashes_to_task
+        for lock in locks:
+            [pair] = tasks[lock.secrethash].mediator_state.transfers_pair
+            assert pair.payer_state == 'payer_waiting_unlock'
+
+        # the locks are unlocked once
+        events = state_manager.dispatch(deepcopy(channel_closed))
+        assert not any(isinstance(event, ContractSendChannelBatchUnlock) for event in events)
+
+        results.append((state_manager.current_state, unlock))
+
+    node_state, unlock = results[0]
+    for other_state, other_unlock in results[1:]:
+        assert other_unlock == unlock
+        assert other_state.payment_mapping == node_state.payment_mapping
+
+
+def make_two_token_networks_state_changes():
+    """ The state changes of `make_target_state_changes` with a second token
+    network, which has a channel that is closed.
+    """
+    state_changes = make_target_state_changes()
+    payment_network_identifier = state_changes[1].payment_network.address
+
+    token_network = TokenNetworkState(factories.make_address(), factories.make_address())
+    channel_state = factories.make_channel(
+        our_balance=factories.UNIT_TRANSFER_AMOUNT,
+        our_address=factories.UNIT_TRANSFER_TARGET,
+        token_address=token_network.token_address,
+        token_network_identifier=token_network.address,
+    )
+
+    state_changes[4:4] = [
+        ContractReceiveNewTokenNetwork(payment_network_identifier, token_network),
+        ContractReceiveChannelNew(token_network.address, channel_state),
+        ActionChannelClose(token_network.address, channel_state.identifier),
+    ]
+    return state_changes
+
+
+def event_types(events_by_state_change):
+    return [[type(event) for event in events] for events in events_by_state_change]
+
+
+def test_sharded_state_manager():
+    state_changes = make_two_token_networks_state_changes()
+
+    state_manager = StateManager(node.state_transition, None)
+    expected_events = [
+        state_manager.dispatch(state_change)
+        for state_change in deepcopy(state_changes)
+    ]
+    expected_state = state_manager.current_state
+
+    sharded_manager = ShardedStateManager(node.state_transition, None)
+    events = [
+        sharded_manager.dispatch(state_change)
+        for state_change in deepcopy(state_changes)
+    ]
+    node_state = sharded_manager.current_state
+
+    assert len(sharded_manager.shards) == 2
+
+    # the shards draw the message identifiers from their own generators
+    assert event_types(events) == event_types(expected_events)
+    assert node_state.block_number == expected_state.block_number
+    assert node_state.payment_mapping == expected_state.payment_mapping
+    assert {
+        queueid: event_types([queue])
+        for queueid, queue in node_state.queueids_to_queues.items()
+    } == {
+        queueid: event_types([queue])
+        for queueid, queue in expected_state.queueids_to_queues.items()
+    }
+
+    payment_networks = node_state.identifiers_to_paymentnetworks
+    expected_payment_networks = expected_state.identifiers_to_paymentnetworks
+    assert payment_networks.keys() == expected_payment_networks.keys()
+    for identifier, payment_network in payment_networks.items():
+        expected_payment_network = expected_payment_networks[identifier]
+        token_networks = payment_network.tokenidentifiers_to_tokennetworks
+        expected_token_networks = expected_payment_network.tokenidentifiers_to_tokennetworks
+        assert token_networks.keys() == expected_token_networks.keys()
+        for token_network_identifier, token_network in token_networks.items():
+            expected_token_network = expected_token_networks[token_network_identifier]
+            assert token_network.channelidentifiers_to_channels == (
+                expected_token_network.channelidentifiers_to_channels
+            )
+
+    expected_indexes = deepcopy(node_state)
+    rebuild_indexes(expected_indexes)
+    for index_name in INDEXES:
+        assert getattr(node_state, index_name) == getattr(expected_indexes, index_name)
+
+    # the events do not depend on the batches nor on the executor
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        sharded_manager = ShardedStateManager(
+            node.state_transition,
+            None,
+            executor=executor,
+            serializer=BinarySerializer,
+            executor_batch_size=1,
+        )
+        sharded_manager.dispatch_batch(deepcopy(state_changes[:2]))
+        assert sharded_manager.dispatch_batch(deepcopy(state_changes[2:])) == events[2:]
+
+    # the generators of the shards are restored from a snapshot
+    sharded_manager = ShardedStateManager(node.state_transition, None)
+    sharded_manager.dispatch_batch(deepcopy(state_changes[:6]))
+    data = BinarySerializer.serialize(sharded_manager.current_state)
+
+    restored_manager = ShardedStateManager(
+        node.state_transition,
+        BinarySerializer.deserialize(data),
+    )
+    assert restored_manager.dispatch_batch(deepcopy(state_changes[6:])) == events[6:]
+
+    with pytest.raises(ValueError):
+        ShardedStateManager(node.state_transition, None, DISPATCH_UNDO_LOG)
+
+
+def test_sharded_state_manager_merge():
+    """ The merged state is updated for the shards that changed. """
+    state_changes = make_two_token_networks_state_changes()
+    state_changes.append(Block(3))
+
+    for dispatch_mode in (DISPATCH_DEEPCOPY, DISPATCH_COPY_ON_WRITE):
+        sharded_manager = ShardedStateManager(node.state_transition, None, dispatch_mode)
+
+        for state_change in deepcopy(state_changes):
+            previous_state = sharded_manager.current_state
+            sharded_manager.dispatch(state_change)
+
+            node_state = sharded_manager.current_state
+            expected_state = merge_shards(sharded_manager.root, sharded_manager.shards)
+
+            assert node_state == expected_state
+            assert node_state.tokennetworkidentifiers_to_pseudorandomgenerators == (
+                expected_state.tokennetworkidentifiers_to_pseudorandomgenerators
+            )
+            for index_name in INDEXES:
+                assert getattr(node_state, index_name) == getattr(expected_state, index_name)
+
+        # the maps a block did not change are shared with the previous state
+        if dispatch_mode == DISPATCH_COPY_ON_WRITE:
+            assert node_state.payment_mapping.secrethashes_to_task is (
+                previous_state.payment_mapping.secrethashes_to_task
+            )
+            assert node_state.queueids_to_queues is previous_state.queueids_to_queues
+
+
+def test_sharded_state_manager_executor_batch_size():
+    """ Only the batches with enough state changes are sent to the executor. """
+    state_changes = make_two_token_networks_state_changes()
+
+    submitted = list()
+
+    class RecordingExecutor(ThreadPoolExecutor):
+        def submit(self, *args, **kwargs):
+            submitted.append(args)
+            return super().submit(*args, **kwargs)
+
+    with RecordingExecutor(max_workers=2) as executor:
+        sharded_manager = ShardedStateManager(
+            node.state_transition,
+            None,
+            executor=executor,
+            serializer=BinarySerializer,
+            executor_batch_size=3,
+        )
+        for state_change in deepcopy(state_changes):
+            sharded_manager.dispatch(state_change)
+
+        assert not submitted
+
+        sharded_manager = ShardedStateManager(
+            node.state_transition,
+            None,
+            executor=executor,
+            serializer=BinarySerializer,
+            executor_batch_size=3,
+        )
+        sharded_manager.dispatch_batch(deepcopy(state_changes[:2]))
+        sharded_manager.dispatch_batch(deepcopy(state_changes[2:]))
+
+        assert submitted
+
+
+def test_sharded_state_manager_failed_batch(monkeypatch):
+    state_changes = make_two_token_networks_state_changes()
+
+    sharded_manager = ShardedStateManager(node.state_transition, None)
+    sharded_manager.dispatch_batch(deepcopy(state_changes[:6]))
+    node_state = sharded_manager.current_state
+    shards = dict(sharded_manager.shards)
+
+    def failing_state_transition(*args, **kwargs):
+        raise RuntimeError('failed transition')
+
+    monkeypatch.setattr(node.target, 'state_transition', failing_state_transition)
+    with pytest.raises(RuntimeError):
+        sharded_manager.dispatch_batch(deepcopy(state_changes[6:]))
+    monkeypatch.undo()
+
+    assert sharded_manager.current_state is node_state
+    assert sharded_manager.shards == shards
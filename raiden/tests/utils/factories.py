@@ -17,11 +17,17 @@ from raiden.utils import (
     privatekey_to_address,
 )
 from raiden.transfer import balance_proof, channel
+from raiden.transfer.indexes import rebuild_indexes
+from raiden.transfer.merkle_tree import compute_layers
 from raiden.transfer.state import (
     BalanceProofSignedState,
+    MerkleTreeState,
     NettingChannelEndState,
     NettingChannelState,
+    NodeState,
+    PaymentNetworkState,
     RouteState,
+    TokenNetworkState,
     TransactionExecutionStatus,
 )
 from raiden.transfer.state import BalanceProofUnsignedState
@@ -369,3 +375,51 @@ def make_signed_transfer_for(
     assert is_valid, msg
 
     return mediated_transfer
+
+
+def make_node_state(number_of_channels, number_of_locks=0, our_address=None):
+    """ Create a NodeState with a single token network and `number_of_channels`
+    open channels, each with `number_of_locks` pending locks from the partner.
+    """
+    our_address = our_address or make_address()
+    token_network = TokenNetworkState(make_address(), make_address())
+    payment_network = PaymentNetworkState(make_address(), [token_network])
+
+    node_state = NodeState(random.Random(), 1)
+    node_state.identifiers_to_paymentnetworks[payment_network.address] = payment_network
+
+    for _ in range(number_of_channels):
+        channel_state = make_channel(
+            our_balance=UNIT_TRANSFER_AMOUNT * (number_of_locks + 1),
+            partner_balance=UNIT_TRANSFER_AMOUNT * (number_of_locks + 1),
+            our_address=our_address,
+            token_address=token_network.token_address,
+            token_network_identifier=token_network.address,
+        )
+        partner_state = channel_state.partner_state
+
+        for lock_number in range(number_of_locks):
+            lock = HashTimeLockState(
+                UNIT_TRANSFER_AMOUNT,
+                UNIT_SETTLE_TIMEOUT,
+                sha3(make_secret(lock_number)),
+            )
+            partner_state.secrethashes_to_lockedlocks[lock.secrethash] = lock
+
+        partner_state.amount_locked = channel.compute_amount_locked(partner_state)
+
+        if number_of_locks:
+            lockhashes = [
+                lock.lockhash
+                for lock in partner_state.secrethashes_to_lockedlocks.values()
+            ]
+            partner_state.merkletree = MerkleTreeState(compute_layers(lockhashes))
+
+        partner_address = partner_state.address
+        token_network.channelidentifiers_to_channels[channel_state.identifier] = channel_state
+        token_network.partneraddresses_to_channels[partner_address] = channel_state
+        token_network.network_graph.network.add_edge(our_address, partner_address)
+
+    rebuild_indexes(node_state)
+
+    return node_state
@@ -5,6 +5,7 @@ import gevent
 import time
 from coincurve import PrivateKey
 
+from raiden.api.python import RaidenAPI
 from raiden.constants import UINT64_MAX, NETWORKNAME_TO_ID, TESTS
 from raiden.messages import (
     LockedTransfer,
@@ -47,6 +48,30 @@ def get_channelstate(app0, app1, token_network_identifier) -> NettingChannelStat
     return channel_state
 
 
+def get_settled_channelstate(app0, app1, token_network_identifier) -> NettingChannelState:
+    """ The channel of `app0` with `app1` once settled. The channel is
+    removed from the node state once there is nothing left to unlock, then
+    its final state is read from the pruned channels.
+    """
+    channel_state = get_channelstate(app0, app1, token_network_identifier)
+
+    if channel_state is None:
+        token_network_state = views.get_token_network_by_identifier(
+            views.state_from_app(app0),
+            token_network_identifier,
+        )
+        pruned_channels = RaidenAPI(app0.raiden).get_pruned_channel_list(
+            app0.raiden.default_registry.address,
+            token_network_state.token_address,
+            app1.raiden.address,
+        )
+
+        assert len(pruned_channels) == 1
+        channel_state = pruned_channels[0]
+
+    return channel_state
+
+
 def transfer(initiator_app, target_app, token, amount, identifier):
     """ Nice to read shortcut to make a transfer.
 
@@ -242,6 +267,25 @@ def assert_synched_channel_state(
     channel0 = get_channelstate(app0, app1, token_network_identifier)
     channel1 = get_channelstate(app1, app0, token_network_identifier)
 
+    assert_synched_channels(
+        channel0, balance0, pending_locks0,
+        channel1, balance1, pending_locks1,
+    )
+
+
+def assert_synched_channels(
+        channel0,
+        balance0,
+        pending_locks0,
+        channel1,
+        balance1,
+        pending_locks1,
+):
+    """ Assert the values of the two ends of a channel, see
+    `assert_synched_channel_state`.
+    """
+    # pylint: disable=too-many-arguments
+
     assert channel0.our_state.contract_balance == channel1.partner_state.contract_balance
     assert channel0.partner_state.contract_balance == channel1.our_state.contract_balance
 
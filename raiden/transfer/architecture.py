@@ -28,6 +28,22 @@ from typing import List
 # outputs are separated under different class hierarquies (StateChange and Event).
 
 
+def setstate_from_pickle(obj, state):
+    """ Restore the attributes of a slotted object from pickled `state`.
+
+    StateChange and Event instances pickled before these classes defined
+    `__slots__` carry a plain dictionary, newer pickles a tuple of the
+    instance dictionary and the slot values.
+    """
+    if isinstance(state, tuple):
+        instance_dict, state = state
+        if instance_dict:
+            obj.__dict__.update(instance_dict)
+
+    for name, value in (state or {}).items():
+        setattr(obj, name, value)
+
+
 class State:
     """ An isolated state, modified by StateChange messages.
 
@@ -37,7 +53,11 @@ class State:
     - State objects may be nested.
     - State classes don't have logic by design.
     - Each iteration must operate on fresh copy of the state, treating the old
-          objects as immutable.
+          objects as immutable. The copy is either a deep copy made by the
+          StateManager or, for `copy_on_write` transitions, a copy of only
+          the objects the transition modifies. The exception is the
+          `undo_log` dispatch mode, where the current state is modified in
+          place and nobody may keep references to the previous one.
     - This class is used as a marker for states.
     """
     __slots__ = ()
@@ -61,6 +81,9 @@ class StateChange:
     """
     __slots__ = ()
 
+    def __setstate__(self, state):
+        setstate_from_pickle(self, state)
+
 
 class Event:
     """ Events produced by the execution of a state change.
@@ -78,14 +101,104 @@ class Event:
     """
     __slots__ = ()
 
+    def __setstate__(self, state):
+        setstate_from_pickle(self, state)
+
 
 class SendMessageEvent(Event):
+    __slots__ = (
+        'recipient',
+        'queue_name',
+        'message_identifier',
+    )
+
     def __init__(self, recipient, queue_name, message_identifier):
         self.recipient = recipient
         self.queue_name = queue_name
         self.message_identifier = message_identifier
 
 
+# The StateManager deep copies the current state and the transition modifies
+# the copy.
+DISPATCH_DEEPCOPY = 'deepcopy'
+# The transition never modifies the state it is given, it copies the objects
+# it changes itself.
+DISPATCH_COPY_ON_WRITE = 'copy_on_write'
+# The transition modifies the current state in place and records how to
+# revert it in an UndoLog, which is rolled back if the transition raises.
+DISPATCH_UNDO_LOG = 'undo_log'
+DISPATCH_MODES = (
+    DISPATCH_DEEPCOPY,
+    DISPATCH_COPY_ON_WRITE,
+    DISPATCH_UNDO_LOG,
+)
+
+
+def copy_on_write(state_transition):
+    """ Mark `state_transition` as never modifying the state it is given.
+
+    Such a function copies the objects it changes itself, so the StateManager
+    does not copy the whole state before dispatching to it.
+    """
+    state_transition.copy_on_write = True
+    return state_transition
+
+
+def supports_undo_log(state_transition):
+    """ Mark `state_transition` as accepting the `undo_log` keyword argument.
+
+    When it is given the function modifies the state in place and records in
+    the UndoLog how to revert every modification.
+    """
+    state_transition.undo_log = True
+    return state_transition
+
+
+def supports_batch(state_transition):
+    """ Mark `state_transition` as accepting the `batch` keyword argument.
+
+    The StateManager gives the same BatchContext to the transitions of a
+    batch, a copy made by one of them is private to the batch and may be
+    modified in place by the following ones.
+    """
+    state_transition.batch = True
+    return state_transition
+
+
+class UndoLog:
+    """ The modifications done in place by a state transition, in order.
+
+    Each entry is a function and its arguments, calling it reverts one
+    modification.
+    """
+    __slots__ = ('entries',)
+
+    def __init__(self):
+        self.entries = list()
+
+    def record(self, undo, *args):
+        self.entries.append((undo, args))
+
+    def rollback(self):
+        """ Revert the recorded modifications, the newest first. """
+        entries = self.entries
+        while entries:
+            undo, args = entries.pop()
+            undo(*args)
+
+
+class BatchContext:
+    """ Shared by the state transitions of a batch, see `supports_batch`.
+
+    `writer` is owned by the state transition, it is None until the first
+    transition of the batch sets it.
+    """
+    __slots__ = ('writer',)
+
+    def __init__(self):
+        self.writer = None
+
+
 class StateManager:
     """ The mutable storage for the application state, this storage can do
     state transitions by applying the StateChanges to the current State.
@@ -93,20 +206,40 @@ class StateManager:
     __slots__ = (
         'state_transition',
         'current_state',
+        'dispatch_mode',
     )
 
-    def __init__(self, state_transition, current_state):
+    def __init__(self, state_transition, current_state, dispatch_mode=None):
         """ Initialize the state manager.
 
         Args:
             state_transition: function that can apply a StateChange message.
             current_state: current application state.
+            dispatch_mode: one of DISPATCH_MODES, by default copy_on_write
+                if the state transition supports it and deepcopy otherwise.
         """
         if not callable(state_transition):
             raise ValueError('state_transition must be a callable')
 
+        if dispatch_mode is None:
+            if getattr(state_transition, 'copy_on_write', False):
+                dispatch_mode = DISPATCH_COPY_ON_WRITE
+            else:
+                dispatch_mode = DISPATCH_DEEPCOPY
+
+        if dispatch_mode not in DISPATCH_MODES:
+            raise ValueError('unknown dispatch mode {}'.format(dispatch_mode))
+
+        supported = (
+            dispatch_mode == DISPATCH_DEEPCOPY or
+            getattr(state_transition, dispatch_mode, False)
+        )
+        if not supported:
+            raise ValueError('state_transition does not support {}'.format(dispatch_mode))
+
         self.state_transition = state_transition
         self.current_state = current_state
+        self.dispatch_mode = dispatch_mode
 
     def dispatch(self, state_change: StateChange) -> List[Event]:
         """ Apply the `state_change` in the current machine and return the
@@ -123,15 +256,37 @@ class StateManager:
         """
         assert isinstance(state_change, StateChange)
 
-        # the state objects must be treated as immutable, so make a copy of the
-        # current state and pass the copy to the state machine to be modified.
-        next_state = deepcopy(self.current_state)
-
-        # update the current state by applying the change
-        iteration = self.state_transition(
-            next_state,
-            state_change,
-        )
+        dispatch_mode = self.dispatch_mode
+
+        if dispatch_mode == DISPATCH_UNDO_LOG:
+            # the current state is modified in place, it is restored if the
+            # transition fails half way
+            undo_log = UndoLog()
+            try:
+                iteration = self.state_transition(
+                    self.current_state,
+                    state_change,
+                    undo_log=undo_log,
+                )
+            except BaseException:
+                undo_log.rollback()
+                raise
+
+        else:
+            # the state objects must be treated as immutable, so make a copy of
+            # the current state and pass the copy to the state machine to be
+            # modified, unless the state machine copies the objects it changes
+            # itself.
+            if dispatch_mode == DISPATCH_COPY_ON_WRITE:
+                next_state = self.current_state
+            else:
+                next_state = deepcopy(self.current_state)
+
+            # update the current state by applying the change
+            iteration = self.state_transition(
+                next_state,
+                state_change,
+            )
 
         assert isinstance(iteration, TransitionResult)
 
@@ -143,6 +298,59 @@ class StateManager:
 
         return events
 
+    def dispatch_batch(self, state_changes: List[StateChange]) -> List[List[Event]]:
+        """ Apply the `state_changes` in order and return the events of each
+        one, in a list per state change.
+
+        The current state is copied at most once for the whole batch and is
+        only replaced once every state change was applied. If a transition
+        raises the current state is left as it was before the batch.
+        """
+        assert all(isinstance(state_change, StateChange) for state_change in state_changes)
+
+        dispatch_mode = self.dispatch_mode
+        state_transition = self.state_transition
+
+        kwargs = dict()
+        if getattr(state_transition, 'batch', False):
+            kwargs['batch'] = BatchContext()
+
+        if dispatch_mode == DISPATCH_UNDO_LOG:
+            undo_log = UndoLog()
+            kwargs['undo_log'] = undo_log
+            next_state = self.current_state
+        elif dispatch_mode == DISPATCH_COPY_ON_WRITE:
+            undo_log = None
+            next_state = self.current_state
+        else:
+            # the copy is private to the batch, the transitions modify it in
+            # turn
+            undo_log = None
+            next_state = deepcopy(self.current_state)
+
+        events_by_state_change = list()
+        try:
+            for state_change in state_changes:
+                iteration = state_transition(next_state, state_change, **kwargs)
+
+                assert isinstance(iteration, TransitionResult)
+
+                next_state = iteration.new_state
+                events = iteration.events
+
+                assert isinstance(next_state, (State, type(None)))
+                assert all(isinstance(e, Event) for e in events)
+
+                events_by_state_change.append(events)
+        except BaseException:
+            if undo_log is not None:
+                undo_log.rollback()
+            raise
+
+        self.current_state = next_state
+
+        return events_by_state_change
+
     def __eq__(self, other):
         return (
             isinstance(other, StateManager) and
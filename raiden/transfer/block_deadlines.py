@@ -0,0 +1,102 @@
+""" Priority index of the channels and payment tasks by block deadline.
+
+The deadline of an object is a lower bound of the first block for which a
+`Block` state change modifies it or produces an event, so a Block only has
+to visit the objects with a deadline at or before its number. An object may
+have several entries in the index, only the entry of its last scheduled
+deadline is returned by `pop_due`, the others are dropped when they are
+popped. The returned objects must still be checked against their current
+deadline.
+
+The index is kept by the node state machine alongside the NodeState, it is
+not part of the state: the serializers store it empty and it is rebuilt from
+the state when it can not be trusted, e.g. after a restore or a failed
+transition. `node_state` is the NodeState the index is valid for.
+"""
+import heapq
+
+DEADLINE_CHANNEL = 0
+DEADLINE_PAYMENT_TASK = 1
+
+# `node_state` of an index updated by the running transition
+IN_TRANSITION = object()
+
+
+class BlockDeadlines:
+    """ A heap of the tuples (deadline, kind, key).
+
+    The key of a channel is the tuple (token_network_identifier,
+    channel_identifier), the key of a payment task is its secrethash.
+    `scheduled` maps the (kind, key) pairs to their last scheduled deadline.
+    """
+
+    __slots__ = (
+        'entries',
+        'scheduled',
+        'node_state',
+    )
+
+    def __init__(self):
+        self.entries = list()
+        self.scheduled = dict()
+        self.node_state = None
+
+    def __reduce__(self):
+        # the index is derived from the state, a restored state rebuilds it
+        return (BlockDeadlines, ())
+
+    def __deepcopy__(self, memo):
+        # valid for the copy of `node_state`, if it is copied along
+        result = BlockDeadlines()
+        result.entries = list(self.entries)
+        result.scheduled = dict(self.scheduled)
+        result.node_state = memo.get(id(self.node_state))
+        return result
+
+    def __repr__(self):
+        return '<BlockDeadlines scheduled:{}>'.format(len(self.scheduled))
+
+    def clear(self):
+        self.entries = list()
+        self.scheduled = dict()
+
+    def _push(self, deadline, kind, key):
+        if self.scheduled.get((kind, key)) != deadline:
+            self.scheduled[(kind, key)] = deadline
+            heapq.heappush(self.entries, (deadline, kind, key))
+
+    def push_channel(self, deadline, token_network_identifier, channel_identifier):
+        self._push(deadline, DEADLINE_CHANNEL, (token_network_identifier, channel_identifier))
+
+    def push_payment_task(self, deadline, secrethash):
+        self._push(deadline, DEADLINE_PAYMENT_TASK, secrethash)
+
+    def pop_due(self, block_number):
+        """ Remove the entries with a deadline at or before `block_number`
+        and return the tuple (channel_keys, secrethashes), without
+        duplicates.
+        """
+        entries = self.entries
+        scheduled = self.scheduled
+        channel_keys = set()
+        secrethashes = set()
+
+        while entries and entries[0][0] <= block_number:
+            deadline, kind, key = heapq.heappop(entries)
+
+            # an older entry, the object was scheduled again
+            if scheduled.get((kind, key)) != deadline:
+                continue
+
+            del scheduled[(kind, key)]
+
+            if kind == DEADLINE_CHANNEL:
+                channel_keys.add(key)
+            else:
+                secrethashes.add(key)
+
+        return channel_keys, secrethashes
+
+
+def invalidate(block_deadlines):
+    block_deadlines.node_state = None
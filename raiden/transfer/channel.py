@@ -37,8 +37,10 @@ from raiden.transfer.mediated_transfer.events import (
 from raiden.transfer.merkle_tree import (
     LEAVES,
     merkleroot,
-    compute_layers,
+    compute_layers_with,
+    compute_layers_without,
     compute_merkleproof_for,
+    compute_merkleproofs_for,
 )
 from raiden.transfer.state import (
     CHANNEL_STATE_CLOSED,
@@ -50,6 +52,7 @@ from raiden.transfer.state import (
     CHANNEL_STATE_UNUSABLE,
     EMPTY_MERKLE_ROOT,
     EMPTY_MERKLE_TREE,
+    compute_amount_locked,
     message_identifier_from_prng,
     BalanceProofSignedState,
     BalanceProofUnsignedState,
@@ -84,6 +87,10 @@ EventsOrError = typing.Tuple[bool, typing.List[Event], typing.Any]
 BalanceProofData = typing.Tuple[typing.Locksroot, typing.Nonce, typing.TokenAmount, typing.TokenAmount]  # noqa
 SendUnlockAndMerkleTree = typing.Tuple[SendBalanceProof, MerkleTreeState]
 
+# Compare `NettingChannelEndState.amount_locked` with the sum of the locks on
+# every read, enabled by the tests
+CHECK_AMOUNT_LOCKED = False
+
 
 TransactionOrder = namedtuple(
     'TransactionOrder',
@@ -118,6 +125,49 @@ def is_deposit_confirmed(
     )
 
 
+def is_settle_timeout_expired(
+        channel_state: NettingChannelState,
+        block_number: typing.BlockNumber,
+) -> bool:
+    if get_status(channel_state) != CHANNEL_STATE_CLOSED:
+        return False
+
+    closed_block_number = channel_state.close_transaction.finished_block_number
+    settlement_end = closed_block_number + channel_state.settle_timeout
+
+    return block_number > settlement_end
+
+
+def is_changed_by_block(
+        channel_state: NettingChannelState,
+        block_number: typing.BlockNumber,
+) -> bool:
+    """ True if the Block for `block_number` modifies `channel_state`, this
+    must match the conditions used by `handle_block`.
+    """
+    return (
+        is_settle_timeout_expired(channel_state, block_number) or
+        is_deposit_confirmed(channel_state, block_number)
+    )
+
+
+def get_block_deadline(channel_state: NettingChannelState) -> typing.Optional[int]:
+    """ The first block for which `is_changed_by_block` is true, None if
+    there is none.
+    """
+    deadlines = list()
+
+    if get_status(channel_state) == CHANNEL_STATE_CLOSED:
+        closed_block_number = channel_state.close_transaction.finished_block_number
+        deadlines.append(closed_block_number + channel_state.settle_timeout + 1)
+
+    if channel_state.deposit_transaction_queue:
+        transaction_block_number = channel_state.deposit_transaction_queue[0].block_number
+        deadlines.append(transaction_block_number + DEFAULT_NUMBER_OF_CONFIRMATIONS_BLOCK + 1)
+
+    return min(deadlines, default=None)
+
+
 def is_lock_locked(
         end_state: NettingChannelEndState,
         secrethash: typing.SecretHash,
@@ -700,22 +750,18 @@ def is_valid_unlock(
 
 
 def get_amount_locked(end_state: NettingChannelEndState) -> typing.Balance:
-    total_pending = sum(
-        lock.amount
-        for lock in end_state.secrethashes_to_lockedlocks.values()
-    )
+    """ Return the sum of the amounts of the pending locks, unlocked or not.
 
-    total_unclaimed = sum(
-        unlock.lock.amount
-        for unlock in end_state.secrethashes_to_unlockedlocks.values()
-    )
+    The sum is kept up to date by `_add_lock` and `_del_lock`, the locks must
+    not be added to or removed from the end state directly. The states
+    written before the sum was kept compute it when they are loaded.
+    """
+    amount_locked = end_state.amount_locked
 
-    total_unclaimed_onchain = sum(
-        unlock.lock.amount
-        for unlock in end_state.secrethashes_to_onchain_unlockedlocks.values()
-    )
+    if CHECK_AMOUNT_LOCKED:
+        assert amount_locked == compute_amount_locked(end_state), 'amount_locked is out of sync'
 
-    return total_pending + total_unclaimed + total_unclaimed_onchain
+    return amount_locked
 
 
 def get_balance(
@@ -875,6 +921,22 @@ def get_status(channel_state):
     return result
 
 
+def _add_lock(end_state: NettingChannelEndState, lock: HashTimeLockState) -> None:
+    """Adds the pending lock to the indexing structures.
+
+    Note:
+        This won't change the merkletree!
+    """
+    amount_locked = get_amount_locked(end_state)
+
+    previous_lock = end_state.secrethashes_to_lockedlocks.get(lock.secrethash)
+    if previous_lock is not None:
+        amount_locked -= previous_lock.amount
+
+    end_state.secrethashes_to_lockedlocks[lock.secrethash] = lock
+    end_state.amount_locked = amount_locked + lock.amount
+
+
 def _del_lock(end_state: NettingChannelEndState, secrethash: typing.SecretHash) -> None:
     """Removes the lock from the indexing structures.
 
@@ -883,15 +945,22 @@ def _del_lock(end_state: NettingChannelEndState, secrethash: typing.SecretHash)
     """
     assert is_lock_pending(end_state, secrethash)
 
+    amount_locked = get_amount_locked(end_state)
+
     if secrethash in end_state.secrethashes_to_lockedlocks:
+        amount_locked -= end_state.secrethashes_to_lockedlocks[secrethash].amount
         del end_state.secrethashes_to_lockedlocks[secrethash]
 
     if secrethash in end_state.secrethashes_to_unlockedlocks:
+        amount_locked -= end_state.secrethashes_to_unlockedlocks[secrethash].lock.amount
         del end_state.secrethashes_to_unlockedlocks[secrethash]
 
     if secrethash in end_state.secrethashes_to_onchain_unlockedlocks:
+        amount_locked -= end_state.secrethashes_to_onchain_unlockedlocks[secrethash].lock.amount
         del end_state.secrethashes_to_onchain_unlockedlocks[secrethash]
 
+    end_state.amount_locked = amount_locked
+
 
 def set_closed(
         channel_state: NettingChannelState,
@@ -925,6 +994,38 @@ def set_settled(
         channel_state.settle_transaction.result = TransactionExecutionStatus.SUCCESS
 
 
+def set_unlocked(
+        channel_state: NettingChannelState,
+        block_number: typing.BlockNumber,
+) -> None:
+    if not channel_state.our_unlock_transaction:
+        channel_state.our_unlock_transaction = TransactionExecutionStatus(
+            None,
+            block_number,
+            TransactionExecutionStatus.SUCCESS,
+        )
+
+    elif not channel_state.our_unlock_transaction.finished_block_number:
+        channel_state.our_unlock_transaction.finished_block_number = block_number
+        channel_state.our_unlock_transaction.result = TransactionExecutionStatus.SUCCESS
+
+
+def is_finished(channel_state: NettingChannelState) -> bool:
+    """ True if the channel is settled and our half of it is unlocked, or
+    there was nothing to unlock.
+    """
+    if get_status(channel_state) != CHANNEL_STATE_SETTLED:
+        return False
+
+    unlock_transaction = channel_state.our_unlock_transaction
+    is_unlocked = (
+        unlock_transaction is not None and
+        unlock_transaction.result == TransactionExecutionStatus.SUCCESS
+    )
+
+    return is_unlocked or not get_batch_unlock(channel_state.partner_state)
+
+
 def update_contract_balance(
         end_state: NettingChannelEndState,
         contract_balance: typing.Balance,
@@ -948,6 +1049,28 @@ def compute_proof_for_lock(
     )
 
 
+def compute_proofs_for_locks(
+        end_state: NettingChannelEndState,
+        secrets_and_locks: typing.List[typing.Tuple[typing.Secret, HashTimeLockState]],
+) -> typing.List[UnlockProofState]:
+    """ Same as `compute_proof_for_lock` for a batch of locks of `end_state`,
+    the merkle tree is traversed once for all of them.
+    """
+    merkle_proofs = compute_merkleproofs_for(
+        end_state.merkletree,
+        [lock.lockhash for _, lock in secrets_and_locks],
+    )
+
+    return [
+        UnlockProofState(
+            merkle_proof,
+            lock.encoded,
+            secret,
+        )
+        for merkle_proof, (secret, lock) in zip(merkle_proofs, secrets_and_locks)
+    ]
+
+
 def compute_merkletree_with(
         merkletree: MerkleTreeState,
         lockhash: typing.LockHash,
@@ -956,11 +1079,9 @@ def compute_merkletree_with(
     # Use None to inform the caller the lockshash is already known
     result = None
 
-    leaves = merkletree.layers[LEAVES]
-    if lockhash not in leaves:
-        leaves = list(leaves)
-        leaves.append(lockhash)
-        result = MerkleTreeState(compute_layers(leaves))
+    layers = compute_layers_with(merkletree.layers, lockhash)
+    if layers is not None:
+        result = MerkleTreeState(layers)
 
     return result
 
@@ -972,15 +1093,11 @@ def compute_merkletree_without(
     # Use None to inform the caller the lockshash is unknown
     result = None
 
-    leaves = merkletree.layers[LEAVES]
-    if lockhash in leaves:
-        leaves = list(leaves)
-        leaves.remove(lockhash)
-
-        if leaves:
-            result = MerkleTreeState(compute_layers(leaves))
-        else:
-            result = EMPTY_MERKLE_TREE
+    layers = compute_layers_without(merkletree.layers, lockhash)
+    if layers:
+        result = MerkleTreeState(layers)
+    elif layers is not None:
+        result = EMPTY_MERKLE_TREE
 
     return result
 
@@ -1214,7 +1331,7 @@ def send_lockedtransfer(
     lock = transfer.lock
     channel_state.our_state.balance_proof = transfer.balance_proof
     channel_state.our_state.merkletree = merkletree
-    channel_state.our_state.secrethashes_to_lockedlocks[lock.secrethash] = lock
+    _add_lock(channel_state.our_state, lock)
 
     return send_locked_transfer_event
 
@@ -1248,7 +1365,7 @@ def send_refundtransfer(
 
     channel_state.our_state.balance_proof = mediated_transfer.balance_proof
     channel_state.our_state.merkletree = merkletree
-    channel_state.our_state.secrethashes_to_lockedlocks[lock.secrethash] = lock
+    _add_lock(channel_state.our_state, lock)
 
     refund_transfer = refund_from_sendmediated(send_mediated_transfer)
     return refund_transfer
@@ -1312,12 +1429,13 @@ def register_secret_endstate(
 ) -> None:
     if is_lock_locked(end_state, secrethash):
         pendinglock = end_state.secrethashes_to_lockedlocks[secrethash]
-        del end_state.secrethashes_to_lockedlocks[secrethash]
+        _del_lock(end_state, secrethash)
 
         end_state.secrethashes_to_unlockedlocks[secrethash] = UnlockPartialProofState(
             pendinglock,
             secret,
         )
+        end_state.amount_locked += pendinglock.amount
 
 
 def register_onchain_secret_endstate(
@@ -1343,6 +1461,7 @@ def register_onchain_secret_endstate(
             pendinglock,
             secret,
         )
+        end_state.amount_locked += pendinglock.amount
 
 
 def register_secret(
@@ -1517,7 +1636,7 @@ def handle_refundtransfer(
         channel_state.partner_state.merkletree = merkletree
 
         lock = refund.transfer.lock
-        channel_state.partner_state.secrethashes_to_lockedlocks[lock.secrethash] = lock
+        _add_lock(channel_state.partner_state, lock)
 
         send_processed = SendProcessed(
             refund.transfer.balance_proof.sender,
@@ -1554,7 +1673,7 @@ def handle_receive_lockedtransfer(
         channel_state.partner_state.merkletree = merkletree
 
         lock = mediated_transfer.lock
-        channel_state.partner_state.secrethashes_to_lockedlocks[lock.secrethash] = lock
+        _add_lock(channel_state.partner_state, lock)
 
         send_processed = SendProcessed(
             mediated_transfer.balance_proof.sender,
@@ -1611,23 +1730,19 @@ def handle_block(
 
     events = list()
 
-    if get_status(channel_state) == CHANNEL_STATE_CLOSED:
-        closed_block_number = channel_state.close_transaction.finished_block_number
-        settlement_end = closed_block_number + channel_state.settle_timeout
-
-        if state_change.block_number > settlement_end:
-            channel_state.settle_transaction = TransactionExecutionStatus(
-                state_change.block_number,
-                None,
-                None,
-            )
-            event = ContractSendChannelSettle(
-                channel_state.identifier,
-                channel_state.token_network_identifier,
-                channel_state.our_state.balance_proof,
-                channel_state.partner_state.balance_proof,
-            )
-            events.append(event)
+    if is_settle_timeout_expired(channel_state, block_number):
+        channel_state.settle_transaction = TransactionExecutionStatus(
+            state_change.block_number,
+            None,
+            None,
+        )
+        event = ContractSendChannelSettle(
+            channel_state.identifier,
+            channel_state.token_network_identifier,
+            channel_state.our_state.balance_proof,
+            channel_state.partner_state.balance_proof,
+        )
+        events.append(event)
 
     while is_deposit_confirmed(channel_state, block_number):
         order_deposit_transaction = heapq.heappop(channel_state.deposit_transaction_queue)
@@ -1749,6 +1864,7 @@ def apply_channel_newbalance(
 def handle_channel_batch_unlock(
         channel_state: NettingChannelState,
         state_change: ContractReceiveChannelBatchUnlock,
+        block_number: typing.BlockNumber,
 ) -> TransitionResult:
     events = list()
 
@@ -1758,66 +1874,104 @@ def handle_channel_batch_unlock(
 
         # Once our half of the channel is unlocked we can clean-up the channel
         if state_change.participant == channel_state.our_state.address:
+            set_unlocked(channel_state, block_number)
             channel_state = None
 
     return TransitionResult(channel_state, events)
 
 
+# The handlers take different arguments, each entry of the dispatch table
+# adapts the arguments of `state_transition` to its handler.
+
+def _dispatch_block(channel_state, state_change, pseudo_random_generator, block_number):
+    # pylint: disable=unused-argument
+    return handle_block(channel_state, state_change, block_number)
+
+
+def _dispatch_action_close(channel_state, state_change, pseudo_random_generator, block_number):
+    # pylint: disable=unused-argument
+    return handle_action_close(channel_state, state_change, block_number)
+
+
+def _dispatch_send_directtransfer(
+        channel_state,
+        state_change,
+        pseudo_random_generator,
+        block_number,
+):
+    # pylint: disable=unused-argument
+    return handle_send_directtransfer(channel_state, state_change, pseudo_random_generator)
+
+
+def _dispatch_channel_closed(channel_state, state_change, pseudo_random_generator, block_number):
+    # pylint: disable=unused-argument
+    return handle_channel_closed(channel_state, state_change)
+
+
+def _dispatch_channel_settled(
+        channel_state,
+        state_change,
+        pseudo_random_generator,
+        block_number,
+):
+    # pylint: disable=unused-argument
+    return handle_channel_settled(channel_state, state_change, block_number)
+
+
+def _dispatch_channel_newbalance(
+        channel_state,
+        state_change,
+        pseudo_random_generator,
+        block_number,
+):
+    # pylint: disable=unused-argument
+    return handle_channel_newbalance(channel_state, state_change, block_number)
+
+
+def _dispatch_channel_batch_unlock(
+        channel_state,
+        state_change,
+        pseudo_random_generator,
+        block_number,
+):
+    # pylint: disable=unused-argument
+    return handle_channel_batch_unlock(channel_state, state_change, block_number)
+
+
+def _dispatch_receive_directtransfer(
+        channel_state,
+        state_change,
+        pseudo_random_generator,
+        block_number,
+):
+    # pylint: disable=unused-argument
+    return handle_receive_directtransfer(channel_state, state_change)
+
+
+# StateChange class -> handler(channel_state, state_change,
+# pseudo_random_generator, block_number)
+STATE_CHANGE_HANDLERS = {
+    Block: _dispatch_block,
+    ActionChannelClose: _dispatch_action_close,
+    ActionTransferDirect: _dispatch_send_directtransfer,
+    ContractReceiveChannelClosed: _dispatch_channel_closed,
+    ContractReceiveChannelSettled: _dispatch_channel_settled,
+    ContractReceiveChannelNewBalance: _dispatch_channel_newbalance,
+    ContractReceiveChannelBatchUnlock: _dispatch_channel_batch_unlock,
+    ReceiveTransferDirect: _dispatch_receive_directtransfer,
+}
+
+
 def state_transition(
         channel_state: NettingChannelState,
         state_change: StateChange,
         pseudo_random_generator: typing.Any,
         block_number: typing.BlockNumber,
 ) -> TransitionResult:
-    # pylint: disable=too-many-branches,unidiomatic-typecheck
+    handler = STATE_CHANGE_HANDLERS.get(type(state_change))
 
-    events: typing.List[Event] = list()
-    iteration = TransitionResult(channel_state, events)
-
-    if type(state_change) == Block:
-        iteration = handle_block(
-            channel_state,
-            state_change,
-            block_number,
-        )
-    elif type(state_change) == ActionChannelClose:
-        iteration = handle_action_close(
-            channel_state,
-            state_change,
-            block_number,
-        )
-    elif type(state_change) == ActionTransferDirect:
-        iteration = handle_send_directtransfer(
-            channel_state,
-            state_change,
-            pseudo_random_generator,
-        )
-    elif type(state_change) == ContractReceiveChannelClosed:
-        iteration = handle_channel_closed(
-            channel_state,
-            state_change,
-        )
-    elif type(state_change) == ContractReceiveChannelSettled:
-        iteration = handle_channel_settled(
-            channel_state,
-            state_change,
-            block_number,
-        )
-    elif type(state_change) == ContractReceiveChannelNewBalance:
-        iteration = handle_channel_newbalance(
-            channel_state,
-            state_change,
-            block_number,
-        )
-    elif type(state_change) == ContractReceiveChannelBatchUnlock:
-        iteration = handle_channel_batch_unlock(
-            channel_state,
-            state_change,
-        )
-    elif type(state_change) == ReceiveTransferDirect:
-        iteration = handle_receive_directtransfer(
-            channel_state,
-            state_change,
-        )
+    if handler is None:
+        events: typing.List[Event] = list()
+        return TransitionResult(channel_state, events)
 
-    return iteration
+    return handler(channel_state, state_change, pseudo_random_generator, block_number)
@@ -14,6 +14,13 @@ class ContractSendChannelClose(Event):
     on-chain.
     """
 
+    __slots__ = (
+        'channel_identifier',
+        'token_address',
+        'token_network_identifier',
+        'balance_proof',
+    )
+
     def __init__(self, channel_identifier, token_address, token_network_identifier, balance_proof):
         self.channel_identifier = channel_identifier
         self.token_address = token_address
@@ -46,6 +53,13 @@ class ContractSendChannelClose(Event):
 class ContractSendChannelSettle(Event):
     """ Event emitted if the netting channel must be settled. """
 
+    __slots__ = (
+        'channel_identifier',
+        'token_network_identifier',
+        'our_balance_proof',
+        'partner_balance_proof',
+    )
+
     def __init__(
             self,
             channel_identifier: typing.ChannelID,
@@ -106,6 +120,12 @@ class ContractSendChannelSettle(Event):
 class ContractSendChannelUpdateTransfer(Event):
     """ Event emitted if the netting channel balance proof must be updated. """
 
+    __slots__ = (
+        'channel_identifier',
+        'token_network_identifier',
+        'balance_proof',
+    )
+
     def __init__(self, channel_identifier, token_network_identifier, balance_proof):
         self.channel_identifier = channel_identifier
         self.token_network_identifier = token_network_identifier
@@ -135,6 +155,12 @@ class ContractSendChannelUpdateTransfer(Event):
 class ContractSendChannelBatchUnlock(Event):
     """ Event emitted when the lock must be claimed on-chain. """
 
+    __slots__ = (
+        'token_network_identifier',
+        'channel_identifier',
+        'merkle_treee_leaves',
+    )
+
     def __init__(self, token_network_identifier, channel_identifier, merkle_treee_leaves):
         self.token_network_identifier = token_network_identifier
         self.channel_identifier = channel_identifier
@@ -162,6 +188,10 @@ class ContractSendChannelBatchUnlock(Event):
 class ContractSendSecretReveal(Event):
     """ Event emitted when the lock must be claimed on-chain. """
 
+    __slots__ = (
+        'secret',
+    )
+
     def __init__(self, secret: typing.Secret):
         if not isinstance(secret, typing.T_Secret):
             raise ValueError('secret must be a Secret instance')
@@ -205,6 +235,12 @@ class EventTransferSentSuccess(Event):
         sucessful but there is no knowledge about the global transfer.
     """
 
+    __slots__ = (
+        'identifier',
+        'amount',
+        'target',
+    )
+
     def __init__(self, identifier, amount, target):
         self.identifier = identifier
         self.amount = amount
@@ -237,6 +273,11 @@ class EventTransferSentFailed(Event):
         has failed, they may infer about lock successes and failures.
     """
 
+    __slots__ = (
+        'identifier',
+        'reason',
+    )
+
     def __init__(self, identifier, reason):
         self.identifier = identifier
         self.reason = reason
@@ -268,6 +309,12 @@ class EventTransferReceivedSuccess(Event):
         there is no correspoding `EventTransferReceivedFailed`.
     """
 
+    __slots__ = (
+        'identifier',
+        'amount',
+        'initiator',
+    )
+
     def __init__(self, identifier, amount, initiator):
         if amount < 0:
             raise ValueError('transferred_amount cannot be negative')
@@ -301,6 +348,11 @@ class EventTransferReceivedSuccess(Event):
 class EventTransferReceivedInvalidDirectTransfer(Event):
     """ Event emitted when an invalid direct transfer is received. """
 
+    __slots__ = (
+        'identifier',
+        'reason',
+    )
+
     def __init__(self, identifier, reason):
         self.identifier = identifier
         self.reason = reason
@@ -322,9 +374,90 @@ class EventTransferReceivedInvalidDirectTransfer(Event):
         return not self.__eq__(other)
 
 
+class EventChannelPruned(Event):
+    """ Event emitted when a finished channel is removed from the node state.
+
+    The final state of the channel is kept with the event in the storage,
+    where it serves the history of the node.
+    """
+
+    __slots__ = (
+        'token_network_identifier',
+        'channel_identifier',
+        'channel_state',
+    )
+
+    def __init__(self, token_network_identifier, channel_identifier, channel_state):
+        self.token_network_identifier = token_network_identifier
+        self.channel_identifier = channel_identifier
+        self.channel_state = channel_state
+
+    def __repr__(self):
+        return '<EventChannelPruned token_network:{} channel:{}>'.format(
+            pex(self.token_network_identifier),
+            pex(self.channel_identifier),
+        )
+
+    def __eq__(self, other):
+        return (
+            isinstance(other, EventChannelPruned) and
+            self.token_network_identifier == other.token_network_identifier and
+            self.channel_identifier == other.channel_identifier and
+            self.channel_state == other.channel_state
+        )
+
+    def __ne__(self, other):
+        return not self.__eq__(other)
+
+
+class EventPaymentTaskPruned(Event):
+    """ Event emitted when a finished payment task is removed from the node
+    state, the final state of the task is kept with the event in the
+    storage.
+    """
+
+    __slots__ = (
+        'secrethash',
+        'token_network_identifier',
+        'payment_identifier',
+        'task',
+    )
+
+    def __init__(self, secrethash, token_network_identifier, payment_identifier, task):
+        self.secrethash = secrethash
+        self.token_network_identifier = token_network_identifier
+        self.payment_identifier = payment_identifier
+        self.task = task
+
+    def __repr__(self):
+        return '<EventPaymentTaskPruned secrethash:{} paymentid:{} task:{}>'.format(
+            pex(self.secrethash),
+            self.payment_identifier,
+            type(self.task).__name__,
+        )
+
+    def __eq__(self, other):
+        return (
+            isinstance(other, EventPaymentTaskPruned) and
+            self.secrethash == other.secrethash and
+            self.token_network_identifier == other.token_network_identifier and
+            self.payment_identifier == other.payment_identifier and
+            self.task == other.task
+        )
+
+    def __ne__(self, other):
+        return not self.__eq__(other)
+
+
 class SendDirectTransfer(SendMessageEvent):
     """ Event emitted when a direct transfer message must be sent. """
 
+    __slots__ = (
+        'payment_identifier',
+        'balance_proof',
+        'token',
+    )
+
     def __init__(
             self,
             recipient,
@@ -370,6 +503,8 @@ class SendDirectTransfer(SendMessageEvent):
 
 
 class SendProcessed(SendMessageEvent):
+    __slots__ = ()
+
     def __repr__(self):
         return (
             '<SendProcessed confirmed_msgid:{} recipient:{}>'
@@ -0,0 +1,147 @@
+""" Secondary indexes of the NodeState.
+
+The views look up token networks and channels by identifier, or the channels
+of a partner, across all the payment networks. Instead of walking the nested
+maps the NodeState keeps indexes of them, which the node state machine
+updates through its writer whenever a payment network, a token network or a
+channel is added or removed.
+
+The indexes only hold identifiers, never the state objects, so they are left
+untouched when the writers copy a token network or a channel and are shared
+between the successive node states. A view must still check that the object
+the index points to exists.
+
+- `tokennetworkidentifiers_to_paymentnetworkidentifiers`: the payment
+  network of each token network.
+- `channelidentifiers_to_tokennetworkidentifiers`: the tuple of the token
+  networks with a channel of that identifier.
+- `partneraddresses_to_channelidentifiers`: the tuple of the
+  (token_network_identifier, channel_identifier) of the channels with that
+  partner.
+"""
+TOKEN_NETWORK_INDEX = 'tokennetworkidentifiers_to_paymentnetworkidentifiers'
+CHANNEL_INDEX = 'channelidentifiers_to_tokennetworkidentifiers'
+PARTNER_INDEX = 'partneraddresses_to_channelidentifiers'
+
+INDEXES = (
+    TOKEN_NETWORK_INDEX,
+    CHANNEL_INDEX,
+    PARTNER_INDEX,
+)
+
+
+class IndexWriter:
+    """ Updates the indexes of a NodeState in place, for the states that are
+    not built by the node state machine.
+    """
+
+    __slots__ = ('node_state',)
+
+    def __init__(self, node_state):
+        self.node_state = node_state
+
+    def set_index(self, index_name, key, value):
+        index = getattr(self.node_state, index_name)
+
+        if value is None:
+            index.pop(key, None)
+        else:
+            index[key] = value
+
+
+def with_item(items, item):
+    if not items:
+        return (item,)
+
+    if item in items:
+        return items
+
+    return items + (item,)
+
+
+def without_item(items, item):
+    """ `items` without `item`, None if nothing is left. """
+    if not items:
+        return None
+
+    return tuple(value for value in items if value != item) or None
+
+
+def index_channel(writer, token_network_identifier, channel_state):
+    node_state = writer.node_state
+    channel_identifier = channel_state.identifier
+    partner_address = channel_state.partner_state.address
+
+    writer.set_index(
+        CHANNEL_INDEX,
+        channel_identifier,
+        with_item(
+            getattr(node_state, CHANNEL_INDEX).get(channel_identifier),
+            token_network_identifier,
+        ),
+    )
+    writer.set_index(
+        PARTNER_INDEX,
+        partner_address,
+        with_item(
+            getattr(node_state, PARTNER_INDEX).get(partner_address),
+            (token_network_identifier, channel_identifier),
+        ),
+    )
+
+
+def unindex_channel(writer, token_network_identifier, channel_state):
+    node_state = writer.node_state
+    channel_identifier = channel_state.identifier
+    partner_address = channel_state.partner_state.address
+
+    writer.set_index(
+        CHANNEL_INDEX,
+        channel_identifier,
+        without_item(
+            getattr(node_state, CHANNEL_INDEX).get(channel_identifier),
+            token_network_identifier,
+        ),
+    )
+    writer.set_index(
+        PARTNER_INDEX,
+        partner_address,
+        without_item(
+            getattr(node_state, PARTNER_INDEX).get(partner_address),
+            (token_network_identifier, channel_identifier),
+        ),
+    )
+
+
+def index_token_network(writer, payment_network_identifier, token_network_state):
+    token_network_identifier = token_network_state.address
+    writer.set_index(TOKEN_NETWORK_INDEX, token_network_identifier, payment_network_identifier)
+
+    for channel_state in token_network_state.channelidentifiers_to_channels.values():
+        index_channel(writer, token_network_identifier, channel_state)
+
+
+def unindex_token_network(writer, token_network_state):
+    token_network_identifier = token_network_state.address
+    writer.set_index(TOKEN_NETWORK_INDEX, token_network_identifier, None)
+
+    for channel_state in token_network_state.channelidentifiers_to_channels.values():
+        unindex_channel(writer, token_network_identifier, channel_state)
+
+
+def index_payment_network(writer, payment_network):
+    token_networks = payment_network.tokenidentifiers_to_tokennetworks
+    for token_network_state in token_networks.values():
+        index_token_network(writer, payment_network.address, token_network_state)
+
+
+def rebuild_indexes(node_state):
+    """ Rebuild the indexes of `node_state` in place, from its payment
+    networks.
+    """
+    for index_name in INDEXES:
+        setattr(node_state, index_name, dict())
+
+    writer = IndexWriter(node_state)
+    for payment_network in node_state.identifiers_to_paymentnetworks.values():
+        index_payment_network(writer, payment_network)
@@ -254,6 +254,61 @@ def handle_secretreveal(
     return iteration
 
 
+def _dispatch_secretrequest(
+        payment_state,
+        state_change,
+        channelidentifiers_to_channels,
+        pseudo_random_generator,
+        block_number,
+):
+    # pylint: disable=unused-argument
+    sub_iteration = initiator.handle_secretrequest(
+        payment_state.initiator,
+        state_change,
+        pseudo_random_generator,
+    )
+    return iteration_from_sub(payment_state, sub_iteration)
+
+
+def _dispatch_cancelpayment(
+        payment_state,
+        state_change,
+        channelidentifiers_to_channels,
+        pseudo_random_generator,
+        block_number,
+):
+    # pylint: disable=unused-argument
+    return handle_cancelpayment(payment_state)
+
+
+def _dispatch_secretreveal(
+        payment_state,
+        state_change,
+        channelidentifiers_to_channels,
+        pseudo_random_generator,
+        block_number,
+):
+    # pylint: disable=unused-argument
+    return handle_secretreveal(
+        payment_state,
+        state_change,
+        channelidentifiers_to_channels,
+        pseudo_random_generator,
+    )
+
+
+# StateChange class -> handler(payment_state, state_change,
+# channelidentifiers_to_channels, pseudo_random_generator, block_number)
+STATE_CHANGE_HANDLERS = {
+    ActionInitInitiator: handle_init,
+    ReceiveSecretRequest: _dispatch_secretrequest,
+    ActionCancelRoute: handle_cancelroute,
+    ReceiveTransferRefundCancelRoute: handle_transferrefundcancelroute,
+    ActionCancelPayment: _dispatch_cancelpayment,
+    ReceiveSecretReveal: _dispatch_secretreveal,
+}
+
+
 def state_transition(
         payment_state: InitiatorPaymentState,
         state_change: StateChange,
@@ -261,51 +316,18 @@ def state_transition(
         pseudo_random_generator: random.Random,
         block_number: typing.BlockNumber,
 ) -> TransitionResult:
-    # pylint: disable=unidiomatic-typecheck
-    if type(state_change) == ActionInitInitiator:
-        iteration = handle_init(
-            payment_state,
-            state_change,
-            channelidentifiers_to_channels,
-            pseudo_random_generator,
-            block_number,
-        )
-    elif type(state_change) == ReceiveSecretRequest:
-        sub_iteration = initiator.handle_secretrequest(
-            payment_state.initiator,
-            state_change,
-            pseudo_random_generator,
-        )
-        iteration = iteration_from_sub(payment_state, sub_iteration)
-    elif type(state_change) == ActionCancelRoute:
-        iteration = handle_cancelroute(
-            payment_state,
-            state_change,
-            channelidentifiers_to_channels,
-            pseudo_random_generator,
-            block_number,
-        )
-    elif type(state_change) == ReceiveTransferRefundCancelRoute:
-        iteration = handle_transferrefundcancelroute(
+    handler = STATE_CHANGE_HANDLERS.get(type(state_change))
+
+    if handler is None:
+        iteration = TransitionResult(payment_state, list())
+    else:
+        iteration = handler(
             payment_state,
             state_change,
             channelidentifiers_to_channels,
             pseudo_random_generator,
             block_number,
         )
-    elif type(state_change) == ActionCancelPayment:
-        iteration = handle_cancelpayment(
-            payment_state,
-        )
-    elif type(state_change) == ReceiveSecretReveal:
-        iteration = handle_secretreveal(
-            payment_state,
-            state_change,
-            channelidentifiers_to_channels,
-            pseudo_random_generator,
-        )
-    else:
-        iteration = TransitionResult(payment_state, list())
 
     sanity_check(iteration.new_state)
 
@@ -787,6 +787,57 @@ def events_for_unlock_if_closed(
     return events
 
 
+def get_pairs_to_unlock_on_close(mediator_state, channel_identifier):
+    """ The pending pairs of `mediator_state` paid through the channel
+    `channel_identifier`, which must be unlocked on chain once the channel
+    is closed.
+    """
+    if mediator_state.secret is None:
+        return list()
+
+    return [
+        pair
+        for pair in get_pending_transfer_pairs(mediator_state.transfers_pair)
+        if pair.payer_transfer.balance_proof.channel_address == channel_identifier and
+        pair.payer_state != 'payer_waiting_unlock'
+    ]
+
+
+def events_for_unlock_on_close(payer_channel, mediator_states):
+    """ Unlock on chain the locks of the closed `payer_channel` for which the
+    `mediator_states` learned the secret before the close.
+
+    The locks of all the mediators are unlocked together, their proofs are
+    computed in a single pass over the merkle tree of the channel.
+    """
+    secrets_and_locks = list()
+
+    for mediator_state in mediator_states:
+        pairs = get_pairs_to_unlock_on_close(mediator_state, payer_channel.identifier)
+
+        for pair in pairs:
+            pair.payer_state = 'payer_waiting_unlock'
+
+        lock = channel.get_lock(payer_channel.partner_state, mediator_state.secrethash)
+        if pairs and lock is not None:
+            secrets_and_locks.append((mediator_state.secret, lock))
+
+    events = list()
+    if secrets_and_locks:
+        unlock_proofs = channel.compute_proofs_for_locks(
+            payer_channel.partner_state,
+            secrets_and_locks,
+        )
+        unlock = ContractSendChannelBatchUnlock(
+            payer_channel.token_network_identifier,
+            payer_channel.identifier,
+            unlock_proofs,
+        )
+        events.append(unlock)
+
+    return events
+
+
 def secret_learned(
         state,
         channelidentifiers_to_channels,
@@ -1017,6 +1068,23 @@ def handle_block(channelidentifiers_to_channels, state, state_change, block_numb
     return iteration
 
 
+def get_block_deadline(mediator_state, channelidentifiers_to_channels):
+    """ A lower bound of the first block for which `handle_block` changes
+    `mediator_state` or produces events, None if there is none.
+    """
+    deadlines = list()
+
+    for pair in get_pending_transfer_pairs(mediator_state.transfers_pair):
+        payer_channel = get_payer_channel(channelidentifiers_to_channels, pair)
+
+        # the secret is revealed on-chain once waiting is not safe
+        deadlines.append(pair.payer_transfer.lock.expiration - payer_channel.reveal_timeout)
+
+        deadlines.append(pair.payee_transfer.lock.expiration + 1)
+
+    return min(deadlines, default=None)
+
+
 def handle_refundtransfer(
         mediator_state: MediatorTransferState,
         mediator_state_change: ReceiveTransferRefund,
@@ -1142,6 +1210,67 @@ def handle_unlock(mediator_state, state_change, channelidentifiers_to_channels):
     return iteration
 
 
+def _dispatch_init(
+        mediator_state,
+        state_change,
+        channelidentifiers_to_channels,
+        pseudo_random_generator,
+        block_number,
+):
+    if mediator_state is not None:
+        return TransitionResult(mediator_state, list())
+
+    return handle_init(
+        state_change,
+        channelidentifiers_to_channels,
+        pseudo_random_generator,
+        block_number,
+    )
+
+
+def _dispatch_block(
+        mediator_state,
+        state_change,
+        channelidentifiers_to_channels,
+        pseudo_random_generator,
+        block_number,
+):
+    # pylint: disable=unused-argument
+    return handle_block(
+        channelidentifiers_to_channels,
+        mediator_state,
+        state_change,
+        block_number,
+    )
+
+
+def _dispatch_unlock(
+        mediator_state,
+        state_change,
+        channelidentifiers_to_channels,
+        pseudo_random_generator,
+        block_number,
+):
+    # pylint: disable=unused-argument
+    return handle_unlock(
+        mediator_state,
+        state_change,
+        channelidentifiers_to_channels,
+    )
+
+
+# StateChange class -> handler(mediator_state, state_change,
+# channelidentifiers_to_channels, pseudo_random_generator, block_number)
+STATE_CHANGE_HANDLERS = {
+    ActionInitMediator: _dispatch_init,
+    Block: _dispatch_block,
+    ReceiveTransferRefund: handle_refundtransfer,
+    ReceiveSecretReveal: handle_secretreveal,
+    ContractReceiveSecretReveal: handle_secretreveal,
+    ReceiveUnlock: _dispatch_unlock,
+}
+
+
 def state_transition(
         mediator_state,
         state_change,
@@ -1150,52 +1279,18 @@ def state_transition(
         block_number,
 ):
     """ State machine for a node mediating a transfer. """
-    # pylint: disable=too-many-branches
     # Notes:
     # - A user cannot cancel a mediated transfer after it was initiated, she
     #   may only reject to mediate before hand. This is because the mediator
     #   doesn't control the secret reveal and needs to wait for the lock
     #   expiration before safely discarding the transfer.
 
-    iteration = TransitionResult(mediator_state, list())
+    handler = STATE_CHANGE_HANDLERS.get(type(state_change))
 
-    if isinstance(state_change, ActionInitMediator):
-        if mediator_state is None:
-            iteration = handle_init(
-                state_change,
-                channelidentifiers_to_channels,
-                pseudo_random_generator,
-                block_number,
-            )
-
-    elif isinstance(state_change, Block):
-        iteration = handle_block(
-            channelidentifiers_to_channels,
-            mediator_state,
-            state_change,
-            block_number,
-        )
-
-    elif isinstance(state_change, ReceiveTransferRefund):
-        iteration = handle_refundtransfer(
-            mediator_state,
-            state_change,
-            channelidentifiers_to_channels,
-            pseudo_random_generator,
-            block_number,
-        )
-
-    elif isinstance(state_change, ReceiveSecretReveal):
-        iteration = handle_secretreveal(
-            mediator_state,
-            state_change,
-            channelidentifiers_to_channels,
-            pseudo_random_generator,
-            block_number,
-        )
-
-    elif isinstance(state_change, ContractReceiveSecretReveal):
-        iteration = handle_secretreveal(
+    if handler is None:
+        iteration = TransitionResult(mediator_state, list())
+    else:
+        iteration = handler(
             mediator_state,
             state_change,
             channelidentifiers_to_channels,
@@ -1203,13 +1298,6 @@ def state_transition(
             block_number,
         )
 
-    elif isinstance(state_change, ReceiveUnlock):
-        iteration = handle_unlock(
-            mediator_state,
-            state_change,
-            channelidentifiers_to_channels,
-        )
-
     # this is the place for paranoia
     if iteration.new_state is not None:
         sanity_check(iteration.new_state)
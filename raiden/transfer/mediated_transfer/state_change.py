@@ -23,6 +23,11 @@ class ActionInitInitiator(StateChange):
         secret: The secret that must be used with the transfer.
     """
 
+    __slots__ = (
+        'transfer',
+        'routes',
+    )
+
     def __init__(self, transfer_description, routes):
         if not isinstance(transfer_description, TransferDescriptionWithSecretState):
             raise ValueError('transfer must be an TransferDescriptionWithSecretState instance.')
@@ -55,6 +60,12 @@ class ActionInitMediator(StateChange):
         from_transfer: The payee transfer.
     """
 
+    __slots__ = (
+        'routes',
+        'from_route',
+        'from_transfer',
+    )
+
     def __init__(
             self,
             routes: typing.List[RouteState],
@@ -98,6 +109,11 @@ class ActionInitTarget(StateChange):
         transfer: The payee transfer.
     """
 
+    __slots__ = (
+        'route',
+        'transfer',
+    )
+
     def __init__(self, route, transfer):
         if not isinstance(route, RouteState):
             raise ValueError('route must be a RouteState instance')
@@ -132,6 +148,12 @@ class ActionCancelRoute(StateChange):
         timeouts.
     """
 
+    __slots__ = (
+        'registry_address',
+        'identifier',
+        'routes',
+    )
+
     def __init__(self, registry_address, identifier, routes):
         self.registry_address = registry_address
         self.identifier = identifier
@@ -157,6 +179,14 @@ class ActionCancelRoute(StateChange):
 class ReceiveSecretRequest(StateChange):
     """ A SecretRequest message received. """
 
+    __slots__ = (
+        'payment_identifier',
+        'amount',
+        'secrethash',
+        'sender',
+        'revealsecret',
+    )
+
     def __init__(self, payment_identifier, amount, secrethash, sender):
         self.payment_identifier = payment_identifier
         self.amount = amount
@@ -189,6 +219,12 @@ class ReceiveSecretRequest(StateChange):
 class ReceiveSecretReveal(StateChange):
     """ A SecretReveal message received. """
 
+    __slots__ = (
+        'secret',
+        'secrethash',
+        'sender',
+    )
+
     def __init__(self, secret, sender):
         secrethash = sha3(secret)
 
@@ -219,6 +255,14 @@ class ReceiveTransferRefundCancelRoute(StateChange):
     route.
     """
 
+    __slots__ = (
+        'sender',
+        'transfer',
+        'routes',
+        'secrethash',
+        'secret',
+    )
+
     def __init__(self, sender, routes, transfer, secret):
         if not isinstance(transfer, LockedTransferSignedState):
             raise ValueError('transfer must be an instance of LockedTransferSignedState')
@@ -254,6 +298,12 @@ class ReceiveTransferRefundCancelRoute(StateChange):
 class ReceiveTransferRefund(StateChange):
     """ A RefundTransfer message received. """
 
+    __slots__ = (
+        'sender',
+        'transfer',
+        'routes',
+    )
+
     def __init__(
             self,
             sender: typing.Address,
@@ -248,52 +248,106 @@ def handle_block(target_state, channel_state, block_number):
     return iteration
 
 
-def state_transition(
+def get_block_deadline(target_state, channel_state):
+    """ A lower bound of the first block for which `handle_block` changes
+    `target_state` or produces events.
+    """
+    # the unsafe region starts before the lock expires
+    return target_state.transfer.lock.expiration - channel_state.reveal_timeout
+
+
+def _dispatch_inittarget(
         target_state,
         state_change,
         channel_state,
         pseudo_random_generator,
         block_number,
 ):
-    """ State machine for the target node of a mediated transfer. """
-    # pylint: disable=too-many-branches,unidiomatic-typecheck
+    # pylint: disable=unused-argument
+    return handle_inittarget(
+        state_change,
+        channel_state,
+        pseudo_random_generator,
+        block_number,
+    )
 
-    iteration = TransitionResult(target_state, list())
 
-    if type(state_change) == ActionInitTarget:
-        iteration = handle_inittarget(
-            state_change,
-            channel_state,
-            pseudo_random_generator,
-            block_number,
-        )
-    elif type(state_change) == Block:
-        assert state_change.block_number == block_number
+def _dispatch_block(
+        target_state,
+        state_change,
+        channel_state,
+        pseudo_random_generator,
+        block_number,
+):
+    # pylint: disable=unused-argument
+    assert state_change.block_number == block_number
 
-        iteration = handle_block(
-            target_state,
-            channel_state,
-            state_change.block_number,
-        )
-    elif type(state_change) == ReceiveSecretReveal:
-        iteration = handle_secretreveal(
-            target_state,
-            state_change,
-            channel_state,
-            pseudo_random_generator,
-        )
-    elif type(state_change) == ContractReceiveSecretReveal:
-        iteration = handle_secretreveal(
-            target_state,
-            state_change,
-            channel_state,
-            pseudo_random_generator,
-        )
-    elif type(state_change) == ReceiveUnlock:
-        iteration = handle_unlock(
-            target_state,
-            state_change,
-            channel_state,
-        )
+    return handle_block(
+        target_state,
+        channel_state,
+        state_change.block_number,
+    )
 
-    return iteration
+
+def _dispatch_secretreveal(
+        target_state,
+        state_change,
+        channel_state,
+        pseudo_random_generator,
+        block_number,
+):
+    # pylint: disable=unused-argument
+    return handle_secretreveal(
+        target_state,
+        state_change,
+        channel_state,
+        pseudo_random_generator,
+    )
+
+
+def _dispatch_unlock(
+        target_state,
+        state_change,
+        channel_state,
+        pseudo_random_generator,
+        block_number,
+):
+    # pylint: disable=unused-argument
+    return handle_unlock(
+        target_state,
+        state_change,
+        channel_state,
+    )
+
+
+# StateChange class -> handler(target_state, state_change, channel_state,
+# pseudo_random_generator, block_number)
+STATE_CHANGE_HANDLERS = {
+    ActionInitTarget: _dispatch_inittarget,
+    Block: _dispatch_block,
+    ReceiveSecretReveal: _dispatch_secretreveal,
+    ContractReceiveSecretReveal: _dispatch_secretreveal,
+    ReceiveUnlock: _dispatch_unlock,
+}
+
+
+def state_transition(
+        target_state,
+        state_change,
+        channel_state,
+        pseudo_random_generator,
+        block_number,
+):
+    """ State machine for the target node of a mediated transfer. """
+    handler = STATE_CHANGE_HANDLERS.get(type(state_change))
+
+    if handler is None:
+        return TransitionResult(target_state, list())
+
+    return handler(
+        target_state,
+        state_change,
+        channel_state,
+        pseudo_random_generator,
+        block_number,
+    )
@@ -1,3 +1,7 @@
+from bisect import bisect_left
+
+from sha3 import keccak_256
+
 from raiden.utils import split_in_pairs
 from raiden.exceptions import HashLengthNot32
 from raiden.utils import sha3
@@ -6,6 +10,9 @@ from raiden.utils import sha3
 LEAVES = 0
 MERKLEROOT = -1
 
+# size of an encoded lock, see `raiden.encoding.messages.Lock`
+LOCK_SIZE = 96
+
 
 def hash_pair(first, second):
     """ Computes the keccak hash of the elements ordered topologically.
@@ -60,6 +67,89 @@ def compute_layers(elements):
     return tree
 
 
+def update_layers(layers, leaves, position):
+    """ Computes the layers of the merkletree for the new `leaves`, from the
+    `layers` of a tree whose leaves before `position` are the same.
+
+    A node only depends on the leaves below it, so the nodes left of the
+    first changed leaf are reused and only the nodes to its right are hashed
+    again. Inserting or removing a leaf shifts the position of the leaves
+    after it, which are paired differently, so the cost is proportional to
+    the number of leaves right of `position`.
+    """
+    tree = [leaves]
+
+    layer = leaves
+    depth = 1
+    while len(layer) > 1:
+        # the first parent with a changed child
+        position = position // 2
+
+        if depth < len(layers):
+            parents = layers[depth][:position]
+        else:
+            parents = []
+
+        for idx in range(len(parents) * 2, len(layer), 2):
+            if idx + 1 < len(layer):
+                parents.append(hash_pair(layer[idx], layer[idx + 1]))
+            else:
+                parents.append(layer[idx])
+
+        layer = parents
+        tree.append(layer)
+        depth += 1
+
+    return tree
+
+
+def compute_layers_with(layers, element):
+    """ Computes the layers of the merkletree with `element` added to the tree
+    of `layers`, the result is the same as `compute_layers`.
+
+    Returns None if the element is already in the tree. `layers` are not
+    modified.
+    """
+    if not isinstance(element, (str, bytes)):
+        raise ValueError('all elements must be str')
+
+    if len(element) != 32:
+        raise HashLengthNot32()
+
+    leaves = layers[LEAVES]
+    position = bisect_left(leaves, element)
+
+    if position < len(leaves) and leaves[position] == element:
+        return None
+
+    leaves = list(leaves)
+    leaves.insert(position, element)
+
+    return update_layers(layers, leaves, position)
+
+
+def compute_layers_without(layers, element):
+    """ Computes the layers of the merkletree with `element` removed from the
+    tree of `layers`, the result is the same as `compute_layers`.
+
+    Returns None if the element is not in the tree and an empty list if it
+    was the last one. `layers` are not modified.
+    """
+    leaves = layers[LEAVES]
+    position = bisect_left(leaves, element)
+
+    if position == len(leaves) or leaves[position] != element:
+        return None
+
+    if len(leaves) == 1:
+        return []
+
+    leaves = list(leaves)
+    del leaves[position]
+
+    return update_layers(layers, leaves, position)
+
+
 def compute_merkleproof_for(merkletree, element):
     """ Containment proof for element.
 
@@ -67,25 +157,64 @@ def compute_merkleproof_for(merkletree, element):
     merkleroot, from the leaf `element` up to `root`.
 
     Raises:
-        IndexError: If the element is not part of the merkletree.
+        ValueError: If the element is not part of the merkletree.
     """
-    idx = merkletree.layers[LEAVES].index(element)
+    leaves = merkletree.layers[LEAVES]
 
-    proof = []
-    for layer in merkletree.layers:
-        if idx % 2:
-            pair = idx - 1
-        else:
-            pair = idx + 1
+    # the leaves are sorted
+    idx = bisect_left(leaves, element)
+    if idx == len(leaves) or leaves[idx] != element:
+        raise ValueError('element is not part of the merkletree')
 
-        # with an odd number of elements the rightmost one does not have a pair.
-        if pair < len(layer):
-            proof.append(layer[pair])
+    return compute_merkleproofs_at(merkletree.layers, [idx])[0]
 
-        # the tree is binary and balanced
-        idx = idx // 2
 
-    return proof
+def compute_merkleproofs_for(merkletree, elements):
+    """ Containment proofs for all the `elements`, in the same order.
+
+    The proofs are built in a single pass over the layers, which is cheaper
+    than calling `compute_merkleproof_for` for each element of a large
+    batch.
+
+    Raises:
+        ValueError: If an element is not part of the merkletree.
+    """
+    leaves = merkletree.layers[LEAVES]
+
+    positions = list()
+    for element in elements:
+        # the leaves are sorted
+        idx = bisect_left(leaves, element)
+        if idx == len(leaves) or leaves[idx] != element:
+            raise ValueError('element is not part of the merkletree')
+
+        positions.append(idx)
+
+    return compute_merkleproofs_at(merkletree.layers, positions)
+
+
+def compute_merkleproofs_at(layers, positions):
+    """ Containment proofs for the leaves at `positions`. """
+    proofs = [list() for _ in positions]
+    positions = list(positions)
+
+    for layer in layers:
+        layer_length = len(layer)
+
+        for proof_idx, idx in enumerate(positions):
+            if idx % 2:
+                pair = idx - 1
+            else:
+                pair = idx + 1
+
+            # with an odd number of elements the rightmost one does not have a pair.
+            if pair < layer_length:
+                proofs[proof_idx].append(layer[pair])
+
+            # the tree is binary and balanced
+            positions[proof_idx] = idx // 2
+
+    return proofs
 
 
 def validate_proof(proof, root, leaf_element):
@@ -109,8 +238,13 @@ def merkleroot(merkletree):
 
 
 def merkle_leaves_from_packed_data(packed_data):
-    number_of_bytes = len(packed_data)
-    leaves = []
-    for i in range(0, number_of_bytes, 96):
-        leaves.append(sha3(packed_data[i: i + 96]))
-    return leaves
+    """ The lockhashes of the locks tightly packed in `packed_data`, in order.
+
+    The locks are hashed from a memoryview over the input, instead of copying
+    each lock to a new bytes object first.
+    """
+    view = memoryview(packed_data)
+    return [
+        keccak_256(view[i: i + LOCK_SIZE]).digest()
+        for i in range(0, len(view), LOCK_SIZE)
+    ]
@@ -11,12 +11,22 @@ from raiden.transfer.mediated_transfer import (
 from raiden.transfer.architecture import (
     SendMessageEvent,
     TransitionResult,
+    copy_on_write,
+    supports_batch,
+    supports_undo_log,
 )
+from raiden.transfer.block_deadlines import IN_TRANSITION, BlockDeadlines
+from raiden.transfer.block_deadlines import invalidate as invalidate_block_deadlines
+from raiden.transfer.path_copy import NodeStateCopy
+from raiden.transfer.undo_log import NodeStateUndo
 from raiden.transfer.events import (
+    EventChannelPruned,
+    EventPaymentTaskPruned,
     EventTransferSentSuccess,
     SendDirectTransfer,
 )
 from raiden.transfer.state import (
+    CHANNEL_STATE_CLOSED,
     NodeState,
     PaymentMappingState,
     PaymentNetworkState,
@@ -78,84 +88,76 @@ def get_token_network_by_token_address(node_state, payment_network_identifier, t
     return token_network_state
 
 
-def subdispatch_to_all_channels(node_state, state_change, block_number):
+def subdispatch_to_channels(writer, state_change, block_number, channel_keys):
+    """ Dispatch the Block to the channels of `channel_keys`, the tuples
+    (token_network_identifier, channel_identifier). The other channels are
+    not copied.
+    """
     events = list()
 
-    for payment_network in node_state.identifiers_to_paymentnetworks.values():
-        for token_network_state in payment_network.tokenaddresses_to_tokennetworks.values():
-            for channel_state in token_network_state.channelidentifiers_to_channels.values():
-                result = channel.state_transition(
-                    channel_state,
-                    state_change,
-                    node_state.pseudo_random_generator,
-                    block_number,
-                )
-                events.extend(result.events)
+    for token_network_identifier, channel_identifier in sorted(channel_keys):
+        token_network_state = writer.token_network(token_network_identifier)
+        result = channel.state_transition(
+            writer.channel(token_network_state, channel_identifier),
+            state_change,
+            writer.pseudo_random_generator(),
+            block_number,
+        )
+        events.extend(result.events)
 
-    return TransitionResult(node_state, events)
+    return TransitionResult(writer.node_state, events)
 
 
-def subdispatch_to_all_lockedtransfers(node_state, state_change):
+def subdispatch_to_lockedtransfers(writer, state_change, secrethashes):
     events = list()
 
-    for secrethash in node_state.payment_mapping.secrethashes_to_task.keys():
-        result = subdispatch_to_paymenttask(node_state, state_change, secrethash)
+    for secrethash in sorted(secrethashes):
+        result = subdispatch_to_paymenttask(writer, state_change, secrethash)
         events.extend(result.events)
 
-    return TransitionResult(node_state, events)
+    return TransitionResult(writer.node_state, events)
 
 
-def subdispatch_to_paymenttask(node_state, state_change, secrethash):
+def subdispatch_to_paymenttask(writer, state_change, secrethash):
+    node_state = writer.node_state
     block_number = node_state.block_number
     sub_task = node_state.payment_mapping.secrethashes_to_task.get(secrethash)
     events = list()
     sub_iteration = None
 
     if sub_task:
-        pseudo_random_generator = node_state.pseudo_random_generator
+        token_network_identifier = sub_task.token_network_identifier
 
         if isinstance(sub_task, PaymentMappingState.InitiatorTask):
-            token_network_identifier = sub_task.token_network_identifier
-            token_network_state = views.get_token_network_by_identifier(
-                node_state,
-                token_network_identifier,
-            )
+            channelidentifiers_to_channels = writer.channels(token_network_identifier)
 
-            if token_network_state:
+            if channelidentifiers_to_channels is not None:
+                sub_task = writer.payment_task(secrethash)
                 sub_iteration = initiator_manager.state_transition(
                     sub_task.manager_state,
                     state_change,
-                    token_network_state.channelidentifiers_to_channels,
-                    pseudo_random_generator,
+                    channelidentifiers_to_channels,
+                    writer.pseudo_random_generator(),
                     block_number,
                 )
                 events = sub_iteration.events
 
         elif isinstance(sub_task, PaymentMappingState.MediatorTask):
-            token_network_identifier = sub_task.token_network_identifier
-            token_network_state = views.get_token_network_by_identifier(
-                node_state,
-                token_network_identifier,
-            )
+            channelidentifiers_to_channels = writer.channels(token_network_identifier)
 
-            if token_network_state:
+            if channelidentifiers_to_channels is not None:
+                sub_task = writer.payment_task(secrethash)
                 sub_iteration = mediator.state_transition(
                     sub_task.mediator_state,
                     state_change,
-                    token_network_state.channelidentifiers_to_channels,
-                    pseudo_random_generator,
+                    channelidentifiers_to_channels,
+                    writer.pseudo_random_generator(),
                     block_number,
                 )
                 events = sub_iteration.events
 
         elif isinstance(sub_task, PaymentMappingState.TargetTask):
-            token_network_identifier = sub_task.token_network_identifier
             channel_identifier = sub_task.channel_identifier
-            token_network_state = views.get_token_network_by_identifier(
-                node_state,
-                token_network_identifier,
-            )
-
             channel_state = views.get_channelstate_by_token_network_identifier(
                 node_state,
                 token_network_identifier,
@@ -163,28 +165,31 @@ def subdispatch_to_paymenttask(node_state, state_change, secrethash):
             )
 
             if channel_state:
+                token_network_state = writer.token_network(token_network_identifier)
+                sub_task = writer.payment_task(secrethash)
                 sub_iteration = target.state_transition(
                     sub_task.target_state,
                     state_change,
-                    channel_state,
-                    pseudo_random_generator,
+                    writer.channel(token_network_state, channel_identifier),
+                    writer.pseudo_random_generator(),
                     block_number,
                 )
                 events = sub_iteration.events
 
         if sub_iteration and sub_iteration.new_state is None:
-            del node_state.payment_mapping.secrethashes_to_task[secrethash]
+            writer.del_payment_task(secrethash)
 
-    return TransitionResult(node_state, events)
+    return TransitionResult(writer.node_state, events)
 
 
 def subdispatch_initiatortask(
-        node_state,
+        writer,
         state_change,
         token_network_identifier,
         secrethash,
 ):
 
+    node_state = writer.node_state
     block_number = node_state.block_number
     sub_task = node_state.payment_mapping.secrethashes_to_task.get(secrethash)
 
@@ -196,23 +201,19 @@ def subdispatch_initiatortask(
         is_valid_subtask = (
             token_network_identifier == sub_task.token_network_identifier
         )
-        manager_state = sub_task.manager_state
+        manager_state = None
+        if is_valid_subtask:
+            manager_state = writer.payment_task(secrethash).manager_state
     else:
         is_valid_subtask = False
 
     events = list()
     if is_valid_subtask:
-        pseudo_random_generator = node_state.pseudo_random_generator
-
-        token_network_state = views.get_token_network_by_identifier(
-            node_state,
-            token_network_identifier,
-        )
         iteration = initiator_manager.state_transition(
             manager_state,
             state_change,
-            token_network_state.channelidentifiers_to_channels,
-            pseudo_random_generator,
+            writer.channels(token_network_identifier),
+            writer.pseudo_random_generator(),
             block_number,
         )
         events = iteration.events
@@ -222,20 +223,21 @@ def subdispatch_initiatortask(
                 token_network_identifier,
                 iteration.new_state,
             )
-            node_state.payment_mapping.secrethashes_to_task[secrethash] = sub_task
+            writer.set_payment_task(secrethash, sub_task)
         elif secrethash in node_state.payment_mapping.secrethashes_to_task:
-            del node_state.payment_mapping.secrethashes_to_task[secrethash]
+            writer.del_payment_task(secrethash)
 
-    return TransitionResult(node_state, events)
+    return TransitionResult(writer.node_state, events)
 
 
 def subdispatch_mediatortask(
-        node_state,
+        writer,
         state_change,
         token_network_identifier,
         secrethash,
 ):
 
+    node_state = writer.node_state
     block_number = node_state.block_number
     sub_task = node_state.payment_mapping.secrethashes_to_task.get(secrethash)
 
@@ -247,23 +249,19 @@ def subdispatch_mediatortask(
         is_valid_subtask = (
             token_network_identifier == sub_task.token_network_identifier
         )
-        mediator_state = sub_task.mediator_state
+        mediator_state = None
+        if is_valid_subtask:
+            mediator_state = writer.payment_task(secrethash).mediator_state
     else:
         is_valid_subtask = False
 
     events = list()
     if is_valid_subtask:
-        token_network_state = views.get_token_network_by_identifier(
-            node_state,
-            token_network_identifier,
-        )
-
-        pseudo_random_generator = node_state.pseudo_random_generator
         iteration = mediator.state_transition(
             mediator_state,
             state_change,
-            token_network_state.channelidentifiers_to_channels,
-            pseudo_random_generator,
+            writer.channels(token_network_identifier),
+            writer.pseudo_random_generator(),
             block_number,
         )
         events = iteration.events
@@ -273,21 +271,22 @@ def subdispatch_mediatortask(
                 token_network_identifier,
                 iteration.new_state,
             )
-            node_state.payment_mapping.secrethashes_to_task[secrethash] = sub_task
+            writer.set_payment_task(secrethash, sub_task)
         elif secrethash in node_state.payment_mapping.secrethashes_to_task:
-            del node_state.payment_mapping.secrethashes_to_task[secrethash]
+            writer.del_payment_task(secrethash)
 
-    return TransitionResult(node_state, events)
+    return TransitionResult(writer.node_state, events)
 
 
 def subdispatch_targettask(
-        node_state,
+        writer,
         state_change,
         token_network_identifier,
         channel_identifier,
         secrethash,
 ):
 
+    node_state = writer.node_state
     block_number = node_state.block_number
     sub_task = node_state.payment_mapping.secrethashes_to_task.get(secrethash)
 
@@ -313,13 +312,15 @@ def subdispatch_targettask(
         )
 
     if channel_state:
-        pseudo_random_generator = node_state.pseudo_random_generator
+        if target_state is not None:
+            target_state = writer.payment_task(secrethash).target_state
 
+        token_network_state = writer.token_network(token_network_identifier)
         iteration = target.state_transition(
             target_state,
             state_change,
-            channel_state,
-            pseudo_random_generator,
+            writer.channel(token_network_state, channel_identifier),
+            writer.pseudo_random_generator(),
             block_number,
         )
         events = iteration.events
@@ -330,19 +331,18 @@ def subdispatch_targettask(
                 channel_identifier,
                 iteration.new_state,
             )
-            node_state.payment_mapping.secrethashes_to_task[secrethash] = sub_task
+            writer.set_payment_task(secrethash, sub_task)
         elif secrethash in node_state.payment_mapping.secrethashes_to_task:
-            del node_state.payment_mapping.secrethashes_to_task[secrethash]
+            writer.del_payment_task(secrethash)
 
-    return TransitionResult(node_state, events)
+    return TransitionResult(writer.node_state, events)
 
 
-def maybe_add_tokennetwork(node_state, payment_network_identifier, token_network_state):
-    token_network_identifier = token_network_state.address
+def maybe_add_tokennetwork(writer, payment_network_identifier, token_network_state):
     token_address = token_network_state.token_address
 
     payment_network_state, token_network_state_previous = get_networks(
-        node_state,
+        writer.node_state,
         payment_network_identifier,
         token_address,
     )
@@ -352,86 +352,394 @@ def maybe_add_tokennetwork(node_state, payment_network_identifier, token_network
             payment_network_identifier,
             [token_network_state],
         )
-
-        ids_to_payments = node_state.identifiers_to_paymentnetworks
-        ids_to_payments[payment_network_identifier] = payment_network_state
+        writer.add_payment_network(payment_network_state)
 
     if token_network_state_previous is None:
-        ids_to_tokens = payment_network_state.tokenidentifiers_to_tokennetworks
-        addrs_to_tokens = payment_network_state.tokenaddresses_to_tokennetworks
+        writer.add_token_network(payment_network_identifier, token_network_state)
+
+
+def get_payment_identifier(task):
+    if isinstance(task, PaymentMappingState.MediatorTask):
+        transfers_pair = task.mediator_state.transfers_pair
+        if transfers_pair:
+            return transfers_pair[0].payer_transfer.payment_identifier
+
+    elif isinstance(task, PaymentMappingState.TargetTask):
+        return task.target_state.transfer.payment_identifier
+
+    return None
+
+
+def is_payment_task_finished(node_state, task):
+    """ True if nothing can change the outcome of the payment `task`
+    anymore. The tasks which are cleaned up by their state machines are
+    not considered.
+    """
+    if isinstance(task, PaymentMappingState.MediatorTask):
+        transfers_pair = task.mediator_state.transfers_pair
+        return bool(transfers_pair) and not mediator.get_pending_transfer_pairs(transfers_pair)
+
+    if isinstance(task, PaymentMappingState.TargetTask):
+        channel_state = views.get_channelstate_by_token_network_identifier(
+            node_state,
+            task.token_network_identifier,
+            task.channel_identifier,
+        )
+        return channel_state is None or task.target_state.state == 'expired'
+
+    return False
+
+
+def get_target_tasks_of_channels(node_state, channel_keys):
+    return {
+        secrethash
+        for secrethash, task in node_state.payment_mapping.secrethashes_to_task.items()
+        if isinstance(task, PaymentMappingState.TargetTask) and
+        (task.token_network_identifier, task.channel_identifier) in channel_keys
+    }
+
 
-        ids_to_tokens[token_network_identifier] = token_network_state
-        addrs_to_tokens[token_address] = token_network_state
+def prune_finished_payment_tasks(writer, secrethashes):
+    payment_tasks = writer.node_state.payment_mapping.secrethashes_to_task
+
+    pruned_events = list()
+    for secrethash in sorted(secrethashes):
+        task = payment_tasks.get(secrethash)
+
+        if task is not None and is_payment_task_finished(writer.node_state, task):
+            writer.del_payment_task(secrethash)
+            pruned_events.append(EventPaymentTaskPruned(
+                secrethash,
+                task.token_network_identifier,
+                get_payment_identifier(task),
+                task,
+            ))
+
+            # the mapping is replaced by the first modification of a copy
+            payment_tasks = writer.node_state.payment_mapping.secrethashes_to_task
+
+    return pruned_events
+
+
+def prune_released_channels(writer, removed_tasks):
+    """ Remove the finished channels which were kept for the `removed_tasks`
+    and are not used by another payment task.
+    """
+    channel_keys = set()
+    for task in removed_tasks:
+        channel_keys.update(views.get_payment_task_channels(task))
+
+    pruned_events = list()
+    for token_network_identifier, channel_identifier in sorted(channel_keys):
+        channel_state = views.get_channelstate_by_token_network_identifier(
+            writer.node_state,
+            token_network_identifier,
+            channel_identifier,
+        )
+
+        is_released = (
+            channel_state is not None and
+            channel.is_finished(channel_state) and
+            not views.is_channel_used_by_payment_tasks(
+                writer.node_state,
+                token_network_identifier,
+                channel_identifier,
+            )
+        )
+        if is_released:
+            pruned_events.append(token_network.prune_channel(
+                writer,
+                writer.token_network(token_network_identifier),
+                channel_state,
+            ))
+
+    return pruned_events
+
+
+def prune_payment_tasks(writer, events):
+    """ Remove the finished payment tasks changed by the transition, or
+    which lost their channel, from the node state, then the finished
+    channels which were kept for the removed tasks. Return the events with
+    their final states.
+    """
+    pruned_channels = {
+        (event.token_network_identifier, event.channel_identifier)
+        for event in events
+        if isinstance(event, EventChannelPruned)
+    }
+
+    secrethashes = set(writer.changed_payment_tasks)
+    if pruned_channels:
+        secrethashes.update(get_target_tasks_of_channels(writer.node_state, pruned_channels))
+
+    pruned_events = prune_finished_payment_tasks(writer, secrethashes)
+
+    # the tasks removed by their state machines are in the list too
+    removed_tasks = writer.removed_payment_tasks
+    writer.removed_payment_tasks = list()
+
+    channel_events = prune_released_channels(writer, removed_tasks)
+    if channel_events:
+        pruned_events.extend(channel_events)
+
+        # the target tasks don't hold their channels, there is no need to
+        # look for released channels again
+        pruned_events.extend(prune_finished_payment_tasks(
+            writer,
+            get_target_tasks_of_channels(writer.node_state, {
+                (event.token_network_identifier, event.channel_identifier)
+                for event in channel_events
+            }),
+        ))
+        writer.removed_payment_tasks.clear()
+
+    return pruned_events
 
 
 def sanity_check(iteration):
     assert isinstance(iteration.new_state, NodeState)
 
 
-def handle_block(node_state, state_change):
+def get_payment_task_block_deadline(node_state, task):
+    """ The block deadline of the payment `task`, see
+    `raiden.transfer.block_deadlines`.
+    """
+    token_network_identifier = task.token_network_identifier
+
+    if isinstance(task, PaymentMappingState.MediatorTask):
+        token_network_state = views.get_token_network_by_identifier(
+            node_state,
+            token_network_identifier,
+        )
+
+        if token_network_state is not None:
+            return mediator.get_block_deadline(
+                task.mediator_state,
+                token_network_state.channelidentifiers_to_channels,
+            )
+
+    elif isinstance(task, PaymentMappingState.TargetTask):
+        channel_state = views.get_channelstate_by_token_network_identifier(
+            node_state,
+            token_network_identifier,
+            task.channel_identifier,
+        )
+
+        if channel_state is not None:
+            return target.get_block_deadline(task.target_state, channel_state)
+
+    # the initiator does not handle blocks
+    return None
+
+
+def schedule_channel(node_state, block_deadlines, token_network_identifier, channel_identifier):
+    channel_state = views.get_channelstate_by_token_network_identifier(
+        node_state,
+        token_network_identifier,
+        channel_identifier,
+    )
+
+    if channel_state is not None:
+        deadline = channel.get_block_deadline(channel_state)
+
+        if deadline is not None:
+            block_deadlines.push_channel(deadline, token_network_identifier, channel_identifier)
+
+
+def schedule_payment_task(node_state, block_deadlines, secrethash):
+    task = node_state.payment_mapping.secrethashes_to_task.get(secrethash)
+
+    if task is not None:
+        deadline = get_payment_task_block_deadline(node_state, task)
+
+        if deadline is not None:
+            block_deadlines.push_payment_task(deadline, secrethash)
+
+
+def rebuild_block_deadlines(node_state, block_deadlines):
+    block_deadlines.clear()
+
+    for payment_network in node_state.identifiers_to_paymentnetworks.values():
+        token_networks = payment_network.tokenidentifiers_to_tokennetworks
+        for token_network_identifier, token_network_state in token_networks.items():
+            for channel_identifier in token_network_state.channelidentifiers_to_channels:
+                schedule_channel(
+                    node_state,
+                    block_deadlines,
+                    token_network_identifier,
+                    channel_identifier,
+                )
+
+    for secrethash in node_state.payment_mapping.secrethashes_to_task:
+        schedule_payment_task(node_state, block_deadlines, secrethash)
+
+
+def begin_block_deadlines(writer, node_state, undo_log):
+    """ Prepare the block deadlines index for a transition of `node_state`
+    and return it.
+
+    The index is marked as invalid until the transition finishes, so that it
+    is rebuilt if the transition fails half way.
+    """
+    block_deadlines = getattr(writer.node_state, 'block_deadlines', None)
+
+    if block_deadlines is None:
+        # restored from storage
+        block_deadlines = BlockDeadlines()
+        writer.node_state.block_deadlines = block_deadlines
+
+    if block_deadlines.node_state is node_state:
+        block_deadlines.node_state = IN_TRANSITION
+    else:
+        block_deadlines.node_state = None
+
+    if undo_log is not None:
+        undo_log.record(invalidate_block_deadlines, block_deadlines)
+
+    return block_deadlines
+
+
+def end_block_deadlines(writer, block_deadlines):
+    """ Schedule the channels and payment tasks changed by the transition. """
+    node_state = writer.node_state
+
+    # the index is only kept up to date once it was built by a Block, and it
+    # is replaced with the node state by an ActionInitNode
+    is_valid = (
+        node_state.block_deadlines is block_deadlines and
+        block_deadlines.node_state is IN_TRANSITION
+    )
+
+    if is_valid:
+        for token_network_identifier, channel_identifier in writer.changed_channels:
+            schedule_channel(
+                node_state,
+                block_deadlines,
+                token_network_identifier,
+                channel_identifier,
+            )
+
+        for secrethash in writer.changed_payment_tasks:
+            schedule_payment_task(node_state, block_deadlines, secrethash)
+
+        block_deadlines.node_state = node_state
+
+    writer.changed_channels.clear()
+    writer.changed_payment_tasks.clear()
+
+
+def pop_due(node_state, block_deadlines, block_number):
+    """ Return the tuple (channel_keys, secrethashes) of the objects the
+    Block for `block_number` must be dispatched to.
+    """
+    if block_deadlines.node_state is not IN_TRANSITION:
+        rebuild_block_deadlines(node_state, block_deadlines)
+        block_deadlines.node_state = IN_TRANSITION
+
+    channel_keys, secrethashes = block_deadlines.pop_due(block_number)
+
+    # the deadlines may be stale, the objects changed since they were scheduled
+    due_channel_keys = list()
+    for token_network_identifier, channel_identifier in channel_keys:
+        channel_state = views.get_channelstate_by_token_network_identifier(
+            node_state,
+            token_network_identifier,
+            channel_identifier,
+        )
+
+        if channel_state is not None and channel.is_changed_by_block(channel_state, block_number):
+            due_channel_keys.append((token_network_identifier, channel_identifier))
+        else:
+            schedule_channel(
+                node_state,
+                block_deadlines,
+                token_network_identifier,
+                channel_identifier,
+            )
+
+    due_secrethashes = list()
+    for secrethash in secrethashes:
+        task = node_state.payment_mapping.secrethashes_to_task.get(secrethash)
+        deadline = None
+
+        if task is not None:
+            deadline = get_payment_task_block_deadline(node_state, task)
+
+        if deadline is not None and deadline <= block_number:
+            due_secrethashes.append(secrethash)
+        elif deadline is not None:
+            block_deadlines.push_payment_task(deadline, secrethash)
+
+    return due_channel_keys, due_secrethashes
+
+
+def handle_block(writer, state_change):
     block_number = state_change.block_number
-    node_state.block_number = block_number
+    writer.node_state.block_number = block_number
+
+    channel_keys, secrethashes = pop_due(
+        writer.node_state,
+        writer.node_state.block_deadlines,
+        block_number,
+    )
+
+    # scheduled again after the transition, even if they are left unchanged
+    writer.changed_channels.update(channel_keys)
+    writer.changed_payment_tasks.update(secrethashes)
 
     # Subdispatch Block state change
-    channels_result = subdispatch_to_all_channels(
-        node_state,
+    channels_result = subdispatch_to_channels(
+        writer,
         state_change,
         block_number,
+        channel_keys,
     )
-    transfers_result = subdispatch_to_all_lockedtransfers(
-        node_state,
+    transfers_result = subdispatch_to_lockedtransfers(
+        writer,
         state_change,
+        secrethashes,
     )
     events = channels_result.events + transfers_result.events
-    return TransitionResult(node_state, events)
+    return TransitionResult(writer.node_state, events)
 
 
-def handle_node_init(node_state, state_change):
-    node_state = NodeState(
+def handle_node_init(writer, state_change):
+    writer.node_state = NodeState(
         state_change.pseudo_random_generator,
         state_change.block_number,
     )
     events = list()
-    return TransitionResult(node_state, events)
+    return TransitionResult(writer.node_state, events)
 
 
-def handle_token_network_action(node_state, state_change):
-    token_network_state = views.get_token_network_by_identifier(
-        node_state,
-        state_change.token_network_identifier,
-    )
+def handle_token_network_action(writer, state_change):
+    token_network_state = writer.token_network(state_change.token_network_identifier)
 
     events = list()
     if token_network_state:
-        pseudo_random_generator = node_state.pseudo_random_generator
         iteration = token_network.state_transition(
+            writer,
             token_network_state,
             state_change,
-            pseudo_random_generator,
-            node_state.block_number,
+            writer.pseudo_random_generator(),
+            writer.node_state.block_number,
         )
 
         if iteration.new_state is None:
             payment_network_state = views.search_payment_network_by_token_network_id(
-                node_state,
+                writer.node_state,
                 state_change.token_network_identifier,
             )
-
-            del payment_network_state.tokenaddresses_to_tokennetworks[
-                token_network_state.token_address
-            ]
-            del payment_network_state.tokenidentifiers_to_tokennetworks[
-                token_network_state.address
-            ]
+            writer.remove_token_network(payment_network_state.address, token_network_state)
 
         events = iteration.events
 
-    return TransitionResult(node_state, events)
+    return TransitionResult(writer.node_state, events)
 
 
-def handle_delivered(node_state, state_change):
+def handle_delivered(writer, state_change):
     # TODO: improve the complexity of this algorithm
-    for queueid, queue in node_state.queueids_to_queues.items():
+    for queueid, queue in writer.node_state.queueids_to_queues.items():
         if queueid[1] == 'global':
             remove = []
 
@@ -439,148 +747,184 @@ def handle_delivered(node_state, state_change):
                 if message.message_identifier == state_change.message_identifier:
                     remove.append(pos)
 
+            if remove:
+                queue = writer.queue(queueid)
+
             for removepos in reversed(remove):
                 queue.pop(removepos)
 
-    return TransitionResult(node_state, [])
+    return TransitionResult(writer.node_state, [])
 
 
-def handle_new_token_network(node_state, state_change):
+def handle_new_token_network(writer, state_change):
     token_network_state = state_change.token_network
     payment_network_identifier = state_change.payment_network_identifier
 
     maybe_add_tokennetwork(
-        node_state,
+        writer,
         payment_network_identifier,
         token_network_state,
     )
 
     events = list()
-    return TransitionResult(node_state, events)
+    return TransitionResult(writer.node_state, events)
 
 
-def handle_node_change_network_state(node_state, state_change):
+def handle_node_change_network_state(writer, state_change):
     events = list()
 
     node_address = state_change.node_address
     network_state = state_change.network_state
-    node_state.nodeaddresses_to_networkstates[node_address] = network_state
+    writer.set_network_state(node_address, network_state)
 
-    return TransitionResult(node_state, events)
+    return TransitionResult(writer.node_state, events)
 
 
-def handle_leave_all_networks(node_state):
+def handle_leave_all_networks(writer, state_change):  # pylint: disable=unused-argument
     events = list()
 
-    for payment_network_state in node_state.identifiers_to_paymentnetworks.values():
-        for token_network_state in payment_network_state.tokenaddresses_to_tokennetworks.values():
-            for channel_state in token_network_state.partneraddresses_to_channels.values():
+    payment_networks = writer.node_state.identifiers_to_paymentnetworks
+    for payment_network_state in list(payment_networks.values()):
+        token_networks = payment_network_state.tokenaddresses_to_tokennetworks
+        for token_network_state in list(token_networks.values()):
+            token_network_state = writer.token_network(token_network_state.address)
+            partner_channels = token_network_state.partneraddresses_to_channels
+
+            for channel_state in list(partner_channels.values()):
                 events.extend(channel.events_for_close(
-                    channel_state,
-                    node_state.block_number,
+                    writer.channel(token_network_state, channel_state.identifier),
+                    writer.node_state.block_number,
                 ))
 
-    return TransitionResult(node_state, events)
+    return TransitionResult(writer.node_state, events)
 
 
-def handle_new_payment_network(node_state, state_change):
+def handle_new_payment_network(writer, state_change):
     events = list()
 
     payment_network = state_change.payment_network
     payment_network_identifier = payment_network.address
-    if payment_network_identifier not in node_state.identifiers_to_paymentnetworks:
-        node_state.identifiers_to_paymentnetworks[payment_network_identifier] = payment_network
+    if payment_network_identifier not in writer.node_state.identifiers_to_paymentnetworks:
+        writer.add_payment_network(payment_network)
 
-    return TransitionResult(node_state, events)
+    return TransitionResult(writer.node_state, events)
 
 
-def handle_tokenadded(node_state, state_change):
+def handle_tokenadded(writer, state_change):
     events = list()
     maybe_add_tokennetwork(
-        node_state,
+        writer,
         state_change.payment_network_identifier,
         state_change.token_network,
     )
 
-    return TransitionResult(node_state, events)
+    return TransitionResult(writer.node_state, events)
 
 
 def handle_channel_batch_unlock(
-        node_state: NodeState,
+        writer,
         state_change: ContractReceiveChannelBatchUnlock,
 ) -> TransitionResult:
     token_network_identifier = state_change.token_network_identifier
-    token_network_state = views.get_token_network_by_identifier(
-        node_state,
-        token_network_identifier,
-    )
+    token_network_state = writer.token_network(token_network_identifier)
 
     events = []
     if token_network_state:
-        pseudo_random_generator = node_state.pseudo_random_generator
         sub_iteration = token_network.subdispatch_to_channel_by_id(
+            writer,
             token_network_state,
             state_change,
-            pseudo_random_generator,
-            node_state.block_number,
+            writer.pseudo_random_generator(),
+            writer.node_state.block_number,
         )
         events.extend(sub_iteration.events)
 
         if sub_iteration.new_state is None:
             payment_network_state = views.get_payment_network_by_identifier(
-                node_state,
+                writer.node_state,
                 token_network_state.address,
             )
+            writer.remove_token_network(payment_network_state.address, token_network_state)
+
+    return TransitionResult(writer.node_state, events)
+
+
+def handle_channel_closed(writer, state_change):
+    iteration = handle_token_network_action(writer, state_change)
+
+    token_network_identifier = state_change.token_network_identifier
+    channel_identifier = state_change.channel_identifier
+    channel_state = views.get_channelstate_by_token_network_identifier(
+        writer.node_state,
+        token_network_identifier,
+        channel_identifier,
+    )
 
-            del payment_network_state.tokenaddresses_to_tokennetworks[
-                token_network_state.token_address
+    if channel_state and channel.get_status(channel_state) == CHANNEL_STATE_CLOSED:
+        # the mediators which learned the secret before the close unlock
+        # their locks of the channel together
+        secrethashes = [
+            secrethash
+            for secrethash, task in writer.node_state.payment_mapping.secrethashes_to_task.items()
+            if isinstance(task, PaymentMappingState.MediatorTask) and
+            task.token_network_identifier == token_network_identifier and
+            mediator.get_pairs_to_unlock_on_close(task.mediator_state, channel_identifier)
+        ]
+
+        if secrethashes:
+            mediator_states = [
+                writer.payment_task(secrethash).mediator_state
+                for secrethash in sorted(secrethashes)
             ]
-            del payment_network_state.tokenidentifiers_to_tokennetworks[token_network_identifier]
+            iteration.events.extend(mediator.events_for_unlock_on_close(
+                channel_state,
+                mediator_states,
+            ))
 
-    return TransitionResult(node_state, events)
+    return iteration
 
 
-def handle_secret_reveal(node_state, state_change):
+def handle_secret_reveal(writer, state_change):
     return subdispatch_to_paymenttask(
-        node_state,
+        writer,
         state_change,
         state_change.secrethash,
     )
 
 
-def handle_init_initiator(node_state, state_change):
+def handle_init_initiator(writer, state_change):
     transfer = state_change.transfer
     secrethash = transfer.secrethash
 
     return subdispatch_initiatortask(
-        node_state,
+        writer,
         state_change,
         transfer.token_network_identifier,
         secrethash,
     )
 
 
-def handle_init_mediator(node_state, state_change):
+def handle_init_mediator(writer, state_change):
     transfer = state_change.from_transfer
     secrethash = transfer.lock.secrethash
     token_network_identifier = transfer.balance_proof.token_network_identifier
 
     return subdispatch_mediatortask(
-        node_state,
+        writer,
         state_change,
         token_network_identifier,
         secrethash,
     )
 
 
-def handle_init_target(node_state, state_change):
+def handle_init_target(writer, state_change):
     transfer = state_change.transfer
     secrethash = transfer.lock.secrethash
     channel_identifier = transfer.balance_proof.channel_address
     token_network_identifier = transfer.balance_proof.token_network_identifier
 
     return subdispatch_targettask(
-        node_state,
+        writer,
         state_change,
         token_network_identifier,
         channel_identifier,
@@ -588,31 +932,31 @@ def handle_init_target(node_state, state_change):
     )
 
 
-def handle_receive_transfer_refund(node_state, state_change):
+def handle_receive_transfer_refund(writer, state_change):
     return subdispatch_to_paymenttask(
-        node_state,
+        writer,
         state_change,
         state_change.transfer.lock.secrethash,
     )
 
 
-def handle_receive_transfer_refund_cancel_route(node_state, state_change):
+def handle_receive_transfer_refund_cancel_route(writer, state_change):
     return subdispatch_to_paymenttask(
-        node_state,
+        writer,
         state_change,
         state_change.transfer.lock.secrethash,
     )
 
 
-def handle_receive_secret_request(node_state, state_change):
+def handle_receive_secret_request(writer, state_change):
     secrethash = state_change.secrethash
-    return subdispatch_to_paymenttask(node_state, state_change, secrethash)
+    return subdispatch_to_paymenttask(writer, state_change, secrethash)
 
 
-def handle_processed(node_state, state_change):
+def handle_processed(writer, state_change):
     # TODO: improve the complexity of this algorithm
     events = list()
-    for queue in node_state.queueids_to_queues.values():
+    for queueid, queue in writer.node_state.queueids_to_queues.items():
         remove = []
 
         # TODO: ensure Processed message came from the correct peer
@@ -626,161 +970,93 @@ def handle_processed(node_state, state_change):
                     ))
                 remove.append(pos)
 
+        if remove:
+            queue = writer.queue(queueid)
+
         for removepos in reversed(remove):
             queue.pop(removepos)
 
-    return TransitionResult(node_state, events)
+    return TransitionResult(writer.node_state, events)
 
 
-def handle_receive_unlock(node_state, state_change):
+def handle_receive_unlock(writer, state_change):
     secrethash = state_change.secrethash
-    return subdispatch_to_paymenttask(node_state, state_change, secrethash)
-
-
-def state_transition(node_state, state_change):
-    # pylint: disable=too-many-branches,unidiomatic-typecheck
-
-    if type(state_change) == Block:
-        iteration = handle_block(
-            node_state,
-            state_change,
-        )
-    elif type(state_change) == ActionInitNode:
-        iteration = handle_node_init(
-            node_state,
-            state_change,
-        )
-    elif type(state_change) == ActionNewTokenNetwork:
-        iteration = handle_new_token_network(
-            node_state,
-            state_change,
-        )
-    elif type(state_change) == ActionChannelClose:
-        iteration = handle_token_network_action(
-            node_state,
-            state_change,
-        )
-    elif type(state_change) == ActionChangeNodeNetworkState:
-        iteration = handle_node_change_network_state(
-            node_state,
-            state_change,
-        )
-    elif type(state_change) == ActionTransferDirect:
-        iteration = handle_token_network_action(
-            node_state,
-            state_change,
-        )
-    elif type(state_change) == ActionLeaveAllNetworks:
-        iteration = handle_leave_all_networks(
-            node_state,
-        )
-    elif type(state_change) == ActionInitInitiator:
-        iteration = handle_init_initiator(
-            node_state,
-            state_change,
-        )
-    elif type(state_change) == ActionInitMediator:
-        iteration = handle_init_mediator(
-            node_state,
-            state_change,
-        )
-    elif type(state_change) == ActionInitTarget:
-        iteration = handle_init_target(
-            node_state,
-            state_change,
-        )
-    elif type(state_change) == ContractReceiveNewPaymentNetwork:
-        iteration = handle_new_payment_network(
-            node_state,
-            state_change,
-        )
-    elif type(state_change) == ContractReceiveNewTokenNetwork:
-        iteration = handle_tokenadded(
-            node_state,
-            state_change,
-        )
-    elif type(state_change) == ContractReceiveChannelBatchUnlock:
-        iteration = handle_channel_batch_unlock(
-            node_state,
-            state_change,
-        )
-    elif type(state_change) == ContractReceiveChannelNew:
-        iteration = handle_token_network_action(
-            node_state,
-            state_change,
-        )
-    elif type(state_change) == ContractReceiveChannelClosed:
-        iteration = handle_token_network_action(
-            node_state,
-            state_change,
-        )
-    elif type(state_change) == ContractReceiveChannelNewBalance:
-        iteration = handle_token_network_action(
-            node_state,
-            state_change,
-        )
-    elif type(state_change) == ContractReceiveChannelSettled:
-        iteration = handle_token_network_action(
-            node_state,
-            state_change,
-        )
-    elif type(state_change) == ContractReceiveRouteNew:
-        iteration = handle_token_network_action(
-            node_state,
-            state_change,
-        )
-    elif type(state_change) == ContractReceiveSecretReveal:
-        iteration = handle_secret_reveal(
-            node_state,
-            state_change,
-        )
-    elif type(state_change) == ReceiveDelivered:
-        iteration = handle_delivered(
-            node_state,
-            state_change,
-        )
-    elif type(state_change) == ReceiveTransferDirect:
-        iteration = handle_token_network_action(
-            node_state,
-            state_change,
-        )
-    elif type(state_change) == ReceiveSecretReveal:
-        iteration = handle_secret_reveal(
-            node_state,
-            state_change,
-        )
-    elif type(state_change) == ReceiveTransferRefundCancelRoute:
-        iteration = handle_receive_transfer_refund_cancel_route(
-            node_state,
-            state_change,
-        )
-    elif type(state_change) == ReceiveTransferRefund:
-        iteration = handle_receive_transfer_refund(
-            node_state,
-            state_change,
-        )
-    elif type(state_change) == ReceiveSecretRequest:
-        iteration = handle_receive_secret_request(
-            node_state,
-            state_change,
-        )
-    elif type(state_change) == ReceiveProcessed:
-        iteration = handle_processed(
-            node_state,
-            state_change,
-        )
-    elif type(state_change) == ReceiveUnlock:
-        iteration = handle_receive_unlock(
-            node_state,
-            state_change,
-        )
+    return subdispatch_to_paymenttask(writer, state_change, secrethash)
+
+
+# StateChange class -> handler(writer, state_change)
+STATE_CHANGE_HANDLERS = {
+    Block: handle_block,
+    ActionInitNode: handle_node_init,
+    ActionNewTokenNetwork: handle_new_token_network,
+    ActionChannelClose: handle_token_network_action,
+    ActionChangeNodeNetworkState: handle_node_change_network_state,
+    ActionTransferDirect: handle_token_network_action,
+    ActionLeaveAllNetworks: handle_leave_all_networks,
+    ActionInitInitiator: handle_init_initiator,
+    ActionInitMediator: handle_init_mediator,
+    ActionInitTarget: handle_init_target,
+    ContractReceiveNewPaymentNetwork: handle_new_payment_network,
+    ContractReceiveNewTokenNetwork: handle_tokenadded,
+    ContractReceiveChannelBatchUnlock: handle_channel_batch_unlock,
+    ContractReceiveChannelNew: handle_token_network_action,
+    ContractReceiveChannelClosed: handle_channel_closed,
+    ContractReceiveChannelNewBalance: handle_token_network_action,
+    ContractReceiveChannelSettled: handle_token_network_action,
+    ContractReceiveRouteNew: handle_token_network_action,
+    ContractReceiveSecretReveal: handle_secret_reveal,
+    ReceiveDelivered: handle_delivered,
+    ReceiveTransferDirect: handle_token_network_action,
+    ReceiveSecretReveal: handle_secret_reveal,
+    ReceiveTransferRefundCancelRoute: handle_receive_transfer_refund_cancel_route,
+    ReceiveTransferRefund: handle_receive_transfer_refund,
+    ReceiveSecretRequest: handle_receive_secret_request,
+    ReceiveProcessed: handle_processed,
+    ReceiveUnlock: handle_receive_unlock,
+}
+
+
+@copy_on_write
+@supports_undo_log
+@supports_batch
+def state_transition(node_state, state_change, undo_log=None, batch=None):
+    """ Apply `state_change` to `node_state` and return the TransitionResult
+    with the new node state.
+
+    `node_state` is not modified, the new state shares all the objects the
+    transition does not change with it. If `undo_log` is given `node_state`
+    is modified in place instead, and the modifications are recorded in it.
+
+    Within a `batch` the writer is shared by the transitions, so an object
+    is copied or recorded at most once for the whole batch.
+    """
+    writer = batch.writer if batch is not None else None
+
+    if writer is None or writer.node_state is not node_state:
+        if undo_log is None:
+            writer = NodeStateCopy(node_state)
+        else:
+            writer = NodeStateUndo(node_state, undo_log)
+
+        if batch is not None:
+            batch.writer = writer
+
+    block_deadlines = None
+    if node_state is not None:
+        block_deadlines = begin_block_deadlines(writer, node_state, undo_log)
+
+    iteration = STATE_CHANGE_HANDLERS[type(state_change)](writer, state_change)
+
+    # the finished channels are pruned by the token networks
+    iteration.events.extend(prune_payment_tasks(writer, iteration.events))
 
     sanity_check(iteration)
 
     for event in iteration.events:
         if isinstance(event, SendMessageEvent):
             queueid = (event.recipient, event.queue_name)
-            queue = node_state.queueids_to_queues.setdefault(queueid, [])
-            queue.append(event)
+            writer.queue(queueid).append(event)
+
+    end_block_deadlines(writer, block_deadlines)
 
     return iteration
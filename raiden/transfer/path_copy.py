@@ -0,0 +1,314 @@
+""" Path copying of the NodeState.
+
+A state transition must never modify the state it is given. Instead of a deep
+copy of the whole NodeState, the node state machine copies the path from the
+root to the objects it changes: the containers on the way are copied
+shallowly, the channels and the payment tasks, which their state machines
+modify in place, are deep copied. Everything else is shared with the
+previous state.
+
+The node state machine does every modification through a writer, either a
+`NodeStateCopy` or a `raiden.transfer.undo_log.NodeStateUndo`. The objects
+returned by the writer can be modified in place, the attributes of
+`writer.node_state` can be assigned directly. The writer keeps the keys of
+the channels and payment tasks it made writable in `changed_channels` and
+`changed_payment_tasks`, for the block deadlines index, the payment tasks it
+removed in `removed_payment_tasks`, and it updates the secondary indexes of
+`raiden.transfer.indexes`.
+"""
+import copy
+from collections.abc import Mapping
+
+from raiden.transfer import indexes
+
+
+class NodeStateCopy:
+    """ The next NodeState, built by a single state transition.
+
+    Every object is copied at most once, the copies are private to the new
+    state and can be modified in place by the transition.
+    """
+
+    __slots__ = (
+        'previous_state',
+        'node_state',
+        'private',
+        'changed_channels',
+        'changed_payment_tasks',
+        'removed_payment_tasks',
+    )
+
+    def __init__(self, node_state):
+        # keeps the objects of the previous state alive, so their ids are
+        # never mistaken for the id of a copy
+        self.previous_state = node_state
+        self.node_state = copy.copy(node_state)
+        self.private = {id(self.node_state)}
+        self.changed_channels = set()
+        self.changed_payment_tasks = set()
+        self.removed_payment_tasks = list()
+
+    def _copy(self, obj):
+        if id(obj) in self.private:
+            return obj
+
+        obj = copy.copy(obj)
+        self.private.add(id(obj))
+        return obj
+
+    def _deepcopy(self, obj):
+        if id(obj) in self.private:
+            return obj
+
+        obj = copy.deepcopy(obj)
+        self.private.add(id(obj))
+        return obj
+
+    def _dict(self, obj, attribute):
+        """ The dictionary `attribute` of the private `obj`. """
+        mapping = getattr(obj, attribute)
+
+        if id(mapping) not in self.private:
+            mapping = dict(mapping)
+            setattr(obj, attribute, mapping)
+            self.private.add(id(mapping))
+
+        return mapping
+
+    def pseudo_random_generator(self):
+        prng = self._deepcopy(self.node_state.pseudo_random_generator)
+        self.node_state.pseudo_random_generator = prng
+        return prng
+
+    def set_index(self, index_name, key, value):
+        """ Set the entry `key` of the index `index_name`, None removes it. """
+        index = self._dict(self.node_state, index_name)
+
+        if value is None:
+            index.pop(key, None)
+        else:
+            index[key] = value
+
+    def set_network_state(self, node_address, network_state):
+        self._dict(self.node_state, 'nodeaddresses_to_networkstates')[node_address] = network_state
+
+    def add_payment_network(self, payment_network):
+        self._dict(self.node_state, 'identifiers_to_paymentnetworks')[
+            payment_network.address
+        ] = payment_network
+        indexes.index_payment_network(self, payment_network)
+
+    def payment_network(self, payment_network_identifier):
+        payment_networks = self._dict(self.node_state, 'identifiers_to_paymentnetworks')
+        payment_network = payment_networks.get(payment_network_identifier)
+
+        if payment_network is not None and id(payment_network) not in self.private:
+            payment_network = self._copy(payment_network)
+            self._dict(payment_network, 'tokenidentifiers_to_tokennetworks')
+            self._dict(payment_network, 'tokenaddresses_to_tokennetworks')
+            payment_networks[payment_network_identifier] = payment_network
+
+        return payment_network
+
+    def add_token_network(self, payment_network_identifier, token_network_state):
+        payment_network = self.payment_network(payment_network_identifier)
+        payment_network.tokenidentifiers_to_tokennetworks[
+            token_network_state.address
+        ] = token_network_state
+        payment_network.tokenaddresses_to_tokennetworks[
+            token_network_state.token_address
+        ] = token_network_state
+        indexes.index_token_network(self, payment_network_identifier, token_network_state)
+
+    def remove_token_network(self, payment_network_identifier, token_network_state):
+        payment_network = self.payment_network(payment_network_identifier)
+        del payment_network.tokenaddresses_to_tokennetworks[token_network_state.token_address]
+        del payment_network.tokenidentifiers_to_tokennetworks[token_network_state.address]
+        indexes.unindex_token_network(self, token_network_state)
+
+    def token_network(self, token_network_identifier):
+        """ The private copy of the token network `token_network_identifier`,
+        or None if it is unknown. The channel maps are copied, not the
+        channels.
+        """
+        payment_network_identifier = getattr(self.node_state, indexes.TOKEN_NETWORK_INDEX).get(
+            token_network_identifier,
+        )
+        payment_network = self.node_state.identifiers_to_paymentnetworks.get(
+            payment_network_identifier,
+        )
+
+        if payment_network is None:
+            return None
+
+        token_networks = payment_network.tokenidentifiers_to_tokennetworks
+        token_network_state = token_networks.get(token_network_identifier)
+
+        if token_network_state is None:
+            return None
+
+        if id(token_network_state) in self.private:
+            return token_network_state
+
+        token_network_copy = self._copy(token_network_state)
+        self._dict(token_network_copy, 'channelidentifiers_to_channels')
+        self._dict(token_network_copy, 'partneraddresses_to_channels')
+
+        payment_network = self.payment_network(payment_network_identifier)
+        payment_network.tokenidentifiers_to_tokennetworks[
+            token_network_identifier
+        ] = token_network_copy
+
+        token_address = token_network_state.token_address
+        token_addresses = payment_network.tokenaddresses_to_tokennetworks
+        if token_addresses.get(token_address) is token_network_state:
+            token_addresses[token_address] = token_network_copy
+
+        return token_network_copy
+
+    def add_route(self, token_network_state, participant1, participant2):
+        """ Add the edge to the graph of the private `token_network_state`. """
+        network_graph = self._deepcopy(token_network_state.network_graph)
+        token_network_state.network_graph = network_graph
+        network_graph.network.add_edge(participant1, participant2)
+        network_graph.version = getattr(network_graph, 'version', 0) + 1
+
+    def add_channel(self, token_network_state, channel_state):
+        partner_address = channel_state.partner_state.address
+        token_network_state.channelidentifiers_to_channels[
+            channel_state.identifier
+        ] = channel_state
+        token_network_state.partneraddresses_to_channels[partner_address] = channel_state
+        self.changed_channels.add((token_network_state.address, channel_state.identifier))
+        indexes.index_channel(self, token_network_state.address, channel_state)
+
+    def remove_channel(self, token_network_state, channel_identifier):
+        """ Remove a channel of the private `token_network_state` and its
+        edge from the network graph.
+        """
+        channel_state = token_network_state.channelidentifiers_to_channels.pop(channel_identifier)
+
+        partner_address = channel_state.partner_state.address
+        partner_channels = token_network_state.partneraddresses_to_channels
+        if partner_channels.get(partner_address) is channel_state:
+            del partner_channels[partner_address]
+
+        our_address = channel_state.our_state.address
+        if token_network_state.network_graph.network.has_edge(our_address, partner_address):
+            network_graph = self._deepcopy(token_network_state.network_graph)
+            token_network_state.network_graph = network_graph
+            network_graph.network.remove_edge(our_address, partner_address)
+            network_graph.version = getattr(network_graph, 'version', 0) + 1
+
+        self.changed_channels.add((token_network_state.address, channel_identifier))
+        indexes.unindex_channel(self, token_network_state.address, channel_state)
+
+    def channel(self, token_network_state, channel_identifier):
+        """ The private copy of a channel of the private `token_network_state`,
+        or None if it is unknown.
+        """
+        channels = token_network_state.channelidentifiers_to_channels
+        channel_state = channels.get(channel_identifier)
+
+        if channel_state is None:
+            return None
+
+        self.changed_channels.add((token_network_state.address, channel_identifier))
+
+        if id(channel_state) in self.private:
+            return channel_state
+
+        channel_copy = self._deepcopy(channel_state)
+        channels[channel_identifier] = channel_copy
+
+        partner_address = channel_state.partner_state.address
+        partner_channels = token_network_state.partneraddresses_to_channels
+        if partner_channels.get(partner_address) is channel_state:
+            partner_channels[partner_address] = channel_copy
+
+        return channel_copy
+
+    def channels(self, token_network_identifier):
+        """ The channels of the token network `token_network_identifier`,
+        made writable when they are looked up, for the payment state
+        machines.
+        """
+        token_network_state = self.token_network(token_network_identifier)
+
+        if token_network_state is None:
+            return None
+
+        return WritableChannels(self, token_network_state)
+
+    def _payment_tasks(self):
+        payment_mapping = self._copy(self.node_state.payment_mapping)
+        self.node_state.payment_mapping = payment_mapping
+        return self._dict(payment_mapping, 'secrethashes_to_task')
+
+    def payment_task(self, secrethash):
+        """ The private copy of the payment task for `secrethash`, or None. """
+        tasks = self._payment_tasks()
+        task = tasks.get(secrethash)
+
+        if task is not None:
+            task = self._deepcopy(task)
+            tasks[secrethash] = task
+            self.changed_payment_tasks.add(secrethash)
+
+        return task
+
+    def set_payment_task(self, secrethash, task):
+        self._payment_tasks()[secrethash] = task
+        self.changed_payment_tasks.add(secrethash)
+
+    def del_payment_task(self, secrethash):
+        self.removed_payment_tasks.append(self._payment_tasks().pop(secrethash))
+
+    def queue(self, queueid):
+        """ The private copy of the queue `queueid`, created if missing. """
+        queues = self._dict(self.node_state, 'queueids_to_queues')
+        queue = queues.get(queueid)
+
+        if queue is None:
+            queue = list()
+            self.private.add(id(queue))
+        elif id(queue) not in self.private:
+            queue = list(queue)
+            self.private.add(id(queue))
+
+        queues[queueid] = queue
+        return queue
+
+
+class WritableChannels(Mapping):
+    """ The channel map of a token network, each channel is made writable by
+    the writer the first time it is looked up.
+
+    Membership tests, iteration and len() don't touch the channels.
+    """
+
+    __slots__ = (
+        'writer',
+        'token_network_state',
+    )
+
+    def __init__(self, writer, token_network_state):
+        self.writer = writer
+        self.token_network_state = token_network_state
+
+    def __getitem__(self, channel_identifier):
+        channel_state = self.writer.channel(self.token_network_state, channel_identifier)
+
+        if channel_state is None:
+            raise KeyError(channel_identifier)
+
+        return channel_state
+
+    def __contains__(self, channel_identifier):
+        return channel_identifier in self.token_network_state.channelidentifiers_to_channels
+
+    def __iter__(self):
+        return iter(self.token_network_state.channelidentifiers_to_channels)
+
+    def __len__(self):
+        return len(self.token_network_state.channelidentifiers_to_channels)
@@ -0,0 +1,668 @@
+""" Dispatch of the state changes by token network.
+
+The token networks share no channels and no payment tasks, so the
+transitions of different token networks are independent of each other. The
+`ShardedStateManager` keeps a NodeState per token network, its shard, with
+the token network, its payment tasks and the queues of its channels, and a
+root NodeState with the payment networks and everything that belongs to no
+token network.
+
+A state change is dispatched to the shard of its token network. The state
+changes that concern the whole node, e.g. `Block` or the reachability of a
+node, are dispatched to the root and to every shard. The state changes that
+add payment networks or token networks, or initialize the node, are applied
+to the root between the dispatches of the shards, and the token networks
+they add are moved to new shards.
+
+Each shard draws from its own pseudo random generator, so its transitions do
+not depend on the order the shards are dispatched in. The generators are
+kept by the merged state in
+`NodeState.tokennetworkidentifiers_to_pseudorandomgenerators`, and therefore
+by the snapshots.
+
+The log is not split: the state changes of all the shards are still written
+in a single stream, which keeps the order of the node wide state changes
+relative to the others for the replay.
+"""
+import itertools
+import operator
+import random
+
+from raiden.transfer.architecture import (
+    DISPATCH_UNDO_LOG,
+    StateChange,
+    StateManager,
+)
+from raiden.transfer.indexes import (
+    CHANNEL_INDEX,
+    PARTNER_INDEX,
+    TOKEN_NETWORK_INDEX,
+    rebuild_indexes,
+)
+from raiden.transfer.mediated_transfer.state_change import (
+    ActionInitInitiator,
+    ActionInitMediator,
+    ActionInitTarget,
+    ReceiveSecretRequest,
+    ReceiveSecretReveal,
+    ReceiveTransferRefund,
+    ReceiveTransferRefundCancelRoute,
+)
+from raiden.transfer.state import NodeState, PaymentNetworkState
+from raiden.transfer.state_change import (
+    ActionChangeNodeNetworkState,
+    ActionInitNode,
+    ActionLeaveAllNetworks,
+    ActionNewTokenNetwork,
+    Block,
+    ContractReceiveNewPaymentNetwork,
+    ContractReceiveNewTokenNetwork,
+    ContractReceiveSecretReveal,
+    ReceiveDelivered,
+    ReceiveProcessed,
+    ReceiveUnlock,
+)
+
+# the key of the root NodeState, the shards use their token network identifier
+ROOT = None
+
+# the minimum number of state changes dispatched to the shards at once for
+# the executor to be used, sending the shards to the workers and back costs
+# more than the dispatch of a few state changes
+EXECUTOR_BATCH_SIZE = 100
+
+# applied to the root, the token networks they add get new shards
+STRUCTURAL_STATE_CHANGES = (
+    ActionInitNode,
+    ActionNewTokenNetwork,
+    ContractReceiveNewPaymentNetwork,
+    ContractReceiveNewTokenNetwork,
+)
+
+# dispatched to the root and to every shard
+NODE_STATE_CHANGES = (
+    ActionChangeNodeNetworkState,
+    ActionLeaveAllNetworks,
+    Block,
+    ReceiveDelivered,
+    ReceiveProcessed,
+)
+
+# dispatched to the shard of the payment task of their secrethash
+SECRETHASH_STATE_CHANGES = (
+    ContractReceiveSecretReveal,
+    ReceiveSecretRequest,
+    ReceiveSecretReveal,
+    ReceiveUnlock,
+)
+
+
+def get_secrethash(state_change):
+    if isinstance(state_change, (ReceiveTransferRefund, ReceiveTransferRefundCancelRoute)):
+        return state_change.transfer.lock.secrethash
+
+    if isinstance(state_change, SECRETHASH_STATE_CHANGES):
+        return state_change.secrethash
+
+    return None
+
+
+def get_initiated_token_network(state_change):
+    """ The token network of the payment task created by `state_change`,
+    None if it does not create one.
+    """
+    if isinstance(state_change, ActionInitInitiator):
+        return state_change.transfer.token_network_identifier
+
+    if isinstance(state_change, ActionInitMediator):
+        return state_change.from_transfer.balance_proof.token_network_identifier
+
+    if isinstance(state_change, ActionInitTarget):
+        return state_change.transfer.balance_proof.token_network_identifier
+
+    return None
+
+
+def get_initiated_secrethash(state_change):
+    if isinstance(state_change, ActionInitMediator):
+        return state_change.from_transfer.lock.secrethash
+
+    if isinstance(state_change, ActionInitTarget):
+        return state_change.transfer.lock.secrethash
+
+    return state_change.transfer.secrethash
+
+
+def make_shard_generator(node_state, token_network_identifier):
+    """ A new generator for the shard of `token_network_identifier`, seeded
+    from the generator of `node_state` without drawing from it.
+    """
+    state = node_state.pseudo_random_generator.getstate()
+    return random.Random(repr(state).encode() + token_network_identifier)
+
+
+def new_shard(node_state, pseudo_random_generator):
+    """ An empty shard, with the node wide state of `node_state`. """
+    shard = NodeState(pseudo_random_generator, node_state.block_number)
+    shard.nodeaddresses_to_networkstates = dict(node_state.nodeaddresses_to_networkstates)
+    return shard
+
+
+def split_node_state(node_state):
+    """ Return the tuple (root, shards) for `node_state`, where shards maps
+    the token network identifiers to their shard.
+
+    The objects of `node_state` are shared with the shards, not copied.
+    """
+    generators = getattr(node_state, 'tokennetworkidentifiers_to_pseudorandomgenerators', None)
+    generators = generators or dict()
+
+    root = new_shard(node_state, node_state.pseudo_random_generator)
+    shards = dict()
+
+    for payment_network in node_state.identifiers_to_paymentnetworks.values():
+        root.identifiers_to_paymentnetworks[payment_network.address] = PaymentNetworkState(
+            payment_network.address,
+            [],
+        )
+
+        token_networks = payment_network.tokenidentifiers_to_tokennetworks
+        for token_network_identifier, token_network_state in token_networks.items():
+            generator = generators.get(token_network_identifier)
+            if generator is None:
+                generator = make_shard_generator(node_state, token_network_identifier)
+
+            shard = new_shard(node_state, generator)
+            shard.identifiers_to_paymentnetworks[payment_network.address] = PaymentNetworkState(
+                payment_network.address,
+                [token_network_state],
+            )
+            shards[token_network_identifier] = shard
+
+    tasks = node_state.payment_mapping.secrethashes_to_task
+    for secrethash, task in tasks.items():
+        shard = shards.get(task.token_network_identifier, root)
+        shard.payment_mapping.secrethashes_to_task[secrethash] = task
+
+    channel_index = getattr(node_state, CHANNEL_INDEX)
+    for queueid, queue in node_state.queueids_to_queues.items():
+        # the channel identifier of the channel queues, a name for the others
+        token_network_identifiers = channel_index.get(queueid[1])
+
+        shard = root
+        if token_network_identifiers:
+            shard = shards.get(token_network_identifiers[0], root)
+
+        shard.queueids_to_queues[queueid] = queue
+
+    for shard in shards.values():
+        rebuild_indexes(shard)
+
+    return root, shards
+
+
+def get_shards_in_order(root, shards):
+    """ The root and the shards by key, the root first, then the shards in
+    their creation order.
+    """
+    shards_in_order = {ROOT: root}
+    shards_in_order.update(shards)
+    return shards_in_order
+
+
+def new_merged_state(root, shards):
+    """ A NodeState with the node wide state of `root`, the payment networks
+    and the generators of the shards, and empty maps otherwise.
+    """
+    node_state = NodeState(root.pseudo_random_generator, root.block_number)
+    node_state.nodeaddresses_to_networkstates = root.nodeaddresses_to_networkstates
+
+    payment_networks = node_state.identifiers_to_paymentnetworks
+    generators = node_state.tokennetworkidentifiers_to_pseudorandomgenerators
+
+    for key, shard in get_shards_in_order(root, shards).items():
+        if key is not ROOT:
+            generators[key] = shard.pseudo_random_generator
+
+        for payment_network in shard.identifiers_to_paymentnetworks.values():
+            merged_payment_network = payment_networks.get(payment_network.address)
+
+            if merged_payment_network is None:
+                merged_payment_network = PaymentNetworkState(payment_network.address, [])
+                payment_networks[payment_network.address] = merged_payment_network
+
+            merged_payment_network.tokenidentifiers_to_tokennetworks.update(
+                payment_network.tokenidentifiers_to_tokennetworks,
+            )
+            merged_payment_network.tokenaddresses_to_tokennetworks.update(
+                payment_network.tokenaddresses_to_tokennetworks,
+            )
+
+    return node_state
+
+
+def merge_shards(root, shards):
+    """ The NodeState of the whole node, it shares the objects of the shards. """
+    node_state = new_merged_state(root, shards)
+
+    tasks = node_state.payment_mapping.secrethashes_to_task
+    queues = node_state.queueids_to_queues
+
+    token_network_index = getattr(node_state, TOKEN_NETWORK_INDEX)
+    channel_index = getattr(node_state, CHANNEL_INDEX)
+    partner_index = getattr(node_state, PARTNER_INDEX)
+
+    for shard in get_shards_in_order(root, shards).values():
+        tasks.update(shard.payment_mapping.secrethashes_to_task)
+
+        # the queues that are not for a channel, e.g. 'global', are shared
+        for queueid, queue in shard.queueids_to_queues.items():
+            queues[queueid] = queues.get(queueid, []) + queue
+
+        token_network_index.update(getattr(shard, TOKEN_NETWORK_INDEX))
+
+        for index, shard_index in (
+                (channel_index, getattr(shard, CHANNEL_INDEX)),
+                (partner_index, getattr(shard, PARTNER_INDEX)),
+        ):
+            for index_key, items in shard_index.items():
+                index[index_key] = index.get(index_key, ()) + items
+
+    return node_state
+
+
+def get_changed_keys(previous_mappings, mappings):
+    """ The keys of the entries that differ between the maps of the previous
+    shards and the maps of the current shards, both by shard key.
+
+    The maps that were not copied by the dispatches are skipped, since their
+    entries did not change.
+    """
+    changed_keys = set()
+
+    for shard_key, mapping in mappings.items():
+        previous_mapping = previous_mappings.get(shard_key, dict())
+
+        if mapping is previous_mapping:
+            continue
+
+        changed_keys.update(previous_mapping.keys() - mapping.keys())
+        changed_keys.update(
+            key
+            for key, value in mapping.items()
+            if previous_mapping.get(key) is not value
+        )
+
+    return changed_keys
+
+
+def merge_changed_entries(merged_state, previous_shards, shards_in_order, get_mapping, combine):
+    """ The map `get_mapping` of `merged_state` with the entries that changed
+    since `previous_shards` merged again. `combine` merges the values of an
+    entry, in the order of the shards.
+    """
+    merged_mapping = get_mapping(merged_state)
+    mappings = {key: get_mapping(shard) for key, shard in shards_in_order.items()}
+    changed_keys = get_changed_keys(
+        {key: get_mapping(shard) for key, shard in previous_shards.items()},
+        mappings,
+    )
+
+    # the map is shared with the previous merged state if nothing changed
+    if not changed_keys:
+        return merged_mapping
+
+    merged_mapping = dict(merged_mapping)
+    for key in changed_keys:
+        values = [mapping[key] for mapping in mappings.values() if key in mapping]
+
+        if values:
+            merged_mapping[key] = combine(values)
+        else:
+            merged_mapping.pop(key, None)
+
+    return merged_mapping
+
+
+def combine_last(values):
+    return values[-1]
+
+
+def combine_lists(values):
+    return list(itertools.chain.from_iterable(values))
+
+
+def combine_tuples(values):
+    return tuple(itertools.chain.from_iterable(values))
+
+
+def update_merged_state(merged_state, previous_shards, root, shards):
+    """ `merge_shards` for the shards that changed since `merged_state` was
+    merged from `previous_shards`, the root and the shards by key.
+
+    Only the entries of the maps the dispatches copied are merged again, the
+    others are shared with `merged_state`, which is left untouched.
+    """
+    shards_in_order = get_shards_in_order(root, shards)
+
+    # the order of the entries depends on the order of the shards
+    if list(previous_shards) != list(shards_in_order)[:len(previous_shards)]:
+        return merge_shards(root, shards)
+
+    node_state = new_merged_state(root, shards)
+
+    node_state.payment_mapping.secrethashes_to_task = merge_changed_entries(
+        merged_state,
+        previous_shards,
+        shards_in_order,
+        lambda state: state.payment_mapping.secrethashes_to_task,
+        combine_last,
+    )
+    node_state.queueids_to_queues = merge_changed_entries(
+        merged_state,
+        previous_shards,
+        shards_in_order,
+        operator.attrgetter('queueids_to_queues'),
+        combine_lists,
+    )
+
+    for index_name, combine in (
+            (TOKEN_NETWORK_INDEX, combine_last),
+            (CHANNEL_INDEX, combine_tuples),
+            (PARTNER_INDEX, combine_tuples),
+    ):
+        index = merge_changed_entries(
+            merged_state,
+            previous_shards,
+            shards_in_order,
+            operator.attrgetter(index_name),
+            combine,
+        )
+        setattr(node_state, index_name, index)
+
+    return node_state
+
+
+def dispatch_shard(state_transition, dispatch_mode, node_state, state_changes):
+    """ Apply `state_changes` to the shard `node_state` and return the tuple
+    (new_state, events_by_state_change).
+    """
+    state_manager = StateManager(state_transition, node_state, dispatch_mode)
+    events_by_state_change = state_manager.dispatch_batch(state_changes)
+    return state_manager.current_state, events_by_state_change
+
+
+def dispatch_serialized_shard(state_transition, dispatch_mode, serializer, data):
+    """ `dispatch_shard` for the serialized tuple (node_state, state_changes),
+    the result is serialized as well. Run by the workers of the executor.
+    """
+    node_state, state_changes = serializer.deserialize(data)
+    result = dispatch_shard(state_transition, dispatch_mode, node_state, state_changes)
+    return serializer.serialize(result)
+
+
+class ShardedStateManager:
+    """ A StateManager that keeps a NodeState per token network, see the
+    module docstring.
+
+    If `executor` is given, e.g. a `concurrent.futures.ProcessPoolExecutor`,
+    the shards of a batch with at least `executor_batch_size` state changes
+    are dispatched in parallel through it. A shard is then sent to the
+    worker and back with its state changes, encoded by `serializer`, which
+    only pays off for batches with a lot of work per shard, such as the
+    replay of the log. The smaller batches are dispatched in-process.
+
+    `current_state` is the NodeState of the whole node, merged from the
+    shards when it is read after a dispatch. Only the shards that changed
+    since the previous read are merged again. It shares the objects of the
+    shards and must be treated as read only.
+    """
+    __slots__ = (
+        'state_transition',
+        'dispatch_mode',
+        'executor',
+        'executor_batch_size',
+        'serializer',
+        'root',
+        'shards',
+        'merged_state',
+        'merged_shards',
+    )
+
+    def __init__(
+            self,
+            state_transition,
+            current_state,
+            dispatch_mode=None,
+            executor=None,
+            serializer=None,
+            executor_batch_size=EXECUTOR_BATCH_SIZE,
+    ):
+        # validates the arguments
+        dispatch_mode = StateManager(state_transition, None, dispatch_mode).dispatch_mode
+
+        if dispatch_mode == DISPATCH_UNDO_LOG:
+            raise ValueError('the undo log can not be used with the sharded state manager')
+
+        if executor is not None and serializer is None:
+            raise ValueError('the executor requires a serializer')
+
+        self.state_transition = state_transition
+        self.dispatch_mode = dispatch_mode
+        self.executor = executor
+        self.executor_batch_size = executor_batch_size
+        self.serializer = serializer
+
+        if current_state is None:
+            self.root = None
+            self.shards = dict()
+        else:
+            self.root, self.shards = split_node_state(current_state)
+
+        self.merged_state = current_state
+        # the tuple (merged_state, shards) of the last merge, shards has the
+        # root and the shards it was merged from, None before the first one
+        self.merged_shards = None
+
+    @property
+    def current_state(self):
+        if self.merged_state is None and self.root is not None:
+            if self.merged_shards is None:
+                merged_state = merge_shards(self.root, self.shards)
+            else:
+                merged_state, previous_shards = self.merged_shards
+                merged_state = update_merged_state(
+                    merged_state,
+                    previous_shards,
+                    self.root,
+                    self.shards,
+                )
+
+            self.merged_state = merged_state
+            self.merged_shards = (
+                merged_state,
+                get_shards_in_order(self.root, self.shards),
+            )
+
+        return self.merged_state
+
+    def dispatch(self, state_change):
+        """ Apply the `state_change` and return the resulting events, see
+        `StateManager.dispatch`.
+        """
+        return self.dispatch_batch([state_change])[0]
+
+    def dispatch_batch(self, state_changes):
+        """ Apply the `state_changes` in order and return the events of each
+        one, see `StateManager.dispatch_batch`.
+
+        The state changes between two structural state changes are dispatched
+        to their shards at once. The events of a state change dispatched to
+        several shards are the events of the root followed by the events of
+        the shards, in the order the shards were created.
+        """
+        assert all(isinstance(state_change, StateChange) for state_change in state_changes)
+
+        root = self.root
+        shards = dict(self.shards)
+        events_by_state_change = [list() for _ in state_changes]
+
+        segment = list()
+        for position, state_change in enumerate(state_changes):
+            if isinstance(state_change, STRUCTURAL_STATE_CHANGES):
+                root = self._dispatch_segment(root, shards, segment, events_by_state_change)
+                segment = list()
+
+                root, events = self._dispatch_structural(root, shards, state_change)
+                events_by_state_change[position] = events
+            else:
+                segment.append((position, state_change))
+
+        root = self._dispatch_segment(root, shards, segment, events_by_state_change)
+
+        # the batch is applied as a whole, nothing is kept if it failed
+        self.root = root
+        self.shards = shards
+        self.merged_state = None
+
+        return events_by_state_change
+
+    def _dispatch(self, node_state, state_changes):
+        return dispatch_shard(self.state_transition, self.dispatch_mode, node_state, state_changes)
+
+    def _dispatch_structural(self, root, shards, state_change):
+        target = ROOT
+
+        if isinstance(state_change, ActionInitNode):
+            shards.clear()
+
+        elif isinstance(state_change, (ActionNewTokenNetwork, ContractReceiveNewTokenNetwork)):
+            payment_network_identifier = state_change.payment_network_identifier
+            token_address = state_change.token_network.token_address
+
+            # the token network is known, the state change is dispatched to
+            # its shard to keep the behavior of the unsharded node
+            for key, shard in shards.items():
+                payment_network = shard.identifiers_to_paymentnetworks.get(
+                    payment_network_identifier,
+                )
+                if payment_network is None:
+                    continue
+
+                if token_address in payment_network.tokenaddresses_to_tokennetworks:
+                    target = key
+
+        if target is not ROOT:
+            shards[target], (events,) = self._dispatch(shards[target], [state_change])
+            return root, events
+
+        root, (events,) = self._dispatch(root, [state_change])
+
+        # the new token networks are moved from the root to their shards
+        payment_networks = root.identifiers_to_paymentnetworks.values()
+        if any(network.tokenidentifiers_to_tokennetworks for network in payment_networks):
+            root, new_shards = split_node_state(root)
+            for key, shard in new_shards.items():
+                # the root has no pseudo random generator for the token
+                # networks, the generator of a known shard is kept
+                if key in shards:
+                    shard.pseudo_random_generator = shards[key].pseudo_random_generator
+                shards[key] = shard
+
+        return root, events
+
+    def _route(self, shards, state_change, initiated):
+        """ The keys of the NodeStates `state_change` must be dispatched to.
+
+        `initiated` maps the secrethashes of the payment tasks created
+        earlier in the same segment to their shard.
+        """
+        if isinstance(state_change, NODE_STATE_CHANGES):
+            return [ROOT] + list(shards)
+
+        token_network_identifier = getattr(state_change, 'token_network_identifier', None)
+
+        if token_network_identifier is None:
+            token_network_identifier = get_initiated_token_network(state_change)
+
+            if token_network_identifier is not None:
+                initiated[get_initiated_secrethash(state_change)] = token_network_identifier
+
+        if token_network_identifier is None:
+            secrethash = get_secrethash(state_change)
+
+            if secrethash is not None:
+                token_network_identifier = initiated.get(secrethash)
+
+                if token_network_identifier is None:
+                    for key, shard in shards.items():
+                        if secrethash in shard.payment_mapping.secrethashes_to_task:
+                            token_network_identifier = key
+                            break
+
+        # an unknown token network is left to the root, which ignores it as
+        # the unsharded node does
+        if token_network_identifier in shards:
+            return [token_network_identifier]
+
+        return [ROOT]
+
+    def _dispatch_segment(self, root, shards, segment, events_by_state_change):
+        """ Dispatch the (position, state_change) pairs of `segment` to their
+        shards, update `shards` and `events_by_state_change`, and return the
+        new root.
+        """
+        if not segment:
+            return root
+
+        initiated = dict()
+        positions_by_key = dict()
+        state_changes_by_key = dict()
+
+        for position, state_change in segment:
+            for key in self._route(shards, state_change, initiated):
+                positions_by_key.setdefault(key, list()).append(position)
+                state_changes_by_key.setdefault(key, list()).append(state_change)
+
+        # the root first, then the shards in their creation order
+        keys = [key for key in [ROOT] + list(shards) if key in state_changes_by_key]
+        jobs = [
+            (root if key is ROOT else shards[key], state_changes_by_key[key])
+            for key in keys
+        ]
+
+        use_executor = (
+            self.executor is not None and
+            len(jobs) > 1 and
+            len(segment) >= self.executor_batch_size
+        )
+
+        if use_executor:
+            serializer = self.serializer
+            futures = [
+                self.executor.submit(
+                    dispatch_serialized_shard,
+                    self.state_transition,
+                    self.dispatch_mode,
+                    serializer,
+                    serializer.serialize(job),
+                )
+                for job in jobs
+            ]
+            results = [serializer.deserialize(future.result()) for future in futures]
+        else:
+            results = [
+                self._dispatch(node_state, state_changes)
+                for node_state, state_changes in jobs
+            ]
+
+        for key, (new_state, shard_events) in zip(keys, results):
+            if key is ROOT:
+                root = new_state
+            else:
+                shards[key] = new_state
+
+            for position, events in zip(positions_by_key[key], shard_events):
+                events_by_state_change[position].extend(events)
+
+        return root
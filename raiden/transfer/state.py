@@ -6,9 +6,8 @@ from collections import namedtuple
 import networkx
 
 from raiden.constants import UINT256_MAX, UINT64_MAX
-from raiden.encoding.format import buffer_for
-from raiden.encoding import messages
-from raiden.transfer.architecture import State
+from raiden.transfer.architecture import State, setstate_from_pickle
+from raiden.transfer.block_deadlines import BlockDeadlines
 from raiden.transfer.merkle_tree import merkleroot
 from raiden.transfer.utils import hash_balance_data
 from raiden.utils import lpex, pex, sha3, typing
@@ -74,6 +73,28 @@ def message_identifier_from_prng(prng):
     return prng.randint(0, UINT64_MAX)
 
 
+def compute_amount_locked(end_state: 'NettingChannelEndState') -> typing.Balance:
+    """ The sum of the amounts of the pending locks of `end_state`, unlocked
+    or not.
+    """
+    total_pending = sum(
+        lock.amount
+        for lock in end_state.secrethashes_to_lockedlocks.values()
+    )
+
+    total_unclaimed = sum(
+        unlock.lock.amount
+        for unlock in end_state.secrethashes_to_unlockedlocks.values()
+    )
+
+    total_unclaimed_onchain = sum(
+        unlock.lock.amount
+        for unlock in end_state.secrethashes_to_onchain_unlockedlocks.values()
+    )
+
+    return total_pending + total_unclaimed + total_unclaimed_onchain
+
+
 class NodeState(State):
     """ Umbrella object that stores all the node state.
     For each registry smart contract there must be a payment network. Within the
@@ -87,6 +108,11 @@ class NodeState(State):
         'identifiers_to_paymentnetworks',
         'nodeaddresses_to_networkstates',
         'payment_mapping',
+        'block_deadlines',
+        'tokennetworkidentifiers_to_paymentnetworkidentifiers',
+        'channelidentifiers_to_tokennetworkidentifiers',
+        'partneraddresses_to_channelidentifiers',
+        'tokennetworkidentifiers_to_pseudorandomgenerators',
     )
 
     def __init__(self, pseudo_random_generator: random.Random, block_number: typing.BlockNumber):
@@ -99,6 +125,14 @@ class NodeState(State):
         self.identifiers_to_paymentnetworks = dict()
         self.nodeaddresses_to_networkstates = dict()
         self.payment_mapping = PaymentMappingState()
+        # not part of the state, see raiden.transfer.block_deadlines
+        self.block_deadlines = BlockDeadlines()
+        # derived from the payment networks, see raiden.transfer.indexes
+        self.tokennetworkidentifiers_to_paymentnetworkidentifiers = dict()
+        self.channelidentifiers_to_tokennetworkidentifiers = dict()
+        self.partneraddresses_to_channelidentifiers = dict()
+        # the generators of the shards, see raiden.transfer.sharding
+        self.tokennetworkidentifiers_to_pseudorandomgenerators = dict()
 
     def __repr__(self):
         return '<NodeState block:{} networks:{} qtd_transfers:{}>'.format(
@@ -215,14 +249,19 @@ class TokenNetworkState(State):
 class TokenNetworkGraphState(State):
     """ Stores the existing channels in the channel manager contract, used for
     route finding.
+
+    `version` is incremented by the writers every time the network changes,
+    it is used to invalidate the routes cached by `raiden.routing`.
     """
 
     __slots__ = (
         'network',
+        'version',
     )
 
     def __init__(self, network: networkx.Graph):
         self.network = network
+        self.version = 0
 
     def __repr__(self):
         return '<TokenNetworkGraphState>'
@@ -588,11 +627,28 @@ class HashTimeLockState(State):
         if not isinstance(secrethash, typing.T_Keccak256):
             raise ValueError('secrethash must be a keccak256 instance')
 
-        packed = messages.Lock(buffer_for(messages.Lock))
-        packed.amount = amount
-        packed.expiration = expiration
-        packed.secrethash = secrethash
-        encoded = bytes(packed.data)
+        if amount < 0:
+            raise ValueError('amount cannot be negative')
+
+        if amount > UINT256_MAX:
+            raise ValueError('amount is too large')
+
+        if expiration < 0:
+            raise ValueError('expiration cannot be negative')
+
+        if expiration > UINT256_MAX:
+            raise ValueError('expiration is too large')
+
+        if len(secrethash) > 32:
+            raise ValueError('secrethash is too large')
+
+        # Same layout as `messages.Lock`, packed directly to avoid allocating
+        # a namedbuffer for each lock
+        encoded = b''.join((
+            expiration.to_bytes(32, byteorder='big'),
+            amount.to_bytes(32, byteorder='big'),
+            secrethash.rjust(32, b'\x00'),
+        ))
 
         self.amount = amount
         self.expiration = expiration
@@ -785,6 +841,7 @@ class NettingChannelEndState(State):
         'secrethashes_to_onchain_unlockedlocks',
         'merkletree',
         'balance_proof',
+        'amount_locked',
     )
 
     def __init__(self, address: typing.Address, balance: typing.TokenAmount):
@@ -802,6 +859,15 @@ class NettingChannelEndState(State):
         self.secrethashes_to_onchain_unlockedlocks: SecretHashToPartialUnlockProof = dict()
         self.merkletree = EMPTY_MERKLE_TREE
         self.balance_proof: typing.Optional[BalanceProofSignedState] = None
+        # sum of the amounts of the pending locks, see channel.get_amount_locked
+        self.amount_locked: typing.Balance = 0
+
+    def __setstate__(self, state):
+        setstate_from_pickle(self, state)
+
+        # the states written before the sum was kept don't have it
+        if not hasattr(self, 'amount_locked'):
+            self.amount_locked = compute_amount_locked(self)
 
     def __repr__(self):
         return '<NettingChannelEndState address:{} contract_balance:{} merkletree:{}>'.format(
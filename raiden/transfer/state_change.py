@@ -17,6 +17,10 @@ class Block(StateChange):
         block_number: The current block_number.
     """
 
+    __slots__ = (
+        'block_number',
+    )
+
     def __init__(self, block_number: typing.BlockNumber):
         if not isinstance(block_number, typing.T_BlockNumber):
             raise ValueError('block_number must be of type block_number')
@@ -42,6 +46,10 @@ class ActionCancelPayment(StateChange):
     state of the transfer.
     """
 
+    __slots__ = (
+        'payment_identifier',
+    )
+
     def __init__(self, payment_identifier: typing.PaymentID):
         self.payment_identifier = payment_identifier
 
@@ -63,6 +71,11 @@ class ActionCancelPayment(StateChange):
 class ActionChannelClose(StateChange):
     """ User is closing an existing channel. """
 
+    __slots__ = (
+        'token_network_identifier',
+        'channel_identifier',
+    )
+
     def __init__(
             self,
             token_network_identifier: typing.TokenNetworkID,
@@ -94,6 +107,10 @@ class ActionCancelTransfer(StateChange):
     state of the transfer.
     """
 
+    __slots__ = (
+        'transfer_identifier',
+    )
+
     def __init__(self, transfer_identifier: typing.TransferID) -> None:
         self.transfer_identifier = transfer_identifier
 
@@ -113,6 +130,13 @@ class ActionCancelTransfer(StateChange):
 
 
 class ActionTransferDirect(StateChange):
+    __slots__ = (
+        'token_network_identifier',
+        'amount',
+        'receiver_address',
+        'payment_identifier',
+    )
+
     def __init__(
             self,
             token_network_identifier: typing.TokenNetworkIdentifier,
@@ -154,6 +178,11 @@ class ActionTransferDirect(StateChange):
 class ContractReceiveChannelNew(StateChange):
     """ A new channel was created and this node IS a participant. """
 
+    __slots__ = (
+        'token_network_identifier',
+        'channel_state',
+    )
+
     def __init__(
             self,
             token_network_identifier: typing.TokenNetworkID,
@@ -182,6 +211,13 @@ class ContractReceiveChannelNew(StateChange):
 class ContractReceiveChannelClosed(StateChange):
     """ A channel to which this node IS a participant was closed. """
 
+    __slots__ = (
+        'token_network_identifier',
+        'channel_identifier',
+        'closing_address',
+        'closed_block_number',
+    )
+
     def __init__(
             self,
             token_network_identifier: typing.TokenNetworkID,
@@ -227,6 +263,11 @@ class ContractReceiveChannelClosed(StateChange):
 
 
 class ActionInitNode(StateChange):
+    __slots__ = (
+        'pseudo_random_generator',
+        'block_number',
+    )
+
     def __init__(
             self,
             pseudo_random_generator,
@@ -257,6 +298,11 @@ class ActionNewTokenNetwork(StateChange):
     A token network corresponds to a channel manager smart contract.
     """
 
+    __slots__ = (
+        'payment_network_identifier',
+        'token_network',
+    )
+
     def __init__(
             self,
             payment_network_identifier: typing.PaymentNetworkID,
@@ -288,6 +334,12 @@ class ActionNewTokenNetwork(StateChange):
 class ContractReceiveChannelNewBalance(StateChange):
     """ A channel to which this node IS a participant had a deposit. """
 
+    __slots__ = (
+        'token_network_identifier',
+        'channel_identifier',
+        'deposit_transaction',
+    )
+
     def __init__(
             self,
             token_network_identifier: typing.TokenNetworkID,
@@ -322,6 +374,12 @@ class ContractReceiveChannelNewBalance(StateChange):
 class ContractReceiveChannelSettled(StateChange):
     """ A channel to which this node IS a participant was settled. """
 
+    __slots__ = (
+        'token_network_identifier',
+        'channel_identifier',
+        'settle_block_number',
+    )
+
     def __init__(
             self,
             token_network_identifier: typing.TokenNetworkID,
@@ -360,6 +418,8 @@ class ContractReceiveChannelSettled(StateChange):
 class ActionLeaveAllNetworks(StateChange):
     """ User is quitting all payment networks. """
 
+    __slots__ = ()
+
     def __repr__(self):
         return '<ActionLeaveAllNetworks>'
 
@@ -373,6 +433,11 @@ class ActionLeaveAllNetworks(StateChange):
 class ActionChangeNodeNetworkState(StateChange):
     """ The network state of `node_address` changed. """
 
+    __slots__ = (
+        'node_address',
+        'network_state',
+    )
+
     def __init__(
             self,
             node_address: typing.Address,
@@ -406,6 +471,10 @@ class ContractReceiveNewPaymentNetwork(StateChange):
     A payment network corresponds to a registry smart contract.
     """
 
+    __slots__ = (
+        'payment_network',
+    )
+
     def __init__(self, payment_network: PaymentNetworkState):
         if not isinstance(payment_network, PaymentNetworkState):
             raise ValueError('payment_network must be a PaymentNetworkState instance')
@@ -430,6 +499,11 @@ class ContractReceiveNewPaymentNetwork(StateChange):
 class ContractReceiveNewTokenNetwork(StateChange):
     """ A new token was registered with the payment network. """
 
+    __slots__ = (
+        'payment_network_identifier',
+        'token_network',
+    )
+
     def __init__(
             self,
             payment_network_identifier: typing.PaymentNetworkID,
@@ -461,6 +535,12 @@ class ContractReceiveNewTokenNetwork(StateChange):
 class ContractReceiveSecretReveal(StateChange):
     """ A new secret was registered with the SecretRegistry contract. """
 
+    __slots__ = (
+        'secret_registry_address',
+        'secrethash',
+        'secret',
+    )
+
     def __init__(
         self,
         secret_registry_address: typing.SecretRegistryAddress,
@@ -508,6 +588,14 @@ class ContractReceiveChannelBatchUnlock(StateChange):
         was transferred. `returned_tokens` was transferred to the channel partner.
     """
 
+    __slots__ = (
+        'token_network_identifier',
+        'channel_identifier',
+        'participant',
+        'unlocked_amount',
+        'returned_tokens',
+    )
+
     def __init__(
             self,
             token_network_identifier: typing.PaymentNetworkID,
@@ -563,6 +651,11 @@ class ContractReceiveChannelBatchUnlock(StateChange):
 class ContractReceiveNewRoute(StateChange):
     """ New channel was created and this node is NOT a participant. """
 
+    __slots__ = (
+        'participant1',
+        'participant2',
+    )
+
     def __init__(self, participant1: typing.Address, participant2: typing.Address):
         if not isinstance(participant1, typing.T_Address):
             raise ValueError('participant1 must be of type address')
@@ -593,6 +686,12 @@ class ContractReceiveNewRoute(StateChange):
 class ContractReceiveRouteNew(StateChange):
     """ New channel was created and this node is NOT a participant. """
 
+    __slots__ = (
+        'token_network_identifier',
+        'participant1',
+        'participant2',
+    )
+
     def __init__(
             self,
             token_network_identifier: typing.TokenNetworkID,
@@ -630,6 +729,13 @@ class ContractReceiveRouteNew(StateChange):
 
 
 class ReceiveTransferDirect(StateChange):
+    __slots__ = (
+        'token_network_identifier',
+        'message_identifier',
+        'payment_identifier',
+        'balance_proof',
+    )
+
     def __init__(
             self,
             token_network_identifier: typing.TokenNetworkID,
@@ -671,6 +777,13 @@ class ReceiveTransferDirect(StateChange):
 
 
 class ReceiveUnlock(StateChange):
+    __slots__ = (
+        'message_identifier',
+        'secret',
+        'secrethash',
+        'balance_proof',
+    )
+
     def __init__(
             self,
             message_identifier: typing.MessageID,
@@ -708,6 +821,10 @@ class ReceiveUnlock(StateChange):
 
 
 class ReceiveDelivered(StateChange):
+    __slots__ = (
+        'message_identifier',
+    )
+
     def __init__(self, message_identifier: typing.MessageID):
         self.message_identifier = message_identifier
 
@@ -727,6 +844,10 @@ class ReceiveDelivered(StateChange):
 
 
 class ReceiveProcessed(StateChange):
+    __slots__ = (
+        'message_identifier',
+    )
+
     def __init__(self, message_identifier: typing.MessageID):
         self.message_identifier = message_identifier
 
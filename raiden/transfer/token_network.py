@@ -1,6 +1,6 @@
-from raiden.transfer import channel
+from raiden.transfer import channel, views
 from raiden.transfer.architecture import TransitionResult
-from raiden.transfer.events import EventTransferSentFailed
+from raiden.transfer.events import EventChannelPruned, EventTransferSentFailed
 from raiden.transfer.state_change import (
     ActionChannelClose,
     ActionTransferDirect,
@@ -13,7 +13,21 @@ from raiden.transfer.state_change import (
 )
 
 
+def prune_channel(writer, token_network_state, channel_state):
+    """ Remove the finished `channel_state` from the token network, its
+    final state is kept by the returned event.
+    """
+    writer.remove_channel(token_network_state, channel_state.identifier)
+
+    return EventChannelPruned(
+        token_network_state.address,
+        channel_state.identifier,
+        channel_state,
+    )
+
+
 def subdispatch_to_channel_by_id(
+        writer,
         token_network_state,
         state_change,
         pseudo_random_generator,
@@ -21,8 +35,7 @@ def subdispatch_to_channel_by_id(
 ):
     events = list()
 
-    ids_to_channels = token_network_state.channelidentifiers_to_channels
-    channel_state = ids_to_channels.get(state_change.channel_identifier)
+    channel_state = writer.channel(token_network_state, state_change.channel_identifier)
 
     if channel_state:
         result = channel.state_transition(
@@ -33,16 +46,28 @@ def subdispatch_to_channel_by_id(
         )
         events.extend(result.events)
 
+        # the channel is settled and there is nothing left to unlock, it is
+        # kept until the payment tasks which look it up are finished
+        is_finished = result.new_state is None and not views.is_channel_used_by_payment_tasks(
+            writer.node_state,
+            token_network_state.address,
+            channel_state.identifier,
+        )
+        if is_finished:
+            events.append(prune_channel(writer, token_network_state, channel_state))
+
     return TransitionResult(token_network_state, events)
 
 
 def handle_channel_close(
+        writer,
         token_network_state,
         state_change,
         pseudo_random_generator,
         block_number,
 ):
     return subdispatch_to_channel_by_id(
+        writer,
         token_network_state,
         state_change,
         pseudo_random_generator,
@@ -50,32 +75,34 @@ def handle_channel_close(
     )
 
 
-def handle_channelnew(token_network_state, state_change):
+def handle_channelnew(
+        writer,
+        token_network_state,
+        state_change,
+        pseudo_random_generator,  # pylint: disable=unused-argument
+        block_number,  # pylint: disable=unused-argument
+):
     events = list()
 
     channel_state = state_change.channel_state
-    channel_id = channel_state.identifier
     our_address = channel_state.our_state.address
     partner_address = channel_state.partner_state.address
 
-    token_network_state.network_graph.network.add_edge(
-        our_address,
-        partner_address,
-    )
-
-    token_network_state.channelidentifiers_to_channels[channel_id] = channel_state
-    token_network_state.partneraddresses_to_channels[partner_address] = channel_state
+    writer.add_route(token_network_state, our_address, partner_address)
+    writer.add_channel(token_network_state, channel_state)
 
     return TransitionResult(token_network_state, events)
 
 
 def handle_balance(
+        writer,
         token_network_state,
         state_change,
         pseudo_random_generator,
         block_number,
 ):
     return subdispatch_to_channel_by_id(
+        writer,
         token_network_state,
         state_change,
         pseudo_random_generator,
@@ -84,12 +111,14 @@ def handle_balance(
 
 
 def handle_closed(
+        writer,
         token_network_state,
         state_change,
         pseudo_random_generator,
         block_number,
 ):
     return subdispatch_to_channel_by_id(
+        writer,
         token_network_state,
         state_change,
         pseudo_random_generator,
@@ -98,12 +127,14 @@ def handle_closed(
 
 
 def handle_settled(
+        writer,
         token_network_state,
         state_change,
         pseudo_random_generator,
         block_number,
 ):
     return subdispatch_to_channel_by_id(
+        writer,
         token_network_state,
         state_change,
         pseudo_random_generator,
@@ -111,10 +142,17 @@ def handle_settled(
     )
 
 
-def handle_newroute(token_network_state, state_change):
+def handle_newroute(
+        writer,
+        token_network_state,
+        state_change,
+        pseudo_random_generator,  # pylint: disable=unused-argument
+        block_number,  # pylint: disable=unused-argument
+):
     events = list()
 
-    token_network_state.network_graph.network.add_edge(
+    writer.add_route(
+        token_network_state,
         state_change.participant1,
         state_change.participant2,
     )
@@ -123,6 +161,7 @@ def handle_newroute(token_network_state, state_change):
 
 
 def handle_action_transfer_direct(
+        writer,
         token_network_state,
         state_change,
         pseudo_random_generator,
@@ -132,6 +171,7 @@ def handle_action_transfer_direct(
     channel_state = token_network_state.partneraddresses_to_channels.get(receiver_address)
 
     if channel_state:
+        channel_state = writer.channel(token_network_state, channel_state.identifier)
         iteration = channel.state_transition(
             channel_state,
             state_change,
@@ -150,6 +190,7 @@ def handle_action_transfer_direct(
 
 
 def handle_receive_transfer_direct(
+        writer,
         token_network_state,
         state_change,
         pseudo_random_generator,
@@ -158,7 +199,7 @@ def handle_receive_transfer_direct(
     events = list()
 
     channel_id = state_change.balance_proof.channel_address
-    channel_state = token_network_state.channelidentifiers_to_channels.get(channel_id)
+    channel_state = writer.channel(token_network_state, channel_id)
 
     if channel_state:
         result = channel.state_transition(
@@ -173,6 +214,7 @@ def handle_receive_transfer_direct(
 
 
 def handle_receive_transfer_refund(
+        writer,
         token_network_state,
         state_change,
         pseudo_random_generator,
@@ -181,7 +223,7 @@ def handle_receive_transfer_refund(
     events = list()
 
     channel_id = state_change.balance_proof.channel_address
-    channel_state = token_network_state.channelidentifiers_to_channels.get(channel_id)
+    channel_state = writer.channel(token_network_state, channel_id)
 
     if channel_state:
         result = channel.state_transition(
@@ -195,67 +237,39 @@ def handle_receive_transfer_refund(
     return TransitionResult(token_network_state, events)
 
 
+# StateChange class -> handler(writer, token_network_state, state_change,
+# pseudo_random_generator, block_number)
+STATE_CHANGE_HANDLERS = {
+    ActionChannelClose: handle_channel_close,
+    ContractReceiveChannelNew: handle_channelnew,
+    ContractReceiveChannelNewBalance: handle_balance,
+    ContractReceiveChannelClosed: handle_closed,
+    ContractReceiveChannelSettled: handle_settled,
+    ContractReceiveRouteNew: handle_newroute,
+    ActionTransferDirect: handle_action_transfer_direct,
+    ReceiveTransferDirect: handle_receive_transfer_direct,
+}
+
+
 def state_transition(
+        writer,
         token_network_state,
         state_change,
         pseudo_random_generator,
         block_number,
 ):
-    # pylint: disable=too-many-branches,unidiomatic-typecheck
+    """ Apply `state_change` to the `token_network_state` returned by
+    `writer`, see `raiden.transfer.path_copy`.
+    """
+    handler = STATE_CHANGE_HANDLERS.get(type(state_change))
 
-    if type(state_change) == ActionChannelClose:
-        iteration = handle_channel_close(
-            token_network_state,
-            state_change,
-            pseudo_random_generator,
-            block_number,
-        )
-    elif type(state_change) == ContractReceiveChannelNew:
-        iteration = handle_channelnew(
-            token_network_state,
-            state_change,
-        )
-    elif type(state_change) == ContractReceiveChannelNewBalance:
-        iteration = handle_balance(
-            token_network_state,
-            state_change,
-            pseudo_random_generator,
-            block_number,
-        )
-    elif type(state_change) == ContractReceiveChannelClosed:
-        iteration = handle_closed(
-            token_network_state,
-            state_change,
-            pseudo_random_generator,
-            block_number,
-        )
-    elif type(state_change) == ContractReceiveChannelSettled:
-        iteration = handle_settled(
-            token_network_state,
-            state_change,
-            pseudo_random_generator,
-            block_number,
-        )
-    elif type(state_change) == ContractReceiveRouteNew:
-        iteration = handle_newroute(
-            token_network_state,
-            state_change,
-        )
-    elif type(state_change) == ActionTransferDirect:
-        iteration = handle_action_transfer_direct(
-            token_network_state,
-            state_change,
-            pseudo_random_generator,
-            block_number,
-        )
-    elif type(state_change) == ReceiveTransferDirect:
-        iteration = handle_receive_transfer_direct(
-            token_network_state,
-            state_change,
-            pseudo_random_generator,
-            block_number,
-        )
-    else:
+    if handler is None:
         raise RuntimeError(state_change)
 
-    return iteration
+    return handler(
+        writer,
+        token_network_state,
+        state_change,
+        pseudo_random_generator,
+        block_number,
+    )
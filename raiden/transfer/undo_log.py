@@ -0,0 +1,294 @@
+""" In place modification of the NodeState with an undo log.
+
+The alternative to `raiden.transfer.path_copy`: the node state machine
+modifies the current state and every modification is recorded in an
+`UndoLog`, which restores the state if the transition fails. The
+containers record the previous value of each key they change. The channels
+and payment tasks, which their state machines modify in place, record a
+pickled image taken before the first modification, restoring it is the only
+time the image is decoded.
+"""
+import pickle
+
+from raiden.transfer import indexes, views
+from raiden.transfer.architecture import State
+from raiden.transfer.path_copy import WritableChannels
+
+MISSING = object()
+
+# class -> names of the attributes of its instances
+CLASS_ATTRIBUTES = dict()
+
+
+def get_attribute_names(cls):
+    names = CLASS_ATTRIBUTES.get(cls)
+
+    if names is None:
+        names = list()
+        for base in cls.__mro__:
+            slots = base.__dict__.get('__slots__', ())
+            if isinstance(slots, str):
+                slots = (slots,)
+            names.extend(name for name in slots if name not in ('__dict__', '__weakref__'))
+
+        CLASS_ATTRIBUTES[cls] = names
+
+    return names
+
+
+def get_attributes(obj):
+    attributes = {
+        name: getattr(obj, name, MISSING)
+        for name in get_attribute_names(type(obj))
+    }
+
+    if hasattr(obj, '__dict__'):
+        attributes.update(obj.__dict__)
+
+    return attributes
+
+
+def restore_attributes(obj, attributes):
+    for name, value in attributes.items():
+        if value is MISSING:
+            if hasattr(obj, name):
+                delattr(obj, name)
+        else:
+            setattr(obj, name, value)
+
+
+def restore_image(obj, image):
+    """ Restore the attributes of `obj` from the pickled `image`. """
+    restore_attributes(obj, get_attributes(pickle.loads(image)))
+
+
+def restore_item(mapping, key, value):
+    if value is MISSING:
+        mapping.pop(key, None)
+    else:
+        mapping[key] = value
+
+
+def restore_list(items, previous_items):
+    items[:] = previous_items
+
+
+def remove_route(network, participant1, participant2, added_nodes):
+    network.remove_edge(participant1, participant2)
+    network.remove_nodes_from(added_nodes)
+
+
+def restore_route(network, participant1, participant2):
+    network.add_edge(participant1, participant2)
+
+
+class NodeStateUndo:
+    """ The writer for a NodeState modified in place, see
+    `raiden.transfer.path_copy.NodeStateCopy` for the interface.
+    """
+
+    __slots__ = (
+        'undo_log',
+        'node_state',
+        'recorded',
+        'changed_channels',
+        'changed_payment_tasks',
+        'removed_payment_tasks',
+    )
+
+    def __init__(self, node_state, undo_log):
+        self.undo_log = undo_log
+        self.node_state = node_state
+        # ids of the objects with a recorded image
+        self.recorded = set()
+        self.changed_channels = set()
+        self.changed_payment_tasks = set()
+        self.removed_payment_tasks = list()
+
+        # the attributes of the node state can be assigned directly
+        undo_log.record(restore_attributes, node_state, get_attributes(node_state))
+
+    def _record_image(self, obj):
+        if id(obj) not in self.recorded:
+            self.recorded.add(id(obj))
+            image = pickle.dumps(obj, pickle.HIGHEST_PROTOCOL)
+            self.undo_log.record(restore_image, obj, image)
+
+    def _set_item(self, mapping, key, value):
+        self.undo_log.record(restore_item, mapping, key, mapping.get(key, MISSING))
+        mapping[key] = value
+
+    def _del_item(self, mapping, key):
+        self.undo_log.record(restore_item, mapping, key, mapping[key])
+        del mapping[key]
+
+    def pseudo_random_generator(self):
+        prng = self.node_state.pseudo_random_generator
+
+        if id(prng) not in self.recorded:
+            self.recorded.add(id(prng))
+            self.undo_log.record(prng.setstate, prng.getstate())
+
+        return prng
+
+    def set_index(self, index_name, key, value):
+        index = getattr(self.node_state, index_name)
+
+        if value is not None:
+            self._set_item(index, key, value)
+        elif key in index:
+            self._del_item(index, key)
+
+    def set_network_state(self, node_address, network_state):
+        self._set_item(
+            self.node_state.nodeaddresses_to_networkstates,
+            node_address,
+            network_state,
+        )
+
+    def add_payment_network(self, payment_network):
+        self._set_item(
+            self.node_state.identifiers_to_paymentnetworks,
+            payment_network.address,
+            payment_network,
+        )
+        indexes.index_payment_network(self, payment_network)
+
+    def payment_network(self, payment_network_identifier):
+        return self.node_state.identifiers_to_paymentnetworks.get(payment_network_identifier)
+
+    def add_token_network(self, payment_network_identifier, token_network_state):
+        payment_network = self.payment_network(payment_network_identifier)
+        self._set_item(
+            payment_network.tokenidentifiers_to_tokennetworks,
+            token_network_state.address,
+            token_network_state,
+        )
+        self._set_item(
+            payment_network.tokenaddresses_to_tokennetworks,
+            token_network_state.token_address,
+            token_network_state,
+        )
+        indexes.index_token_network(self, payment_network_identifier, token_network_state)
+
+    def remove_token_network(self, payment_network_identifier, token_network_state):
+        payment_network = self.payment_network(payment_network_identifier)
+        self._del_item(
+            payment_network.tokenaddresses_to_tokennetworks,
+            token_network_state.token_address,
+        )
+        self._del_item(
+            payment_network.tokenidentifiers_to_tokennetworks,
+            token_network_state.address,
+        )
+        indexes.unindex_token_network(self, token_network_state)
+
+    def token_network(self, token_network_identifier):
+        return views.get_token_network_by_identifier(self.node_state, token_network_identifier)
+
+    def add_route(self, token_network_state, participant1, participant2):
+        network_graph = token_network_state.network_graph
+        network = network_graph.network
+
+        if not network.has_edge(participant1, participant2):
+            added_nodes = [
+                node
+                for node in {participant1, participant2}
+                if not network.has_node(node)
+            ]
+            self.undo_log.record(remove_route, network, participant1, participant2, added_nodes)
+            network.add_edge(participant1, participant2)
+
+            # The version is not restored by the undo log, a rolled back graph
+            # keeps the new version, so that a version of the graph is never
+            # reused for different edges.
+            network_graph.version = getattr(network_graph, 'version', 0) + 1
+
+    def add_channel(self, token_network_state, channel_state):
+        self._set_item(
+            token_network_state.channelidentifiers_to_channels,
+            channel_state.identifier,
+            channel_state,
+        )
+        self._set_item(
+            token_network_state.partneraddresses_to_channels,
+            channel_state.partner_state.address,
+            channel_state,
+        )
+        self.changed_channels.add((token_network_state.address, channel_state.identifier))
+        indexes.index_channel(self, token_network_state.address, channel_state)
+
+    def remove_channel(self, token_network_state, channel_identifier):
+        channel_state = token_network_state.channelidentifiers_to_channels[channel_identifier]
+        self._del_item(token_network_state.channelidentifiers_to_channels, channel_identifier)
+
+        partner_address = channel_state.partner_state.address
+        partner_channels = token_network_state.partneraddresses_to_channels
+        if partner_channels.get(partner_address) is channel_state:
+            self._del_item(partner_channels, partner_address)
+
+        our_address = channel_state.our_state.address
+        network_graph = token_network_state.network_graph
+        network = network_graph.network
+        if network.has_edge(our_address, partner_address):
+            self.undo_log.record(restore_route, network, our_address, partner_address)
+            network.remove_edge(our_address, partner_address)
+            network_graph.version = getattr(network_graph, 'version', 0) + 1
+
+        self.changed_channels.add((token_network_state.address, channel_identifier))
+        indexes.unindex_channel(self, token_network_state.address, channel_state)
+
+    def channel(self, token_network_state, channel_identifier):
+        channel_state = token_network_state.channelidentifiers_to_channels.get(
+            channel_identifier,
+        )
+
+        if channel_state is not None:
+            self._record_image(channel_state)
+            self.changed_channels.add((token_network_state.address, channel_identifier))
+
+        return channel_state
+
+    def channels(self, token_network_identifier):
+        token_network_state = self.token_network(token_network_identifier)
+
+        if token_network_state is None:
+            return None
+
+        return WritableChannels(self, token_network_state)
+
+    def payment_task(self, secrethash):
+        task = self.node_state.payment_mapping.secrethashes_to_task.get(secrethash)
+
+        # the tasks are tuples, their states are modified in place
+        if task is not None:
+            for value in task:
+                if isinstance(value, State):
+                    self._record_image(value)
+
+            self.changed_payment_tasks.add(secrethash)
+
+        return task
+
+    def set_payment_task(self, secrethash, task):
+        self._set_item(self.node_state.payment_mapping.secrethashes_to_task, secrethash, task)
+        self.changed_payment_tasks.add(secrethash)
+
+    def del_payment_task(self, secrethash):
+        tasks = self.node_state.payment_mapping.secrethashes_to_task
+        self.removed_payment_tasks.append(tasks[secrethash])
+        self._del_item(tasks, secrethash)
+
+    def queue(self, queueid):
+        queues = self.node_state.queueids_to_queues
+        queue = queues.get(queueid)
+
+        if queue is None:
+            queue = list()
+            self._set_item(queues, queueid, queue)
+            self.recorded.add(id(queue))
+        elif id(queue) not in self.recorded:
+            self.recorded.add(id(queue))
+            self.undo_log.record(restore_list, queue, list(queue))
+
+        return queue
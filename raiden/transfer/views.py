@@ -19,14 +19,7 @@ def all_neighbour_nodes(node_state: NodeState) -> typing.Set[typing.Address]:
     """ Return the identifiers for all nodes accross all payment networks which
     have a channel open with this one.
     """
-    addresses = set()
-
-    for payment_network in node_state.identifiers_to_paymentnetworks.values():
-        for token_network in payment_network.tokenidentifiers_to_tokennetworks.values():
-            for channel_state in token_network.partneraddresses_to_channels.values():
-                addresses.add(channel_state.partner_state.address)
-
-    return addresses
+    return set(node_state.partneraddresses_to_channelidentifiers)
 
 
 def block_number(node_state: NodeState) -> int:
@@ -145,12 +138,11 @@ def get_payment_network_by_identifier(
 def get_token_network_registry_by_token_network_identifier(
         node_state: NodeState,
         token_network_identifier: typing.Address,
-) -> typing.Address:
-    for token_network in node_state.identifiers_to_paymentnetworks.values():
-        if token_network_identifier in token_network.tokenidentifiers_to_tokennetworks:
-            return token_network
+) -> typing.Optional[PaymentNetworkState]:
+    index = node_state.tokennetworkidentifiers_to_paymentnetworkidentifiers
+    payment_network_identifier = index.get(token_network_identifier)
 
-    return None
+    return node_state.identifiers_to_paymentnetworks.get(payment_network_identifier)
 
 
 def get_token_network_identifier_by_token_address(
@@ -238,15 +230,17 @@ def get_token_network_by_identifier(
         token_network_id: typing.TokenAddress,
 ) -> typing.Optional[TokenNetworkState]:
 
+    payment_network_state = get_token_network_registry_by_token_network_identifier(
+        node_state,
+        token_network_id,
+    )
+
     token_network_state = None
-    for payment_network_state in node_state.identifiers_to_paymentnetworks.values():
+    if payment_network_state is not None:
         token_network_state = payment_network_state.tokenidentifiers_to_tokennetworks.get(
             token_network_id,
         )
 
-        if token_network_state:
-            return token_network_state
-
     return token_network_state
 
 
@@ -425,6 +419,47 @@ def get_transfer_role(
     return result
 
 
+def get_payment_task_channels(
+        task,
+) -> typing.Set[typing.Tuple[typing.TokenNetworkID, typing.ChannelID]]:
+    """ Return the (token_network_identifier, channel_identifier) of the
+    channels which the state machine of the payment `task` requires.
+
+    A target task is finished once its channel is gone, it does not hold
+    its channel.
+    """
+    token_network_identifier = task.token_network_identifier
+    channel_identifiers = set()
+
+    if isinstance(task, PaymentMappingState.InitiatorTask):
+        initiator_state = task.manager_state.initiator
+        if initiator_state is not None:
+            channel_identifiers.add(initiator_state.channel_identifier)
+
+    elif isinstance(task, PaymentMappingState.MediatorTask):
+        for pair in task.mediator_state.transfers_pair:
+            channel_identifiers.add(pair.payer_transfer.balance_proof.channel_address)
+            channel_identifiers.add(pair.payee_transfer.balance_proof.channel_address)
+
+    return {
+        (token_network_identifier, channel_identifier)
+        for channel_identifier in channel_identifiers
+    }
+
+
+def is_channel_used_by_payment_tasks(
+        node_state: NodeState,
+        token_network_identifier: typing.TokenNetworkID,
+        channel_identifier: typing.ChannelID,
+) -> bool:
+    key = (token_network_identifier, channel_identifier)
+
+    return any(
+        key in get_payment_task_channels(task)
+        for task in node_state.payment_mapping.secrethashes_to_task.values()
+    )
+
+
 def list_channelstate_for_tokennetwork(
         node_state: NodeState,
         payment_network_id: typing.PaymentNetworkID,
@@ -452,12 +487,23 @@ def list_channelstate_for_partner(
 ) -> typing.List[NettingChannelState]:
 
     payment_network = node_state.identifiers_to_paymentnetworks.get(payment_network_id)
+    channel_identifiers = node_state.partneraddresses_to_channelidentifiers.get(
+        partner_address,
+        (),
+    )
 
     result = []
     if payment_network is not None:
 
-        for token_network in payment_network.tokenaddresses_to_tokennetworks.values():
-            channel_state = token_network.partneraddresses_to_channels.get(partner_address)
+        for token_network_id, channel_id in channel_identifiers:
+            token_network = payment_network.tokenidentifiers_to_tokennetworks.get(
+                token_network_id,
+            )
+
+            if token_network is None:
+                continue
+
+            channel_state = token_network.channelidentifiers_to_channels.get(channel_id)
             if channel_state:
                 # TODO: Either enforce immutability or make a copy
                 result.append(channel_state)
@@ -484,10 +530,21 @@ def search_for_channel(
 ) -> NettingChannelState:
 
     payment_network = node_state.identifiers_to_paymentnetworks.get(payment_network_id)
+    token_network_ids = node_state.channelidentifiers_to_tokennetworkidentifiers.get(
+        channel_id,
+        (),
+    )
 
     result = None
     if payment_network is not None:
-        for token_network in payment_network.tokenaddresses_to_tokennetworks.values():
+        for token_network_id in token_network_ids:
+            token_network = payment_network.tokenidentifiers_to_tokennetworks.get(
+                token_network_id,
+            )
+
+            if token_network is None:
+                continue
+
             channel_state = token_network.channelidentifiers_to_channels.get(channel_id)
 
             if channel_state:
@@ -500,18 +557,12 @@ def search_for_channel(
 def search_payment_network_by_token_network_id(
         node_state: NodeState,
         token_network_id: typing.Address,
-) -> typing.Optional['TokenNetworkState']:
-
-    payment_network_state = None
-    for payment_network in node_state.identifiers_to_paymentnetworks.values():
-        token_network_state = payment_network.tokenidentifiers_to_tokennetworks.get(
-            token_network_id,
-        )
-
-        if token_network_state:
-            return payment_network_state
+) -> typing.Optional[PaymentNetworkState]:
 
-    return payment_network_state
+    return get_token_network_registry_by_token_network_identifier(
+        node_state,
+        token_network_id,
+    )
 
 
 def filter_channels_by_partneraddress(
@@ -55,7 +55,9 @@ from raiden.network.sockfactory import SocketFactory
 from raiden.network.throttle import TokenBucket
 from raiden.network.transport import MatrixTransport, UDPTransport
 from raiden.network.utils import get_free_port
+from raiden.transfer.architecture import DISPATCH_MODES
 from raiden.settings import (
+    DEFAULT_DISPATCH_MODE,
     DEFAULT_NAT_KEEPALIVE_RETRIES,
     ETHERSCAN_API,
     INITIAL_PORT,
@@ -1248,3 +1250,101 @@ def removedb(ctx):
     if not result:
         print('No raiden databases found for {}'.format(address_hex))
         print('Nothing to delete.')
+
+
+@run.command('replay-db')
+@click.argument(
+    'database',
+    type=click.Path(exists=True, dir_okay=False),
+)
+@option(
+    '--from-snapshot',
+    is_flag=True,
+    help=(
+        'Restore the latest snapshot and replay only the state changes applied after it. '
+        'Always done if the log was compacted.'
+    ),
+)
+@option(
+    '--profile',
+    is_flag=True,
+    help='Profile the replay with cProfile and print the most expensive functions.',
+)
+@option(
+    '--profile-output',
+    type=click.Path(dir_okay=False, writable=True),
+    help='Save the cProfile statistics to this file, for use with pstats.',
+)
+@option(
+    '--dispatch-mode',
+    type=click.Choice(DISPATCH_MODES),
+    default=DEFAULT_DISPATCH_MODE,
+    show_default=True,
+    help='How the state machine protects the state from failed state transitions.',
+)
+def replay_db(database, from_snapshot, profile, profile_output, dispatch_mode):
+    """Replay the state changes of a node database and report the state machine performance.
+
+    The database is opened read-only and no Ethereum node is needed.
+    """
+    import cProfile
+    import pstats
+    from raiden.storage.replay import replay_database
+    from raiden.storage.serialize import BinarySerializer
+    from raiden.storage.sqlite import SQLiteStorage
+    from raiden.transfer import node
+
+    storage = SQLiteStorage(database, BinarySerializer, read_only=True)
+
+    if not from_snapshot and not storage.is_log_complete():
+        print('The log was compacted, replaying from the latest snapshot.')
+        from_snapshot = True
+
+    profiler = cProfile.Profile() if profile or profile_output else None
+
+    _, statistics = replay_database(
+        storage,
+        node.state_transition,
+        from_snapshot=from_snapshot,
+        profiler=profiler,
+        dispatch_mode=dispatch_mode,
+    )
+
+    print('Replayed {} state changes from identifier {} in {:.3f}s ({:.1f}/s)'.format(
+        statistics.statechanges,
+        statistics.from_statechange_id,
+        statistics.elapsed,
+        statistics.statechanges_per_second(),
+    ))
+    print('Dispatch time {:.3f}s, {} events produced'.format(
+        statistics.dispatch_elapsed,
+        statistics.events,
+    ))
+
+    by_time = sorted(
+        statistics.statechanges_by_type.items(),
+        key=lambda item: item[1][1],
+        reverse=True,
+    )
+    print()
+    print('{:<45} {:>10} {:>12} {:>12} {:>7}'.format(
+        'state change', 'count', 'total (s)', 'mean (ms)', '%',
+    ))
+    for name, (count_, elapsed) in by_time:
+        print('{:<45} {:>10} {:>12.3f} {:>12.3f} {:>7.1f}'.format(
+            name,
+            count_,
+            elapsed,
+            elapsed / count_ * 1000,
+            elapsed / statistics.dispatch_elapsed * 100 if statistics.dispatch_elapsed else 0,
+        ))
+
+    if profiler is not None:
+        if profile_output:
+            profiler.dump_stats(profile_output)
+            print()
+            print('Profile saved to {}'.format(profile_output))
+
+        if profile:
+            print()
+            pstats.Stats(profiler).sort_stats('cumulative').print_stats(30)
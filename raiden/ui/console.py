@@ -50,6 +50,8 @@ def print_usage():
         HEADER, OKBLUE))
     print("\tuse `{}lasterr(n){}` to see n lines of stderr. [default 1]".format(
         HEADER, OKBLUE))
+    print("\tuse `{}tools.state_size(){}` to see the size of the node state.".format(
+        HEADER, OKBLUE))
     print("\tuse `{}help(<topic>){}` for help on a specific topic.".format(HEADER, OKBLUE))
     print("\ttype `{}usage(){}` to see this help again.".format(HEADER, OKBLUE))
     print("\n" + ENDC)
@@ -418,6 +420,12 @@ class ConsoleTools:
             total_deposit,
         )
 
+    def state_size(self):
+        """ The memory and serialized size in bytes of the node state, by
+        payment network, token network, channel, merkle tree and payment task.
+        """
+        return self._api.get_state_size()
+
     def wait_for_contract(self, contract_address_hex, timeout=None):
         """ Wait until a contract is mined
 